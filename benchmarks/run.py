@@ -0,0 +1,583 @@
+"""Benchmarks and load simulations for the rental inventory application
+
+    python benchmarks/run.py <name> [args...]
+
+Each builds its own database in a temporary folder and prints what it measured.
+"""
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (
+    AUDIT_TABLES, SCRYPT_N, SCRYPT_P, SCRYPT_R, AnalyticsSnapshot, BackupManager, DatabaseManager, Ledger,
+    MaintenancePlanner, ProductCatalog, ReceiptRenderer, ReportRunner, ReturnScheduler, SimulatedClock,
+    is_lock_error,
+)
+
+def build_benchmark_database(path, size_mb):
+    """Fill a database with synthetic rentals until it reaches size_mb"""
+    db = DatabaseManager(path)
+    conn = sqlite3.connect(path)
+    batch, next_id = 50000, 0
+    products = ['Car', 'Van', 'Minibus', 'Truck']
+    while os.path.getsize(path) < size_mb * 1024 * 1024:
+        rows = [(random.randint(1, 1000), f"BENCH{next_id + i}", products[i % 4], 'CAR452', '1-30 days',
+                 12.0, str(datetime.date.today() - datetime.timedelta(days=i % 720)), 30, 342.0, 51.3, 393.3)
+                for i in range(batch)]
+        conn.executemany('''
+            INSERT INTO rentals (customer_id, receipt_ref, product_type, product_code, no_days, cost_per_day,
+                                 app_date, last_credit_review, subtotal, tax, total)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        next_id += batch
+    conn.close()
+    return db
+
+def run_backup_benchmark(db_path=None, size_mb=2048):
+    """Measure snapshot throughput and main-thread latency while a snapshot runs"""
+    if not db_path:
+        db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+        print(f"Building {size_mb} MB benchmark database at {db_path}...")
+        build_benchmark_database(db_path, int(size_mb))
+    manager = BackupManager(DatabaseManager(db_path))
+    size = os.path.getsize(db_path)
+
+    # Simulated GUI event loop: a 10 ms tick doing a small query, timing how late each tick runs
+    latencies, done = [], threading.Event()
+
+    def gui_loop():
+        conn = sqlite3.connect(db_path)
+        while not done.is_set():
+            expected = time.perf_counter() + 0.01
+            time.sleep(0.01)
+            conn.execute('SELECT COUNT(*) FROM products').fetchone()
+            latencies.append(time.perf_counter() - expected)
+        conn.close()
+
+    probe = threading.Thread(target=gui_loop)
+    probe.start()
+    started = time.perf_counter()
+    manager.copy_database(db_path + '.copy')
+    copy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    archive = manager.snapshot(label='benchmark')
+    snapshot_seconds = time.perf_counter() - started
+    done.set()
+    probe.join()
+    os.remove(db_path + '.copy')
+
+    latencies.sort()
+    print(f"Database size:        {size / 1024 / 1024:.0f} MB")
+    print(f"Online copy:          {copy_seconds:.2f} s ({size / 1024 / 1024 / copy_seconds:.0f} MB/s)")
+    print(f"Verified snapshot:    {snapshot_seconds:.2f} s ({size / 1024 / 1024 / snapshot_seconds:.0f} MB/s), "
+          f"archive {os.path.getsize(archive) / 1024 / 1024:.0f} MB")
+    print(f"GUI tick lateness:    p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+
+def run_receipt_benchmark(count=5000, workers=None):
+    """Measure batch receipt throughput, single process against the process pool"""
+    db_path = os.path.join(tempfile.mkdtemp(), 'receipts.db')
+    db = DatabaseManager(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT INTO rentals (customer_id, receipt_ref, product_type, product_code, no_days, cost_per_day,
+                             last_credit_review, payment_method, discount, subtotal, tax, total)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(i % 50 + 1, f"BENCH{i}", 'Car', 'CAR452', '1-30 days', 12.0, 30, 'Cash', 5.0, 342.0, 51.3, 393.3)
+          for i in range(int(count))])
+    conn.commit()
+    conn.close()
+    renderer = ReceiptRenderer(db)
+    workers = int(workers) if workers else os.cpu_count()
+
+    for label, path in (('PDF', 'receipts.pdf'), ('zip', 'receipts.zip')):
+        for pool_size in (1, workers):
+            stats = renderer.batch(os.path.join(os.path.dirname(db_path), path), workers=pool_size)
+            print(f"{label:<4} {pool_size:>2} worker(s): {stats['receipts']} receipts in {stats['seconds']:.2f} s "
+                  f"({stats['receipts_per_sec']:.0f} receipts/s)")
+
+def run_invoicing_benchmark(rentals=1000000, customers=50000):
+    """Time the nightly invoicing run over a synthetic book of rentals and payments"""
+    rentals, customers = int(rentals), int(customers)
+    db_path = os.path.join(tempfile.mkdtemp(), 'invoicing.db')
+    db = DatabaseManager(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO customers (customer_name) VALUES (?)',
+                     [(f"Customer {i}",) for i in range(customers)])
+    today = datetime.date.today()
+    conn.executemany('''
+        INSERT INTO rentals (customer_id, receipt_ref, product_type, total, created_date)
+        VALUES (?, ?, 'Car', ?, ?)
+    ''', ((random.randint(1, customers), f"BENCH{i}", round(random.uniform(50, 500), 2),
+           str(today - datetime.timedelta(days=random.randint(0, 365)))) for i in range(rentals)))
+    conn.executemany('INSERT INTO payments (customer_id, amount, paid_date) VALUES (?, ?, ?)',
+                     ((random.randint(1, customers), round(random.uniform(50, 500), 2),
+                       str(today - datetime.timedelta(days=random.randint(0, 365)))) for _ in range(rentals // 2)))
+    conn.commit()
+    conn.close()
+
+    ledger = Ledger(db)
+    summary = ledger.run_invoicing()
+    print(f"Book:         {rentals} rentals, {rentals // 2} payments, {customers} customers")
+    print(f"Invoicing:    {summary['seconds']:.2f} s for {summary['customers']} statements, "
+          f"outstanding £{summary['outstanding']:,.2f}")
+    print("Aging:        " + ", ".join(f"{bucket} £{amount:,.2f}" for bucket, amount in summary['aging'].items()))
+    started = time.perf_counter()
+    count = ledger.export_statements(summary['run_id'], os.path.join(os.path.dirname(db_path), 'statements.csv'))
+    print(f"CSV export:   {time.perf_counter() - started:.2f} s for {count} statements")
+
+def run_snapshot_benchmark(rentals=500000):
+    """Compare the analytics snapshot with row tuples for memory, load and group-by time"""
+    import tracemalloc
+    rentals = int(rentals)
+    db_path = os.path.join(tempfile.mkdtemp(), 'snapshot.db')
+    db = DatabaseManager(db_path)
+    conn = sqlite3.connect(db_path)
+    products, methods = ['Car', 'Van', 'Minibus', 'Truck'], ['Cash', 'Visa Card', 'Master Card', 'Debit Card']
+    today = datetime.date.today()
+    conn.executemany('''
+        INSERT INTO rentals (customer_id, receipt_ref, product_type, payment_method, total, created_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((random.randint(1, 20000), f"BENCH{i}", products[i % 4], methods[i % 4], round(random.uniform(50, 500), 2),
+           str(today - datetime.timedelta(days=i % 720))) for i in range(rentals)))
+    conn.commit()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = conn.execute('''
+        SELECT rental_id, created_date, total, product_type, payment_method, customer_id FROM rentals
+    ''').fetchall()
+    tuples_seconds = time.perf_counter() - started
+    tuples_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+    conn.close()
+
+    snapshot = AnalyticsSnapshot(db)
+    started = time.perf_counter()
+    snapshot.refresh()
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    snapshot.group_by('product')
+    snapshot.group_by('payment')
+    snapshot.monthly(today.toordinal() - 365)
+    snapshot.customer_totals()
+    query_seconds = time.perf_counter() - started
+
+    # Cold start of a second process: build the cache once, then map it
+    cache_dir = os.path.join(os.path.dirname(db_path), 'snapshot_analytics')
+    AnalyticsSnapshot(db, cache_dir).refresh()
+    started = time.perf_counter()
+    cached = AnalyticsSnapshot(db, cache_dir)
+    cached.refresh()
+    cached.group_by('product')
+    cold_seconds = time.perf_counter() - started
+
+    print(f"Rentals:          {rentals}")
+    print(f"Row tuples:       {tuples_bytes / 1024 / 1024:.1f} MB, fetched in {tuples_seconds:.2f} s")
+    print(f"Snapshot:         {snapshot.memory_bytes() / 1024 / 1024:.1f} MB "
+          f"({tuples_bytes / snapshot.memory_bytes():.0f}x smaller), loaded in {load_seconds:.2f} s")
+    print(f"Dashboard groups: {query_seconds * 1000:.1f} ms (product, payment, monthly, per-customer)")
+    print(f"Cached cold start: {cold_seconds * 1000:.1f} ms to map {cached.size} rows and group by product")
+
+def run_catalog_benchmark(units=50000, selections=1000):
+    """Time product-type selection on the rental form against a large fleet"""
+    units, selections = int(units), int(selections)
+    db_path = os.path.join(tempfile.mkdtemp(), 'catalog.db')
+    db = DatabaseManager(db_path)
+    types = [f"Type{i:02d}" for i in range(40)]
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO products (product_type, product_code, cost_per_day, available_quantity, status) VALUES (?, ?, ?, ?, ?)",
+        ((types[i % len(types)], f"U{i:06d}", 20.0 + i % 30, i % 3, 'Available' if i % 10 else 'Maintenance')
+         for i in range(units)))
+    conn.commit()
+    conn.close()
+    picks = [random.choice(types) for _ in range(selections)]
+
+    # What the form did before: list every product, then one query per selection
+    started = time.perf_counter()
+    products = db.get_all_products()
+    sorted(set(p[1] for p in products if p[4] > 0 and p[5] == 'Available'))
+    list_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for product_type in picks:
+        conn = db.connect()
+        conn.execute('SELECT product_code, cost_per_day FROM products WHERE product_type = ? AND available_quantity > 0 AND status = "Available" AND deleted_at IS NULL LIMIT 1',
+                     (product_type,)).fetchone()
+        conn.close()
+    query_seconds = time.perf_counter() - started
+
+    catalog = ProductCatalog(db)
+    started = time.perf_counter()
+    catalog.available_types()
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for product_type in picks:
+        catalog.first_available(product_type)
+    lookup_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for product_id in range(1, 101):
+        catalog.invalidate(product_id)
+        catalog.first_available(picks[0])
+    invalidate_seconds = time.perf_counter() - started
+
+    print(f"Fleet:            {units} units, {len(types)} types")
+    print(f"Type list:        {list_seconds * 1000:.1f} ms from all rows, {load_seconds * 1000:.1f} ms catalog load")
+    print(f"Select type:      {query_seconds / selections * 1e6:.0f} us per query, "
+          f"{lookup_seconds / selections * 1e6:.1f} us from the catalog")
+    print(f"Edit + reselect:  {invalidate_seconds / 100 * 1e6:.0f} us per single-product invalidation")
+
+def run_maintenance_benchmark(units=20000, days=60, per_day=200, seed=11):
+    """Per-rental re-planning against a full re-plan, then simulated days checking no unit due for service is rentable"""
+    units, days, per_day, rng = int(units), int(days), int(per_day), random.Random(int(seed))
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), 'maintenance.db'))
+    customer_id = db.add_customer('Maintenance Simulation')
+    codes = ['CAR452', 'VAN775', 'MIN334', 'TRK7483']
+    for code in codes:
+        product = db.product_catalog.by_product_code(code)
+        db.update_product(product[0], product[1], product[2], product[3], units // len(codes), product[5])
+    conn = db.connect()
+    conn.execute('UPDATE units SET rental_days = abs(random()) % 40, odometer = abs(random()) % 7000')
+    conn.commit()
+    unit_ids = [row[0] for row in conn.execute('SELECT unit_id FROM units')]
+    conn.close()
+
+    started = time.perf_counter()
+    db.maintenance.replan_all()
+    full_seconds = time.perf_counter() - started
+    sample = rng.sample(unit_ids, min(1000, len(unit_ids)))
+    conn = db.connect()
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    for unit_id in sample:
+        db.maintenance.replan(cursor, [unit_id])
+    incremental_seconds = (time.perf_counter() - started) / len(sample)
+    conn.rollback()
+    conn.close()
+
+    clock = SimulatedClock(datetime.datetime.combine(datetime.date.today(), datetime.time(9)))
+    scheduler = ReturnScheduler(db, clock)
+    planned, saved, serviced = {}, 0, 0
+    for day in range(days):
+        today = clock.now().date()
+        for i in range(per_day):
+            product = db.product_catalog.by_product_code(rng.choice(codes))
+            length = rng.randint(1, 10)
+            due = today + datetime.timedelta(days=length)
+            try:
+                rental_id = db.save_rental((customer_id, f"MNT{day}-{i}", product[1], product[2], f"{length} days", product[3],
+                                            'Yes', str(today), str(due), length, str(due), '', 'No', 0, 'No', 0, 'No', '',
+                                            'Cash', 0, 0, 0, 0, 0, product[3] * length, product[3] * length))
+            except ValueError:
+                continue  # Every unit of that product is out or in the workshop
+            saved += 1
+            planned.setdefault(due, []).append(rental_id)
+        for rental_id in planned.pop(today, []):
+            scheduler.return_rental(rental_id, odometer=None)
+        clock.advance(days=1)
+        serviced += len(db.maintenance.tick(clock.now().date())[1])
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    intervals = MaintenancePlanner.intervals(cursor)
+    overdue = [unit_id for unit_id, product_type, days_used, miles_used in cursor.execute('''
+        SELECT unit_id, product_type, rental_days - serviced_rental_days, odometer - serviced_odometer
+        FROM units WHERE state = 'available'
+    ''') if MaintenancePlanner.due_reason(intervals[product_type], days_used, miles_used)]
+    windows = dict(cursor.execute('SELECT status, COUNT(*) FROM maintenance_windows GROUP BY status').fetchall())
+    conn.close()
+    assert not overdue, f"{len(overdue)} units due for service are available to rent"
+
+    print(f"Fleet:            {len(unit_ids)} units")
+    print(f"Full re-plan:     {full_seconds * 1000:.0f} ms")
+    print(f"Per rental:       {incremental_seconds * 1e6:.0f} us to re-plan the affected unit")
+    print(f"Simulated days:   {days}, {saved} rentals, {serviced} services completed, "
+          f"{windows.get('planned', 0)} planned, {windows.get('active', 0)} in the workshop")
+    print("All checks passed: no unit due for service is available to rent")
+
+def run_audit_benchmark(entries=500000, saves=2000):
+    """Save latency with and without the audit triggers, then flush, per-row history and compaction at scale"""
+    entries, saves = int(entries), int(saves)
+    db_path = os.path.join(tempfile.mkdtemp(), 'audit.db')
+    db = DatabaseManager(db_path)
+    customer_ids = [db.add_customer(f"Customer {i}", f"0700{i:06d}", f"c{i}@example.com", f"{i} High Street")
+                    for i in range(200)]
+    db.audit.flush()
+
+    def time_saves(tag):
+        started = time.perf_counter()
+        for i in range(saves):
+            db.update_customer(customer_ids[i % len(customer_ids)], f"Customer {i % len(customer_ids)}",
+                               f"0711{i:06d}", f"c{i}@example.com", f"{i} {tag} Road")
+        return (time.perf_counter() - started) / saves
+
+    audited = time_saves('Audited')
+    started = time.perf_counter()
+    flushed = db.audit.flush()
+    flush_seconds = time.perf_counter() - started
+    conn = db.connect()
+    for table in AUDIT_TABLES:
+        for op in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER audit_{table}_{op}')
+    conn.commit()
+    conn.close()
+    db.actor = None
+    plain = time_saves('Plain')
+
+    # A few years of journal for many rows
+    rng = random.Random(3)
+    first = datetime.datetime.now() - datetime.timedelta(days=3 * 365)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO audit_journal (table_name, row_id, op, diff, actor, changed_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (('products', str(rng.randint(1, entries // 20)), 'update', json.dumps({'cost_per_day': [10.0, 11.0]}),
+          'bench@counter', (first + datetime.timedelta(seconds=i * 3 * 365 * 86400 // entries)).strftime('%Y-%m-%dT%H:%M:%S.000'))
+         for i in range(entries)))
+    conn.commit()
+    conn.close()
+    picks = [rng.randint(1, entries // 20) for _ in range(1000)]
+    started = time.perf_counter()
+    for row_id in picks:
+        db.audit.history('products', row_id)
+    history_seconds = (time.perf_counter() - started) / len(picks)
+    started = time.perf_counter()
+    day = datetime.date.today() - datetime.timedelta(days=30)
+    changed = len(db.audit.between(day, day + datetime.timedelta(days=1)))
+    between_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    removed = db.audit.compact(365)
+    compact_seconds = time.perf_counter() - started
+
+    print(f"Customer save:    {plain * 1000:.2f} ms without auditing, {audited * 1000:.2f} ms audited "
+          f"(+{(audited - plain) * 1e6:.0f} us)")
+    print(f"Flush:            {flushed} entries in {flush_seconds * 1000:.1f} ms")
+    print(f"Row history:      {history_seconds * 1000:.2f} ms per row over {entries} entries")
+    print(f"One day's trail:  {changed} changes in {between_seconds * 1000:.1f} ms")
+    print(f"Compaction:       {removed} entries older than 365 days folded in {compact_seconds:.2f} s")
+
+def run_access_benchmark(checks=200000, saves=500):
+    """Time sign-in, a compiled permission check against a per-call lookup, and a checked customer save"""
+    checks, saves = int(checks), int(saves)
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), 'access.db'))
+    db.access.add_user('owner', 'benchmark-owner', 'admin')
+    db.access.add_user('counter', 'benchmark-counter', 'clerk')
+    started = time.perf_counter()
+    db.access.sign_in('counter', 'benchmark-counter')
+    sign_in_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(checks):
+        db.access.require('customers.edit')
+    check_seconds = (time.perf_counter() - started) / checks
+    try:
+        db.access.require('pricing.edit')
+        raise AssertionError("A clerk was allowed to change prices")
+    except PermissionError:
+        pass
+
+    # What each action would add if it looked the role up on its connection instead
+    conn = db.connect()
+    started = time.perf_counter()
+    for _ in range(10000):
+        permissions = conn.execute('''
+            SELECT r.permissions FROM users u JOIN roles r ON r.role = u.role WHERE u.username = ? AND u.active = 1
+        ''', ('counter',)).fetchone()[0]
+        'customers.edit' in permissions.split(',')
+    query_seconds = (time.perf_counter() - started) / 10000
+    conn.close()
+
+    started = time.perf_counter()
+    for i in range(saves):
+        db.add_customer(f"Access Customer {i}")
+    save_seconds = (time.perf_counter() - started) / saves
+
+    print(f"Sign-in:          {sign_in_seconds * 1000:.0f} ms (scrypt n={SCRYPT_N}, r={SCRYPT_R}, p={SCRYPT_P})")
+    print(f"Permission check: {check_seconds * 1e6:.2f} us compiled, {query_seconds * 1e6:.0f} us as a per-call lookup")
+    print(f"Customer save:    {save_seconds * 1000:.2f} ms, of which {check_seconds / save_seconds:.3%} is the check")
+
+def run_pii_benchmark(customers=20000, saves=1000, lookups=2000):
+    """Time the customer directory load and customer saves with encrypted details against plaintext, and the indexed lookups"""
+    customers, saves, lookups = int(customers), int(saves), int(lookups)
+    folder = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(folder, 'pii.db'), key_file=os.path.join(folder, 'pii.key'))
+    people = [(f"Customer {i}", f"0700{i:06d}", f"c{i}@example.com", f"{i} High Street") for i in range(customers)]
+    conn = db.connect()
+    # The same customers as they were stored before encryption
+    conn.execute('''
+        CREATE TABLE plain_customers (
+            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT NOT NULL,
+            phone TEXT,
+            email TEXT,
+            address TEXT,
+            created_date DATE DEFAULT CURRENT_DATE
+        )
+    ''')
+    conn.executemany('INSERT INTO plain_customers (customer_name, phone, email, address) VALUES (?, ?, ?, ?)', people)
+    # A new database, so the customers take ids 1, 2, ... as in plain_customers
+    conn.executemany('''
+        INSERT INTO customers (customer_id, customer_name, phone, email, address, phone_bidx, email_bidx)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(i, name) + db.seal_customer(i, phone, email, address)
+          for i, (name, phone, email, address) in enumerate(people, start=1)])
+    conn.commit()
+    conn.close()
+
+    # load_customers_tree and the rental form's customer list both read get_all_customers
+    started = time.perf_counter()
+    conn = db.connect()
+    conn.execute('SELECT * FROM plain_customers ORDER BY customer_name').fetchall()
+    conn.close()
+    plain_load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    loaded = db.get_all_customers()
+    load_seconds = time.perf_counter() - started
+    if loaded[0][2:5] != next(p[1:] for p in people if p[0] == loaded[0][1]):
+        raise AssertionError("Customer details did not decrypt to what was saved")
+
+    started = time.perf_counter()
+    for i in range(saves):
+        db.seal_customer(customers + i + 1, f"0800{i:06d}", f"s{i}@example.com", f"{i} Low Road")
+    seal_seconds = (time.perf_counter() - started) / saves
+    started = time.perf_counter()
+    for i in range(saves):
+        db.add_customer(f"Saved Customer {i}", f"0800{i:06d}", f"s{i}@example.com", f"{i} Low Road")
+    save_seconds = (time.perf_counter() - started) / saves
+
+    # Look up a customer from the middle of the directory, typed the way a clerk might
+    target = customers // 2
+    phone = f"0700{target:06d}"
+    conn = db.connect()
+    plans = {}
+    for label, term in (('email', f'c{target}@example.com'), ('phone', f'{phone[:4]} {phone[4:7]} {phone[7:]}'),
+                        ('name prefix', f'Customer {target}')):
+        started = time.perf_counter()
+        for _ in range(lookups):
+            found = db.find_customers(term)
+        seconds = (time.perf_counter() - started) / lookups
+        if not found:
+            raise AssertionError(f"No customer found by {label}")
+        # The plan find_customers runs, to show the lookup stays on an index
+        where = {'email': 'email_bidx = ?', 'phone': 'phone_bidx = ?'}.get(label, "customer_name LIKE ? ESCAPE '\\'")
+        plan = conn.execute(f'EXPLAIN QUERY PLAN SELECT * FROM customers WHERE {where}', ('x',)).fetchall()
+        plans[label] = (seconds, ' / '.join(row[-1] for row in plan))
+    duplicates = db.find_duplicate_customers(f'{phone[:5]} {phone[5:]}', f'C{target}@Example.com ')
+    conn.close()
+
+    print(f"Directory load:   {customers} customers in {load_seconds * 1000:.0f} ms encrypted, "
+          f"{plain_load_seconds * 1000:.0f} ms plaintext")
+    print(f"Customer save:    {save_seconds * 1000:.2f} ms, of which {seal_seconds / save_seconds:.1%} "
+          f"({seal_seconds * 1e6:.0f} us) is encryption and blind indexes")
+    for label, (seconds, plan) in plans.items():
+        print(f"Lookup by {label + ':':<12} {seconds * 1000:.2f} ms ({plan})")
+    print(f"Duplicate check:  {len(duplicates)} match for a reformatted phone and email")
+
+def stress_counter(db_path, seconds, seed, journal_mode):
+    """One simulated rental counter: save a rental, read the history page, repeat"""
+    rng = random.Random(seed)
+    db = DatabaseManager(db_path, journal_mode)
+    returns = ReturnScheduler(db)
+    saved = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        total = round(rng.uniform(50, 500), 2)
+        try:
+            rental_id = db.save_rental((rng.randint(1, 50), f"STRESS{seed}-{saved + failed}", 'Car', 'CAR452', '3 days',
+                                        25.0, 'No', '', '', 3, '', '', 'No', 0, 'No', 0, 'No', '', 'Cash', 0, 0, 0, 0,
+                                        round(total * 0.15, 2), total, round(total * 1.15, 2)))
+            returned = returns.return_rental(rental_id)
+            if returned['maintenance']:
+                db.maintenance.complete_service(returned['unit_id'])  # The workshop turns it round at once
+            saved += 1
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            failed += 1
+        db.get_rental_page(limit=20)
+    return saved, failed, db.lock_metrics.summary()
+
+def run_concurrency_benchmark(processes=4, seconds=5, journal_mode='WAL'):
+    """N counter processes writing one database file; reports throughput, failures and lock waits"""
+    processes, seconds = int(processes), float(seconds)
+    db_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    db = DatabaseManager(db_path, journal_mode)
+    car = db.product_catalog.by_product_code('CAR452')
+    db.update_product(car[0], car[1], car[2], car[3], processes * 2, car[5])
+    for i in range(50):
+        db.add_customer(f"Stress Customer {i}")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(stress_counter, repeat(db_path), repeat(seconds), range(processes), repeat(journal_mode)))
+    elapsed = time.perf_counter() - started
+
+    saved = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    metrics = [result[2] for result in results]
+    transactions = sum(m['transactions'] for m in metrics)
+    wait = sum(m['wait_seconds'] for m in metrics)
+    print(f"Counters:         {processes} processes x {seconds:.0f} s, journal_mode={journal_mode}")
+    print(f"Saved rentals:    {saved} ({saved / elapsed:.0f}/s)")
+    print(f"Failed saves:     {failed} ({failed / max(saved + failed, 1):.2%})")
+    print(f"Lock retries:     {sum(m['retries'] for m in metrics)}")
+    print(f"Lock wait:        avg {wait / max(transactions, 1) * 1000:.2f} ms, "
+          f"max {max(m['max_wait'] for m in metrics) * 1000:.1f} ms")
+
+def run_reports_benchmark(rentals=50000, workers=None):
+    """Time the board pack with one worker against the full process pool"""
+    rentals = int(rentals)
+    workers = int(workers) if workers else os.cpu_count() or 1
+    root = tempfile.mkdtemp()
+    db_path = os.path.join(root, 'reports.db')
+    db = DatabaseManager(db_path)
+    conn = sqlite3.connect(db_path)
+    products, methods = ['Car', 'Van', 'Minibus', 'Truck'], ['Cash', 'Visa Card', 'Master Card', 'Debit Card']
+    today = datetime.date.today()
+    conn.executemany(
+        "INSERT INTO rentals (customer_id, receipt_ref, product_type, payment_method, total, created_date) VALUES (?, ?, ?, ?, ?, ?)",
+        ((random.randint(1, 2000), f"BENCH{i}", products[i % 4], methods[i % 4], round(random.uniform(50, 500), 2),
+          str(today - datetime.timedelta(days=i % 720))) for i in range(rentals)))
+    conn.commit()
+    conn.close()
+
+    runner = ReportRunner(db, os.path.join(root, 'reports_analytics'))
+    serial = runner.run(os.path.join(root, 'serial'), workers=1)
+    parallel = runner.run(os.path.join(root, 'parallel'), workers=workers)
+
+    print(f"Rentals:          {rentals}")
+    print(f"Reports:          {serial['reports']} ({len(serial['files'])} files + board_pack.pdf)")
+    print(f"1 worker:         {serial['seconds']:.2f} s ({serial['reports'] / serial['seconds']:.1f} reports/s)")
+    print(f"{workers} workers:        {parallel['seconds']:.2f} s ({parallel['reports'] / parallel['seconds']:.1f} reports/s, "
+          f"{serial['seconds'] / parallel['seconds']:.1f}x)")
+
+BENCHMARKS = {
+    'backup': run_backup_benchmark,
+    'receipts': run_receipt_benchmark,
+    'invoicing': run_invoicing_benchmark,
+    'snapshot': run_snapshot_benchmark,
+    'reports': run_reports_benchmark,
+    'concurrency': run_concurrency_benchmark,
+    'catalog': run_catalog_benchmark,
+    'maintenance': run_maintenance_benchmark,
+    'audit': run_audit_benchmark,
+    'access': run_access_benchmark,
+    'pii': run_pii_benchmark
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        sys.exit(f"usage: {sys.argv[0]} {{{'|'.join(BENCHMARKS)}}} [args...]")
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -1,9 +1,14 @@
 import tkinter as tk
 from tkinter import *
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import sqlite3
 import random
 import datetime
+import bisect
+import heapq
+import json
+import math
+import re
 from tkcalendar import DateEntry
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
@@ -12,11 +17,46 @@ import pandas as pd
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 import os
+import gzip
+import socket
+import struct
+import uuid
+import threading
+import queue
+import time
+import hashlib
+import hmac
+import binascii
+import getpass
+import shutil
+import sys
+import io
+import urllib.parse
+import string
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Advisory file locks: flock on POSIX, byte-range locks on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Customer details are sealed with AES-GCM when the cryptography package is installed
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    AESGCM = None
 
 # Add numpy import for trend analysis
 try:
     import numpy as np
+    NUMPY_AVAILABLE = True
 except ImportError:
+    NUMPY_AVAILABLE = False
     # Fallback if numpy is not available
     class np:
         @staticmethod
@@ -27,16 +67,454 @@ except ImportError:
         def poly1d(coeffs):
             return lambda x: [0] * len(x) if isinstance(x, list) else 0
 
+# Default tariff: (label, max_days, credit_limit, discount %)
+DEFAULT_TARIFF_PERIODS = [
+    ("1-30 days", 30, "£150", 5.0),
+    ("31-90 days", 90, "£200", 10.0),
+    ("91-270 days", 270, "£250", 15.0),
+    ("271-365 days", 365, "£300", 20.0)
+]
+
+DEFAULT_TARIFF_SETTINGS = {
+    'tax_rate': '0.15',
+    'discount_tiers': '0,5,10,15,20',
+    'late_fee_multiplier': '1.5'
+}
+
+# Overdue scan: at least this often, and at each midnight a rental falls due
+RETURN_SCAN_MINUTES = 15
+
+PRICING_RULE_TYPES = ('seasonal', 'loyalty', 'surcharge')
+
+# How often a compiled rule plan re-reads the stored rules version, so edits
+# made by other instances sharing the database are picked up
+RULES_CHECK_SECONDS = 5
+
+# Replicated tables and their local primary keys, in dependency order
+SYNC_TABLES = {
+    'customers': 'customer_id',
+    'products': 'product_id',
+    'rentals': 'rental_id'
+}
+
+# Branches accept sync sessions on every interface so others can reach them across the
+# network; RENTAL_SYNC_HOST narrows that, e.g. to 127.0.0.1. Both ends prove they hold
+# the same key file before anything else is exchanged
+SYNC_HOST = os.environ.get('RENTAL_SYNC_HOST', '0.0.0.0')
+SYNC_PORT = 47800
+SYNC_NONCE_BYTES = 16
+
+# Columns that only mean something in the local database and are not replicated
+SYNC_LOCAL_COLUMNS = {'unit_id'}
+
+# Per-vehicle states and the moves allowed between them
+UNIT_STATES = ('available', 'reserved', 'rented', 'maintenance', 'retired')
+UNIT_TRANSITIONS = {
+    'available': ('reserved', 'rented', 'maintenance', 'retired'),
+    'reserved': ('available', 'rented'),
+    'rented': ('available', 'maintenance'),
+    'maintenance': ('available', 'retired'),
+    'retired': (),
+}
+
+# Service intervals per product type: (rental days, miles, workshop days)
+DEFAULT_SERVICE_INTERVALS = {
+    'Car': (60, 10000, 1),
+    'Van': (45, 8000, 2),
+    'Minibus': (45, 8000, 2),
+    'Truck': (30, 6000, 2)
+}
+# A unit this close to its rental-day interval is serviced instead of going out again
+MAINTENANCE_LOOKAHEAD_DAYS = 7
+
+# Backup defaults
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_INTERVAL_MINUTES = 60
+BACKUP_KEEP = 24
+# Tables the redo log for point-in-time restore leaves out: its own table, the per-transaction
+# audit actor, sign-in sessions, the forecaster's cache and settings written once at creation
+REDO_EXCLUDED_TABLES = {'redo_log', 'audit_context', 'sessions', 'forecast_state', 'sync_meta', 'pii_settings'}
+
+# Rentals older than this move to per-year archive databases
+ARCHIVE_HORIZON_DAYS = 730
+
+# Audit journal: customer details and prices, with their keys, and columns that change too often
+# to be worth a trace. Every connection parses the audit triggers, so the list is kept short
+AUDIT_TABLES = {
+    'customers': 'customer_id',
+    'products': 'product_id',
+    'tariff_rates': 'product_type',
+    'pricing_rules': 'rule_id'
+}
+AUDIT_IGNORED_COLUMNS = {'sync_uid', 'available_quantity', 'phone_bidx', 'email_bidx'}
+AUDIT_FLUSH_SECONDS = 5
+AUDIT_RETENTION_DAYS = 730
+
+# What a role can be granted, and how a refusal describes it
+PERMISSIONS = {
+    'rentals.create': 'create rentals',
+    'rentals.return': 'check in returned rentals',
+    'customers.edit': 'add or edit customers',
+    'payments.record': 'record payments',
+    'products.edit': 'add or edit products',
+    'products.delete': 'delete products',
+    'fleet.edit': 'change vehicle states or service schedules',
+    'pricing.edit': 'change prices, tariffs or pricing rules',
+    'billing.run': 'run invoicing',
+    'sync.manage': 'replicate with other branches',
+    'backup.manage': 'restore snapshots or archive rentals',
+    'audit.manage': 'compact the audit journal',
+    'users.manage': 'manage user accounts'
+}
+
+# Roles created with a new database; '*' grants every permission
+DEFAULT_ROLES = {
+    'clerk': 'rentals.create,rentals.return,customers.edit,payments.record',
+    'manager': ('rentals.create,rentals.return,customers.edit,payments.record,products.edit,products.delete,'
+                'fleet.edit,pricing.edit,billing.run,sync.manage,backup.manage'),
+    'admin': '*'
+}
+
+# scrypt cost per password check: 16 MB of memory and some tens of milliseconds
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+MIN_PASSWORD_LENGTH = 8
+
+# A session with no changes for this long has to sign in again
+SESSION_IDLE_MINUTES = 30
+
+# Customer details stored encrypted (see FieldCipher), and the blind index column of those
+# looked up by equality. Every machine opening the database needs a copy of the key file
+PII_COLUMNS = ('phone', 'email', 'address')
+PII_BLIND_INDEXES = {'phone': 'phone_bidx', 'email': 'email_bidx'}
+PII_KEY_FILE = os.environ.get('RENTAL_PII_KEY_FILE') or os.path.join(os.path.expanduser('~'), '.rental_inventory', 'pii.key')
+
+# History tab paging and sortable columns (heading -> typed SQL expression)
+HISTORY_PAGE_SIZE = 500
+HISTORY_SORT_COLUMNS = {
+    'ID': 'r.rental_id',
+    'Receipt': 'r.receipt_ref',
+    'Customer': 'c.customer_name',
+    'Product': 'r.product_type',
+    'Days': 'r.last_credit_review',
+    'Total': 'r.total',
+    'Date': 'r.created_date',
+}
+
+# More changes than this to one table in a single flush collapse into a reload
+EVENT_RELOAD_THRESHOLD = 50
+
+# Background threads never touch Tk; the GUI thread drains their callbacks this often
+UI_POLL_MS = 100
+
+class ChangeEvent:
+    """A committed change to one row of a table"""
+    table = None
+
+    def __init__(self, entity_id, **fields):
+        self.entity_id = entity_id
+        self.fields = fields
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.entity_id!r})"
+
+class RentalCreated(ChangeEvent):
+    table = 'rentals'
+
+class ProductAdded(ChangeEvent):
+    table = 'products'
+
+class ProductUpdated(ChangeEvent):
+    table = 'products'
+
+class ProductDeleted(ChangeEvent):
+    table = 'products'
+
+class CustomerAdded(ChangeEvent):
+    table = 'customers'
+
+class CustomerUpdated(ChangeEvent):
+    table = 'customers'
+
+class RentalReturned(ChangeEvent):
+    table = 'rentals'
+
+class RentalOverdue(ChangeEvent):
+    table = 'rentals'
+
+class TableReloaded(ChangeEvent):
+    """Too many changes to apply one by one; entity_id is the table name"""
+
+class EventBus:
+    """Publish/subscribe for data changes, coalesced per entity until the next flush"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.pending = {}
+        self.scheduler = None
+        self.flush_scheduled = False
+        self.lock = threading.Lock()
+
+    def subscribe(self, event_type, handler):
+        """Call handler for events of event_type or any subclass of it"""
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def set_scheduler(self, scheduler):
+        """Defer delivery: scheduler(flush) arranges for flush to run later, possibly from another thread"""
+        self.scheduler = scheduler
+
+    def publish(self, event):
+        """Queue an event; a later event for the same entity and type replaces an earlier one"""
+        with self.lock:
+            key = (type(event), event.entity_id)
+            self.pending.pop(key, None)
+            self.pending[key] = event
+            schedule = self.scheduler is not None and not self.flush_scheduled
+            self.flush_scheduled = self.flush_scheduled or schedule
+        if self.scheduler is None:
+            self.flush()
+        elif schedule:
+            self.scheduler(self.flush)
+
+    def flush(self):
+        """Deliver queued events in order, reloading tables with too many changes"""
+        with self.lock:
+            events = list(self.pending.values())
+            self.pending = {}
+            self.flush_scheduled = False
+
+        per_table = {}
+        for event in events:
+            per_table[event.table] = per_table.get(event.table, 0) + 1
+        reloaded = {table for table, count in per_table.items() if table and count > EVENT_RELOAD_THRESHOLD}
+
+        for table in sorted(reloaded):
+            self.deliver(TableReloaded(table))
+        for event in events:
+            if event.table not in reloaded:
+                self.deliver(event)
+        return len(events)
+
+    def deliver(self, event):
+        for event_type in type(event).__mro__:
+            for handler in self.handlers.get(event_type, ()):
+                handler(event)
+
+# Due date of a rental: its recorded end date, else start plus rental days
+OPEN_RENTAL_SELECT = '''
+    SELECT r.rental_id, r.customer_id, r.unit_id,
+           COALESCE(date(r.date_rev), date(r.created_date, '+' || COALESCE(r.last_credit_review, 0) || ' days')),
+           COALESCE(r.cost_per_day, 0)
+    FROM rentals r
+'''
+
+# Several counters share one database file: SQLite waits up to the busy
+# timeout for a lock, then writers back off with jitter and try again
+BUSY_TIMEOUT_SECONDS = 2.0
+
+# A rollback journal (DELETE) is safe on a network share. WAL lets counters read
+# while another writes but needs shared memory, so it is only for a local disk;
+# set RENTAL_JOURNAL_MODE=WAL or pass --journal-mode WAL to use it
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'WAL')
+DEFAULT_JOURNAL_MODE = os.environ.get('RENTAL_JOURNAL_MODE', 'DELETE').upper()
+LOCK_RETRIES = 8
+LOCK_BACKOFF_SECONDS = 0.05
+LOCK_BACKOFF_MAX_SECONDS = 1.0
+WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+def default_actor():
+    """Who the audit journal credits with changes made at this counter"""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'unknown'
+    return f"{user}@{socket.gethostname()}"
+
+def is_lock_error(error):
+    return isinstance(error, sqlite3.OperationalError) and (
+        'locked' in str(error) or 'busy' in str(error))
+
+class FileLock:
+    """Advisory lock held on a file for the duration of a with block; shared where the OS allows"""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+b')
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ten seconds; keep waiting
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+class LockMetrics:
+    """Write-lock waits, retries and failures across every connection of a DatabaseManager"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited, retries, failed=False):
+        with self.lock:
+            self.transactions += 1
+            self.retries += retries
+            self.failures += failed
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'transactions': self.transactions,
+                'retries': self.retries,
+                'failures': self.failures,
+                'wait_seconds': self.wait_seconds,
+                'avg_wait': self.wait_seconds / self.transactions if self.transactions else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+class LockingCursor(sqlite3.Cursor):
+    """Cursor whose first write opens the transaction with BEGIN IMMEDIATE"""
+
+    def execute(self, sql, parameters=()):
+        if self.connection.begin_for(sql):
+            return self
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.begin_for(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+class LockingConnection(sqlite3.Connection):
+    """Connection that takes the write lock up front and retries lock errors with jittered backoff"""
+    metrics = None
+    retries = LOCK_RETRIES
+    actor = None
+
+    def cursor(self, factory=LockingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def begin_for(self, sql):
+        """Begin an immediate transaction before a write; True when sql was a plain BEGIN it replaced"""
+        if self.in_transaction or self.isolation_level is None:
+            return False
+        words = sql.split()
+        verb = words[0].upper() if words else ''
+        if verb == 'BEGIN' and (len(words) == 1 or words[1].upper() in ('DEFERRED', 'TRANSACTION')):
+            self.begin_immediate()
+            return True
+        if verb in WRITE_VERBS:
+            self.begin_immediate()
+        return False
+
+    def begin_immediate(self):
+        """Take the write lock; a writer that gets it never deadlocks against another mid-transaction"""
+        self._retry_locked(lambda: sqlite3.Connection.execute(self, 'BEGIN IMMEDIATE'))
+        if self.actor:
+            # Read by the audit triggers; only ever set inside a write transaction
+            sqlite3.Connection.execute(self, 'UPDATE audit_context SET actor = ? WHERE id = 1', (self.actor,))
+
+    def commit(self):
+        if self.actor and self.in_transaction:
+            sqlite3.Connection.execute(self, 'UPDATE audit_context SET actor = NULL WHERE id = 1')
+        self._retry_locked(super().commit)
+
+    def _retry_locked(self, operation):
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                operation()
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e) or attempt == self.retries:
+                    if self.metrics and is_lock_error(e):
+                        self.metrics.record(time.perf_counter() - started, attempt, failed=True)
+                    raise
+                backoff = min(LOCK_BACKOFF_MAX_SECONDS, LOCK_BACKOFF_SECONDS * 2 ** attempt)
+                time.sleep(random.uniform(0, backoff))
+            else:
+                if self.metrics:
+                    self.metrics.record(time.perf_counter() - started, attempt)
+                return
+
 class DatabaseManager:
-    def __init__(self, db_name="rental_inventory.db"):
+    read_only = False
+
+    def __init__(self, db_name="rental_inventory.db", journal_mode=None, key_file=None):
         self.db_name = db_name
+        self.journal_mode = (journal_mode or DEFAULT_JOURNAL_MODE).upper()
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode: {journal_mode}")
+        self.pii = FieldCipher(key_file)
+        self.rules_version = 0
+        self.actor = default_actor()
+        self.events = EventBus()
+        self.lock_metrics = LockMetrics()
+        self.product_catalog = ProductCatalog(self)
+        self.fleet = FleetManager(self)
+        self.maintenance = MaintenancePlanner(self)
+        self.audit = AuditJournal(self)
+        self.archive = ArchiveManager(self)
+        if self.read_only:
+            # Read-only copies never migrate the schema and get no session, so every mutation is refused
+            self.access = AccessControl(self)
+            return
         self.init_database()
+        # Scripts that open the database directly act as this machine's user with every
+        # permission; the application signs that session out and asks someone to sign in
+        self.access = AccessControl(self, Session(self.actor, 'system', frozenset(PERMISSIONS), idle_seconds=None))
     
+    def connect(self):
+        """Open a connection to the database"""
+        conn = sqlite3.connect(self.db_name, timeout=BUSY_TIMEOUT_SECONDS,
+                               factory=LockingConnection, isolation_level='IMMEDIATE')
+        conn.metrics = self.lock_metrics
+        conn.actor = self.actor
+        # NORMAL is only crash-safe with WAL; a rollback journal needs FULL
+        conn.execute(f"PRAGMA synchronous = {'NORMAL' if self.journal_mode == 'WAL' else 'FULL'}")
+        conn.execute('PRAGMA foreign_keys = ON')
+        return conn
+
     def init_database(self):
         """Initialize the database and create tables"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.connect()
+        conn.actor = None  # The audit tables may not exist yet
+        # Migrations below rebuild tables, which enforced foreign keys would cascade into
+        conn.execute('PRAGMA foreign_keys = OFF')
         cursor = conn.cursor()
         
+        # See JOURNAL_MODES: DELETE by default, WAL only when asked for on a local disk
+        cursor.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        
         # Create customers table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS customers (
@@ -95,6 +573,9 @@ class DatabaseManager:
                 status TEXT DEFAULT 'Available'
             )
         ''')
+        # Deleting a product only tombstones it, so rentals keep joining to their product
+        has_tombstones = 'deleted_at' in [row[1] for row in cursor.execute('PRAGMA table_info(products)')]
+        self.ensure_column(cursor, 'products', 'deleted_at', 'TEXT')
         
         # Insert default products if they don't exist
         default_products = [
@@ -109,31 +590,737 @@ class DatabaseManager:
                 INSERT OR IGNORE INTO products (product_type, product_code, cost_per_day, available_quantity)
                 VALUES (?, ?, ?, ?)
             ''', product)
-        
+
+        # Create tariff tables (rental period bands and pricing settings)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tariff_periods (
+                period_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label TEXT UNIQUE NOT NULL,
+                max_days INTEGER NOT NULL,
+                credit_limit TEXT,
+                discount REAL DEFAULT 0
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tariff_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Product type rate overrides (fall back to products.cost_per_day)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tariff_rates (
+                product_type TEXT PRIMARY KEY,
+                cost_per_day REAL NOT NULL
+            )
+        ''')
+
+        # Create pricing rules table (seasonal rates, loyalty tiers, surcharges)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pricing_rules (
+                rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                rule_type TEXT NOT NULL,
+                product_type TEXT,
+                start_date DATE,
+                end_date DATE,
+                min_rentals INTEGER DEFAULT 0,
+                adjustment REAL NOT NULL,
+                description TEXT,
+                active INTEGER DEFAULT 1
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pricing_rules_type ON pricing_rules (rule_type, active)')
+
+        # Create demand forecast state table (one smoothing state per product type)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS forecast_state (
+                product_type TEXT PRIMARY KEY,
+                last_ordinal INTEGER NOT NULL,
+                level REAL NOT NULL,
+                trend REAL NOT NULL,
+                weekly TEXT NOT NULL,
+                annual TEXT NOT NULL
+            )
+        ''')
+
+        # Insert default tariff if it doesn't exist
+        for period in DEFAULT_TARIFF_PERIODS:
+            cursor.execute('''
+                INSERT OR IGNORE INTO tariff_periods (label, max_days, credit_limit, discount)
+                VALUES (?, ?, ?, ?)
+            ''', period)
+
+        for key, value in DEFAULT_TARIFF_SETTINGS.items():
+            cursor.execute('INSERT OR IGNORE INTO tariff_settings (key, value) VALUES (?, ?)', (key, value))
+
+        # Create rollups of archived rentals (see ArchiveManager)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rental_rollups (
+                month TEXT NOT NULL,
+                product_type TEXT NOT NULL,
+                payment_method TEXT NOT NULL,
+                rentals INTEGER DEFAULT 0,
+                revenue REAL DEFAULT 0,
+                rental_days INTEGER DEFAULT 0,
+                PRIMARY KEY (month, product_type, payment_method)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_created_date ON rentals (created_date)')
+        # Catalog lookups only ever want live products, so tombstones stay out of the index
+        cursor.execute('DROP INDEX IF EXISTS idx_products_type_status_qty')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_products_active_type_status_qty
+            ON products (product_type, status, available_quantity) WHERE deleted_at IS NULL
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_total ON rentals (total)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_days ON rentals (last_credit_review)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_product_date ON rentals (product_type, created_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_payment_date ON rentals (payment_method, created_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_customer_date ON rentals (customer_id, created_date)')
+
+        # Count in-place rewrites (updates and deletes) of rentals so column
+        # snapshots, which only append new rental_ids, know when to rebuild
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                table_name TEXT PRIMARY KEY,
+                rewrites INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO data_versions (table_name, rewrites) VALUES ('rentals', 0)")
+
+        # Every pricing rule edit bumps a stored version in the same transaction,
+        # so compiled rule plans in other instances know to recompile
+        cursor.execute("INSERT OR IGNORE INTO data_versions (table_name, rewrites) VALUES ('pricing_rules', 0)")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS pricing_rules_version_{event.lower()} AFTER {event} ON pricing_rules
+                BEGIN
+                    UPDATE data_versions SET rewrites = rewrites + 1 WHERE table_name = 'pricing_rules';
+                END
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS rentals_rewrite_update AFTER UPDATE ON rentals WHEN OLD.sync_uid IS NOT NULL
+            BEGIN
+                UPDATE data_versions SET rewrites = rewrites + 1 WHERE table_name = 'rentals';
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS rentals_rewrite_delete AFTER DELETE ON rentals
+            BEGIN
+                UPDATE data_versions SET rewrites = rewrites + 1 WHERE table_name = 'rentals';
+            END
+        ''')
+        # Customer analytics only read the created date, so only rewrites of it count
+        cursor.execute("INSERT OR IGNORE INTO data_versions (table_name, rewrites) VALUES ('customers', 0)")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_rewrite_update AFTER UPDATE OF created_date ON customers
+            BEGIN
+                UPDATE data_versions SET rewrites = rewrites + 1 WHERE table_name = 'customers';
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS customers_rewrite_delete AFTER DELETE ON customers
+            BEGIN
+                UPDATE data_versions SET rewrites = rewrites + 1 WHERE table_name = 'customers';
+            END
+        ''')
+
+        # Physical vehicles: each product has one unit per vehicle, and
+        # products.available_quantity counts its units in the available state
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS units (
+                unit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products (product_id),
+                product_type TEXT NOT NULL,
+                unit_code TEXT UNIQUE NOT NULL,
+                state TEXT NOT NULL DEFAULT 'available',
+                rental_id INTEGER,
+                state_changed TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_units_state_type ON units (state, product_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_units_product_state ON units (product_id, state)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_units_rental ON units (rental_id)')
+        self.ensure_column(cursor, 'rentals', 'unit_id', 'INTEGER')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS units_available_count AFTER UPDATE OF state ON units
+            WHEN (OLD.state = 'available') != (NEW.state = 'available')
+            BEGIN
+                UPDATE products
+                SET available_quantity = available_quantity + (CASE WHEN NEW.state = 'available' THEN 1 ELSE -1 END)
+                WHERE product_id = NEW.product_id;
+            END
+        ''')
+        # Usage since the last service drives maintenance (see MaintenancePlanner)
+        self.ensure_column(cursor, 'units', 'odometer', 'INTEGER DEFAULT 0')
+        self.ensure_column(cursor, 'units', 'rental_days', 'INTEGER DEFAULT 0')
+        self.ensure_column(cursor, 'units', 'serviced_odometer', 'INTEGER DEFAULT 0')
+        self.ensure_column(cursor, 'units', 'serviced_rental_days', 'INTEGER DEFAULT 0')
+        self.ensure_column(cursor, 'units', 'last_serviced', 'DATE')
+        self.ensure_foreign_key(cursor, 'units', 'product_id', 'products (product_id)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS service_intervals (
+                product_type TEXT PRIMARY KEY,
+                rental_days INTEGER,
+                mileage INTEGER,
+                service_days INTEGER DEFAULT 1
+            )
+        ''')
+        cursor.executemany('INSERT OR IGNORE INTO service_intervals VALUES (?, ?, ?, ?)',
+                           ((t,) + interval for t, interval in DEFAULT_SERVICE_INTERVALS.items()))
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_windows (
+                window_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                unit_id INTEGER NOT NULL,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL,
+                reason TEXT,
+                status TEXT NOT NULL DEFAULT 'planned',
+                completed_date DATE,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (unit_id) REFERENCES units (unit_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_unit ON maintenance_windows (unit_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_status_dates ON maintenance_windows (status, start_date, end_date)')
+        # Marks a Maintenance status the planner set, the only kind it may lift again
+        has_hold = 'maintenance_hold' in [row[1] for row in cursor.execute('PRAGMA table_info(products)')]
+        self.ensure_column(cursor, 'products', 'maintenance_hold', 'INTEGER DEFAULT 0')
+        if not has_hold:
+            # Existing Maintenance statuses the planner's rule explains are taken to be its own
+            cursor.execute('''
+                UPDATE products SET maintenance_hold = 1
+                WHERE status = 'Maintenance'
+                  AND NOT EXISTS (SELECT 1 FROM units WHERE product_id = products.product_id
+                                  AND state NOT IN ('maintenance', 'retired'))
+                  AND EXISTS (SELECT 1 FROM units WHERE product_id = products.product_id AND state = 'maintenance')
+            ''')
+
+        # Products from before unit tracking get one unit per counted vehicle
+        for product_id, quantity in cursor.execute('''
+            SELECT product_id, available_quantity FROM products p
+            WHERE available_quantity > 0 AND NOT EXISTS (SELECT 1 FROM units u WHERE u.product_id = p.product_id)
+        ''').fetchall():
+            self.fleet.resize(cursor, product_id, quantity)
+
+        # Create payments ledger and invoicing tables (see Ledger)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS payments (
+                payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                rental_id INTEGER,
+                amount REAL NOT NULL,
+                payment_method TEXT,
+                reference TEXT,
+                paid_date DATE DEFAULT CURRENT_DATE,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
+                FOREIGN KEY (rental_id) REFERENCES rentals (rental_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_customer_date ON payments (customer_id, paid_date)')
+        # Deleting a rental looks up the payments that reference it
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_rental ON payments (rental_id)')
+
+        # Rentals out now, queued by due date (see ReturnScheduler), and completed returns
+        open_rentals_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'open_rentals'").fetchone()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS open_rentals (
+                rental_id INTEGER PRIMARY KEY,
+                customer_id INTEGER,
+                unit_id INTEGER,
+                due_date DATE NOT NULL,
+                daily_rate REAL DEFAULT 0,
+                overdue_since DATE
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_open_rentals_due ON open_rentals (overdue_since, due_date)')
+        if not open_rentals_exists:
+            # Rentals whose end date has not passed are still out
+            cursor.execute(f'''
+                INSERT INTO open_rentals (rental_id, customer_id, unit_id, due_date, daily_rate)
+                {OPEN_RENTAL_SELECT} WHERE date(r.date_rev) >= date('now')
+            ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rental_returns (
+                rental_id INTEGER PRIMARY KEY,
+                customer_id INTEGER,
+                receipt_ref TEXT,
+                unit_id INTEGER,
+                due_date DATE,
+                returned_date DATE NOT NULL,
+                days_late INTEGER DEFAULT 0,
+                late_fee REAL DEFAULT 0,
+                returned_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rental_returns_customer ON rental_returns (customer_id, returned_date)')
+
+        # Charges of archived rentals stay on the customer's account as one rolled-up debit
+        archived_charges_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_charges'").fetchone()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archived_charges (
+                customer_id INTEGER PRIMARY KEY,
+                rentals INTEGER DEFAULT 0,
+                charges REAL DEFAULT 0,
+                last_date DATE
+            )
+        ''')
+
+        # Every charge and late fee debits and every payment credits the customer's account
+        cursor.execute('DROP VIEW IF EXISTS ledger')
+        cursor.execute('''
+            CREATE VIEW ledger AS
+            SELECT customer_id, date(created_date) AS entry_date, 'charge' AS entry_type, rental_id,
+                   receipt_ref AS reference, COALESCE(total, 0) AS debit, 0 AS credit
+            FROM rentals WHERE customer_id IS NOT NULL
+            UNION ALL
+            SELECT customer_id, last_date, 'archived charges', NULL, rentals || ' archived rentals', charges, 0
+            FROM archived_charges
+            UNION ALL
+            SELECT customer_id, returned_date, 'late fee', rental_id, receipt_ref, late_fee, 0
+            FROM rental_returns WHERE late_fee > 0 AND customer_id IS NOT NULL
+            UNION ALL
+            SELECT customer_id, paid_date, 'payment', rental_id, reference, 0, amount
+            FROM payments
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS invoice_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                as_of DATE NOT NULL,
+                customers INTEGER DEFAULT 0,
+                outstanding REAL DEFAULT 0,
+                seconds REAL DEFAULT 0,
+                run_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statements (
+                run_id INTEGER NOT NULL,
+                customer_id INTEGER NOT NULL,
+                charges REAL DEFAULT 0,
+                payments REAL DEFAULT 0,
+                balance REAL DEFAULT 0,
+                current REAL DEFAULT 0,
+                days_31_60 REAL DEFAULT 0,
+                days_61_90 REAL DEFAULT 0,
+                days_over_90 REAL DEFAULT 0,
+                PRIMARY KEY (run_id, customer_id)
+            )
+        ''')
+
+        # Create change-data-capture tables for branch replication
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changelog (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                sync_uid TEXT NOT NULL,
+                op TEXT NOT NULL,
+                payload TEXT,
+                changed_at TEXT NOT NULL,
+                origin TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_changelog_row ON changelog (table_name, sync_uid, seq)')
+
+        # Row images of every change since the oldest kept snapshot, replayed by point-in-time restore:
+        # row_key holds the old primary key of an updated or deleted row, payload the new row
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS redo_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_key TEXT,
+                payload TEXT,
+                logged_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                peer_id TEXT PRIMARY KEY,
+                last_sent_seq INTEGER DEFAULT 0,
+                last_received_seq INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('node_id', ?)", (uuid.uuid4().hex,))
+
+        for table in SYNC_TABLES:
+            self.ensure_column(cursor, table, 'sync_uid', 'TEXT')
+            cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_sync_uid ON {table} (sync_uid)')
+
+        # Audit journal: triggers append to an unindexed staging table so saves stay
+        # cheap, and AuditJournal.flush() moves entries to the indexed journal in batches
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS audit_context (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                actor TEXT,
+                compacting INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO audit_context (id) VALUES (1)')
+        for table in ('audit_pending', 'audit_journal'):
+            key = 'pending_id INTEGER PRIMARY KEY' if table == 'audit_pending' else 'entry_id INTEGER PRIMARY KEY AUTOINCREMENT'
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key},
+                    table_name TEXT NOT NULL,
+                    row_id TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    diff TEXT,
+                    actor TEXT,
+                    changed_at TEXT NOT NULL
+                )
+            ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_journal (table_name, row_id, entry_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_changed ON audit_journal (changed_at)')
+        for action in ('UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS audit_journal_no_{action.lower()} BEFORE {action} ON audit_journal
+                WHEN (SELECT compacting FROM audit_context WHERE id = 1) IS NOT 1
+                BEGIN
+                    SELECT RAISE(ABORT, 'The audit journal is append-only');
+                END
+            ''')
+
+        # Accounts sign in with scrypt-hashed passwords; roles are compiled into
+        # in-memory permission sets at sign-in (see AccessControl)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS roles (
+                role TEXT PRIMARY KEY,
+                permissions TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        cursor.executemany('INSERT OR IGNORE INTO roles (role, permissions) VALUES (?, ?)', DEFAULT_ROLES.items())
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL COLLATE NOCASE,
+                password_hash TEXT NOT NULL,
+                role TEXT NOT NULL REFERENCES roles (role),
+                active INTEGER DEFAULT 1,
+                created_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_login DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users (user_id),
+                host TEXT,
+                started_at TEXT NOT NULL,
+                ended_at TEXT
+            )
+        ''')
+
+        # Customer details are stored encrypted: phone and email are found through their blind
+        # indexes, and names, which stay readable, by prefix (see FieldCipher)
+        for column in PII_BLIND_INDEXES.values():
+            self.ensure_column(cursor, 'customers', column, 'TEXT')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_customers_{column} ON customers ({column})')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers (customer_name COLLATE NOCASE)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pii_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Triggers are rebuilt last so they capture every column added above
+        self.install_sync_triggers(cursor)
+        self.install_audit_triggers(cursor)
+        self.install_redo_triggers(cursor)
+        baseline_seq = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+        if not has_tombstones:
+            # Products hard-deleted before tombstones come back as deleted rows for their units and rentals
+            # to join, under their old id and the code their units were numbered from, if it is free
+            cursor.execute('''
+                INSERT INTO products (product_id, product_type, product_code, cost_per_day, available_quantity, status, deleted_at)
+                SELECT o.product_id, o.product_type,
+                       CASE WHEN NOT EXISTS (SELECT 1 FROM products WHERE product_code = o.code) THEN o.code END,
+                       NULL, 0, 'Unavailable', strftime('%Y-%m-%dT%H:%M:%f', 'now')
+                FROM (
+                    SELECT u.product_id, MAX(u.product_type) AS product_type,
+                           substr(MIN(u.unit_code), 1, length(MIN(u.unit_code)) - 4) AS code
+                    FROM units u
+                    WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.product_id = u.product_id)
+                    GROUP BY u.product_id
+                ) o
+            ''')
+            cursor.execute('''
+                INSERT INTO products (product_type, product_code, cost_per_day, available_quantity, status, deleted_at)
+                SELECT MAX(product_type), product_code, MAX(cost_per_day), 0, 'Unavailable', strftime('%Y-%m-%dT%H:%M:%f', 'now')
+                FROM rentals r
+                WHERE product_code IS NOT NULL AND product_code != ''
+                  AND NOT EXISTS (SELECT 1 FROM products p WHERE p.product_code = r.product_code)
+                GROUP BY product_code
+            ''')
+        for table in SYNC_TABLES:
+            cursor.execute(f'UPDATE {table} SET sync_uid = lower(hex(randomblob(16))) WHERE sync_uid IS NULL')
+        self.encrypt_customer_details(cursor)
+        # Pre-existing and default rows are baseline versions that any real edit supersedes
+        cursor.execute("UPDATE changelog SET changed_at = '1970-01-01T00:00:00.000' WHERE seq > ?", (baseline_seq,))
+
         conn.commit()
+        # Archives written before charges were rolled up on archiving are rolled up once now
+        if not archived_charges_exists:
+            self.archive.roll_up_archived_charges(cursor)
         conn.close()
+
+    @staticmethod
+    def ensure_column(cursor, table, column, declaration):
+        """Add a column to an existing table if it is missing"""
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+    @staticmethod
+    def ensure_foreign_key(cursor, table, column, reference):
+        """Rebuild a table whose column does not yet declare its foreign key, keeping its rows, indexes and triggers"""
+        if any(row[3] == column for row in cursor.execute(f'PRAGMA foreign_key_list({table})')):
+            return
+        sql = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        dependents = [row[0] for row in cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (table,))]
+        body = re.sub(rf'(\b{column}\b[^,]*)', rf'\1 REFERENCES {reference}', sql.split('(', 1)[1], count=1)
+        cursor.execute(f'CREATE TABLE {table}_rebuilt ({body}')
+        cursor.execute(f'INSERT INTO {table}_rebuilt SELECT * FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_rebuilt RENAME TO {table}')
+        for statement in dependents:
+            cursor.execute(statement)
+
+    def encrypt_customer_details(self, cursor):
+        """Encrypt customer details held in plaintext; the first time, also the copies in the changelog and audit journal"""
+        stored = cursor.execute("SELECT value FROM pii_settings WHERE key = 'key_id'").fetchone()
+        self.pii.load(create=stored is None)
+        if stored is not None and stored[0] != self.pii.key_id:
+            raise RuntimeError(f"{self.pii.key_file} is not the key customer details in {self.db_name} were encrypted with")
+        if stored is None:
+            # Plaintext overwritten below is zeroed instead of lingering in free pages
+            cursor.execute('PRAGMA secure_delete = ON')
+
+        # Rows from before encryption, or sealed before the customer_id was bound to their details
+        unsealed = ' OR '.join(f"({column} != '' AND " + ' AND '.join(f"{column} NOT LIKE '{prefix}%'"
+                                                                      for prefix in FieldCipher.SEALED_PREFIXES) + ')'
+                               for column in PII_COLUMNS)
+        rows = cursor.execute(f'SELECT customer_id, phone, email, address FROM customers WHERE {unsealed}').fetchall()
+        staged = cursor.execute('SELECT COALESCE(MAX(pending_id), 0) FROM audit_pending').fetchone()[0]
+        cursor.executemany('''
+            UPDATE customers SET phone = ?, email = ?, address = ?, phone_bidx = ?, email_bidx = ? WHERE customer_id = ?
+        ''', [self.seal_customer(*row) + (row[0],) for row in rows])
+        # Encrypting is not an edit, so it leaves no audit entry
+        cursor.execute('DELETE FROM audit_pending WHERE pending_id > ?', (staged,))
+        if stored is not None:
+            return
+
+        def seal(column, value, customer_id):
+            if isinstance(value, list):
+                return [seal(column, item, customer_id) for item in value]
+            return self.pii.encrypt(column, value, customer_id) if isinstance(value, str) else value
+
+        # Payloads carry the customer_id their details are sealed to, for the branch receiving them
+        for seq, payload, customer_id in cursor.execute('''
+            SELECT l.seq, l.payload, c.customer_id FROM changelog l
+            LEFT JOIN customers c ON c.sync_uid = l.sync_uid
+            WHERE l.table_name = 'customers' AND l.payload IS NOT NULL
+        ''').fetchall():
+            row = json.loads(payload)
+            row['customer_id'] = row.get('customer_id', customer_id)
+            row.update({column: seal(column, row[column], row['customer_id']) for column in PII_COLUMNS if column in row})
+            cursor.execute('UPDATE changelog SET payload = ? WHERE seq = ?', (json.dumps(row, separators=(',', ':')), seq))
+
+        # Staged audit entries are value arrays in audit column order, an update's old values then its new
+        positions = [(column, i) for i, column in enumerate(self.audit_columns(cursor, 'customers')) if column in PII_COLUMNS]
+        for pending_id, row_id, op, diff in cursor.execute('''
+            SELECT pending_id, row_id, op, diff FROM audit_pending WHERE table_name = 'customers'
+        ''').fetchall():
+            values = json.loads(diff)
+            offsets = (0, len(values) // 2) if op == 'update' else (0,)
+            for column, i in positions:
+                for j in (offset + i for offset in offsets if offset + i < len(values)):
+                    values[j] = seal(column, values[j], row_id)
+            cursor.execute('UPDATE audit_pending SET diff = ? WHERE pending_id = ?', (json.dumps(values), pending_id))
+        # The journal refuses edits unless the compacting flag is up in this transaction
+        cursor.execute('UPDATE audit_context SET compacting = 1 WHERE id = 1')
+        for entry_id, row_id, diff in cursor.execute('''
+            SELECT entry_id, row_id, diff FROM audit_journal WHERE table_name = 'customers'
+        ''').fetchall():
+            values = {column: seal(column, value, row_id) if column in PII_COLUMNS else value
+                      for column, value in json.loads(diff).items()}
+            cursor.execute('UPDATE audit_journal SET diff = ? WHERE entry_id = ?',
+                           (json.dumps(values, separators=(',', ':')), entry_id))
+        cursor.execute('UPDATE audit_context SET compacting = 0 WHERE id = 1')
+        cursor.execute("INSERT OR IGNORE INTO pii_settings (key, value) VALUES ('key_id', ?)", (self.pii.key_id,))
+
+    def install_sync_triggers(self, cursor):
+        """(Re)create the change-capture triggers feeding the changelog"""
+        now = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+        origin = "(SELECT value FROM sync_meta WHERE key = 'node_id')"
+
+        for table, key in SYNC_TABLES.items():
+            columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+            fields = [f"'{column}', NEW.{column}" for column in columns
+                      if column != key and column not in SYNC_LOCAL_COLUMNS]
+            if table == 'customers':
+                # The receiving branch opens the details with the customer_id they were sealed to
+                fields.append(f"'{key}', NEW.{key}")
+            if table == 'rentals':
+                # Rentals travel with their customer's replication id, not the local customer_id
+                fields.append("'customer_uid', (SELECT sync_uid FROM customers WHERE customer_id = NEW.customer_id)")
+            log_upsert = f'''
+                INSERT INTO changelog (table_name, sync_uid, op, payload, changed_at, origin)
+                VALUES ('{table}', NEW.sync_uid, 'upsert', json_object({', '.join(fields)}), {now}, {origin})
+            '''
+
+            for suffix in ('uid', 'cdc_insert', 'cdc_update', 'cdc_delete'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_{suffix}')
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_uid AFTER INSERT ON {table} WHEN NEW.sync_uid IS NULL
+                BEGIN
+                    UPDATE {table} SET sync_uid = lower(hex(randomblob(16))) WHERE {key} = NEW.{key};
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_cdc_insert AFTER INSERT ON {table} WHEN NEW.sync_uid IS NOT NULL
+                BEGIN {log_upsert}; END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_cdc_update AFTER UPDATE ON {table} WHEN NEW.sync_uid IS NOT NULL
+                BEGIN {log_upsert}; END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_cdc_delete AFTER DELETE ON {table} WHEN OLD.sync_uid IS NOT NULL
+                BEGIN
+                    INSERT INTO changelog (table_name, sync_uid, op, payload, changed_at, origin)
+                    VALUES ('{table}', OLD.sync_uid, 'delete', NULL, {now}, {origin});
+                END
+            ''')
+    
+    @staticmethod
+    def audit_columns(cursor, table):
+        """Columns an audit entry records, in table order; ALTER TABLE only appends, so older entries still line up"""
+        return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})') if row[1] not in AUDIT_IGNORED_COLUMNS]
+
+    def install_audit_triggers(self, cursor):
+        """(Re)create the triggers staging audit entries: the row for inserts and deletes, before and after for updates"""
+        # Every connection parses these, so they stay minimal: bare value arrays, and the
+        # batched flush names the columns, narrows updates to what changed and drops no-ops
+        for table, key in AUDIT_TABLES.items():
+            columns = self.audit_columns(cursor, table)
+            old, new = (', '.join(f'{ref}.{column}' for column in columns) for ref in ('OLD', 'NEW'))
+
+            def stage(op, ref, values):
+                return (f"INSERT INTO audit_pending (table_name, row_id, op, diff, actor, changed_at) "
+                        f"VALUES ('{table}', {ref}.{key}, '{op}', json_array({values}), (SELECT actor FROM audit_context), "
+                        f"strftime('%Y-%m-%dT%H:%M:%f', 'now'))")
+
+            for op in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS audit_{table}_{op}')
+            cursor.execute(f"CREATE TRIGGER audit_{table}_insert AFTER INSERT ON {table} "
+                           f"BEGIN {stage('insert', 'NEW', new)}; END")
+            # UPDATE OF keeps statements on ignored columns from firing it at all
+            cursor.execute(f"CREATE TRIGGER audit_{table}_update AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                           f"BEGIN {stage('update', 'NEW', old + ', ' + new)}; END")
+            cursor.execute(f"CREATE TRIGGER audit_{table}_delete AFTER DELETE ON {table} "
+                           f"BEGIN {stage('delete', 'OLD', old)}; END")
     
+    @staticmethod
+    def redo_tables(cursor):
+        """Logged tables with their columns, primary key columns in key order, and text columns"""
+        tables = {}
+        for (table,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+            if table not in REDO_EXCLUDED_TABLES:
+                info = cursor.execute(f'PRAGMA table_info({table})').fetchall()
+                tables[table] = ([row[1] for row in info],
+                                 [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]],
+                                 {row[1] for row in info if 'TEXT' in row[2].upper()})
+        return tables
+
+    def install_redo_triggers(self, cursor):
+        """(Re)create the triggers logging row images for point-in-time restore"""
+        # Unlike the audit triggers these cover every table, which adds about a millisecond to each
+        # new connection's schema parse; they stay as short as they can: bare value arrays in table
+        # order, as ALTER TABLE only appends, and the timestamp left to the column default
+        for table, (columns, key, text) in self.redo_tables(cursor).items():
+            # Text written by a JSON function would nest as JSON; concatenating keeps it a string
+            values = [f"NEW.{column} || ''" if column in text else f'NEW.{column}' for column in columns]
+            row = f"json_array({', '.join(values)})"
+            old_key = f"json_array({', '.join(f'OLD.{column}' for column in key)})"
+
+            def log(row_key, payload):
+                return f"INSERT INTO redo_log (table_name, row_key, payload) VALUES ('{table}', {row_key}, {payload})"
+
+            for op in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS redo_{table}_{op}')
+            cursor.execute(f"CREATE TRIGGER redo_{table}_insert AFTER INSERT ON {table} BEGIN {log('NULL', row)}; END")
+            cursor.execute(f"CREATE TRIGGER redo_{table}_update AFTER UPDATE ON {table} BEGIN {log(old_key, row)}; END")
+            cursor.execute(f"CREATE TRIGGER redo_{table}_delete AFTER DELETE ON {table} BEGIN {log(old_key, 'NULL')}; END")
+
     def save_rental(self, rental_data):
-        """Save rental data to database"""
-        conn = sqlite3.connect(self.db_name)
+        """Save rental data to database, assigning a free unit of the rented product"""
+        self.access.require('rentals.create')
+        product = self.product_catalog.by_product_code(rental_data[3]) if rental_data[3] else None
+        conn = self.connect()
         cursor = conn.cursor()
+        unit_id = None
         
-        cursor.execute('''
-            INSERT INTO rentals (
-                customer_id, receipt_ref, product_type, product_code, no_days, cost_per_day,
-                account_open, app_date, next_credit_review, last_credit_review, date_rev,
-                credit_limit, credit_check, sett_due_day, payment_due, discount, deposit,
-                pay_due_day, payment_method, check_credit, term_agreed, account_on_hold,
-                restrict_mailing, tax, subtotal, total
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', rental_data)
-        
-        conn.commit()
-        conn.close()
-    
-    def get_all_rentals(self):
+        try:
+            if product:
+                unit_id = self.fleet.assign(cursor, product[0])
+                if unit_id is None:
+                    raise ValueError(f"No {product[1]} ({product[2]}) is available to rent")
+            
+            cursor.execute('''
+                INSERT INTO rentals (
+                    customer_id, receipt_ref, product_type, product_code, no_days, cost_per_day,
+                    account_open, app_date, next_credit_review, last_credit_review, date_rev,
+                    credit_limit, credit_check, sett_due_day, payment_due, discount, deposit,
+                    pay_due_day, payment_method, check_credit, term_agreed, account_on_hold,
+                    restrict_mailing, tax, subtotal, total, unit_id
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', tuple(rental_data) + (unit_id,))
+            rental_id = cursor.lastrowid
+            if unit_id:
+                cursor.execute('UPDATE units SET rental_id = ? WHERE unit_id = ?', (rental_id, unit_id))
+            cursor.execute(f'''
+                INSERT INTO open_rentals (rental_id, customer_id, unit_id, due_date, daily_rate)
+                {OPEN_RENTAL_SELECT} WHERE r.rental_id = ?
+            ''', (rental_id,))
+            if unit_id:
+                self.maintenance.replan(cursor, [unit_id])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if unit_id:
+                self.fleet.unassigned(product[0], unit_id)
+            raise
+        finally:
+            conn.close()
+        
+        if product:
+            self.product_catalog.invalidate(product[0])
+        self.events.publish(RentalCreated(
+            rental_id, customer_id=rental_data[0], product_type=rental_data[2], payment_method=rental_data[18],
+            account_on_hold=rental_data[21], total=rental_data[25]))
+        return rental_id
+    
+    def get_all_rentals(self):
         """Get all rental records"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.connect()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM rentals ORDER BY created_date DESC')
         results = cursor.fetchall()
@@ -142,7 +1329,7 @@ class DatabaseManager:
     
     def search_rentals(self, search_term):
         """Search rentals by receipt reference or product type"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.connect()
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM rentals 
@@ -153,89 +1340,4487 @@ class DatabaseManager:
         conn.close()
         return results
 
+    @staticmethod
+    def compile_rental_filters(filters):
+        """Compile history filters into a parameterized condition over rentals r / customers c"""
+        filters = filters or {}
+        clauses, params = [], []
+        
+        if filters.get('search'):
+            clauses.append('(r.receipt_ref LIKE ? OR r.product_type LIKE ? OR c.customer_name LIKE ?)')
+            params += [f"%{filters['search']}%"] * 3
+        # Half-open date range so the created_date index serves it
+        if filters.get('start_date'):
+            clauses.append('r.created_date >= ?')
+            params.append(str(filters['start_date']))
+        if filters.get('end_date'):
+            clauses.append('r.created_date < ?')
+            params.append(str(filters['end_date'] + datetime.timedelta(days=1)))
+        for key in ('rental_id', 'product_type', 'payment_method', 'customer_id'):
+            if filters.get(key) is not None:
+                clauses.append(f'r.{key} = ?')
+                params.append(filters[key])
+        if filters.get('min_total') is not None:
+            clauses.append('r.total >= ?')
+            params.append(filters['min_total'])
+        if filters.get('max_total') is not None:
+            clauses.append('r.total <= ?')
+            params.append(filters['max_total'])
+        if filters.get('on_hold') is not None:
+            if filters['on_hold']:
+                clauses.append('r.account_on_hold = 1')
+            else:
+                clauses.append('(r.account_on_hold = 0 OR r.account_on_hold IS NULL)')
+        
+        return ' AND '.join(clauses) or '1 = 1', params
+    
+    @staticmethod
+    def keyset_condition(sort_expr, descending, after):
+        """Condition for rows after the (sort value, rental_id) cursor; NULLs sort first ascending, last descending"""
+        value, rental_id = after
+        if descending:
+            if value is None:
+                return f'({sort_expr} IS NULL AND r.rental_id < ?)', [rental_id]
+            return f'(({sort_expr}, r.rental_id) < (?, ?) OR {sort_expr} IS NULL)', [value, rental_id]
+        if value is None:
+            return f'(({sort_expr} IS NULL AND r.rental_id > ?) OR {sort_expr} IS NOT NULL)', [rental_id]
+        return f'(({sort_expr}, r.rental_id) > (?, ?))', [value, rental_id]
+
+    def get_rental_page(self, filters=None, sort_column='Date', descending=True,
+                        limit=HISTORY_PAGE_SIZE, after=None):
+        """Get one page of filtered rental history rows, sorted in SQL on the typed column
+
+        Pages are keyset-paged: each row ends with its sort value, and the last row's
+        (sort value, rental_id) passed as after= starts the next page. Date ranges
+        reaching archived years read those archives too.
+        """
+        if sort_column not in HISTORY_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {sort_column}")
+        sort_expr = HISTORY_SORT_COLUMNS[sort_column]
+        direction = 'DESC' if descending else 'ASC'
+        where, params = self.compile_rental_filters(filters)
+        if after is not None:
+            condition, cursor_params = self.keyset_condition(sort_expr, descending, after)
+            where, params = f'{where} AND {condition}', params + cursor_params
+        filters = filters or {}
+        
+        # rental_id breaks ties so pages never overlap or skip rows; a limit
+        # of None returns every matching row (used by exports)
+        return self.archive.query_rentals(
+            f'''r.rental_id, r.receipt_ref, c.customer_name, r.product_type,
+                r.no_days, r.total, r.created_date, {sort_expr}''',
+            where, params, filters.get('start_date'), filters.get('end_date'),
+            order_by=f'8 {direction}, 1 {direction}',
+            joins='LEFT JOIN customers c ON r.customer_id = c.customer_id',
+            limit=limit, sort_key=lambda row: (row[7] is not None, row[7], row[0]), descending=descending)
+    
+    def get_rental_facets(self, filters=None):
+        """Count filtered rentals per product type, payment method and hold flag in one grouped pass"""
+        where, params = self.compile_rental_filters(filters)
+        filters = filters or {}
+        groups = self.archive.query_rentals(
+            '''r.product_type, r.payment_method, COALESCE(r.account_on_hold, 0),
+               COUNT(*), COALESCE(SUM(r.total), 0)''',
+            where, params, filters.get('start_date'), filters.get('end_date'),
+            joins='LEFT JOIN customers c ON r.customer_id = c.customer_id', group_by='1, 2, 3')
+        
+        facets = {'product_type': {}, 'payment_method': {}, 'on_hold': {},
+                  'rentals': 0, 'revenue': 0.0}
+        for product_type, payment_method, on_hold, count, revenue in groups:
+            for facet, value in (('product_type', product_type or 'Unknown'),
+                                 ('payment_method', payment_method or 'Unknown'),
+                                 ('on_hold', bool(on_hold))):
+                facets[facet][value] = facets[facet].get(value, 0) + count
+            facets['rentals'] += count
+            facets['revenue'] += revenue
+        return facets
+    
+    def get_rental_product_types(self):
+        """Distinct product types that appear in rentals"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT product_type FROM rentals WHERE product_type IS NOT NULL ORDER BY product_type')
+        results = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return results
+
     def get_all_customers(self):
         """Get all customers"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.connect()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM customers ORDER BY customer_name')
+        results = [self.reveal_customer(row) for row in cursor.fetchall()]
+        conn.close()
+        return results
+
+    def get_customer(self, customer_id):
+        """Get one customer row, or None"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM customers WHERE customer_id = ?', (customer_id,))
+        result = self.reveal_customer(cursor.fetchone())
+        conn.close()
+        return result
+
+    def find_customers(self, term, limit=None):
+        """Customers whose name starts with term, or whose phone or email is exactly term, by name"""
+        term = (term or '').strip()
+        if '@' in term:
+            where, params = 'email_bidx = ?', [self.pii.blind_index('email', term)]
+        elif re.fullmatch(r'[\d\s()+-]+', term) and len(FieldCipher.normalize('phone', term)) >= 5:
+            where, params = 'phone_bidx = ?', [self.pii.blind_index('phone', term)]
+        else:
+            # A case-insensitive LIKE prefix is served by the NOCASE name index
+            escaped = re.sub(r'([\\%_])', r'\\\1', term)
+            where, params = "customer_name LIKE ? ESCAPE '\\'", [f'{escaped}%']
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT * FROM customers WHERE {where} ORDER BY customer_name LIMIT ?',
+                       params + [-1 if limit is None else limit])
+        results = [self.reveal_customer(row) for row in cursor.fetchall()]
+        conn.close()
+        return results
+
+    def find_duplicate_customers(self, phone=None, email=None, exclude_id=None):
+        """(customer_id, customer_name) of customers already holding this phone number or email"""
+        clauses, params = [], []
+        for column, value in (('phone', phone), ('email', email)):
+            index = self.pii.blind_index(column, value)
+            if index:
+                clauses.append(f'{PII_BLIND_INDEXES[column]} = ?')
+                params.append(index)
+        if not clauses:
+            return []
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT customer_id, customer_name FROM customers
+            WHERE ({' OR '.join(clauses)}) AND customer_id IS NOT ?
+            ORDER BY customer_name
+        ''', params + [exclude_id])
+        results = cursor.fetchall()
+        conn.close()
+        return results
+
+    def seal_customer(self, customer_id, phone=None, email=None, address=None, stored=None):
+        """Details as stored for a customer: (phone, email, address) encrypted, then their blind indexes.
+        An unchanged detail keeps its stored ciphertext, so saving a customer as it was changes nothing"""
+        details = [self.pii.decrypt(column, value, customer_id)
+                   for column, value in zip(PII_COLUMNS, (phone, email, address))]
+        sealed = tuple(old if FieldCipher.is_sealed(old) and self.pii.decrypt(column, old, customer_id) == new
+                       else self.pii.encrypt(column, new, customer_id)
+                       for column, new, old in zip(PII_COLUMNS, details, stored or (None,) * len(PII_COLUMNS)))
+        plain = dict(zip(PII_COLUMNS, details))
+        return sealed + tuple(self.pii.blind_index(column, plain[column]) for column in PII_BLIND_INDEXES)
+
+    @staticmethod
+    def next_customer_id(cursor):
+        """The customer_id AUTOINCREMENT would give the next insert; call inside a write transaction"""
+        return cursor.execute('''
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'customers'), 0),
+                       COALESCE((SELECT MAX(customer_id) FROM customers), 0)) + 1
+        ''').fetchone()[0]
+
+    def reveal_customer(self, row):
+        """A customers row with its details decrypted; they follow customer_id and customer_name"""
+        if row is None:
+            return None
+        row = list(row)
+        for position, column in enumerate(PII_COLUMNS, start=2):
+            row[position] = self.pii.decrypt(column, row[position], row[0])
+        return tuple(row)
+
+    def add_customer(self, customer_name, phone=None, email=None, address=None):
+        """Insert a customer and return the new customer_id"""
+        self.access.require('customers.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        # The id is taken inside the write transaction, so the details can be sealed to it before the insert
+        cursor.execute('BEGIN')
+        customer_id = self.next_customer_id(cursor)
+        cursor.execute('''
+            INSERT INTO customers (customer_id, customer_name, phone, email, address, phone_bidx, email_bidx)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (customer_id, customer_name) + self.seal_customer(customer_id, phone, email, address))
+        conn.commit()
+        conn.close()
+        self.events.publish(CustomerAdded(customer_id))
+        return customer_id
+
+    def update_customer(self, customer_id, customer_name, phone=None, email=None, address=None):
+        """Update a customer's contact details"""
+        self.access.require('customers.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        stored = cursor.execute('SELECT phone, email, address FROM customers WHERE customer_id = ?',
+                                (customer_id,)).fetchone()
+        cursor.execute('''
+            UPDATE customers 
+            SET customer_name = ?, phone = ?, email = ?, address = ?, phone_bidx = ?, email_bidx = ?
+            WHERE customer_id = ?
+        ''', (customer_name,) + self.seal_customer(customer_id, phone, email, address, stored) + (customer_id,))
+        conn.commit()
+        conn.close()
+        self.events.publish(CustomerUpdated(customer_id))
+
+    # New methods for product management
+    def add_product(self, product_type, product_code, cost_per_day, available_quantity):
+        """Add a new product to the database."""
+        self.access.require('products.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            # A deleted code comes back as its old row, so the code's rental history stays with it
+            deleted = cursor.execute('SELECT product_id FROM products WHERE product_code = ? AND deleted_at IS NOT NULL',
+                                     (product_code,)).fetchone()
+            if deleted:
+                product_id = deleted[0]
+                cursor.execute('''
+                    UPDATE products SET product_type = ?, cost_per_day = ?, status = 'Available', deleted_at = NULL
+                    WHERE product_id = ?
+                ''', (product_type, cost_per_day, product_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO products (product_type, product_code, cost_per_day, available_quantity)
+                    VALUES (?, ?, ?, ?)
+                ''', (product_type, product_code, cost_per_day, available_quantity))
+                product_id = cursor.lastrowid
+            self.fleet.resize(cursor, product_id, available_quantity)
+            conn.commit()
+            self.product_catalog.invalidate(product_id)
+            self.events.publish(ProductAdded(product_id))
+            return True
+        except sqlite3.IntegrityError:
+            messagebox.showerror("Error", "Product code already exists.")
+            return False
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to add product: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def update_product(self, product_id, product_type, product_code, cost_per_day, available_quantity, status):
+        """Update an existing product's details."""
+        self.access.require('products.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            # A status changed by hand is no longer the maintenance planner's to lift
+            cursor.execute('''
+                UPDATE products
+                SET product_type = ?, product_code = ?, cost_per_day = ?, available_quantity = ?, status = ?,
+                    maintenance_hold = CASE WHEN status = ? THEN maintenance_hold ELSE 0 END
+                WHERE product_id = ?
+            ''', (product_type, product_code, cost_per_day, available_quantity, status, status, product_id))
+            self.fleet.resize(cursor, product_id, available_quantity)
+            conn.commit()
+            self.product_catalog.invalidate(product_id)
+            self.events.publish(ProductUpdated(product_id))
+            return True
+        except sqlite3.IntegrityError:
+            messagebox.showerror("Error", "Product code already exists for another product.")
+            return False
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to update product: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def delete_product(self, product_id):
+        """Tombstone a product: it leaves the catalog but its rentals still join to it"""
+        self.access.require('products.delete')
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE products SET deleted_at = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+                WHERE product_id = ? AND deleted_at IS NULL
+            ''', (product_id,))
+            self.fleet.retire_product(cursor, product_id)
+            conn.commit()
+            self.product_catalog.invalidate(product_id)
+            self.events.publish(ProductDeleted(product_id))
+            return True
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to delete product: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def get_all_products(self):
+        """Get all products from the database."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM products WHERE deleted_at IS NULL ORDER BY product_type, product_code')
+        results = cursor.fetchall()
+        conn.close()
+        return results
+
+    def get_product(self, product_id):
+        """Get one product row, or None once it has been deleted"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM products WHERE product_id = ? AND deleted_at IS NULL', (product_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result
+
+    # Tariff methods
+    def get_tariff(self):
+        """Load the current tariff from the database."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT label, max_days, credit_limit, discount FROM tariff_periods ORDER BY max_days')
+        periods = cursor.fetchall()
+        cursor.execute('SELECT key, value FROM tariff_settings')
+        settings = dict(cursor.fetchall())
+        cursor.execute('SELECT product_type, cost_per_day FROM tariff_rates')
+        type_rates = dict(cursor.fetchall())
+        conn.close()
+
+        tax_rate = float(settings.get('tax_rate', DEFAULT_TARIFF_SETTINGS['tax_rate']))
+        tiers = settings.get('discount_tiers', DEFAULT_TARIFF_SETTINGS['discount_tiers'])
+        discount_tiers = [float(t) for t in tiers.split(',') if t.strip()]
+        return Tariff(periods, tax_rate, discount_tiers, type_rates)
+
+    def save_tariff(self, tariff):
+        """Replace the stored tariff with the given one."""
+        self.access.require('pricing.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM tariff_periods')
+            cursor.executemany('''
+                INSERT INTO tariff_periods (label, max_days, credit_limit, discount)
+                VALUES (?, ?, ?, ?)
+            ''', tariff.periods)
+            cursor.execute('DELETE FROM tariff_rates')
+            cursor.executemany('INSERT INTO tariff_rates (product_type, cost_per_day) VALUES (?, ?)',
+                               list(tariff.type_rates.items()))
+            cursor.executemany('INSERT OR REPLACE INTO tariff_settings (key, value) VALUES (?, ?)', [
+                ('tax_rate', str(tariff.tax_rate)),
+                ('discount_tiers', ','.join(f"{t:g}" for t in tariff.discount_tiers))
+            ])
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Error", f"Failed to save tariff: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    # Pricing rule methods
+    def get_pricing_rules(self, active_only=False):
+        """Get pricing rules, optionally only the active ones."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        query = 'SELECT * FROM pricing_rules'
+        if active_only:
+            query += ' WHERE active = 1'
+        cursor.execute(query + ' ORDER BY rule_type, rule_id')
         results = cursor.fetchall()
         conn.close()
         return results
 
-    # New methods for product management
-    def add_product(self, product_type, product_code, cost_per_day, available_quantity):
-        """Add a new product to the database."""
-        conn = sqlite3.connect(self.db_name)
+    def add_pricing_rule(self, rule_type, adjustment, product_type=None, start_date=None, end_date=None,
+                         min_rentals=0, description=None):
+        """Add a pricing rule; adjustment is a percentage (negative for discounts)."""
+        self.access.require('pricing.edit')
+        if rule_type not in PRICING_RULE_TYPES:
+            messagebox.showerror("Error", f"Unknown rule type: {rule_type}")
+            return False
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO pricing_rules (rule_type, product_type, start_date, end_date, min_rentals, adjustment, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (rule_type, product_type, start_date, end_date, min_rentals, adjustment, description))
+            conn.commit()
+            self.rules_version = self.get_rules_version()
+            return True
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to add pricing rule: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def update_pricing_rule(self, rule_id, rule_type, adjustment, product_type=None, start_date=None,
+                            end_date=None, min_rentals=0, description=None, active=1):
+        """Update an existing pricing rule."""
+        self.access.require('pricing.edit')
+        if rule_type not in PRICING_RULE_TYPES:
+            messagebox.showerror("Error", f"Unknown rule type: {rule_type}")
+            return False
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE pricing_rules
+                SET rule_type = ?, product_type = ?, start_date = ?, end_date = ?, min_rentals = ?,
+                    adjustment = ?, description = ?, active = ?
+                WHERE rule_id = ?
+            ''', (rule_type, product_type, start_date, end_date, min_rentals, adjustment, description, active, rule_id))
+            conn.commit()
+            self.rules_version = self.get_rules_version()
+            return True
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to update pricing rule: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def delete_pricing_rule(self, rule_id):
+        """Delete a pricing rule."""
+        self.access.require('pricing.edit')
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM pricing_rules WHERE rule_id = ?', (rule_id,))
+            conn.commit()
+            self.rules_version = self.get_rules_version()
+            return True
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to delete pricing rule: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def get_rules_version(self):
+        """Stored pricing rules version, bumped by triggers on every rule edit."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT rewrites FROM data_versions WHERE table_name = 'pricing_rules'")
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+    def get_customer_rental_ids(self):
+        """Get {customer_id: sorted rental_ids}; loyalty counts are taken from this one query."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT customer_id, rental_id FROM rentals WHERE customer_id IS NOT NULL ORDER BY customer_id, rental_id')
+        results = {}
+        for customer_id, rental_id in cursor.fetchall():
+            results.setdefault(customer_id, []).append(rental_id)
+        conn.close()
+        return results
+
+class ReadOnlyDatabase(DatabaseManager):
+    """Read-only access to an existing database, used by report worker processes"""
+    read_only = True
+
+    def connect(self):
+        path = urllib.parse.quote(os.path.abspath(self.db_name))
+        return sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+
+class Session:
+    """A signed-in user and the permissions their role compiled to"""
+
+    def __init__(self, username, role, permissions, session_id=None, idle_seconds=SESSION_IDLE_MINUTES * 60):
+        self.username = username
+        self.role = role
+        self.permissions = permissions
+        self.session_id = session_id
+        self.idle_seconds = idle_seconds
+        self.last_active = time.monotonic()
+
+class AccessControl:
+    """Users, roles and sessions; a permission check is one lookup in the session's compiled set"""
+
+    def __init__(self, db_manager, session=None):
+        self.db_manager = db_manager
+        self.session = session
+
+    @staticmethod
+    def hash_password(password, salt=None):
+        """A salted scrypt hash, stored with its parameters as scrypt$n$r$p$salt$hash"""
+        salt = salt or os.urandom(16)
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+    @staticmethod
+    def verify_password(password, stored):
+        """Whether a password matches a stored hash, compared in constant time"""
+        try:
+            scheme, n, r, p, salt, digest = stored.split('$')
+        except ValueError:
+            return False
+        if scheme != 'scrypt':
+            return False
+        candidate = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt),
+                                   n=int(n), r=int(r), p=int(p), dklen=len(digest) // 2)
+        return hmac.compare_digest(candidate.hex(), digest)
+
+    @staticmethod
+    def compile_roles(cursor):
+        """role -> frozenset of the permissions it grants"""
+        roles = {}
+        for role, permissions in cursor.execute('SELECT role, permissions FROM roles'):
+            granted = {p.strip() for p in (permissions or '').split(',')}
+            roles[role] = frozenset(PERMISSIONS) if '*' in granted else frozenset(granted & set(PERMISSIONS))
+        return roles
+
+    def current(self):
+        """The signed-in session, kept alive; raises PermissionError if there is none or it has lapsed"""
+        session = self.session
+        if session is None:
+            raise PermissionError("Sign in to make changes")
+        now = time.monotonic()
+        if session.idle_seconds and now - session.last_active > session.idle_seconds:
+            self.sign_out()
+            raise PermissionError("Your session has expired; sign in again")
+        session.last_active = now
+        return session
+
+    def require(self, permission):
+        """Raise PermissionError unless the signed-in user's role grants permission"""
+        session = self.current()
+        if permission not in session.permissions:
+            raise PermissionError(f"{session.username} ({session.role}) may not {PERMISSIONS[permission]}")
+
+    def has_users(self):
+        conn = self.db_manager.connect()
+        found = conn.execute('SELECT 1 FROM users LIMIT 1').fetchone()
+        conn.close()
+        return found is not None
+
+    def sign_in(self, username, password):
+        """Start a session, ending any current one; raises PermissionError for a wrong name or password"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            row = cursor.execute('SELECT user_id, username, password_hash, role FROM users WHERE username = ? AND active = 1',
+                                 ((username or '').strip(),)).fetchone()
+            if row is None:
+                # Unknown names cost a hash too, so timing does not tell which accounts exist
+                self.hash_password(password)
+                raise PermissionError("Unknown user name or wrong password")
+            if not self.verify_password(password, row[2]):
+                raise PermissionError("Unknown user name or wrong password")
+            permissions = self.compile_roles(cursor).get(row[3], frozenset())
+            cursor.execute('''
+                INSERT INTO sessions (user_id, host, started_at) VALUES (?, ?, strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+            ''', (row[0], socket.gethostname()))
+            session_id = cursor.lastrowid
+            cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?', (row[0],))
+            conn.commit()
+        finally:
+            conn.close()
+        self.sign_out()
+        self.session = Session(row[1], row[3], permissions, session_id)
+        self.db_manager.actor = f"{row[1]}@{socket.gethostname()}"
+        return self.session
+
+    def sign_out(self):
+        """End the current session; changes are refused until someone signs in"""
+        session, self.session = self.session, None
+        if session is not None and session.session_id is not None:
+            conn = self.db_manager.connect()
+            conn.execute("UPDATE sessions SET ended_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE session_id = ?",
+                         (session.session_id,))
+            conn.commit()
+            conn.close()
+        self.db_manager.actor = default_actor()
+
+    def roles(self):
+        conn = self.db_manager.connect()
+        roles = self.compile_roles(conn.cursor())
+        conn.close()
+        return roles
+
+    def users(self):
+        """(username, role, active, last_login) for every account"""
+        conn = self.db_manager.connect()
+        rows = conn.execute('SELECT username, role, active, last_login FROM users ORDER BY username').fetchall()
+        conn.close()
+        return rows
+
+    def add_user(self, username, password, role):
+        """Create an account; the first one needs no sign-in and is always an administrator"""
+        first = not self.has_users()
+        if not first:
+            self.require('users.manage')
+        role = 'admin' if first else role
+        username = (username or '').strip()
+        if not username:
+            raise ValueError("A user name is required")
+        self._check(password, role)
+        conn = self.db_manager.connect()
+        try:
+            conn.execute('INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
+                         (username, self.hash_password(password), role))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            raise ValueError(f"A user named {username} already exists")
+        finally:
+            conn.close()
+
+    def set_password(self, username, password, current=None):
+        """Change your own password given the current one, or anyone's with users.manage"""
+        session = self.current()
+        own = session.session_id is not None and session.username.lower() == username.lower()
+        if not own:
+            self.require('users.manage')
+        elif current is None:
+            raise ValueError("Give your current password to change it")
+        self._check(password)
+        conn = self.db_manager.connect()
+        try:
+            row = conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                raise ValueError(f"No user named {username}")
+            if own and not self.verify_password(current, row[0]):
+                raise PermissionError("The current password is wrong")
+            conn.execute('UPDATE users SET password_hash = ? WHERE username = ?', (self.hash_password(password), username))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def set_role(self, username, role):
+        """Give a user another role; it applies from their next sign-in"""
+        self.require('users.manage')
+        self._check(role=role)
+        self._update_user('UPDATE users SET role = ? WHERE username = ?', (role, username), username)
+
+    def set_active(self, username, active):
+        """Disable or re-enable an account"""
+        self.require('users.manage')
+        self._update_user('UPDATE users SET active = ? WHERE username = ?', (1 if active else 0, username), username)
+
+    def _update_user(self, sql, params, username):
+        conn = self.db_manager.connect()
+        try:
+            if conn.execute(sql, params).rowcount == 0:
+                raise ValueError(f"No user named {username}")
+            admins = self.compile_roles(conn.cursor())
+            if not any(role for (role,) in conn.execute('SELECT role FROM users WHERE active = 1')
+                       if 'users.manage' in admins.get(role, ())):
+                raise ValueError("At least one active account must be able to manage users")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _check(self, password=None, role=None):
+        if password is not None and len(password) < MIN_PASSWORD_LENGTH:
+            raise ValueError(f"Passwords need at least {MIN_PASSWORD_LENGTH} characters")
+        if role is not None and role not in self.roles():
+            raise ValueError(f"Unknown role: {role}")
+
+class FieldCipher:
+    """Encrypts customer details under a local key file, with HMAC blind indexes for equality lookups
+
+    A value is sealed with an AEAD whose associated data is the customer_id and column, so a
+    ciphertext copied onto another customer or into another column fails to open. AES-256-GCM
+    from the cryptography package is used when it is installed ('enc2:', 12-byte random nonce).
+    Without it the fallback ('enc3:') is encrypt-then-MAC from the standard library: a keyed
+    BLAKE2b keystream (key, 16-byte random nonce, block counter) XORed with the value, then a
+    keyed BLAKE2b tag over the associated data and the nonce and ciphertext. Both keys, and the
+    key branches sign their sync handshakes with, are derived from the key file by HMAC-SHA256
+    under their own labels. A machine without the package cannot open 'enc2:' values, so
+    branches sharing customers should install it alike.
+    'enc1:' values, sealed before the associated data was bound, are still read and are
+    re-sealed the next time the database is opened. Blind indexes are HMAC-SHA256 and
+    deterministic, so equal details give equal index values and a plain SQL index can find them.
+    """
+    GCM_PREFIX = 'enc2:'
+    FALLBACK_PREFIX = 'enc3:'
+    LEGACY_PREFIX = 'enc1:'
+    PREFIX = GCM_PREFIX if AESGCM else FALLBACK_PREFIX
+    SEALED_PREFIXES = (GCM_PREFIX, FALLBACK_PREFIX)
+    GCM_NONCE_BYTES = 12
+    NONCE_BYTES = 16
+    TAG_BYTES = 16
+
+    def __init__(self, key_file=None):
+        self.key_file = key_file or PII_KEY_FILE
+        self.keys = None
+
+    def load(self, create=False):
+        """Read the key file, or with create make one; returns the derived keys"""
+        if self.keys is not None:
+            return self.keys
+        try:
+            with open(self.key_file, 'r', encoding='ascii') as f:
+                master = bytes.fromhex(f.read().strip())
+        except FileNotFoundError:
+            if not create:
+                raise RuntimeError(f"Customer details are encrypted, but the key file {self.key_file} is missing. "
+                                   f"Copy it from a machine that already opens this database.")
+            master = self._create()
+        if len(master) != 32:
+            raise RuntimeError(f"{self.key_file} is not a valid key file")
+        derive = lambda label: hmac.digest(master, label, 'sha256')
+        self.keys = {'encrypt': derive(b'encrypt'), 'mac': derive(b'mac'), 'index': derive(b'index'),
+                     'sync': derive(b'sync'), 'id': derive(b'key-id').hex()[:16]}
+        if AESGCM:
+            self.keys['gcm'] = AESGCM(self.keys['encrypt'])
+        return self.keys
+
+    def _create(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.key_file)), exist_ok=True)
+        master = os.urandom(32)
+        try:
+            fd = os.open(self.key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Another process opening a new database got there first
+            with open(self.key_file, 'r', encoding='ascii') as f:
+                return bytes.fromhex(f.read().strip())
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(master.hex())
+        return master
+
+    @property
+    def key_id(self):
+        """Fingerprint of the key, stored in the database and exchanged by syncing branches"""
+        return self.load()['id']
+
+    def sign(self, *parts):
+        """HMAC-SHA256 of the parts under the sync key; only a branch with the same key file can produce it"""
+        message = b'\0'.join(str(part).encode('utf-8') for part in parts)
+        return hmac.digest(self.load()['sync'], message, 'sha256').hex()
+
+    def verify(self, signature, *parts):
+        """Check a peer's signature in constant time"""
+        return hmac.compare_digest(str(signature).encode('utf-8'), self.sign(*parts).encode('utf-8'))
+
+    @classmethod
+    def is_encrypted(cls, value):
+        return isinstance(value, str) and value.startswith((cls.LEGACY_PREFIX,) + cls.SEALED_PREFIXES)
+
+    @classmethod
+    def is_sealed(cls, value):
+        """Encrypted with its customer_id bound, so it never needs sealing again"""
+        return isinstance(value, str) and value.startswith(cls.SEALED_PREFIXES)
+
+    @staticmethod
+    def associated_data(customer_id, column):
+        return f"{'' if customer_id is None else customer_id}\0{column}".encode('utf-8')
+
+    def _apply_keystream(self, keys, nonce, data):
+        stream = hashlib.blake2b(nonce + b'\0\0\0\0', key=keys['encrypt']).digest()
+        for block in range(1, (len(data) + 63) // 64):
+            stream += hashlib.blake2b(nonce + struct.pack('!I', block), key=keys['encrypt']).digest()
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(stream[:len(data)], 'big')).to_bytes(len(data), 'big')
+
+    def _tag(self, keys, associated, body):
+        # The length prefix keeps the associated data and the body from running into each other
+        return hashlib.blake2b(struct.pack('!I', len(associated)) + associated + body,
+                               key=keys['mac'], digest_size=self.TAG_BYTES).digest()
+
+    def encrypt(self, column, value, customer_id):
+        """Ciphertext of one column value of a customer; empty values and sealed ones are kept"""
+        if not value or self.is_sealed(value):
+            return value
+        keys = self.keys or self.load()
+        associated = self.associated_data(customer_id, column)
+        if AESGCM:
+            nonce = os.urandom(self.GCM_NONCE_BYTES)
+            raw = nonce + keys['gcm'].encrypt(nonce, value.encode('utf-8'), associated)
+        else:
+            nonce = os.urandom(self.NONCE_BYTES)
+            body = nonce + self._apply_keystream(keys, nonce, value.encode('utf-8'))
+            raw = body + self._tag(keys, associated, body)
+        return self.PREFIX + binascii.b2a_base64(raw, newline=False).decode('ascii')
+
+    def decrypt(self, column, value, customer_id):
+        """Plaintext of one column value of a customer; values that were never encrypted pass through"""
+        if not self.is_encrypted(value):
+            return value
+        keys = self.keys or self.load()
+        prefix = value[:len(self.PREFIX)]
+        raw = binascii.a2b_base64(value[len(prefix):])
+        failed = ValueError(f"A customer {column} cannot be decrypted with the key in {self.key_file}")
+        if prefix == self.GCM_PREFIX:
+            if not AESGCM:
+                raise RuntimeError("Customer details were encrypted with AES-GCM; install the cryptography package to read them")
+            nonce = raw[:self.GCM_NONCE_BYTES]
+            try:
+                return keys['gcm'].decrypt(nonce, raw[self.GCM_NONCE_BYTES:],
+                                           self.associated_data(customer_id, column)).decode('utf-8')
+            except InvalidTag:
+                raise failed from None
+        body, tag = raw[:-self.TAG_BYTES], raw[-self.TAG_BYTES:]
+        if prefix == self.LEGACY_PREFIX:
+            expected = hashlib.blake2b(column.encode('utf-8') + b'\0' + body, key=keys['mac'],
+                                       digest_size=self.TAG_BYTES).digest()
+        else:
+            expected = self._tag(keys, self.associated_data(customer_id, column), body)
+        if not hmac.compare_digest(tag, expected):
+            raise failed
+        return self._apply_keystream(keys, body[:self.NONCE_BYTES], body[self.NONCE_BYTES:]).decode('utf-8')
+
+    @staticmethod
+    def normalize(column, value):
+        """The form a detail is matched on: phone digits only, emails trimmed and lower-cased"""
+        if column == 'phone':
+            return re.sub(r'\D', '', value or '')
+        return (value or '').strip().lower()
+
+    def blind_index(self, column, value):
+        """Deterministic keyed hash of a normalized detail, or None when it is empty"""
+        normalized = self.normalize(column, value)
+        if not normalized:
+            return None
+        return hmac.digest(self.load()['index'], f"{column}\0{normalized}".encode('utf-8'), 'sha256').hex()[:32]
+
+class FleetManager:
+    """Per-vehicle units with a state machine and a longest-idle-first pool of free units per product"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.lock = threading.Lock()
+        self.pools = {}  # product_id -> heap of (state_changed, unit_id)
+        self.free = {}   # product_id -> unit_ids the heap may hand out
+
+    def _load_pool(self, cursor, product_id):
+        heap = [(changed or '', unit_id) for changed, unit_id in cursor.execute('''
+            SELECT state_changed, unit_id FROM units WHERE product_id = ? AND state = 'available'
+        ''', (product_id,))]
+        heapq.heapify(heap)
+        self.pools[product_id] = heap
+        self.free[product_id] = {unit_id for _, unit_id in heap}
+
+    def forget(self, product_id):
+        """Drop a product's pool so it is reloaded from the units table on next use"""
+        with self.lock:
+            self.pools.pop(product_id, None)
+            self.free.pop(product_id, None)
+
+    @staticmethod
+    def _set_state(cursor, unit_id, state, from_states, rental_id=None):
+        """Conditional move, so a unit another process changed first is never overwritten"""
+        cursor.execute(f'''
+            UPDATE units SET state = ?, rental_id = ?, state_changed = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+            WHERE unit_id = ? AND state IN ({', '.join('?' * len(from_states))})
+        ''', (state, rental_id, unit_id) + tuple(from_states))
+        return cursor.rowcount == 1
+
+    def assign(self, cursor, product_id, rental_id=None):
+        """Rent out the longest-idle available unit of a product inside the caller's transaction; None if none is free"""
+        with self.lock:
+            reloaded = product_id not in self.pools
+            if reloaded:
+                self._load_pool(cursor, product_id)
+            while True:
+                heap, free = self.pools[product_id], self.free[product_id]
+                while heap:
+                    _, unit_id = heapq.heappop(heap)
+                    if unit_id not in free:
+                        continue  # Left the available state since it was pooled
+                    free.discard(unit_id)
+                    # Another counter may have taken it since the pool was loaded
+                    if self._set_state(cursor, unit_id, 'rented', ('available',), rental_id):
+                        return unit_id
+                if reloaded:
+                    return None
+                # Units freed by other processes are only seen after a reload
+                self._load_pool(cursor, product_id)
+                reloaded = True
+
+    def unassigned(self, product_id, unit_id):
+        """Put back a unit whose rental was rolled back"""
+        self._track(product_id, unit_id, 'available', '')
+
+    def _track(self, product_id, unit_id, state, changed=None):
+        with self.lock:
+            if product_id not in self.pools:
+                return
+            if state != 'available':
+                self.free[product_id].discard(unit_id)
+            elif unit_id not in self.free[product_id]:
+                self.free[product_id].add(unit_id)
+                changed = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] if changed is None else changed
+                heapq.heappush(self.pools[product_id], (changed, unit_id))
+
+    def transition(self, unit_id, state):
+        """Move a unit to a new state if the state machine allows it; returns the previous state"""
+        self.db_manager.access.require('fleet.edit')
+        if state not in UNIT_STATES:
+            raise ValueError(f"Unknown unit state: {state}")
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            row = cursor.execute('SELECT product_id, state, rental_id FROM units WHERE unit_id = ?', (unit_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown unit: {unit_id}")
+            product_id, current, rental_id = row
+            if state not in UNIT_TRANSITIONS[current]:
+                raise ValueError(f"A {current} unit cannot become {state}")
+            if not self._set_state(cursor, unit_id, state, (current,), rental_id if state == 'maintenance' else None):
+                raise ValueError(f"Unit {unit_id} changed state meanwhile; try again")
+            conn.commit()
+        finally:
+            conn.close()
+        self._track(product_id, unit_id, state)
+        self.db_manager.product_catalog.invalidate(product_id)
+        return current
+
+    def release_rental(self, rental_id, state='available'):
+        """Bring back the unit out on a rental, to available or straight into maintenance"""
+        conn = self.db_manager.connect()
+        row = conn.execute("SELECT unit_id FROM units WHERE rental_id = ? AND state = 'rented'", (rental_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        self.transition(row[0], state)
+        return row[0]
+
+    def check_in(self, cursor, rental_id, state='available'):
+        """Return a rental's unit inside the caller's transaction; (product_id, unit_id) or None"""
+        if state not in UNIT_TRANSITIONS['rented']:
+            raise ValueError(f"A returned unit cannot become {state}")
+        row = cursor.execute("SELECT unit_id, product_id FROM units WHERE rental_id = ? AND state = 'rented'",
+                             (rental_id,)).fetchone()
+        if row is None or not self._set_state(cursor, row[0], state, ('rented',),
+                                              rental_id if state == 'maintenance' else None):
+            return None
+        return row[1], row[0]
+
+    def checked_in(self, product_id, unit_id, state='available'):
+        """After the check-in commits: offer the unit again and refresh stock counts"""
+        self._track(product_id, unit_id, state)
+        self.db_manager.product_catalog.invalidate(product_id)
+
+    def resize(self, cursor, product_id, quantity):
+        """Add or retire available units until a product has quantity of them, inside the caller's transaction"""
+        product_code, available = cursor.execute('''
+            SELECT p.product_code, (SELECT COUNT(*) FROM units WHERE product_id = p.product_id AND state = 'available')
+            FROM products p WHERE p.product_id = ?
+        ''', (product_id,)).fetchone()
+        prefix = product_code or f"P{product_id}"
+        # Numbering continues past every unit made under the code, a hard-deleted product's included
+        total = cursor.execute('SELECT COUNT(*) FROM units WHERE unit_code > ? AND unit_code < ?',
+                               (f"{prefix}-", f"{prefix}.")).fetchone()[0]
+        if quantity > available:
+            cursor.executemany('''
+                INSERT INTO units (product_id, product_type, unit_code)
+                SELECT product_id, product_type, ? FROM products WHERE product_id = ?
+            ''', ((f"{prefix}-{n:03d}", product_id) for n in range(total + 1, total + 1 + quantity - available)))
+        elif quantity < available:
+            cursor.execute('''
+                UPDATE units SET state = 'retired', state_changed = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+                WHERE unit_id IN (
+                    SELECT unit_id FROM units WHERE product_id = ? AND state = 'available'
+                    ORDER BY unit_id DESC LIMIT ?
+                )
+            ''', (product_id, available - quantity))
+        # The units are authoritative for the stock count
+        cursor.execute('''
+            UPDATE products SET available_quantity = (
+                SELECT COUNT(*) FROM units WHERE product_id = products.product_id AND state = 'available')
+            WHERE product_id = ? AND available_quantity IS NOT (
+                SELECT COUNT(*) FROM units WHERE product_id = products.product_id AND state = 'available')
+        ''', (product_id,))
+        self.forget(product_id)
+
+    def retire_product(self, cursor, product_id):
+        """Retire a deleted product's vehicles inside the caller's transaction"""
+        # Vehicles still out stay rented until they come back
+        cursor.execute('''
+            UPDATE units SET state = 'retired', state_changed = strftime('%Y-%m-%dT%H:%M:%f', 'now')
+            WHERE product_id = ? AND state != 'rented'
+        ''', (product_id,))
+        # A replicated product arrives with the other branch's count
+        cursor.execute('''
+            UPDATE products SET available_quantity = (
+                SELECT COUNT(*) FROM units WHERE product_id = products.product_id AND state = 'available')
+            WHERE product_id = ?
+        ''', (product_id,))
+        self.forget(product_id)
+
+    def units(self, product_id):
+        """(unit_id, unit_code, state, rental_id, state_changed) for one product"""
+        conn = self.db_manager.connect()
+        rows = conn.execute('''
+            SELECT unit_id, unit_code, state, rental_id, state_changed FROM units
+            WHERE product_id = ? ORDER BY unit_code
+        ''', (product_id,)).fetchall()
+        conn.close()
+        return rows
+
+    def state_counts(self, product_type=None):
+        """Units per state, for one product type or the whole fleet"""
+        conn = self.db_manager.connect()
+        if product_type is None:
+            rows = conn.execute('SELECT state, COUNT(*) FROM units GROUP BY state').fetchall()
+        else:
+            rows = conn.execute('SELECT state, COUNT(*) FROM units WHERE product_type = ? GROUP BY state',
+                                (product_type,)).fetchall()
+        conn.close()
+        counts = dict.fromkeys(UNIT_STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def fleet_sizes(self):
+        """Units in the fleet (any state but retired) per product type"""
+        conn = self.db_manager.connect()
+        rows = conn.execute('''
+            SELECT u.product_type, COUNT(*) FROM units u
+            JOIN products p ON p.product_id = u.product_id
+            WHERE u.state != 'retired' AND p.deleted_at IS NULL
+            GROUP BY u.product_type
+        ''').fetchall()
+        conn.close()
+        return dict(rows)
+
+    def unit_by_code(self, unit_code):
+        conn = self.db_manager.connect()
+        row = conn.execute('SELECT unit_id, product_id, state FROM units WHERE unit_code = ?', (unit_code,)).fetchone()
+        conn.close()
+        return row
+
+class SimulatedClock:
+    """Clock for exercising the return scheduler: time only moves when advanced"""
+
+    def __init__(self, start=None):
+        self.current = start or datetime.datetime.now()
+
+    def now(self):
+        return self.current
+
+    def advance(self, days=0, hours=0, minutes=0):
+        self.current += datetime.timedelta(days=days, hours=hours, minutes=minutes)
+        return self.current
+
+class SystemClock:
+    def now(self):
+        return datetime.datetime.now()
+
+class ReturnScheduler:
+    """Return workflow plus a background overdue scan driven by the open_rentals due-date index"""
+
+    def __init__(self, db_manager, clock=None):
+        self.db_manager = db_manager
+        self.clock = clock or SystemClock()
+        self.timer = None
+
+    def late_fee_multiplier(self, cursor):
+        row = cursor.execute("SELECT value FROM tariff_settings WHERE key = 'late_fee_multiplier'").fetchone()
+        return float(row[0] if row else DEFAULT_TARIFF_SETTINGS['late_fee_multiplier'])
+
+    def tick(self):
+        """Flag rentals that went past their due date since the last scan; returns their ids"""
+        today = str(self.clock.now().date())
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        # Only the newly due slice of the index is read, never the whole book
+        due = [row[0] for row in cursor.execute('''
+            SELECT rental_id FROM open_rentals WHERE overdue_since IS NULL AND due_date < ?
+        ''', (today,))]
+        if due:
+            cursor.execute('''
+                UPDATE open_rentals SET overdue_since = ?
+                WHERE overdue_since IS NULL AND due_date < ?
+            ''', (today, today))
+            conn.commit()
+        conn.close()
+        for rental_id in due:
+            self.db_manager.events.publish(RentalOverdue(rental_id))
+        return due
+
+    def next_due(self):
+        """Earliest due date still waiting to go overdue, or None"""
+        conn = self.db_manager.connect()
+        row = conn.execute('SELECT MIN(due_date) FROM open_rentals WHERE overdue_since IS NULL').fetchone()
+        conn.close()
+        return datetime.date.fromisoformat(row[0]) if row and row[0] else None
+
+    def return_rental(self, rental_id, unit_state='available', odometer=None):
+        """Close a rental: charge any late fee and restock its unit, or send it for a service that fell due; returns the return record"""
+        self.db_manager.access.require('rentals.return')
+        today = self.clock.now().date()
+        maintenance = self.db_manager.maintenance
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            row = cursor.execute('''
+                SELECT o.customer_id, r.receipt_ref, o.unit_id, o.due_date, o.daily_rate, o.overdue_since,
+                       r.last_credit_review
+                FROM open_rentals o LEFT JOIN rentals r ON r.rental_id = o.rental_id
+                WHERE o.rental_id = ?
+            ''', (rental_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Rental {rental_id} is not out")
+            customer_id, receipt_ref, unit_id, due_date, daily_rate, overdue_since, booked_days = row
+            days_late = max(0, (today - datetime.date.fromisoformat(due_date)).days)
+            late_fee = round(days_late * (daily_rate or 0) * self.late_fee_multiplier(cursor), 2)
+
+            cursor.execute('DELETE FROM open_rentals WHERE rental_id = ?', (rental_id,))
+            if cursor.rowcount != 1:
+                raise ValueError(f"Rental {rental_id} was returned meanwhile")
+            cursor.execute('''
+                INSERT INTO rental_returns (rental_id, customer_id, receipt_ref, unit_id, due_date,
+                                            returned_date, days_late, late_fee)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (rental_id, customer_id, receipt_ref, unit_id, due_date, str(today), days_late, late_fee))
+            restocked = self.db_manager.fleet.check_in(cursor, rental_id, unit_state)
+            if restocked:
+                maintenance.record_usage(cursor, restocked[1], max(int(booked_days or 0), 1) + days_late, odometer)
+                # Re-planned as it comes back, so a unit due for service never goes out again first
+                if maintenance.replan(cursor, [restocked[1]], today):
+                    unit_state = 'maintenance'
+            conn.commit()
+        finally:
+            conn.close()
+
+        if restocked:
+            self.db_manager.fleet.checked_in(*restocked, unit_state)
+            self.db_manager.events.publish(ProductUpdated(restocked[0]))
+        self.db_manager.events.publish(RentalReturned(rental_id, days_late=days_late, late_fee=late_fee,
+                                                      was_overdue=overdue_since is not None))
+        return {'rental_id': rental_id, 'due_date': due_date, 'returned_date': str(today),
+                'days_late': days_late, 'late_fee': late_fee, 'unit_id': unit_id,
+                'maintenance': bool(restocked) and unit_state == 'maintenance'}
+
+    def overdue(self, limit=None):
+        """Overdue rentals, most overdue first, with the late fee accrued so far"""
+        today = self.clock.now().date()
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        multiplier = self.late_fee_multiplier(cursor)
+        rows = cursor.execute('''
+            SELECT o.rental_id, r.receipt_ref, c.customer_name, u.unit_code, o.due_date, o.daily_rate
+            FROM open_rentals o
+            LEFT JOIN rentals r ON r.rental_id = o.rental_id
+            LEFT JOIN customers c ON c.customer_id = o.customer_id
+            LEFT JOIN units u ON u.unit_id = o.unit_id
+            WHERE o.overdue_since IS NOT NULL
+            ORDER BY o.due_date
+            LIMIT ?
+        ''', (-1 if limit is None else limit,)).fetchall()
+        conn.close()
+        result = []
+        for rental_id, receipt_ref, customer_name, unit_code, due_date, daily_rate in rows:
+            days_late = (today - datetime.date.fromisoformat(due_date)).days
+            result.append((rental_id, receipt_ref, customer_name, unit_code, due_date, days_late,
+                           round(days_late * (daily_rate or 0) * multiplier, 2)))
+        return result
+
+    def overdue_count(self):
+        conn = self.db_manager.connect()
+        count = conn.execute('SELECT COUNT(*) FROM open_rentals WHERE overdue_since IS NOT NULL').fetchone()[0]
+        conn.close()
+        return count
+
+    def start(self, interval_minutes=RETURN_SCAN_MINUTES, on_overdue=None, on_error=None):
+        """Scan in a background thread, waking at the next midnight a rental falls due or every interval"""
+        def run():
+            try:
+                # Maintenance windows open and close on day boundaries too
+                self.db_manager.maintenance.tick(self.clock.now().date())
+                due = self.tick()
+                if due and on_overdue:
+                    on_overdue(due)
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+            self.start(interval_minutes, on_overdue, on_error)
+
+        delay = interval_minutes * 60
+        next_due = self.next_due()
+        if next_due is not None:
+            # A rental due on day D is overdue from midnight starting D + 1
+            overdue_at = datetime.datetime.combine(next_due + datetime.timedelta(days=1), datetime.time())
+            delay = max(1.0, min(delay, (overdue_at - self.clock.now()).total_seconds()))
+        self.timer = threading.Timer(delay, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+class MaintenancePlanner:
+    """Service windows per unit from rental days and mileage against per-type intervals, planned around open rentals"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    @staticmethod
+    def intervals(cursor):
+        """product_type -> (rental days, miles, workshop days)"""
+        return {row[0]: row[1:] for row in cursor.execute(
+            'SELECT product_type, rental_days, mileage, service_days FROM service_intervals')}
+
+    @staticmethod
+    def due_reason(interval, days_used, miles_used):
+        """Why a unit needs a service now, or None if it can go out again"""
+        if interval is None:
+            return None
+        rental_days, mileage, _ = interval
+        # Short intervals get a proportionally short margin, so a fresh unit is never due
+        if rental_days and days_used + min(MAINTENANCE_LOOKAHEAD_DAYS, rental_days // 4) >= rental_days:
+            return f"{days_used} of {rental_days} rental days"
+        if mileage and miles_used >= mileage:
+            return f"{miles_used:,} of {mileage:,} miles"
+        return None
+
+    @staticmethod
+    def record_usage(cursor, unit_id, rental_days, odometer=None):
+        """Add a finished rental's days, and the odometer reading if one was taken, inside the caller's transaction"""
+        cursor.execute('''
+            UPDATE units SET rental_days = rental_days + ?, odometer = MAX(odometer, COALESCE(?, odometer))
+            WHERE unit_id = ?
+        ''', (rental_days, odometer, unit_id))
+
+    @staticmethod
+    def sync_status(cursor, product_ids):
+        """A product whose every working unit is in the workshop shows as Maintenance
+
+        The planner only puts Available products on hold and only lifts holds it
+        placed itself (maintenance_hold), so a status set by hand is never changed.
+        """
+        # Only rows whose status actually flips are written: every products update
+        # stages an audit entry, so re-writing an unchanged status would journal no-ops
+        cursor.executemany('''
+            UPDATE products
+            SET status = CASE status WHEN 'Available' THEN 'Maintenance' ELSE 'Available' END,
+                maintenance_hold = (status = 'Available')
+            WHERE product_id = ?
+              AND (status = 'Available' OR (status = 'Maintenance' AND maintenance_hold = 1))
+              AND (status = 'Maintenance') IS NOT (
+                  NOT EXISTS (SELECT 1 FROM units WHERE product_id = products.product_id
+                              AND state NOT IN ('maintenance', 'retired'))
+                  AND EXISTS (SELECT 1 FROM units WHERE product_id = products.product_id AND state = 'maintenance'))
+        ''', ((product_id,) for product_id in product_ids))
+
+    def replan(self, cursor, unit_ids, today=None):
+        """Re-plan the service windows of some units inside the caller's transaction; returns units sent to the workshop"""
+        today = today or datetime.date.today()
+        intervals = self.intervals(cursor)
+        fleet = self.db_manager.fleet
+        products, started = set(), []
+        for unit_id in unit_ids:
+            row = cursor.execute('''
+                SELECT u.product_id, u.product_type, u.state, u.rental_days - u.serviced_rental_days,
+                       u.odometer - u.serviced_odometer, o.due_date, r.last_credit_review, w.window_id, w.status
+                FROM units u
+                LEFT JOIN open_rentals o ON o.rental_id = u.rental_id AND u.state = 'rented'
+                LEFT JOIN rentals r ON r.rental_id = o.rental_id
+                LEFT JOIN maintenance_windows w ON w.unit_id = u.unit_id AND w.status IN ('planned', 'active')
+                WHERE u.unit_id = ?
+            ''', (unit_id,)).fetchone()
+            if row is None:
+                continue
+            product_id, product_type, state, days_used, miles_used, due_date, booked_days, window_id, window_status = row
+            if window_status == 'active':
+                if state == 'maintenance':
+                    continue  # In the workshop now
+                # Taken out of maintenance by hand, so the window is void
+                cursor.execute("UPDATE maintenance_windows SET status = 'cancelled' WHERE window_id = ?", (window_id,))
+                window_id = None
+            products.add(product_id)
+            interval = intervals.get(product_type)
+            if due_date:
+                days_used += max(int(booked_days or 0), 1)  # As it will stand when the unit is back
+            reason = self.due_reason(interval, days_used, miles_used)
+            if reason is None or state in ('maintenance', 'retired'):
+                if window_id:
+                    cursor.execute('DELETE FROM maintenance_windows WHERE window_id = ?', (window_id,))
+                continue
+
+            # A unit out on a rental is booked until its due date, so its service starts then
+            start = max(today, datetime.date.fromisoformat(due_date)) if due_date else today
+            end = start + datetime.timedelta(days=max(interval[2] or 1, 1) - 1)
+            if window_id:
+                cursor.execute('UPDATE maintenance_windows SET start_date = ?, end_date = ?, reason = ? WHERE window_id = ?',
+                               (str(start), str(end), reason, window_id))
+            else:
+                cursor.execute('INSERT INTO maintenance_windows (unit_id, start_date, end_date, reason) VALUES (?, ?, ?, ?)',
+                               (unit_id, str(start), str(end), reason))
+                window_id = cursor.lastrowid
+            if start <= today and state == 'available' and fleet._set_state(cursor, unit_id, 'maintenance', ('available',)):
+                cursor.execute("UPDATE maintenance_windows SET status = 'active' WHERE window_id = ?", (window_id,))
+                started.append((product_id, unit_id, 'maintenance'))
+        self.sync_status(cursor, products)
+        return started
+
+    def applied(self, changes):
+        """After the planning transaction commits: update the unit pools and stock counts"""
+        for product_id, unit_id, state in changes:
+            self.db_manager.fleet.checked_in(product_id, unit_id, state)
+        for product_id in sorted({change[0] for change in changes}):
+            self.db_manager.events.publish(ProductUpdated(product_id))
+
+    def replan_all(self, product_type=None, today=None):
+        """Full re-plan, for when service intervals change; returns units sent to the workshop"""
+        self.db_manager.access.require('fleet.edit')
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            if product_type is None:
+                unit_ids = [row[0] for row in cursor.execute("SELECT unit_id FROM units WHERE state != 'retired'")]
+            else:
+                unit_ids = [row[0] for row in cursor.execute(
+                    "SELECT unit_id FROM units WHERE product_type = ? AND state != 'retired'", (product_type,))]
+            started = self.replan(cursor, unit_ids, today)
+            conn.commit()
+        finally:
+            conn.close()
+        self.applied(started)
+        return started
+
+    def set_interval(self, product_type, rental_days, mileage, service_days=1):
+        """Change a product type's service interval and re-plan its units"""
+        self.db_manager.access.require('fleet.edit')
+        conn = self.db_manager.connect()
+        conn.execute('INSERT OR REPLACE INTO service_intervals VALUES (?, ?, ?, ?)',
+                     (product_type, rental_days, mileage, service_days))
+        conn.commit()
+        conn.close()
+        return self.replan_all(product_type)
+
+    def tick(self, today=None):
+        """Open windows that have started on units now free and close the ones that are over; returns (started, finished)"""
+        today = str(today or datetime.date.today())
+        fleet = self.db_manager.fleet
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        started, finished = [], []
+        try:
+            for window_id, unit_id, product_id in cursor.execute('''
+                SELECT w.window_id, w.unit_id, u.product_id FROM maintenance_windows w JOIN units u ON u.unit_id = w.unit_id
+                WHERE w.status = 'planned' AND w.start_date <= ? AND u.state = 'available'
+            ''', (today,)).fetchall():
+                if fleet._set_state(cursor, unit_id, 'maintenance', ('available',)):
+                    cursor.execute("UPDATE maintenance_windows SET status = 'active' WHERE window_id = ?", (window_id,))
+                    started.append((product_id, unit_id, 'maintenance'))
+            cursor.execute('''
+                UPDATE maintenance_windows SET status = 'cancelled'
+                WHERE status = 'active' AND unit_id NOT IN (SELECT unit_id FROM units WHERE state = 'maintenance')
+            ''')
+            for unit_id, product_id in cursor.execute('''
+                SELECT w.unit_id, u.product_id FROM maintenance_windows w JOIN units u ON u.unit_id = w.unit_id
+                WHERE w.status = 'active' AND w.end_date < ?
+            ''', (today,)).fetchall():
+                if self._complete(cursor, unit_id, today):
+                    finished.append((product_id, unit_id, 'available'))
+            self.sync_status(cursor, {change[0] for change in started + finished})
+            conn.commit()
+        finally:
+            conn.close()
+        self.applied(started + finished)
+        return started, finished
+
+    def _complete(self, cursor, unit_id, today):
+        if not self.db_manager.fleet._set_state(cursor, unit_id, 'available', ('maintenance',)):
+            return False
+        cursor.execute('''
+            UPDATE units SET serviced_rental_days = rental_days, serviced_odometer = odometer, last_serviced = ?
+            WHERE unit_id = ?
+        ''', (today, unit_id))
+        cursor.execute('''
+            UPDATE maintenance_windows SET status = 'done', completed_date = ?
+            WHERE unit_id = ? AND status IN ('planned', 'active')
+        ''', (today, unit_id))
+        return True
+
+    def complete_service(self, unit_id, today=None):
+        """Sign a unit out of the workshop: its usage counters restart and it can be rented again"""
+        self.db_manager.access.require('fleet.edit')
+        today = str(today or datetime.date.today())
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            row = cursor.execute('SELECT product_id FROM units WHERE unit_id = ?', (unit_id,)).fetchone()
+            if row is None or not self._complete(cursor, unit_id, today):
+                raise ValueError(f"Unit {unit_id} is not in maintenance")
+            self.sync_status(cursor, [row[0]])
+            conn.commit()
+        finally:
+            conn.close()
+        self.applied([(row[0], unit_id, 'available')])
+
+    def schedule(self, product_id=None):
+        """Open windows, soonest first: (unit_code, start, end, status, reason, rental days, miles since service)"""
+        conn = self.db_manager.connect()
+        rows = conn.execute(f'''
+            SELECT u.unit_code, w.start_date, w.end_date, w.status, w.reason,
+                   u.rental_days - u.serviced_rental_days, u.odometer - u.serviced_odometer
+            FROM maintenance_windows w JOIN units u ON u.unit_id = w.unit_id
+            WHERE w.status IN ('planned', 'active') {'AND u.product_id = ?' if product_id else ''}
+            ORDER BY w.start_date, u.unit_code
+        ''', (product_id,) if product_id else ()).fetchall()
+        conn.close()
+        return rows
+
+# Other counters' product edits are picked up when the catalog is this old
+CATALOG_MAX_AGE_SECONDS = 60
+
+class ProductCatalog:
+    """In-memory products indexed by id, code, (type, status) and rentable units per type"""
+    COLUMNS = 'product_id, product_type, product_code, cost_per_day, available_quantity, status'
+
+    def __init__(self, db_manager, max_age=CATALOG_MAX_AGE_SECONDS):
+        self.db_manager = db_manager
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.dirty = set()
+        self.by_id = {}
+        self.by_code = {}
+        self.by_type_status = {}
+        self.available = {}  # product_type -> sorted [(product_code, product_id)]
+
+    def invalidate(self, product_id=None):
+        """Mark one product, or with no id the whole catalog, for reloading on next use"""
+        with self.lock:
+            if product_id is None:
+                self.loaded_at = None
+            else:
+                self.dirty.add(product_id)
+
+    def _ensure(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age:
+            self._load(None)
+        elif self.dirty:
+            self._load(self.dirty)
+
+    def _load(self, product_ids):
+        conn = self.db_manager.connect()
+        if product_ids is None:
+            rows = conn.execute(f'SELECT {self.COLUMNS} FROM products WHERE deleted_at IS NULL').fetchall()
+            self.by_id, self.by_code, self.by_type_status, self.available = {}, {}, {}, {}
+            self.loaded_at = time.monotonic()
+        else:
+            rows = conn.execute(f'''
+                SELECT {self.COLUMNS} FROM products
+                WHERE product_id IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL
+            ''', (json.dumps(list(product_ids)),)).fetchall()
+            for product_id in product_ids:
+                self._remove(product_id)
+        conn.close()
+        for row in rows:
+            self._add(row)
+        self.dirty = set()
+
+    @staticmethod
+    def rentable(row):
+        return (row[4] or 0) > 0 and row[5] == 'Available'
+
+    def _add(self, row):
+        product_id, product_type, product_code = row[:3]
+        self.by_id[product_id] = row
+        self.by_code[product_code] = product_id
+        self.by_type_status.setdefault((product_type, row[5]), set()).add(product_id)
+        if self.rentable(row):
+            bisect.insort(self.available.setdefault(product_type, []), (product_code or '', product_id))
+
+    def _remove(self, product_id):
+        row = self.by_id.pop(product_id, None)
+        if row is None:
+            return
+        product_id, product_type, product_code = row[:3]
+        if self.by_code.get(product_code) == product_id:
+            del self.by_code[product_code]
+        ids = self.by_type_status[(product_type, row[5])]
+        ids.discard(product_id)
+        if not ids:
+            del self.by_type_status[(product_type, row[5])]
+        if self.rentable(row):
+            units = self.available[product_type]
+            del units[bisect.bisect_left(units, (product_code or '', product_id))]
+            if not units:
+                del self.available[product_type]
+
+    def get(self, product_id):
+        """(product_id, type, code, cost_per_day, available_quantity, status), or None"""
+        with self.lock:
+            self._ensure()
+            return self.by_id.get(product_id)
+
+    def by_product_code(self, product_code):
+        with self.lock:
+            self._ensure()
+            return self.by_id.get(self.by_code.get(product_code))
+
+    def products(self, product_type, status):
+        """Products of one type in one status, by product code"""
+        with self.lock:
+            self._ensure()
+            rows = [self.by_id[i] for i in self.by_type_status.get((product_type, status), ())]
+        return sorted(rows, key=lambda row: row[2] or '')
+
+    def available_types(self):
+        """Product types with at least one available unit in stock"""
+        with self.lock:
+            self._ensure()
+            return sorted(self.available)
+
+    def first_available(self, product_type):
+        """The available product of a type with the lowest code, or None"""
+        with self.lock:
+            self._ensure()
+            units = self.available.get(product_type)
+            return self.by_id[units[0][1]] if units else None
+
+class Tariff:
+    """Pricing configuration: period bands, discount tiers, tax rate and per-type rates"""
+    def __init__(self, periods, tax_rate=0.15, discount_tiers=(0, 5, 10, 15, 20), type_rates=None):
+        # periods are (label, max_days, credit_limit, discount %) rows
+        self.periods = sorted([tuple(p) for p in periods], key=lambda p: p[1])
+        self.tax_rate = tax_rate
+        self.discount_tiers = list(discount_tiers)
+        self.type_rates = dict(type_rates or {})
+
+        self._period_index = {p[0]: p for p in self.periods}
+        self._band_limits = [p[1] for p in self.periods]
+
+    def period_labels(self):
+        """Labels of the rental period bands, shortest first"""
+        return [p[0] for p in self.periods]
+
+    def period_for_label(self, label):
+        """Return the (label, max_days, credit_limit, discount) band for a label"""
+        return self._period_index.get(label)
+
+    def band_limits(self):
+        """Upper day limit of each period band, shortest first"""
+        return list(self._band_limits)
+
+    def band_discount(self, days):
+        """Default discount % for a rental length"""
+        if not self.periods:
+            return 0.0
+        index = min(bisect.bisect_left(self._band_limits, days), len(self.periods) - 1)
+        return float(self.periods[index][3] or 0)
+
+    def rate_for(self, product_type, default_rate):
+        """Daily rate for a product type, honouring tariff overrides"""
+        return self.type_rates.get(product_type, default_rate)
+
+class RuleEngine:
+    """Compiles pricing rules into interval and tier lookups, recompiled only after edits"""
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.compiled_version = None
+        self.checked_at = None
+        self.customer_rentals = {}
+
+    def ensure_compiled(self):
+        """Recompile the evaluation plan if rules changed since the last compile"""
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= RULES_CHECK_SECONDS:
+            self.db_manager.rules_version = self.db_manager.get_rules_version()
+            self.checked_at = now
+        if self.compiled_version != self.db_manager.rules_version:
+            self.compile()
+
+    def invalidate(self):
+        """Force a recompile on the next evaluation"""
+        self.compiled_version = None
+        self.checked_at = None
+
+    def compile(self):
+        """Build the evaluation plan from the active rules"""
+        version = self.db_manager.rules_version
+        seasonal = {}
+        loyalty = []
+        surcharges = {}
+
+        for rule in self.db_manager.get_pricing_rules(active_only=True):
+            rule_type, product_type, start, end, min_rentals, adjustment = rule[1:7]
+            if rule_type == 'seasonal' and start and end:
+                first = datetime.date.fromisoformat(str(start)[:10]).toordinal()
+                last = datetime.date.fromisoformat(str(end)[:10]).toordinal()
+                seasonal.setdefault(product_type, []).append((first, last, adjustment))
+            elif rule_type == 'loyalty':
+                loyalty.append((min_rentals or 0, adjustment))
+            elif rule_type == 'surcharge':
+                surcharges[product_type] = surcharges.get(product_type, 0.0) + adjustment
+
+        # Seasons become one piecewise-constant step function per product type
+        global_seasons = seasonal.get(None, [])
+        self.season_plans = {None: self._build_steps(global_seasons)}
+        for product_type, intervals in seasonal.items():
+            if product_type is not None:
+                self.season_plans[product_type] = self._build_steps(global_seasons + intervals)
+
+        # Loyalty tiers sorted by threshold; the highest reached tier applies
+        loyalty.sort()
+        self.loyalty_thresholds = [t[0] for t in loyalty]
+        self.loyalty_adjustments = [t[1] for t in loyalty]
+
+        global_surcharge = surcharges.get(None, 0.0)
+        self.surcharges = {t: v + global_surcharge for t, v in surcharges.items() if t is not None}
+        self.global_surcharge = global_surcharge
+
+        # Each customer's rental ids; a rental's loyalty count is the number before it
+        self.customer_rentals = self.db_manager.get_customer_rental_ids()
+        self.compiled_version = version
+
+    @staticmethod
+    def _build_steps(intervals):
+        """Turn (first, last, adjustment) intervals into sorted breakpoints and step values"""
+        deltas = {}
+        for first, last, adjustment in intervals:
+            deltas[first] = deltas.get(first, 0.0) + adjustment
+            deltas[last + 1] = deltas.get(last + 1, 0.0) - adjustment
+
+        points = sorted(deltas)
+        values = []
+        running = 0.0
+        for point in points:
+            running += deltas[point]
+            values.append(running)
+        return points, values
+
+    def _loyalty_for_count(self, count):
+        index = bisect.bisect_right(self.loyalty_thresholds, count) - 1
+        return self.loyalty_adjustments[index] if index >= 0 else 0.0
+
+    def prior_rentals(self, customer_id, rental_id=None):
+        """Rentals a customer had before rental_id (all of them for a new quote)"""
+        rental_ids = self.customer_rentals.get(customer_id, ())
+        if rental_id is None:
+            return len(rental_ids)
+        return bisect.bisect_left(rental_ids, rental_id)
+
+    def note_rental(self, customer_id, rental_id):
+        """Count a newly saved rental towards its customer's loyalty tier"""
+        if customer_id is None or rental_id is None or self.compiled_version is None:
+            return
+        rental_ids = self.customer_rentals.setdefault(customer_id, [])
+        if not rental_ids or rental_ids[-1] < rental_id:
+            rental_ids.append(rental_id)
+
+    def adjustment(self, product_type=None, customer_id=None, on_date=None):
+        """Combined rule adjustment % for one quote"""
+        self.ensure_compiled()
+        on_date = on_date or datetime.date.today()
+        if isinstance(on_date, str):
+            on_date = datetime.date.fromisoformat(on_date[:10])
+
+        points, values = self.season_plans.get(product_type, self.season_plans[None])
+        index = bisect.bisect_right(points, on_date.toordinal()) - 1
+        seasonal = values[index] if index >= 0 else 0.0
+
+        loyalty = self._loyalty_for_count(self.prior_rentals(customer_id))
+        surcharge = self.surcharges.get(product_type, self.global_surcharge)
+        return seasonal + loyalty + surcharge
+
+    def adjustment_batch(self, product_types, customer_ids, ordinals, rental_ids=None):
+        """Vectorised rule adjustment % for arrays of rentals; existing rentals pass their rental_ids"""
+        self.ensure_compiled()
+        product_types = np.asarray(product_types, dtype=object).astype(str)
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        result = np.zeros(len(ordinals), dtype=np.float64)
+
+        # Seasons and surcharges: one searchsorted per distinct product type
+        types, codes = np.unique(product_types, return_inverse=True)
+        for code, product_type in enumerate(types):
+            rows = codes == code
+            points, values = self.season_plans.get(product_type, self.season_plans[None])
+            if points:
+                index = np.searchsorted(np.array(points), ordinals[rows], side='right') - 1
+                steps = np.concatenate(([0.0], np.array(values)))
+                result[rows] += steps[index + 1]
+            result[rows] += self.surcharges.get(product_type, self.global_surcharge)
+
+        # Loyalty: tier lookup over the same prior-rental counts a quote uses
+        if rental_ids is None:
+            rental_ids = [None] * len(ordinals)
+        counts = np.array([self.prior_rentals(c, int(r) if r is not None else None)
+                           for c, r in zip(customer_ids, rental_ids)], dtype=np.int64)
+        if self.loyalty_thresholds:
+            index = np.searchsorted(np.array(self.loyalty_thresholds), counts, side='right') - 1
+            tiers = np.concatenate(([0.0], np.array(self.loyalty_adjustments, dtype=np.float64)))
+            result += tiers[index + 1]
+        return result
+
+class PricingEngine:
+    """Prices single quotes and NumPy arrays of rentals against a tariff"""
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.rules = RuleEngine(db_manager)
+        self.reload()
+
+    def reload(self):
+        """Reload the tariff after it has been edited"""
+        self.tariff = self.db_manager.get_tariff()
+
+    def quote(self, days, rate, discount_pct=None, product_type=None, tariff=None, customer_id=None,
+              on_date=None):
+        """Price a single rental; returns (subtotal, tax, total)"""
+        tariff = tariff or self.tariff
+        rate = tariff.rate_for(product_type, rate)
+        if discount_pct is None:
+            discount_pct = tariff.band_discount(days)
+        adjustment = self.rules.adjustment(product_type, customer_id, on_date)
+
+        subtotal = round(days * rate * (1 - discount_pct / 100) * (1 + adjustment / 100), 2)
+        tax = round(subtotal * tariff.tax_rate, 2)
+        return subtotal, tax, round(subtotal + tax, 2)
+
+    def price_batch(self, days, rates, discount_pct=None, product_types=None, tariff=None,
+                    customer_ids=None, ordinals=None, rental_ids=None):
+        """Price arrays of rentals at once; returns (subtotal, tax, total) arrays"""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for batch pricing")
+
+        tariff = tariff or self.tariff
+        days = np.asarray(days, dtype=np.float64)
+        rates = self.rates_batch(rates, product_types, tariff)
+
+        # Default discounts come from the period band each rental falls into
+        if discount_pct is None:
+            if tariff.periods:
+                limits = np.array(tariff.band_limits(), dtype=np.float64)
+                band_discounts = np.array([p[3] or 0 for p in tariff.periods], dtype=np.float64)
+                bands = np.minimum(np.searchsorted(limits, days, side='left'), len(limits) - 1)
+                discount_pct = band_discounts[bands]
+            else:
+                discount_pct = np.zeros_like(days)
+        discount_pct = np.asarray(discount_pct, dtype=np.float64)
+
+        # Seasonal, loyalty and surcharge rules when rental dates are known
+        adjustment = 0.0
+        if ordinals is not None:
+            if customer_ids is None:
+                customer_ids = [None] * len(days)
+            if product_types is None:
+                product_types = [None] * len(days)
+            adjustment = self.rules.adjustment_batch(product_types, customer_ids, ordinals, rental_ids)
+
+        subtotal = np.round(days * rates * (1 - discount_pct / 100) * (1 + adjustment / 100), 2)
+        tax = np.round(subtotal * tariff.tax_rate, 2)
+        return subtotal, tax, np.round(subtotal + tax, 2)
+
+    def rates_batch(self, rates, product_types=None, tariff=None):
+        """Daily rates as an array, with the tariff's per-type overrides applied through a small lookup table"""
+        tariff = tariff or self.tariff
+        rates = np.array(rates, dtype=np.float64)
+        if product_types is not None and tariff.type_rates:
+            types, codes = np.unique(np.asarray(product_types, dtype=object).astype(str), return_inverse=True)
+            overrides = np.array([tariff.type_rates.get(t, np.nan) for t in types], dtype=np.float64)
+            per_row = overrides[codes]
+            rates = np.where(np.isnan(per_row), rates, per_row)
+        return rates
+
+    def load_rentals(self, where="", params=(), open_only=False):
+        """Load rentals as column arrays for batch pricing
+
+        With open_only, only rentals still out (in open_rentals) are loaded, at the
+        daily rate each was agreed at; otherwise at the product's current rate.
+        """
+        if open_only:
+            rate, join = 'COALESCE(o.daily_rate, 0)', 'JOIN open_rentals o ON o.rental_id = r.rental_id'
+        else:
+            rate, join = 'COALESCE(p.cost_per_day, r.cost_per_day, 0)', 'LEFT JOIN products p ON r.product_code = p.product_code'
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT r.rental_id, r.product_type, r.last_credit_review, r.discount, r.total,
+                   {rate}, r.customer_id,
+                   CAST(julianday(COALESCE(NULLIF(r.app_date, ''), r.created_date)) - 1721424.5 AS INTEGER)
+            FROM rentals r
+            {join}
+            {where}
+        ''', params)
+        rows = cursor.fetchall()
+        conn.close()
+
+        columns = list(zip(*rows)) if rows else [()] * 8
+        return {
+            'rental_id': np.array(columns[0], dtype=np.int64),
+            'product_type': np.array(columns[1], dtype=object),
+            'days': np.array([d or 0 for d in columns[2]], dtype=np.float64),
+            'discount': np.array([d or 0 for d in columns[3]], dtype=np.float64),
+            'total': np.array([t or 0 for t in columns[4]], dtype=np.float64),
+            'rate': np.array(columns[5], dtype=np.float64),
+            'customer_id': list(columns[6]),
+            'ordinal': np.array([o or 0 for o in columns[7]], dtype=np.int64)
+        }
+
+    def reprice_open_book(self):
+        """Reprice every rental still out, overdue ones included, against the current tariff; returns rows updated"""
+        self.db_manager.access.require('pricing.edit')
+        self.reload()
+        # Returned rentals are settled, whatever their booked end date
+        book = self.load_rentals(open_only=True)
+        if len(book['rental_id']) == 0:
+            return 0
+
+        # Agreed discounts are kept; rates and tax follow the new tariff
+        subtotal, tax, total = self.price_batch(book['days'], book['rate'], book['discount'],
+                                                book['product_type'], customer_ids=book['customer_id'],
+                                                ordinals=book['ordinal'], rental_ids=book['rental_id'])
+        # The stored daily rate is what the rental grid shows and what late fees are charged at
+        rates = self.rates_batch(book['rate'], book['product_type']).tolist()
+        rental_ids = book['rental_id'].tolist()
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.executemany('UPDATE rentals SET cost_per_day = ?, subtotal = ?, tax = ?, total = ? WHERE rental_id = ?',
+                           zip(rates, subtotal.tolist(), tax.tolist(), total.tolist(), rental_ids))
+        cursor.executemany('UPDATE open_rentals SET daily_rate = ? WHERE rental_id = ?', zip(rates, rental_ids))
+        conn.commit()
+        conn.close()
+        return len(book['rental_id'])
+
+    def simulate(self, tariff, start_date=None, end_date=None, keep_discounts=False):
+        """What-if pricing of historical rentals under another tariff"""
+        clauses, params = [], []
+        if start_date:
+            clauses.append("DATE(r.created_date) >= ?")
+            params.append(str(start_date))
+        if end_date:
+            clauses.append("DATE(r.created_date) <= ?")
+            params.append(str(end_date))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        history = self.load_rentals(where, params)
+
+        discounts = history['discount'] if keep_discounts else None
+        _, _, simulated = self.price_batch(history['days'], history['rate'], discounts,
+                                           history['product_type'], tariff,
+                                           customer_ids=history['customer_id'], ordinals=history['ordinal'],
+                                           rental_ids=history['rental_id'])
+
+        # Revenue deltas per product type in one grouped reduction
+        types, codes = np.unique(history['product_type'].astype(str), return_inverse=True)
+        actual_by_type = np.bincount(codes, weights=history['total'], minlength=len(types))
+        simulated_by_type = np.bincount(codes, weights=simulated, minlength=len(types))
+        return {
+            'rentals': len(history['rental_id']),
+            'actual_revenue': float(history['total'].sum()),
+            'simulated_revenue': float(simulated.sum()),
+            'by_product_type': {str(t): (float(a), float(s))
+                                for t, a, s in zip(types, actual_by_type, simulated_by_type)}
+        }
+
+class UtilizationEngine:
+    """Occupied unit-days per product type per day, kept as difference arrays"""
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.reset()
+
+    def reset(self):
+        """Drop all accumulated intervals; the next refresh rebuilds from scratch"""
+        self.changelog_seq = None
+        self.origin = None
+        self.span = 0
+        self.occupancy_deltas = {}
+        self.revenue_deltas = {}
+        self.contributions = {}
+
+    def _grow(self, first, last):
+        """Make sure the day axis covers ordinals first..last (inclusive)"""
+        if self.origin is None:
+            self.origin = first
+        new_origin = min(self.origin, first)
+        needed = max(self.origin + self.span, last + 1) - new_origin
+        if new_origin == self.origin and needed <= self.span:
+            return
+
+        pad_before = self.origin - new_origin
+        new_span = needed + 90  # Headroom so appending new rentals rarely reallocates
+        for deltas in (self.occupancy_deltas, self.revenue_deltas):
+            for product_type, array in deltas.items():
+                grown = np.zeros(new_span, dtype=array.dtype)
+                grown[pad_before:pad_before + len(array)] = array
+                deltas[product_type] = grown
+        self.origin = new_origin
+        self.span = new_span
+
+    RENTAL_COLUMNS = '''r.sync_uid, r.rental_id, r.product_type, MAX(COALESCE(r.last_credit_review, 0), 1),
+                         COALESCE(r.total, 0),
+                         CAST(julianday(COALESCE(NULLIF(r.app_date, ''), r.created_date)) - 1721424.5 AS INTEGER)'''
+
+    def refresh(self):
+        """Fold rentals added, repriced, returned or deleted since the last refresh into the difference arrays
+
+        Changes are found through the changelog sequence, so in-place updates are
+        picked up as well as new rentals. Archiving drops its deletes from the
+        changelog, so archived rentals keep counting, as they do in a full build.
+        """
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for utilization analytics")
+
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        seq = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+        if self.changelog_seq is None:
+            conn.close()
+            rows = self.db_manager.archive.query_rentals(self.RENTAL_COLUMNS)
+            changed = set()
+        else:
+            changed = {row[0] for row in cursor.execute('''
+                SELECT DISTINCT sync_uid FROM changelog WHERE seq > ? AND seq <= ? AND table_name = 'rentals'
+            ''', (self.changelog_seq, seq))}
+            rows = []
+            uids = list(changed)
+            for chunk_start in range(0, len(uids), 500):
+                chunk = uids[chunk_start:chunk_start + 500]
+                cursor.execute(f'''
+                    SELECT {self.RENTAL_COLUMNS} FROM rentals r
+                    WHERE r.sync_uid IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                rows.extend(cursor.fetchall())
+            conn.close()
+        self.changelog_seq = seq
+
+        # Changed rentals first take back what they contributed before
+        removed = [self.contributions.pop(uid) for uid in changed if uid in self.contributions]
+        if removed:
+            self._apply(*zip(*removed), sign=-1)
+
+        added = []
+        for uid, rental_id, product_type, days, total, start in rows:
+            if product_type is None or start is None:
+                continue
+            key = uid or rental_id
+            self.contributions[key] = (str(product_type), start, days, total / days)
+            added.append(self.contributions[key])
+        if added:
+            self._apply(*zip(*added), sign=1)
+        return len(removed) + len(added)
+
+    def _apply(self, types, starts, days, daily_revenue, sign):
+        """Add (sign=1) or remove (sign=-1) rental intervals from the difference arrays"""
+        starts = np.array(starts, dtype=np.int64)
+        days = np.array(days, dtype=np.int64)
+        daily_revenue = np.array(daily_revenue, dtype=np.float64) * sign
+        self._grow(int(starts.min()), int((starts + days).max()))
+
+        # Each rental adds +1 at its first day and -1 the day after it ends
+        types = np.array(types, dtype=object).astype(str)
+        for product_type in np.unique(types):
+            rows_of_type = types == product_type
+            first = starts[rows_of_type] - self.origin
+            end = first + days[rows_of_type]
+
+            occupancy = self.occupancy_deltas.setdefault(str(product_type), np.zeros(self.span, dtype=np.int64))
+            revenue = self.revenue_deltas.setdefault(str(product_type), np.zeros(self.span, dtype=np.float64))
+            np.add.at(occupancy, first, sign)
+            np.add.at(occupancy, end, -sign)
+            np.add.at(revenue, first, daily_revenue[rows_of_type])
+            np.add.at(revenue, end, -daily_revenue[rows_of_type])
+
+    def fleet_capacity(self):
+        """Units in the fleet per product type, whether out on rent, in the workshop or available"""
+        return self.db_manager.fleet.fleet_sizes()
+
+    def daily_occupancy(self, product_type, start, end):
+        """Units out per day for ordinals start..end (inclusive)"""
+        days = end - start + 1
+        deltas = self.occupancy_deltas.get(product_type)
+        if deltas is None or self.origin is None:
+            return np.zeros(days, dtype=np.int64)
+
+        occupied = np.cumsum(deltas)
+        result = np.zeros(days, dtype=np.int64)
+        lo, hi = max(start, self.origin), min(end, self.origin + self.span - 1)
+        if lo <= hi:
+            result[lo - start:hi - start + 1] = occupied[lo - self.origin:hi - self.origin + 1]
+        return result
+
+    def report(self, start_date, end_date):
+        """Utilization %, revenue per available unit-day and peak concurrency per product type"""
+        self.refresh()
+        start, end = start_date.toordinal(), end_date.toordinal()
+        days = end - start + 1
+        capacity = self.fleet_capacity()
+
+        report = {}
+        for product_type in sorted(set(capacity) | set(self.occupancy_deltas)):
+            occupied = self.daily_occupancy(product_type, start, end)
+            revenue = np.zeros(days, dtype=np.float64)
+            if product_type in self.revenue_deltas:
+                daily = np.cumsum(self.revenue_deltas[product_type])
+                lo, hi = max(start, self.origin), min(end, self.origin + self.span - 1)
+                if lo <= hi:
+                    revenue[lo - start:hi - start + 1] = daily[lo - self.origin:hi - self.origin + 1]
+
+            units = capacity.get(product_type, 0)
+            available_unit_days = units * days
+            report[product_type] = {
+                'units': units,
+                'occupied_unit_days': int(occupied.sum()),
+                'utilization': float(occupied.sum() / available_unit_days * 100) if available_unit_days else 0.0,
+                'revenue_per_unit_day': float(revenue.sum() / available_unit_days) if available_unit_days else 0.0,
+                'peak_concurrency': int(occupied.max()) if days > 0 else 0,
+                'daily_occupancy': occupied
+            }
+        return report
+
+class DemandForecaster:
+    """Double-seasonal (weekly + annual) exponential smoothing of daily rentals per product type"""
+    def __init__(self, db_manager, alpha=0.1, beta=0.01, gamma=0.1, delta=0.05, damping=0.98):
+        self.db_manager = db_manager
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.delta = delta
+        self.damping = damping
+        self.states = None
+
+    def load_states(self):
+        """Load saved smoothing states from the database"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT product_type, last_ordinal, level, trend, weekly, annual FROM forecast_state')
+        self.states = {}
+        for product_type, last_ordinal, level, trend, weekly, annual in cursor.fetchall():
+            self.states[product_type] = {
+                'last_ordinal': last_ordinal, 'level': level, 'trend': trend,
+                'weekly': json.loads(weekly), 'annual': json.loads(annual)
+            }
+        conn.close()
+
+    def save_states(self, product_types):
+        """Persist the smoothing states of the given product types"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO forecast_state (product_type, last_ordinal, level, trend, weekly, annual)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(t, self.states[t]['last_ordinal'], self.states[t]['level'], self.states[t]['trend'],
+               json.dumps(self.states[t]['weekly']), json.dumps(self.states[t]['annual']))
+              for t in product_types])
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _annual_index(ordinal):
+        return min(datetime.date.fromordinal(ordinal).timetuple().tm_yday, 365) - 1
+
+    def daily_counts(self, after_ordinal=None, before_ordinal=None):
+        """Rentals started per product type per day, as {type: {ordinal: count}}"""
+        clauses, params = ["product_type IS NOT NULL"], []
+        start_expr = "CAST(julianday(COALESCE(NULLIF(app_date, ''), created_date)) - 1721424.5 AS INTEGER)"
+        if after_ordinal is not None:
+            clauses.append(f"{start_expr} > ?")
+            params.append(after_ordinal)
+        if before_ordinal is not None:
+            clauses.append(f"{start_expr} < ?")
+            params.append(before_ordinal)
+
+        # Archived years count too; their groups come back separately and are summed
+        counts = {}
+        for product_type, day, count in self.db_manager.archive.query_rentals(
+                f'product_type, {start_expr} AS day, COUNT(*)', ' AND '.join(clauses), params, group_by='1, 2'):
+            if day is not None:
+                by_day = counts.setdefault(product_type, {})
+                by_day[day] = by_day.get(day, 0) + count
+        return counts
+
+    def _initial_state(self, series, first_ordinal):
+        """Seed level and weekly pattern from the first weeks of history"""
+        warmup = series[:28] if len(series) >= 7 else series
+        level = sum(warmup) / len(warmup) if warmup else 0.0
+        weekly = [0.0] * 7
+        for offset, value in enumerate(warmup):
+            weekly[(first_ordinal + offset) % 7] += (value - level) / max(1, len(warmup) // 7)
+        return {'last_ordinal': first_ordinal - 1, 'level': level, 'trend': 0.0,
+                'weekly': weekly, 'annual': [0.0] * 365}
+
+    def _update(self, state, ordinal, observed):
+        """Apply one day's observation to a smoothing state"""
+        week, year = ordinal % 7, self._annual_index(ordinal)
+        weekly, annual = state['weekly'], state['annual']
+        level, trend = state['level'], state['trend']
+
+        new_level = self.alpha * (observed - weekly[week] - annual[year]) + (1 - self.alpha) * (level + self.damping * trend)
+        state['trend'] = self.beta * (new_level - level) + (1 - self.beta) * self.damping * trend
+        weekly[week] = self.gamma * (observed - new_level - annual[year]) + (1 - self.gamma) * weekly[week]
+        annual[year] = self.delta * (observed - new_level - weekly[week]) + (1 - self.delta) * annual[year]
+        state['level'] = new_level
+        state['last_ordinal'] = ordinal
+
+    def update(self):
+        """Fold complete days since each model's last update into its state"""
+        if self.states is None:
+            self.load_states()
+
+        today = datetime.date.today().toordinal()
+        known_since = min((s['last_ordinal'] for s in self.states.values()), default=None)
+        counts = self.daily_counts(known_since, today)
+
+        changed = set()
+        for product_type in set(counts) | set(self.states):
+            by_day = counts.get(product_type, {})
+            state = self.states.get(product_type)
+            if state is None:
+                if not by_day:
+                    continue
+                first = min(by_day)
+                series = [by_day.get(first + i, 0) for i in range(today - first)]
+                state = self.states[product_type] = self._initial_state(series, first)
+
+            # Days without rentals are observations of zero demand
+            for ordinal in range(state['last_ordinal'] + 1, today):
+                self._update(state, ordinal, by_day.get(ordinal, 0))
+                changed.add(product_type)
+
+        if changed and not self.db_manager.read_only:
+            self.save_states(changed)
+        return changed
+
+    def forecast(self, product_type, horizon=90):
+        """Expected rentals per day for the next horizon days"""
+        state = self.states.get(product_type) if self.states else None
+        if state is None:
+            return [0.0] * horizon
+
+        result = []
+        damped_trend = 0.0
+        for step in range(1, horizon + 1):
+            damped_trend += state['trend'] * self.damping ** step
+            ordinal = state['last_ordinal'] + step
+            value = (state['level'] + damped_trend + state['weekly'][ordinal % 7]
+                     + state['annual'][self._annual_index(ordinal)])
+            result.append(max(0.0, value))
+        return result
+
+    def average_rental_days(self):
+        """Mean rental length per product type"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT product_type, AVG(MAX(COALESCE(last_credit_review, 0), 1))
+            FROM rentals WHERE product_type IS NOT NULL
+            GROUP BY product_type
+        ''')
+        results = dict(cursor.fetchall())
+        conn.close()
+        return results
+
+    def stock_recommendations(self, horizon=90, headroom=1.1):
+        """Recommended fleet size per product type from forecast demand"""
+        self.update()
+        durations = self.average_rental_days()
+        capacity = self.db_manager.fleet.fleet_sizes()
+
+        recommendations = {}
+        for product_type in sorted(set(capacity) | set(self.states)):
+            daily = self.forecast(product_type, horizon)
+            duration = durations.get(product_type, 1) or 1
+            # Units out ~ rentals started over the last `duration` days (Little's law)
+            window = max(1, int(round(duration)))
+            concurrent = [sum(daily[max(0, i - window + 1):i + 1]) for i in range(horizon)]
+            needed = int(math.ceil(max(concurrent, default=0) * headroom))
+            recommendations[product_type] = {
+                'forecast': daily,
+                'expected_rentals': sum(daily),
+                'recommended_units': needed,
+                'current_units': capacity.get(product_type, 0),
+                'shortfall': needed - capacity.get(product_type, 0)
+            }
+        return recommendations
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def ordinals_to_months(ordinals):
+    """Months since 1970-01 for an array of date ordinals"""
+    days = (np.asarray(ordinals, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    return days.astype('datetime64[M]').astype(np.int64)
+
+class CustomerAnalytics:
+    """Cohort retention, RFM segmentation and lifetime value over columnar extracts"""
+    RFM_SEGMENTS = ['Champions', 'Loyal', 'New', 'At Risk', 'Hibernating', 'Needs Attention']
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.reset()
+
+    def reset(self):
+        """Drop the extracts; the next refresh reloads everything"""
+        self.rewrites = None
+        self.customer_high_water = 0
+        self.rental_high_water = 0
+        self.customer_created = np.zeros(0, dtype=np.int64)   # created ordinal by customer_id, 0 = none
+        self.rental_customer = np.zeros(0, dtype=np.int64)
+        self.rental_ordinal = np.zeros(0, dtype=np.int64)
+        self.rental_total = np.zeros(0, dtype=np.float64)
+        self.cache = {}
+
+    @property
+    def data_version(self):
+        return (self.rewrites, self.customer_high_water, self.rental_high_water)
+
+    def refresh(self):
+        """Append customers and rentals added since the last refresh; reload everything after in-place rewrites"""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for customer analytics")
+
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT table_name, rewrites FROM data_versions WHERE table_name IN ('customers', 'rentals')")
+        rewrites = tuple(sorted(cursor.fetchall()))
+        if rewrites != self.rewrites:
+            self.reset()
+            self.rewrites = rewrites
+        cursor.execute('''
+            SELECT customer_id, CAST(julianday(created_date) - 1721424.5 AS INTEGER)
+            FROM customers WHERE customer_id > ? ORDER BY customer_id
+        ''', (self.customer_high_water,))
+        customers = cursor.fetchall()
+        rental_columns = '''r.rental_id, r.customer_id, COALESCE(r.total, 0),
+            CAST(julianday(COALESCE(NULLIF(r.app_date, ''), r.created_date)) - 1721424.5 AS INTEGER)'''
+        if self.rental_high_water:
+            cursor.execute(f'''
+                SELECT {rental_columns}
+                FROM rentals r WHERE r.rental_id > ? AND r.customer_id IS NOT NULL ORDER BY r.rental_id
+            ''', (self.rental_high_water,))
+            rentals = cursor.fetchall()
+            conn.close()
+        else:
+            # A full load reads archived years too; new rentals only ever land in the hot table
+            conn.close()
+            rentals = self.db_manager.archive.query_rentals(rental_columns, 'r.customer_id IS NOT NULL',
+                                                            order_by='1', sort_key=lambda row: row[0])
+
+        if customers:
+            ids = np.array([c[0] for c in customers], dtype=np.int64)
+            created = np.array([c[1] or 0 for c in customers], dtype=np.int64)
+            if ids.max() >= len(self.customer_created):
+                grown = np.zeros(int(ids.max()) + 1, dtype=np.int64)
+                grown[:len(self.customer_created)] = self.customer_created
+                self.customer_created = grown
+            self.customer_created[ids] = created
+            self.customer_high_water = int(ids.max())
+
+        if rentals:
+            self.rental_customer = np.concatenate((self.rental_customer, np.array([r[1] for r in rentals], dtype=np.int64)))
+            self.rental_total = np.concatenate((self.rental_total, np.array([r[2] for r in rentals], dtype=np.float64)))
+            self.rental_ordinal = np.concatenate((self.rental_ordinal, np.array([r[3] or 0 for r in rentals], dtype=np.int64)))
+            self.rental_high_water = max(r[0] for r in rentals)
+
+        if customers or rentals:
+            self.cache = {}
+
+    def _cached(self, key, compute):
+        """Return a cached result for the current data version, computing it if needed"""
+        self.refresh()
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def _known_rentals(self):
+        """Mask of rentals whose customer exists with a created date"""
+        customers = self.rental_customer
+        known = (customers >= 0) & (customers < len(self.customer_created))
+        known[known] = self.customer_created[customers[known]] > 0
+        return known
+
+    def cohorts(self):
+        """Acquisition cohorts by created month with a retention matrix (cohort x months since join)"""
+        return self._cached('cohorts', self._compute_cohorts)
+
+    def _compute_cohorts(self):
+        created = self.customer_created
+        customer_ids = np.nonzero(created > 0)[0]
+        if len(customer_ids) == 0:
+            return {'months': [], 'sizes': np.zeros(0), 'retention': np.zeros((0, 0))}
+
+        customer_month = ordinals_to_months(created[customer_ids])
+        first_month = int(customer_month.min())
+        cohort_labels = np.arange(first_month, int(customer_month.max()) + 1)
+        sizes = np.bincount(customer_month - first_month, minlength=len(cohort_labels))
+
+        known = self._known_rentals()
+        renting = self.rental_customer[known]
+        rental_month = ordinals_to_months(self.rental_ordinal[known])
+        cohort = ordinals_to_months(created[renting])
+        age = rental_month - cohort
+        valid = age >= 0
+
+        # Count each customer once per active month
+        pairs = np.unique(np.stack((renting[valid], rental_month[valid])), axis=1)
+        pair_cohort = ordinals_to_months(created[pairs[0]]) - first_month
+        pair_age = pairs[1] - (pair_cohort + first_month)
+        active = np.zeros((len(cohort_labels), int(pair_age.max()) + 1 if len(pair_age) else 1), dtype=np.int64)
+        np.add.at(active, (pair_cohort, pair_age), 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            retention = np.where(sizes[:, None] > 0, active / sizes[:, None], np.nan)
+        months = [str(np.datetime64(int(m), 'M')) for m in cohort_labels]
+        return {'months': months, 'sizes': sizes, 'active': active, 'retention': retention}
+
+    def monthly_retention_rate(self):
+        """Average share of a cohort renting again the month after joining"""
+        retention = self.cohorts()['retention']
+        if retention.shape[1] < 2 or np.all(np.isnan(retention[:, 1])):
+            return 0.0
+        return float(np.clip(np.nanmean(retention[:, 1]), 0.0, 0.99))
+
+    def rfm(self, today=None):
+        """Recency/frequency/monetary scores (1-5), segment and lifetime value per renting customer"""
+        today = (today or datetime.date.today()).toordinal()
+        return self._cached(('rfm', today), lambda: self._compute_rfm(today))
+
+    def _compute_rfm(self, today):
+        if len(self.rental_customer) == 0:
+            return {'customer_id': np.zeros(0, dtype=np.int64)}
+
+        customer_ids, inverse = np.unique(self.rental_customer, return_inverse=True)
+        frequency = np.bincount(inverse)
+        monetary = np.bincount(inverse, weights=self.rental_total)
+        last = np.full(len(customer_ids), np.iinfo(np.int64).min, dtype=np.int64)
+        first = np.full(len(customer_ids), np.iinfo(np.int64).max, dtype=np.int64)
+        np.maximum.at(last, inverse, self.rental_ordinal)
+        np.minimum.at(first, inverse, self.rental_ordinal)
+        recency = today - last
+
+        def quintile(values):
+            ranks = np.argsort(np.argsort(values, kind='stable'), kind='stable')
+            return ranks * 5 // len(values) + 1
+
+        r_score, f_score, m_score = quintile(-recency), quintile(frequency), quintile(monetary)
+        segment = np.select(
+            [(r_score >= 4) & (f_score >= 4), f_score >= 4, (r_score >= 4) & (f_score <= 2),
+             (r_score <= 2) & (f_score >= 3), (r_score <= 2) & (f_score <= 2)],
+            [0, 1, 2, 3, 4], default=5)
+
+        # Lifetime value: spend so far plus expected future months at the current monthly run rate
+        retention = self.monthly_retention_rate()
+        tenure_months = np.maximum(1.0, (today - first) / 30.44)
+        monthly_value = monetary / tenure_months
+        ltv = monetary + monthly_value * retention / (1 - retention)
+        return {
+            'customer_id': customer_ids, 'recency': recency, 'frequency': frequency, 'monetary': monetary,
+            'r_score': r_score, 'f_score': f_score, 'm_score': m_score, 'segment': segment, 'ltv': ltv
+        }
+
+    def segment_summary(self):
+        """Customer count, revenue and average LTV per RFM segment"""
+        rfm = self.rfm()
+        if len(rfm['customer_id']) == 0:
+            return {}
+        counts = np.bincount(rfm['segment'], minlength=len(self.RFM_SEGMENTS))
+        revenue = np.bincount(rfm['segment'], weights=rfm['monetary'], minlength=len(self.RFM_SEGMENTS))
+        ltv = np.bincount(rfm['segment'], weights=rfm['ltv'], minlength=len(self.RFM_SEGMENTS))
+        return {name: {'customers': int(counts[i]), 'revenue': float(revenue[i]),
+                       'avg_ltv': float(ltv[i] / counts[i]) if counts[i] else 0.0}
+                for i, name in enumerate(self.RFM_SEGMENTS)}
+
+    def export_tables(self, filename):
+        """Write the RFM/LTV table and cohort retention table as CSV files"""
+        rfm = self.rfm()
+        table = pd.DataFrame({key: value for key, value in rfm.items() if key != 'segment'})
+        if len(rfm['customer_id']):
+            table['segment'] = np.array(self.RFM_SEGMENTS)[rfm['segment']]
+        table.to_csv(filename, index=False)
+
+        cohorts = self.cohorts()
+        retention = pd.DataFrame(cohorts['retention'], index=cohorts['months'])
+        retention.insert(0, 'customers', cohorts['sizes'])
+        cohort_file = os.path.splitext(filename)[0] + '_cohorts.csv'
+        retention.to_csv(cohort_file, index_label='cohort')
+        return filename, cohort_file
+
+class SyncEngine:
+    """Exchanges coalesced changelog deltas between rental_inventory.db instances"""
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        conn = self.db_manager.connect()
+        self.node_id = conn.execute("SELECT value FROM sync_meta WHERE key = 'node_id'").fetchone()[0]
+        conn.close()
+
+    def changes_since(self, seq=0, exclude_origin=None):
+        """Latest change per row after seq; returns (changes, last seq in the log)"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.table_name, c.sync_uid, c.op, c.payload, c.changed_at, c.origin
+            FROM changelog c
+            JOIN (
+                SELECT MAX(seq) AS seq FROM changelog WHERE seq > ? GROUP BY table_name, sync_uid
+            ) latest ON c.seq = latest.seq
+            WHERE c.origin != ?
+            ORDER BY c.seq
+        ''', (seq, exclude_origin or ''))
+        changes = [list(row) for row in cursor.fetchall()]
+        upto = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+        conn.close()
+        return changes, upto
+
+    def apply_changes(self, changes):
+        """Apply remote deltas with last-writer-wins on (changed_at, origin); returns (applied, skipped)"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        before = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+        columns = {t: {row[1] for row in cursor.execute(f'PRAGMA table_info({t})')} for t in SYNC_TABLES}
+        order = {table: i for i, table in enumerate(SYNC_TABLES)}
+        applied, skipped, versions = 0, 0, []
+
+        try:
+            for table, uid, op, payload, changed_at, origin in sorted(changes, key=lambda c: order.get(c[0], len(order))):
+                if table not in SYNC_TABLES:
+                    continue
+                row = json.loads(payload) if payload else None
+                target_uid = self._local_uid(cursor, table, uid, row)
+
+                local = cursor.execute('''
+                    SELECT MAX(changed_at || '|' || origin) FROM changelog
+                    WHERE table_name = ? AND sync_uid IN (?, ?)
+                ''', (table, uid, target_uid)).fetchone()[0]
+                if local and local >= f"{changed_at}|{origin}":
+                    # Local data wins, but branches still converge on the smaller uid
+                    if target_uid != uid and uid < target_uid:
+                        cursor.execute(f'UPDATE {table} SET sync_uid = ? WHERE sync_uid = ?', (uid, target_uid))
+                    skipped += 1
+                    continue
+
+                if op == 'delete' and table == 'products':
+                    # Products are only ever tombstoned, here as at the counter
+                    cursor.execute('''
+                        UPDATE products SET deleted_at = COALESCE(deleted_at, ?) WHERE sync_uid = ?
+                    ''', (changed_at, target_uid))
+                    stored_uid = target_uid
+                elif op == 'delete':
+                    cursor.execute(f'DELETE FROM {table} WHERE sync_uid = ?', (target_uid,))
+                    stored_uid = target_uid
+                else:
+                    stored_uid = self._upsert(cursor, table, uid, target_uid, row, columns[table])
+                versions.append((changed_at, origin, before, table, stored_uid))
+                applied += 1
+
+            # Products another branch deleted stop offering their vehicles here too
+            for (product_id,) in cursor.execute('''
+                SELECT DISTINCT u.product_id FROM products p JOIN units u ON u.product_id = p.product_id
+                WHERE p.deleted_at IS NOT NULL AND u.state NOT IN ('rented', 'retired')
+            ''').fetchall():
+                self.db_manager.fleet.retire_product(cursor, product_id)
+
+            # Re-stamp the entries our triggers just wrote with the remote version
+            cursor.executemany('''
+                UPDATE changelog SET changed_at = ?, origin = ?
+                WHERE seq > ? AND table_name = ? AND sync_uid = ?
+            ''', versions)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.db_manager.product_catalog.invalidate()
+        return applied, skipped
+
+    @staticmethod
+    def _local_uid(cursor, table, uid, row):
+        """The uid a remote row maps to locally (products also match on product_code)"""
+        if table == 'products' and row is not None:
+            if not cursor.execute('SELECT 1 FROM products WHERE sync_uid = ?', (uid,)).fetchone():
+                existing = cursor.execute('SELECT sync_uid FROM products WHERE product_code = ?',
+                                          (row.get('product_code'),)).fetchone()
+                if existing:
+                    return existing[0]
+        return uid
+
+    def _upsert(self, cursor, table, uid, target_uid, row, columns):
+        """Insert or update one replicated row; returns the sync_uid it is stored under"""
+        key = SYNC_TABLES[table]
+        remote_id = row.pop(key, None)
+        if table == 'rentals':
+            customer_uid = row.pop('customer_uid', None)
+            found = cursor.execute('SELECT customer_id FROM customers WHERE sync_uid = ?', (customer_uid,)).fetchone()
+            row['customer_id'] = found[0] if found else None
+        row = {column: value for column, value in row.items() if column in columns}
+        # Branches that created the same product code converge on the smaller uid
+        row['sync_uid'] = min(uid, target_uid)
+        if table == 'customers':
+            self._seal_details(cursor, target_uid, remote_id, row)
+
+        existing = cursor.execute(f'SELECT sync_uid FROM {table} WHERE sync_uid = ?', (target_uid,)).fetchone()
+        if existing:
+            assignments = ', '.join(f'{column} = ?' for column in row)
+            cursor.execute(f'UPDATE {table} SET {assignments} WHERE sync_uid = ?', list(row.values()) + [existing[0]])
+            return row['sync_uid']
+
+        placeholders = ', '.join('?' for _ in row)
+        try:
+            cursor.execute(f'INSERT INTO {table} ({", ".join(row)}) VALUES ({placeholders})', list(row.values()))
+        except sqlite3.IntegrityError:
+            if table != 'rentals':
+                raise
+            # Two branches issued the same receipt number; keep both rentals
+            row['receipt_ref'] = f"{row.get('receipt_ref')}-{uid[:4]}"
+            cursor.execute(f'INSERT INTO {table} ({", ".join(row)}) VALUES ({placeholders})', list(row.values()))
+        return uid
+
+    def _seal_details(self, cursor, target_uid, remote_id, row):
+        """Re-seal a replicated customer's details to the local customer_id and index them.
+        The sender sealed them to its own customer_id, or sent plaintext if it predates encryption"""
+        db = self.db_manager
+        stored = cursor.execute('SELECT customer_id, phone, email, address FROM customers WHERE sync_uid = ?',
+                                (target_uid,)).fetchone()
+        customer_id = stored[0] if stored else db.next_customer_id(cursor)
+        details = [db.pii.decrypt(column, row.get(column), remote_id) for column in PII_COLUMNS]
+        if stored is None:
+            row['customer_id'] = customer_id
+        elif not all(column in row for column in PII_COLUMNS):
+            # A payload missing a detail leaves the stored one as it was
+            details = [details[i] if column in row else db.pii.decrypt(column, stored[i + 1], customer_id)
+                       for i, column in enumerate(PII_COLUMNS)]
+        sealed = db.seal_customer(customer_id, *details, stored=stored[1:] if stored else None)
+        row.update(zip(PII_COLUMNS + tuple(PII_BLIND_INDEXES.values()), sealed))
+
+    def _peer_state(self, peer_id):
+        conn = self.db_manager.connect()
+        conn.execute('INSERT OR IGNORE INTO sync_peers (peer_id) VALUES (?)', (peer_id,))
+        conn.commit()
+        state = conn.execute('SELECT last_sent_seq, last_received_seq FROM sync_peers WHERE peer_id = ?',
+                             (peer_id,)).fetchone()
+        conn.close()
+        return state
+
+    def _record_peer(self, peer_id, sent=None, received=None):
+        conn = self.db_manager.connect()
+        conn.execute('INSERT OR IGNORE INTO sync_peers (peer_id) VALUES (?)', (peer_id,))
+        if sent is not None:
+            conn.execute('UPDATE sync_peers SET last_sent_seq = MAX(last_sent_seq, ?) WHERE peer_id = ?', (sent, peer_id))
+        if received is not None:
+            conn.execute('UPDATE sync_peers SET last_received_seq = MAX(last_received_seq, ?) WHERE peer_id = ?',
+                         (received, peer_id))
+        conn.commit()
+        conn.close()
+
+    # File exchange
+    def export_changes(self, path, peer_id='file'):
+        """Write changes not yet exported for peer_id to a compressed delta file"""
+        self.db_manager.access.require('sync.manage')
+        last_sent, _ = self._peer_state(peer_id)
+        changes, upto = self.changes_since(last_sent, exclude_origin=peer_id)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'from': self.node_id, 'upto': upto, 'changes': changes, 'pii_key': self.db_manager.pii.key_id},
+                      f, separators=(',', ':'))
+        self._record_peer(peer_id, sent=upto)
+        return len(changes)
+
+    def import_changes(self, path):
+        """Apply a delta file written by another branch"""
+        self.db_manager.access.require('sync.manage')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            message = json.load(f)
+        self._check_key(message)
+        result = self.apply_changes(message['changes'])
+        self._record_peer(message['from'], received=message['upto'])
+        return result
+
+    def _check_key(self, message):
+        """Refuse changes from a branch whose customer details are encrypted under another key"""
+        if message.get('pii_key') not in (None, self.db_manager.pii.key_id):
+            raise ValueError(f"Branch {message.get('from')} encrypts customer details with a different key; "
+                             f"copy its key file to {self.db_manager.pii.key_file} before syncing")
+
+    # Socket exchange
+    @staticmethod
+    def _send(sock, message):
+        data = gzip.compress(json.dumps(message, separators=(',', ':')).encode('utf-8'))
+        sock.sendall(struct.pack('!I', len(data)) + data)
+
+    @staticmethod
+    def _receive(sock):
+        def read(size):
+            data = b''
+            while len(data) < size:
+                chunk = sock.recv(size - len(data))
+                if not chunk:
+                    raise ConnectionError("Peer closed the connection")
+                data += chunk
+            return data
+        size = struct.unpack('!I', read(4))[0]
+        message = json.loads(gzip.decompress(read(size)).decode('utf-8'))
+        if 'error' in message:
+            raise ValueError(message['error'])
+        return message
+
+    def _refuse(self, sock, peer_id):
+        """Tell a peer that could not prove it holds our key file why it was refused, and stop"""
+        self._send(sock, {'error': f"Branch {self.node_id} refused the sync: the branches do not share a key file"})
+        raise ValueError(f"Branch {peer_id} did not prove it holds the key file {self.db_manager.pii.key_file}; "
+                         f"copy the same key file to both branches before syncing")
+
+    def serve(self, host=SYNC_HOST, port=SYNC_PORT, once=True):
+        """Accept sync sessions from other branches"""
+        self.db_manager.access.require('sync.manage')
+        with socket.create_server((host, port)) as server:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    self._handle_session(conn)
+                if once:
+                    break
+
+    def _handle_session(self, conn):
+        # Challenge and response both ways over the two nonces and node ids, signed with the
+        # sync key; nothing about this branch is told to a peer before it has answered
+        hello = self._receive(conn)
+        peer_id = hello.get('from')
+        if not hello.get('nonce'):
+            self._refuse(conn, peer_id)  # A branch from before the handshake
+        nonce = os.urandom(SYNC_NONCE_BYTES).hex()
+        transcript = (hello['nonce'], nonce, peer_id, self.node_id)
+        self._send(conn, {'from': self.node_id, 'nonce': nonce, 'proof': self.db_manager.pii.sign('serve', *transcript)})
+        answer = self._receive(conn)
+        if not self.db_manager.pii.verify(answer.get('proof'), 'connect', *transcript):
+            self._refuse(conn, peer_id)
+        _, received = self._peer_state(peer_id)
+        self._send(conn, {'received': received})
+
+        # Apply the peer's delta, then answer with ours from its acknowledged position
+        request = self._receive(conn)
+        self.apply_changes(request['changes'])
+        self._record_peer(peer_id, received=request['upto'])
+        changes, upto = self.changes_since(request['received'], exclude_origin=peer_id)
+        self._send(conn, {'changes': changes, 'upto': upto})
+        self._record_peer(peer_id, sent=upto)
+
+    def sync_with(self, host='127.0.0.1', port=SYNC_PORT):
+        """Run one two-way sync session with a serving branch; returns (sent, applied, skipped)"""
+        self.db_manager.access.require('sync.manage')
+        with socket.create_connection((host, port)) as conn:
+            nonce = os.urandom(SYNC_NONCE_BYTES).hex()
+            self._send(conn, {'from': self.node_id, 'nonce': nonce})
+            hello = self._receive(conn)
+            peer_id = hello['from']
+            transcript = (nonce, hello['nonce'], self.node_id, peer_id)
+            if not self.db_manager.pii.verify(hello.get('proof'), 'serve', *transcript):
+                self._refuse(conn, peer_id)
+            self._send(conn, {'proof': self.db_manager.pii.sign('connect', *transcript)})
+            received = self._receive(conn)['received']
+            _, acknowledged = self._peer_state(peer_id)
+
+            changes, upto = self.changes_since(received, exclude_origin=peer_id)
+            self._send(conn, {'changes': changes, 'upto': upto, 'received': acknowledged})
+            reply = self._receive(conn)
+
+        self._record_peer(peer_id, sent=upto)
+        applied, skipped = self.apply_changes(reply['changes'])
+        self._record_peer(peer_id, received=reply['upto'])
+        return len(changes), applied, skipped
+
+class BackupManager:
+    """Online snapshots through the sqlite3 backup API, with compressed archives and point-in-time restore"""
+    def __init__(self, db_manager, backup_dir=None, pages_per_step=BACKUP_PAGES_PER_STEP, keep=BACKUP_KEEP,
+                 step_pause=0.001):
+        self.db_manager = db_manager
+        self.backup_dir = backup_dir or os.path.join(os.path.dirname(os.path.abspath(db_manager.db_name)), 'backups')
+        self.pages_per_step = pages_per_step
+        self.keep = keep
+        self.step_pause = step_pause
+        self.progress = (0, 0)  # (remaining, total) pages of the running copy
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def copy_database(self, target_path, source_path=None):
+        """Page-stepped online copy; other connections keep working between steps"""
+        source = sqlite3.connect(source_path or self.db_manager.db_name)
+        target = sqlite3.connect(target_path)
+
+        def progress(status, remaining, total):
+            self.progress = (remaining, total)
+            time.sleep(self.step_pause)  # Let the GUI thread and writers in between steps
+
+        try:
+            source.backup(target, pages=self.pages_per_step, progress=progress)
+        finally:
+            target.close()
+            source.close()
+
+    @staticmethod
+    def file_sha256(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def integrity_check(path):
+        conn = sqlite3.connect(path)
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        conn.close()
+        return result
+
+    def snapshot(self, label='snapshot'):
+        """Take a verified, compressed snapshot; returns the archive path"""
+        with self.lock:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(self.db_manager.db_name))[0]
+            base = os.path.join(self.backup_dir, f"{name}-{label}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+            temp_path = base + '.db'
+
+            # Read the redo log position first; replay skips anything the copy already holds
+            conn = self.db_manager.connect()
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM redo_log').fetchone()[0]
+            conn.close()
+            taken_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+
+            try:
+                self.copy_database(temp_path)
+                check = self.integrity_check(temp_path)
+                if check != 'ok':
+                    raise RuntimeError(f"Snapshot failed integrity check: {check}")
+
+                manifest = {
+                    'database': os.path.basename(self.db_manager.db_name),
+                    'taken_at': taken_at,
+                    'redo_seq': seq,
+                    'size': os.path.getsize(temp_path),
+                    'sha256': self.file_sha256(temp_path)
+                }
+                with open(temp_path, 'rb') as source, gzip.open(base + '.db.gz', 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                with open(base + '.json', 'w') as f:
+                    json.dump(manifest, f, indent=2)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            self.prune()
+            return base + '.db.gz'
+
+    def list_snapshots(self):
+        """Archives with their manifests, newest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        snapshots = []
+        for filename in os.listdir(self.backup_dir):
+            if filename.endswith('.db.gz'):
+                archive = os.path.join(self.backup_dir, filename)
+                manifest_path = archive[:-len('.db.gz')] + '.json'
+                if os.path.exists(manifest_path):
+                    with open(manifest_path) as f:
+                        snapshots.append((archive, json.load(f)))
+        return sorted(snapshots, key=lambda s: s[1]['taken_at'], reverse=True)
+
+    def prune(self):
+        """Keep only the newest scheduled snapshots, and the redo log back to the oldest snapshot left"""
+        scheduled = [s for s in self.list_snapshots() if '-snapshot-' in os.path.basename(s[0])]
+        for archive, _ in scheduled[self.keep:]:
+            os.remove(archive)
+            os.remove(archive[:-len('.db.gz')] + '.json')
+        kept = [manifest['redo_seq'] for _, manifest in self.list_snapshots() if 'redo_seq' in manifest]
+        if kept:
+            conn = self.db_manager.connect()
+            conn.execute('DELETE FROM redo_log WHERE seq <= ?', (min(kept),))
+            conn.commit()
+            conn.close()
+
+    def _extract(self, archive):
+        """Decompress an archive next to it; returns the temporary database path"""
+        temp_path = archive[:-len('.gz')] + '.restore'
+        with gzip.open(archive, 'rb') as source, open(temp_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        return temp_path
+
+    def verify(self, archive):
+        """Check an archive against its manifest checksum and SQLite's integrity check"""
+        with open(archive[:-len('.db.gz')] + '.json') as f:
+            manifest = json.load(f)
+        temp_path = self._extract(archive)
+        try:
+            if self.file_sha256(temp_path) != manifest['sha256']:
+                return False, "Checksum mismatch"
+            check = self.integrity_check(temp_path)
+            return check == 'ok', check
+        finally:
+            os.remove(temp_path)
+
+    def restore(self, archive, target_time=None):
+        """Restore a snapshot, optionally rolled forward through the redo log to target_time (UTC ISO)"""
+        self.db_manager.access.require('backup.manage')
+        ok, message = self.verify(archive)
+        if not ok:
+            raise RuntimeError(f"Snapshot is damaged: {message}")
+        with open(archive[:-len('.db.gz')] + '.json') as f:
+            manifest = json.load(f)
+
+        changes = []
+        if target_time:
+            if 'redo_seq' not in manifest:
+                raise RuntimeError("This snapshot predates the redo log and can only be restored as taken")
+            conn = self.db_manager.connect()
+            first = conn.execute('SELECT MIN(seq) FROM redo_log').fetchone()[0]
+            changes = conn.execute('''
+                SELECT seq, table_name, row_key, payload, logged_at FROM redo_log
+                WHERE seq > ? AND logged_at <= ? ORDER BY seq
+            ''', (manifest['redo_seq'], target_time)).fetchall()
+            conn.close()
+            if first is not None and first > manifest['redo_seq'] + 1:
+                raise RuntimeError("The redo log no longer reaches back to this snapshot")
+
+        # Keep the current state in case the restore needs undoing
+        self.snapshot(label='pre-restore')
+        temp_path = self._extract(archive)
+        try:
+            # Opening the copy brings its schema up to date, under this database's key
+            DatabaseManager(temp_path, journal_mode=self.db_manager.journal_mode, key_file=self.db_manager.pii.key_file)
+            if target_time:
+                self.replay(temp_path, manifest['redo_seq'], changes)
+
+            # Copy the restored pages over the live database through the backup API
+            self.copy_database(self.db_manager.db_name, source_path=temp_path)
+            self.db_manager.product_catalog.invalidate()
+        finally:
+            os.remove(temp_path)
+
+    @staticmethod
+    def replay(path, redo_seq, changes):
+        """Apply redo log entries to a restored copy by primary key, with its triggers stood down"""
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        # The entries already hold every row the triggers wrote, the changelog and audit rows included
+        triggers = cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+        for name, _ in triggers:
+            cursor.execute(f'DROP TRIGGER {name}')
+        tables = DatabaseManager.redo_tables(cursor)
+        # Whatever the copy logged past its snapshot position was its own migration, not history
+        cursor.execute('DELETE FROM redo_log WHERE seq > ?', (redo_seq,))
+        for seq, table, row_key, payload, logged_at in changes:
+            columns, key, _ = tables[table]
+            if row_key is not None:
+                cursor.execute(f"DELETE FROM {table} WHERE {' AND '.join(f'{column} = ?' for column in key)}",
+                               json.loads(row_key))
+            if payload is not None:
+                values = json.loads(payload)
+                cursor.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(columns[:len(values)])}) "
+                               f"VALUES ({', '.join('?' * len(values))})", values)
+            cursor.execute('INSERT INTO redo_log (seq, table_name, row_key, payload, logged_at) VALUES (?, ?, ?, ?, ?)',
+                           (seq, table, row_key, payload, logged_at))
+        for _, sql in triggers:
+            cursor.execute(sql)
+        conn.commit()
+        conn.close()
+
+    def start_schedule(self, interval_minutes=BACKUP_INTERVAL_MINUTES, on_error=None):
+        """Take a snapshot every interval in a background thread"""
+        def run():
+            try:
+                self.snapshot()
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+            self.start_schedule(interval_minutes, on_error)
+
+        self.timer = threading.Timer(interval_minutes * 60, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop_schedule(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+class ArchiveManager:
+    """Moves closed rentals into per-year cold databases and unions them back only when needed"""
+    def __init__(self, db_manager, horizon_days=ARCHIVE_HORIZON_DAYS):
+        self.db_manager = db_manager
+        self.horizon_days = horizon_days
+
+    def archive_path(self, year):
+        base = os.path.splitext(os.path.abspath(self.db_manager.db_name))[0]
+        return f"{base}_archive_{year}.db"
+
+    def archived_years(self):
+        """Years that have an archive file"""
+        base = os.path.splitext(os.path.abspath(self.db_manager.db_name))[0]
+        folder, prefix = os.path.dirname(base), os.path.basename(base) + '_archive_'
+        years = []
+        for filename in os.listdir(folder):
+            if filename.startswith(prefix) and filename.endswith('.db') and filename[len(prefix):-3].isdigit():
+                years.append(int(filename[len(prefix):-3]))
+        return sorted(years)
+
+    def cutoff_date(self):
+        return datetime.date.today() - datetime.timedelta(days=self.horizon_days)
+
+    def _rental_columns(self, cursor, schema='main'):
+        return [(row[1], row[2]) for row in cursor.execute(f'PRAGMA {schema}.table_info(rentals)')]
+
+    def _prepare_archive(self, cursor, columns):
+        """Create or widen the attached archive's rentals table to match the hot schema"""
+        definitions = ', '.join(f"{name} {kind or ''}".strip() + (' PRIMARY KEY' if name == 'rental_id' else '')
+                                for name, kind in columns)
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS archive.rentals ({definitions})')
+        existing = {row[1] for row in cursor.execute('PRAGMA archive.table_info(rentals)')}
+        for name, kind in columns:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE archive.rentals ADD COLUMN {name} {kind or ""}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_rentals_created ON rentals (created_date)')
+
+    def archive_old_rentals(self):
+        """Move rentals older than the horizon into their year's archive; returns rows moved"""
+        self.db_manager.access.require('backup.manage')
+        cutoff = str(self.cutoff_date())
+        conn = self.db_manager.connect()
+        # Payments keep pointing at rentals that move into another file, where no foreign key can follow
+        conn.execute('PRAGMA foreign_keys = OFF')
+        cursor = conn.cursor()
+        years = [row[0] for row in cursor.execute('''
+            SELECT DISTINCT strftime('%Y', created_date) FROM rentals WHERE created_date < ?
+        ''', (cutoff,)) if row[0]]
+        columns = self._rental_columns(cursor)
+        names = ', '.join(name for name, _ in columns)
+        moved = 0
+
+        try:
+            for year in years:
+                cursor.execute('ATTACH DATABASE ? AS archive', (self.archive_path(year),))
+                try:
+                    self._prepare_archive(cursor, columns)
+                    cursor.execute('BEGIN')
+                    before = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changelog').fetchone()[0]
+                    selection = "FROM main.rentals WHERE created_date < ? AND strftime('%Y', created_date) = ?"
+
+                    # Roll the moved rows up first so analytics totals stay complete
+                    cursor.execute(f'''
+                        INSERT INTO rental_rollups (month, product_type, payment_method, rentals, revenue, rental_days)
+                        SELECT strftime('%Y-%m', created_date), COALESCE(product_type, ''), COALESCE(payment_method, ''),
+                               COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(last_credit_review), 0)
+                        {selection}
+                        GROUP BY 1, 2, 3
+                        ON CONFLICT (month, product_type, payment_method) DO UPDATE SET
+                            rentals = rentals + excluded.rentals,
+                            revenue = revenue + excluded.revenue,
+                            rental_days = rental_days + excluded.rental_days
+                    ''', (cutoff, year))
+                    self._roll_up_charges(cursor, 'main', "r.created_date < ? AND strftime('%Y', r.created_date) = ?",
+                                          (cutoff, year))
+                    cursor.execute(f'INSERT OR REPLACE INTO archive.rentals ({names}) SELECT {names} {selection}',
+                                   (cutoff, year))
+                    cursor.execute(f'DELETE {selection}', (cutoff, year))
+                    moved += cursor.rowcount
+
+                    # Archiving is local housekeeping, not a delete other branches should replay
+                    cursor.execute("DELETE FROM changelog WHERE seq > ? AND table_name = 'rentals' AND op = 'delete'",
+                                   (before,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.execute('DETACH DATABASE archive')
+        finally:
+            conn.close()
+        return moved
+
+    @staticmethod
+    def _roll_up_charges(cursor, schema, condition, params=()):
+        """Add rentals in schema.rentals matching condition to their customers' archived charges"""
+        cursor.execute(f'''
+            INSERT INTO main.archived_charges (customer_id, rentals, charges, last_date)
+            SELECT r.customer_id, COUNT(*), COALESCE(SUM(r.total), 0), MAX(date(r.created_date))
+            FROM {schema}.rentals r
+            WHERE r.customer_id IS NOT NULL AND {condition}
+            GROUP BY r.customer_id
+            ON CONFLICT (customer_id) DO UPDATE SET
+                rentals = rentals + excluded.rentals,
+                charges = charges + excluded.charges,
+                last_date = MAX(COALESCE(last_date, ''), excluded.last_date)
+        ''', params)
+
+    def roll_up_archived_charges(self, cursor):
+        """Roll up the charges held in every existing archive file"""
+        for year in self.archived_years():
+            cursor.execute('ATTACH DATABASE ? AS archive', (self.archive_path(year),))
+            try:
+                cursor.execute('BEGIN')
+                self._roll_up_charges(cursor, 'archive', '1 = 1')
+                cursor.connection.commit()
+            except Exception:
+                cursor.connection.rollback()
+                raise
+            finally:
+                cursor.execute('DETACH DATABASE archive')
+
+    def years_for_range(self, start_date=None, end_date=None):
+        """Archive years a date range reaches into"""
+        first = start_date.year if start_date else None
+        last = min(end_date.year if end_date else 9999, self.cutoff_date().year)
+        return [y for y in self.archived_years() if (first is None or y >= first) and y <= last]
+
+    def query_rentals(self, columns, where='1 = 1', params=(), start_date=None, end_date=None, order_by=None,
+                      joins='', group_by=None, limit=None, sort_key=None, descending=False):
+        """Run a rentals query over the hot table plus only the archives the date range needs
+
+        The rentals table must be aliased r in columns, joins and where; joins may only
+        reference main-schema tables such as customers. group_by groups each table
+        separately, so callers sum groups that repeat. SQLite attaches at most ten
+        databases, so past eight archive years the query runs in chunks whose ordered
+        rows are merged with sort_key.
+        """
+        clauses, range_params = [where], list(params)
+        if start_date:
+            clauses.append('r.created_date >= ?')
+            range_params.append(str(start_date))
+        if end_date:
+            clauses.append('r.created_date < ?')
+            range_params.append(str(end_date + datetime.timedelta(days=1)))
+        condition = ' AND '.join(f'({c})' for c in clauses)
+        grouping = f' GROUP BY {group_by}' if group_by else ''
+
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        years = self.years_for_range(start_date, end_date)
+        results = []
+        for chunk_start in range(0, max(len(years), 1), 8):
+            chunk = years[chunk_start:chunk_start + 8]
+            parts = [] if chunk_start else [f'SELECT {columns} FROM main.rentals r {joins} WHERE {condition}{grouping}']
+            for year in chunk:
+                cursor.execute(f'ATTACH DATABASE ? AS archive_{year}', (self.archive_path(year),))
+                parts.append(f'SELECT {columns} FROM archive_{year}.rentals r {joins} WHERE {condition}{grouping}')
+            if parts:
+                sql = ' UNION ALL '.join(parts)
+                if order_by:
+                    sql += f' ORDER BY {order_by}'
+                if limit is not None:
+                    sql += f' LIMIT {int(limit)}'
+                results.extend(cursor.execute(sql, range_params * len(parts)).fetchall())
+            for year in chunk:
+                cursor.execute(f'DETACH DATABASE archive_{year}')
+        conn.close()
+
+        if len(years) > 8 and sort_key:
+            results.sort(key=sort_key, reverse=descending)
+            if limit is not None:
+                results = results[:limit]
+        return results
+
+    def rollup_totals(self, group_by='product_type'):
+        """Archived rentals, revenue and rental days grouped by a rollup column"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {group_by}, SUM(rentals), SUM(revenue), SUM(rental_days)
+            FROM rental_rollups GROUP BY {group_by}
+        ''')
+        results = {row[0]: row[1:] for row in cursor.fetchall()}
+        conn.close()
+        return results
+
+class AuditJournal:
+    """Append-only journal of master-data changes: triggers stage raw rows, flush() moves them to the indexed journal as JSON diffs"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.timer = None
+
+    @staticmethod
+    def entry_diff(table, op, diff, columns=None):
+        """Decoded journal diff; staged value arrays are named here and a staged update narrows to {column: [old, new]}"""
+        diff = json.loads(diff) if diff else {}
+        if not isinstance(diff, list):
+            return diff
+        if op == 'update':
+            half = len(diff) // 2
+            old, new = dict(zip(columns, diff[:half])), dict(zip(columns, diff[half:]))
+            return {column: [old.get(column), value] for column, value in new.items() if old.get(column) != value}
+        return {column: value for column, value in zip(columns, diff) if column != AUDIT_TABLES.get(table)}
+
+    def staged_diffs(self, cursor, rows):
+        """Decode (table, op, diff) of staged rows, reading each table's columns once"""
+        columns = {}
+        for table in {row[0] for row in rows}:
+            columns[table] = self.db_manager.audit_columns(cursor, table)
+        return [self.entry_diff(table, op, diff, columns[table]) for table, op, diff in rows]
+
+    def flush(self):
+        """Move staged entries into the journal in one transaction; returns how many were journaled"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            # Inside the write lock, so a counter flushing at the same time cannot move them twice
+            rows = cursor.execute('''
+                SELECT pending_id, table_name, row_id, op, diff, actor, changed_at FROM audit_pending ORDER BY pending_id
+            ''').fetchall()
+            if not rows:
+                return 0
+            diffs = self.staged_diffs(cursor, [(table_name, op, diff) for _, table_name, _, op, diff, _, _ in rows])
+            # Updates that rewrote a row with the same values leave no trace
+            entries = [(table_name, row_id, op, json.dumps(diff, separators=(',', ':')), actor or 'unknown', changed_at)
+                       for (_, table_name, row_id, op, _, actor, changed_at), diff in zip(rows, diffs)
+                       if diff or op != 'update']
+            cursor.executemany('''
+                INSERT INTO audit_journal (table_name, row_id, op, diff, actor, changed_at) VALUES (?, ?, ?, ?, ?, ?)
+            ''', entries)
+            cursor.execute('DELETE FROM audit_pending WHERE pending_id <= ?', (rows[-1][0],))
+            conn.commit()
+            return len(entries)
+        finally:
+            conn.close()
+
+    def history(self, table, row_id, limit=None):
+        """Changes to one row, newest first, including any not flushed yet: (changed_at, actor, op, diff)"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        rows = cursor.execute('''
+            SELECT changed_at, actor, op, diff FROM (
+                SELECT 0 AS staged, entry_id AS seq, changed_at, actor, op, diff FROM audit_journal
+                WHERE table_name = ? AND row_id = ?
+                UNION ALL
+                SELECT 1, pending_id, changed_at, actor, op, diff FROM audit_pending
+                WHERE table_name = ? AND row_id = ?
+            )
+            ORDER BY staged DESC, seq DESC
+            LIMIT ?
+        ''', (table, str(row_id), table, str(row_id), -1 if limit is None else limit)).fetchall()
+        diffs = self.staged_diffs(cursor, [(table, op, diff) for _, _, op, diff in rows])
+        conn.close()
+        return [(changed_at, actor or 'unknown', op, self.reveal(table, row_id, diff))
+                for (changed_at, actor, op, _), diff in zip(rows, diffs) if diff or op != 'update']
+
+    def between(self, start, end, table=None):
+        """Flushed changes made in [start, end), oldest first: (changed_at, table, row_id, actor, op, diff)"""
+        clauses, params = ['changed_at >= ?', 'changed_at < ?'], [str(start), str(end)]
+        if table:
+            clauses.append('table_name = ?')
+            params.append(table)
+        conn = self.db_manager.connect()
+        rows = conn.execute(f'''
+            SELECT changed_at, table_name, row_id, actor, op, diff FROM audit_journal
+            WHERE {' AND '.join(clauses)} ORDER BY changed_at, entry_id
+        ''', params).fetchall()
+        conn.close()
+        return [row[:5] + (self.reveal(row[1], row[2], self.entry_diff(row[1], row[4], row[5])),) for row in rows]
+
+    def reveal(self, table, row_id, diff):
+        """A decoded diff of one row with encrypted customer details readable"""
+        if table != 'customers':
+            return diff
+        decrypt = lambda column, value: self.db_manager.pii.decrypt(column, value, row_id)
+        return {column: ([decrypt(column, item) for item in value] if isinstance(value, list) else decrypt(column, value))
+                if column in PII_COLUMNS else value for column, value in diff.items()}
+
+    @staticmethod
+    def fold(state, op, diff):
+        """A row's values after one more journal entry; None once deleted"""
+        if op in ('insert', 'snapshot'):
+            return dict(diff)
+        if op == 'delete':
+            return None
+        state = dict(state or {})
+        for column, (_, new) in diff.items():
+            state[column] = new
+        return state
+
+    def complete(self, cursor, table, row_id, cutoff, state):
+        """Fill in the columns a partial snapshot never saw change: the live row, or the row as it
+        was deleted, with every change since the cutoff undone"""
+        if state is None:
+            return None
+        key = AUDIT_TABLES[table]
+        columns = self.db_manager.audit_columns(cursor, table)
+        live = cursor.execute(f'SELECT {", ".join(columns)} FROM {table} WHERE {key} = ?', (row_id,)).fetchone()
+        before = {column: value for column, value in zip(columns, live or ()) if column != key}
+        newer = cursor.execute('''
+            SELECT op, diff FROM (
+                SELECT 0 AS staged, entry_id AS seq, op, diff FROM audit_journal
+                WHERE table_name = ? AND row_id = ? AND changed_at >= ?
+                UNION ALL
+                SELECT 1, pending_id, op, diff FROM audit_pending
+                WHERE table_name = ? AND row_id = ?
+            )
+            ORDER BY staged DESC, seq DESC
+        ''', (table, str(row_id), cutoff, table, str(row_id))).fetchall()
+        for (op, _), diff in zip(newer, self.staged_diffs(cursor, [(table, op, diff) for op, diff in newer])):
+            if op == 'delete':
+                before = dict(diff)
+            elif op == 'update':
+                before.update((column, old) for column, (old, _) in diff.items())
+            else:
+                before = {}  # Created again since; nothing to go on
+        return {**before, **state}
+
+    def compact(self, retention_days=AUDIT_RETENTION_DAYS, today=None):
+        """Fold entries older than the retention period into one snapshot per row; returns entries removed"""
+        self.db_manager.access.require('audit.manage')
+        cutoff = str((today or datetime.date.today()) - datetime.timedelta(days=retention_days))
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            rows = cursor.execute('''
+                SELECT entry_id, table_name, row_id, op, diff FROM audit_journal
+                WHERE changed_at < ? ORDER BY table_name, row_id, entry_id
+            ''', (cutoff,)).fetchall()
+            if not rows:
+                return 0
+            snapshots, removed, state, last, partial = [], [], None, None, False
+            for entry_id, table_name, row_id, op, diff in rows:
+                if last is not None and last[1:] != (table_name, row_id):
+                    snapshots.append((last[0], self.complete(cursor, *last[1:], cutoff, state) if partial else state))
+                    state, partial = None, False
+                if last is not None and last[1:] == (table_name, row_id):
+                    removed.append(last[0])
+                # A row journaled from an update on was there before the journal began
+                partial = partial or (state is None and op == 'update')
+                state = self.fold(state, op, self.entry_diff(table_name, op, diff))
+                last = (entry_id, table_name, row_id)
+            snapshots.append((last[0], self.complete(cursor, *last[1:], cutoff, state) if partial else state))
+
+            # The journal refuses edits unless the compacting flag is up in this transaction
+            cursor.execute('UPDATE audit_context SET compacting = 1 WHERE id = 1')
+            removed += [entry_id for entry_id, state in snapshots if state is None]
+            cursor.executemany("UPDATE audit_journal SET op = 'snapshot', diff = ? WHERE entry_id = ?",
+                               ((json.dumps(state, separators=(',', ':')), entry_id)
+                                for entry_id, state in snapshots if state is not None))
+            cursor.executemany('DELETE FROM audit_journal WHERE entry_id = ?', ((entry_id,) for entry_id in removed))
+            cursor.execute('UPDATE audit_context SET compacting = 0 WHERE id = 1')
+            conn.commit()
+            return len(removed)
+        finally:
+            conn.close()
+
+    def start_schedule(self, interval_seconds=AUDIT_FLUSH_SECONDS, on_error=None):
+        """Flush staged entries every few seconds in a background thread"""
+        def run():
+            try:
+                self.flush()
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+            self.start_schedule(interval_seconds, on_error)
+
+        self.timer = threading.Timer(interval_seconds, run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop_schedule(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+class Ledger:
+    """Payments ledger, customer balances and the set-based invoicing run"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    def record_payment(self, customer_id, amount, payment_method='Cash', reference='', paid_date=None, rental_id=None):
+        """Credit a payment (or a refund, when negative) to a customer's account"""
+        self.db_manager.access.require('payments.record')
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO payments (customer_id, rental_id, amount, payment_method, reference, paid_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (customer_id, rental_id, round(float(amount), 2), payment_method, reference,
+              str(paid_date or datetime.date.today())))
+        payment_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return payment_id
+
+    def customer_balance(self, customer_id):
+        """Outstanding balance (charges less payments) for one customer"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(SUM(debit - credit), 0) FROM ledger WHERE customer_id = ?', (customer_id,))
+        balance = cursor.fetchone()[0]
+        conn.close()
+        return round(balance, 2)
+
+    def customer_ledger(self, customer_id, limit=None):
+        """Ledger entries for a customer, newest first, with the running balance after each"""
+        conn = self.db_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT entry_date, entry_type, reference, debit, credit, balance FROM (
+                SELECT entry_date, entry_type, reference, debit, credit,
+                       SUM(debit - credit) OVER (ORDER BY entry_date, entry_type, rental_id
+                                                 ROWS UNBOUNDED PRECEDING) AS balance
+                FROM ledger WHERE customer_id = ?
+            )
+            ORDER BY entry_date DESC, entry_type DESC
+            LIMIT ?
+        ''', (customer_id, -1 if limit is None else limit))
+        entries = cursor.fetchall()
+        conn.close()
+        return entries
+
+    def run_invoicing(self, as_of=None):
+        """Compute balances and aging buckets for every customer in one pass; returns the run summary"""
+        self.db_manager.access.require('billing.run')
+        as_of = as_of or datetime.date.today()
+        started = time.perf_counter()
+
+        conn = self.db_manager.connect()
         cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO products (product_type, product_code, cost_per_day, available_quantity)
-                VALUES (?, ?, ?, ?)
-            ''', (product_type, product_code, cost_per_day, available_quantity))
+            summary = self._run_invoicing(cursor, as_of, started)
             conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "Product code already exists.")
-            return False
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add product: {str(e)}")
-            return False
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             conn.close()
+        return summary
 
-    def update_product(self, product_id, product_type, product_code, cost_per_day, available_quantity, status):
-        """Update an existing product's details."""
-        conn = sqlite3.connect(self.db_name)
+    def _run_invoicing(self, cursor, as_of, started):
+        """The invoicing run's statements, written in one transaction on cursor"""
+        cursor.execute('BEGIN')
+        cursor.execute('INSERT INTO invoice_runs (as_of) VALUES (?)', (str(as_of),))
+        run_id = cursor.lastrowid
+
+        # Payments settle the oldest charges first, so a charge is unpaid by
+        # however much the running charge total exceeds everything paid
+        cursor.execute('''
+            WITH paid AS (
+                SELECT customer_id, SUM(amount) AS paid
+                FROM payments WHERE paid_date <= ?
+                GROUP BY customer_id
+            ),
+            charges AS (
+                SELECT customer_id, created_date, amount,
+                       SUM(amount) OVER (PARTITION BY customer_id ORDER BY created_date, rental_id
+                                         ROWS UNBOUNDED PRECEDING) AS running
+                FROM (
+                    -- A late fee is charged with its rental once the rental is back
+                    SELECT r.customer_id, r.created_date, r.rental_id,
+                           COALESCE(r.total, 0) + COALESCE((
+                               SELECT late_fee FROM rental_returns rr
+                               WHERE rr.rental_id = r.rental_id AND rr.returned_date < ?), 0) AS amount
+                    FROM rentals r
+                    WHERE r.customer_id IS NOT NULL AND r.created_date < ?
+                    UNION ALL
+                    -- Archived rentals: their rolled-up charges, older than any hot rental, and late fees
+                    SELECT customer_id, last_date, 0, charges
+                    FROM archived_charges WHERE last_date < ?
+                    UNION ALL
+                    SELECT rr.customer_id, rr.returned_date, rr.rental_id, rr.late_fee
+                    FROM rental_returns rr
+                    WHERE rr.late_fee > 0 AND rr.customer_id IS NOT NULL AND rr.returned_date < ?
+                      AND NOT EXISTS (SELECT 1 FROM rentals r WHERE r.rental_id = rr.rental_id)
+                )
+            ),
+            aged AS (
+                SELECT ch.customer_id, ch.amount,
+                       MIN(ch.amount, MAX(0, ch.running - COALESCE(p.paid, 0))) AS unpaid,
+                       julianday(?) - julianday(date(ch.created_date)) AS age
+                FROM charges ch LEFT JOIN paid p ON p.customer_id = ch.customer_id
+            ),
+            totals AS (
+                SELECT customer_id, SUM(amount) AS charges,
+                       SUM(CASE WHEN age <= 30 THEN unpaid ELSE 0 END) AS current,
+                       SUM(CASE WHEN age > 30 AND age <= 60 THEN unpaid ELSE 0 END) AS days_31_60,
+                       SUM(CASE WHEN age > 60 AND age <= 90 THEN unpaid ELSE 0 END) AS days_61_90,
+                       SUM(CASE WHEN age > 90 THEN unpaid ELSE 0 END) AS days_over_90
+                FROM aged
+                GROUP BY customer_id
+            )
+            INSERT INTO statements (run_id, customer_id, charges, payments, balance,
+                                    current, days_31_60, days_61_90, days_over_90)
+            SELECT ?, c.customer_id, COALESCE(t.charges, 0), COALESCE(p.paid, 0),
+                   ROUND(COALESCE(t.charges, 0) - COALESCE(p.paid, 0), 2),
+                   ROUND(COALESCE(t.current, 0), 2), ROUND(COALESCE(t.days_31_60, 0), 2),
+                   ROUND(COALESCE(t.days_61_90, 0), 2), ROUND(COALESCE(t.days_over_90, 0), 2)
+            FROM customers c
+            LEFT JOIN totals t ON t.customer_id = c.customer_id
+            LEFT JOIN paid p ON p.customer_id = c.customer_id
+            WHERE t.customer_id IS NOT NULL OR p.customer_id IS NOT NULL
+        ''', (str(as_of), str(as_of + datetime.timedelta(days=1)), str(as_of + datetime.timedelta(days=1)),
+              str(as_of + datetime.timedelta(days=1)), str(as_of + datetime.timedelta(days=1)), str(as_of), run_id))
+
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(MAX(balance, 0)), 0), COALESCE(SUM(current), 0),
+                   COALESCE(SUM(days_31_60), 0), COALESCE(SUM(days_61_90), 0), COALESCE(SUM(days_over_90), 0)
+            FROM statements WHERE run_id = ?
+        ''', (run_id,))
+        customers, outstanding, current, days_31_60, days_61_90, days_over_90 = cursor.fetchone()
+        seconds = time.perf_counter() - started
+        cursor.execute('UPDATE invoice_runs SET customers = ?, outstanding = ?, seconds = ? WHERE run_id = ?',
+                       (customers, outstanding, seconds, run_id))
+
+        return {
+            'run_id': run_id,
+            'as_of': as_of,
+            'customers': customers,
+            'outstanding': outstanding,
+            'aging': {'current': current, '31-60': days_31_60, '61-90': days_61_90, 'over 90': days_over_90},
+            'seconds': seconds,
+        }
+
+    def latest_run(self):
+        """Id of the most recent invoicing run, or None"""
+        conn = self.db_manager.connect()
         cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE products
-                SET product_type = ?, product_code = ?, cost_per_day = ?, available_quantity = ?, status = ?
-                WHERE product_id = ?
-            ''', (product_type, product_code, cost_per_day, available_quantity, status, product_id))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "Product code already exists for another product.")
-            return False
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to update product: {str(e)}")
-            return False
-        finally:
-            conn.close()
+        cursor.execute('SELECT MAX(run_id) FROM invoice_runs')
+        run_id = cursor.fetchone()[0]
+        conn.close()
+        return run_id
 
-    def delete_product(self, product_id):
-        """Delete a product from the database."""
-        conn = sqlite3.connect(self.db_name)
+    def statements(self, run_id, outstanding_only=True):
+        """Statement rows of a run joined with customer details"""
+        conn = self.db_manager.connect()
         cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT s.customer_id, c.customer_name, c.address, s.charges, s.payments, s.balance,
+                   s.current, s.days_31_60, s.days_61_90, s.days_over_90
+            FROM statements s
+            JOIN customers c ON c.customer_id = s.customer_id
+            WHERE s.run_id = ? {'AND s.balance != 0' if outstanding_only else ''}
+            ORDER BY c.customer_name, s.customer_id
+        ''', (run_id,))
+        decrypt = self.db_manager.pii.decrypt
+        rows = [row[:2] + (decrypt('address', row[2], row[0]),) + row[3:] for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    def export_statements(self, run_id, path, entries_per_statement=10):
+        """Write statements of a run as CSV (when path ends in .csv) or one PDF page per customer"""
+        rows = self.statements(run_id)
+        conn = self.db_manager.connect()
+        as_of = conn.execute('SELECT as_of FROM invoice_runs WHERE run_id = ?', (run_id,)).fetchone()[0]
+        conn.close()
+
+        if path.lower().endswith('.csv'):
+            pd.DataFrame(rows, columns=['customer_id', 'customer_name', 'address', 'charges', 'payments', 'balance',
+                                        'current', 'days_31_60', 'days_61_90', 'days_over_90']).to_csv(path, index=False)
+            return len(rows)
+
+        pdf = canvas.Canvas(path, pagesize=letter)
+        width, height = letter
+        for customer_id, name, address, charges, payments, balance, *aging in rows:
+            pdf.setFont("Helvetica-Bold", 18)
+            pdf.drawString(50, height - 60, "Account Statement")
+            pdf.setFont("Helvetica", 11)
+            pdf.drawString(50, height - 90, f"{name} (ID: {customer_id})")
+            pdf.drawString(50, height - 106, (address or '')[:80])
+            pdf.drawString(400, height - 90, f"Statement date: {as_of}")
+
+            pdf.setFont("Helvetica-Bold", 10)
+            for x, label in zip((50, 150, 250, 350, 450), ('Current', '31-60 days', '61-90 days', 'Over 90', 'Balance')):
+                pdf.drawString(x, height - 150, label)
+            pdf.setFont("Helvetica", 10)
+            for x, amount in zip((50, 150, 250, 350, 450), aging + [balance]):
+                pdf.drawString(x, height - 166, f"£{amount:,.2f}")
+
+            # Recent activity, newest first
+            pdf.setFont("Helvetica-Bold", 10)
+            y_pos = height - 210
+            for x, label in zip((50, 130, 210, 360, 450), ('Date', 'Type', 'Reference', 'Amount', 'Balance')):
+                pdf.drawString(x, y_pos, label)
+            pdf.line(50, y_pos - 5, 550, y_pos - 5)
+            pdf.setFont("Helvetica", 9)
+            for entry_date, entry_type, reference, debit, credit, running in self.customer_ledger(
+                    customer_id, entries_per_statement):
+                y_pos -= 15
+                pdf.drawString(50, y_pos, str(entry_date))
+                pdf.drawString(130, y_pos, entry_type.title())
+                pdf.drawString(210, y_pos, str(reference or '')[:24])
+                pdf.drawString(360, y_pos, f"£{debit - credit:,.2f}")
+                pdf.drawString(450, y_pos, f"£{running:,.2f}")
+
+            pdf.setFont("Helvetica-Bold", 12)
+            pdf.drawString(50, y_pos - 40, f"Total charges £{charges:,.2f}   Total paid £{payments:,.2f}   "
+                                           f"Amount due £{max(balance, 0):,.2f}")
+            pdf.showPage()
+        pdf.save()
+        return len(rows)
+
+class AnalyticsSnapshot:
+    """Rentals held as compact NumPy columns for the analytics dashboards
+
+    With a cache_dir the columns live in fixed-width files that are
+    memory-mapped on start-up and appended to on refresh, so a new process
+    only reads rentals added since the cache was last written. Writers hold
+    an exclusive lock on the cache while they refresh and re-read its
+    metadata first, so several processes can share one cache. Over a
+    ReadOnlyDatabase the cache is mapped but never written; newer rentals
+    are held in memory instead.
+    """
+    COLUMNS = (
+        ('rental_id', 'int64'),
+        ('day', 'int32'),            # date ordinal of created_date
+        ('total_pence', 'int64'),
+        ('product', 'int16'),        # code into self.products
+        ('payment', 'int16'),        # code into self.payments
+        ('customer_id', 'int32'),    # -1 = walk-in
+    )
+    FETCH_BATCH = 100000
+
+    def __init__(self, db_manager, cache_dir=None):
+        self.db_manager = db_manager
+        self.cache_dir = cache_dir
+        self.writes_cache = bool(cache_dir) and not db_manager.read_only
+        self.reset(truncate_cache=False)
+
+    def reset(self, truncate_cache=True):
+        """Drop all columns (and cache files); the next refresh reloads everything"""
+        self.size = 0
+        self.high_water = 0
+        self.rewrites = None
+        self.products, self.product_codes = [], {}
+        self.payments, self.payment_codes = [], {}
+        if self.cache_dir:
+            self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in self.COLUMNS}
+            if truncate_cache and self.writes_cache:
+                # Fresh files rather than truncating in place: other processes may still map the old ones
+                os.makedirs(self.cache_dir, exist_ok=True)
+                for name, _ in self.COLUMNS:
+                    open(self._cache_path(f'{name}.bin.tmp'), 'wb').close()
+                    os.replace(self._cache_path(f'{name}.bin.tmp'), self._cache_path(f'{name}.bin'))
+        else:
+            self.columns = {name: np.zeros(1024, dtype=dtype) for name, dtype in self.COLUMNS}
+
+    def _cache_path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    @staticmethod
+    def _node_id(cursor):
+        cursor.execute("SELECT value FROM sync_meta WHERE key = 'node_id'")
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _write_cache_meta(self, node_id):
+        """Write the dictionary and metadata files, replacing the old ones atomically"""
+        for filename, content in (('dictionary.json', {'products': self.products, 'payments': self.payments}),
+                                  ('meta.json', {'node_id': node_id, 'rewrites': self.rewrites,
+                                                 'high_water': self.high_water, 'size': self.size})):
+            temp_path = self._cache_path(filename + '.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(content, f)
+            os.replace(temp_path, self._cache_path(filename))
+
+    def _map_cache(self):
+        """Memory-map the first self.size rows of every column file read-only"""
+        for name, dtype in self.COLUMNS:
+            if self.size:
+                self.columns[name] = np.memmap(self._cache_path(f'{name}.bin'), dtype=dtype, mode='r',
+                                               shape=(self.size,))
+            else:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+
+    def _open_cache(self, cursor, rewrites):
+        """Map an existing cache if it was built from this database at this data version"""
         try:
-            cursor.execute('DELETE FROM products WHERE product_id = ?', (product_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete product: {str(e)}")
+            with open(self._cache_path('meta.json')) as f:
+                meta = json.load(f)
+            with open(self._cache_path('dictionary.json')) as f:
+                dictionary = json.load(f)
+            valid = (meta['node_id'] == self._node_id(cursor) and meta['rewrites'] == rewrites and
+                     all(os.path.getsize(self._cache_path(f'{name}.bin')) >= meta['size'] * np.dtype(dtype).itemsize
+                         for name, dtype in self.COLUMNS))
+        except (OSError, ValueError, KeyError):
+            valid = False
+        if not valid:
             return False
-        finally:
-            conn.close()
 
-    def get_all_products(self):
-        """Get all products from the database."""
-        conn = sqlite3.connect(self.db_name)
+        self.size, self.high_water = meta['size'], meta['high_water']
+        self.products, self.payments = dictionary['products'], dictionary['payments']
+        self.product_codes = {value: code for code, value in enumerate(self.products)}
+        self.payment_codes = {value: code for code, value in enumerate(self.payments)}
+
+        # Drop any tail left by an append that never reached meta.json
+        for name, dtype in self.COLUMNS if self.writes_cache else ():
+            with open(self._cache_path(f'{name}.bin'), 'r+b') as f:
+                f.truncate(self.size * np.dtype(dtype).itemsize)
+        self._map_cache()
+
+        # The newest cached row must still match the database (catches restores)
+        if self.size:
+            cursor.execute('SELECT CAST(ROUND(COALESCE(total, 0) * 100) AS INTEGER) FROM rentals WHERE rental_id = ?',
+                           (self.high_water,))
+            row = cursor.fetchone()
+            if row is None or row[0] != int(self.columns['total_pence'][-1]):
+                return False
+        self.rewrites = rewrites
+        return True
+
+    @property
+    def data_version(self):
+        return (self.rewrites, self.high_water)
+
+    def column(self, name):
+        """Filled part of a column"""
+        return self.columns[name][:self.size]
+
+    @staticmethod
+    def _encode(values, dictionary, codes):
+        """Dictionary-encode a sequence of strings, extending the dictionary as needed"""
+        out = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(dictionary)
+                dictionary.append(value)
+            out.append(code)
+        return out
+
+    def _append(self, batch):
+        """Append equal-length column lists, doubling capacity when full"""
+        count = len(batch['rental_id'])
+        if self.writes_cache:
+            # Release the maps before growing the files underneath them
+            self.columns = {}
+            for name, dtype in self.COLUMNS:
+                with open(self._cache_path(f'{name}.bin'), 'ab') as f:
+                    f.write(np.asarray(batch[name], dtype=dtype).tobytes())
+            self.size += count
+            return
+
+        capacity = len(self.columns['rental_id'])
+        if self.size + count > capacity:
+            capacity = max(capacity, 1024)
+            while capacity < self.size + count:
+                capacity *= 2
+            for name, dtype in self.COLUMNS:
+                grown = np.zeros(capacity, dtype=dtype)
+                grown[:self.size] = self.columns[name][:self.size]
+                self.columns[name] = grown
+        for name, _ in self.COLUMNS:
+            self.columns[name][self.size:self.size + count] = batch[name]
+        self.size += count
+
+    def refresh(self):
+        """Append rentals added since the last refresh; rebuild if any were changed or deleted"""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for the analytics snapshot")
+
+        if not self.cache_dir:
+            return self._refresh()
+        if self.writes_cache:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        elif not os.path.isdir(self.cache_dir):
+            return self._refresh()
+        with FileLock(self._cache_path('cache.lock'), shared=not self.writes_cache):
+            return self._refresh()
+
+    def _refresh(self):
+        conn = self.db_manager.connect()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM products ORDER BY product_type, product_code')
-        results = cursor.fetchall()
+        cursor.execute("SELECT rewrites FROM data_versions WHERE table_name = 'rentals'")
+        rewrites = cursor.fetchone()[0]
+        if self.writes_cache:
+            # Another process may have appended to or rebuilt the cache since we last looked
+            opened = self._open_cache(cursor, rewrites)
+            rebuilt = not opened
+        else:
+            opened = self.rewrites is None and self.cache_dir and self._open_cache(cursor, rewrites)
+            rebuilt = not opened and rewrites != self.rewrites
+        if rebuilt:
+            self.reset()
+            self.rewrites = rewrites
+
+        cursor.execute('''
+            SELECT rental_id, CAST(julianday(created_date) - 1721424.5 AS INTEGER),
+                   CAST(ROUND(COALESCE(total, 0) * 100) AS INTEGER), product_type, payment_method,
+                   COALESCE(customer_id, -1)
+            FROM rentals WHERE rental_id > ? ORDER BY rental_id
+        ''', (self.high_water,))
+        added = 0
+        while True:
+            rows = cursor.fetchmany(self.FETCH_BATCH)
+            if not rows:
+                break
+            rental_ids, days, pence, products, payments, customers = zip(*rows)
+            self._append({
+                'rental_id': rental_ids,
+                'day': [d or 0 for d in days],
+                'total_pence': pence,
+                'product': self._encode(products, self.products, self.product_codes),
+                'payment': self._encode(payments, self.payments, self.payment_codes),
+                'customer_id': customers,
+            })
+            self.high_water = rental_ids[-1]
+            added += len(rows)
+        if self.writes_cache and (added or rebuilt):
+            self._map_cache()
+            self._write_cache_meta(self._node_id(cursor))
         conn.close()
-        return results
+        return added
+
+    def memory_bytes(self):
+        """Bytes held by the filled columns"""
+        return sum(self.column(name).nbytes for name, _ in self.COLUMNS)
+
+    def _mask(self, start_ordinal=None, product=None):
+        """Rows created on or after start_ordinal, optionally of one product type (all rows when None)"""
+        if start_ordinal is None and product is None:
+            return slice(None)
+        mask = np.ones(self.size, dtype=bool)
+        if start_ordinal is not None:
+            mask &= self.column('day') >= start_ordinal
+        if product is not None:
+            mask &= self.column('product') == self.product_codes.get(product, -1)
+        return mask
+
+    def group_by(self, key, start_ordinal=None):
+        """{value: (rentals, revenue)} for 'product' or 'payment', skipping NULL values"""
+        mask = self._mask(start_ordinal)
+        dictionary = self.products if key == 'product' else self.payments
+        codes = self.column(key)[mask]
+        counts = np.bincount(codes, minlength=len(dictionary))
+        revenue = np.bincount(codes, weights=self.column('total_pence')[mask], minlength=len(dictionary)) / 100
+        return {value: (int(counts[code]), float(revenue[code]))
+                for code, value in enumerate(dictionary) if value is not None and counts[code]}
+
+    def daily(self, start_ordinal, end_ordinal):
+        """Rentals and revenue per day for start_ordinal..end_ordinal inclusive"""
+        days = self.column('day')
+        mask = (days >= start_ordinal) & (days <= end_ordinal)
+        offsets = days[mask] - start_ordinal
+        length = end_ordinal - start_ordinal + 1
+        counts = np.bincount(offsets, minlength=length)
+        revenue = np.bincount(offsets, weights=self.column('total_pence')[mask], minlength=length) / 100
+        return counts, revenue
+
+    def monthly(self, start_ordinal, product=None):
+        """(months since 1970-01, rentals, revenue) for months with rentals since start_ordinal"""
+        mask = self._mask(start_ordinal, product)
+        months, index = np.unique(ordinals_to_months(self.column('day')[mask]), return_inverse=True)
+        counts = np.bincount(index, minlength=len(months))
+        revenue = np.bincount(index, weights=self.column('total_pence')[mask], minlength=len(months)) / 100
+        return months, counts, revenue
+
+    def customer_totals(self):
+        """(customer_ids, rentals, spend) for rentals with a customer"""
+        customers = self.column('customer_id')
+        known = customers >= 0
+        ids, index = np.unique(customers[known], return_inverse=True)
+        counts = np.bincount(index, minlength=len(ids))
+        spend = np.bincount(index, weights=self.column('total_pence')[known], minlength=len(ids)) / 100
+        return ids, counts, spend
+
+    def summary(self):
+        """Total rentals, revenue and distinct customers"""
+        customers = self.column('customer_id')
+        return {
+            'rentals': self.size,
+            'revenue': int(self.column('total_pence').sum()) / 100,
+            'customers': len(np.unique(customers[customers >= 0])),
+        }
+
+# Receipt layout shared by the rental form and batch statements
+RECEIPT_TEMPLATE = """
+═══════════════════════════════════════════════
+           RENTAL INVOICE
+═══════════════════════════════════════════════
+
+Receipt Ref:     {receipt_ref}
+Date:           {date}
+Customer:       {customer}
+
+─────────────────────────────────────────────────
+RENTAL DETAILS:
+─────────────────────────────────────────────────
+Product:        {product_type}
+Product Code:   {product_code}
+Rental Period:  {no_days}
+Daily Rate:     {cost_per_day}
+Total Days:     {days}
+
+Payment Method: {payment_method}
+Discount:       {discount}
+
+─────────────────────────────────────────────────
+BILLING SUMMARY:
+─────────────────────────────────────────────────
+Subtotal:       £{subtotal:.2f}
+{tax_label:<16}£{tax:.2f}
+─────────────────────────────────────────────────
+TOTAL:          £{total:.2f}
+═══════════════════════════════════════════════
+
+Thank you for choosing our rental service!
+Contact us: info@rentalservice.com
+Phone: (555) 123-4567
+
+═══════════════════════════════════════════════
+"""
+
+# Receipts per worker task in batch rendering
+RECEIPT_BATCH_CHUNK = 250
+
+# Box-drawing characters are not in the standard PDF fonts
+PDF_TEXT_TRANSLATION = str.maketrans({'═': '=', '─': '-'})
+
+def compile_template(template):
+    """Parse a str.format template once and return a function rendering it from a dict"""
+    parts = [(literal, field, spec) for literal, field, spec, _ in string.Formatter().parse(template)]
+
+    def render(fields):
+        out = []
+        for literal, field, spec in parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(fields[field], spec))
+        return ''.join(out)
+    return render
+
+render_receipt_text = compile_template(RECEIPT_TEMPLATE)
+
+def draw_receipt_page(pdf, text):
+    """Draw one receipt as a page of a reportlab canvas"""
+    width, height = letter
+    text_object = pdf.beginText(50, height - 50)
+    text_object.setFont('Courier', 10)
+    for line in text.translate(PDF_TEXT_TRANSLATION).splitlines():
+        text_object.textLine(line)
+    pdf.drawText(text_object)
+    pdf.showPage()
+
+def render_receipt_chunk(rows, tax_rate, as_pdf):
+    """Render rental rows to (receipt_ref, text or single-page PDF bytes); runs in pool workers"""
+    results = []
+    for row in rows:
+        fields = ReceiptRenderer.fields_from_row(row, tax_rate)
+        text = render_receipt_text(fields)
+        if as_pdf:
+            buffer = io.BytesIO()
+            pdf = canvas.Canvas(buffer, pagesize=letter)
+            draw_receipt_page(pdf, text)
+            pdf.save()
+            results.append((fields['receipt_ref'], buffer.getvalue()))
+        else:
+            results.append((fields['receipt_ref'], text))
+    return results
+
+class ReceiptRenderer:
+    """Render rental receipts as text or PDF, singly or in batches"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    @staticmethod
+    def tax_label(tax_rate):
+        """Label for the tax line of a receipt"""
+        return f"Tax ({tax_rate * 100:g}%):"
+
+    @staticmethod
+    def fields_from_row(row, tax_rate):
+        """Template fields for a stored rental row (see load_rows)"""
+        (receipt_ref, created_date, customer_id, customer_name, product_type, product_code,
+         no_days, cost_per_day, days, payment_method, discount, subtotal, tax, total) = row
+        return {
+            'receipt_ref': receipt_ref or '',
+            'date': (created_date or '')[:10],
+            'customer': f"{customer_name} (ID: {customer_id})" if customer_name else "Walk-in Customer",
+            'product_type': product_type or '',
+            'product_code': product_code or '',
+            'no_days': no_days or '',
+            'cost_per_day': f"£{cost_per_day or 0:.2f}",
+            'days': days or 0,
+            'payment_method': payment_method or '',
+            'discount': f"{discount or 0:g}%",
+            'subtotal': subtotal or 0,
+            'tax_label': ReceiptRenderer.tax_label(tax_rate),
+            'tax': tax or 0,
+            'total': total or 0,
+        }
+
+    def render_text(self, fields):
+        """Render one receipt from a field dict"""
+        return render_receipt_text(fields)
+
+    def load_rows(self, start_date=None, end_date=None, customer_ids=None):
+        """Rental rows for receipts created in a date range and/or for a list of customers, archives included"""
+        where, params = '1 = 1', []
+        if customer_ids:
+            where = 'r.customer_id IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps([int(c) for c in customer_ids]))
+
+        # The trailing rental_id orders rows from archive chunks and is dropped again
+        rows = self.db_manager.archive.query_rentals(
+            '''r.receipt_ref, r.created_date, r.customer_id, c.customer_name, r.product_type,
+               r.product_code, r.no_days, r.cost_per_day, r.last_credit_review, r.payment_method,
+               r.discount, r.subtotal, r.tax, r.total, r.rental_id''',
+            where, params, start_date, end_date, order_by='2, 15',
+            joins='LEFT JOIN customers c ON r.customer_id = c.customer_id',
+            sort_key=lambda row: (row[1] is not None, row[1], row[14]))
+        return [row[:14] for row in rows]
+
+    def batch(self, output_path, start_date=None, end_date=None, customer_ids=None, tax_rate=0.15, workers=None):
+        """Render matching receipts to one multi-page PDF, or a zip of PDFs when output_path ends in .zip"""
+        started = time.perf_counter()
+        rows = self.load_rows(start_date, end_date, customer_ids)
+        as_zip = output_path.lower().endswith('.zip')
+        chunks = [rows[i:i + RECEIPT_BATCH_CHUNK] for i in range(0, len(rows), RECEIPT_BATCH_CHUNK)]
+
+        # Small batches are not worth starting worker processes for
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                rendered = pool.map(render_receipt_chunk, chunks, repeat(tax_rate), repeat(as_zip))
+                self._write_batch(output_path, as_zip, rendered)
+        else:
+            self._write_batch(output_path, as_zip,
+                              (render_receipt_chunk(chunk, tax_rate, as_zip) for chunk in chunks))
+
+        seconds = time.perf_counter() - started
+        return {
+            'receipts': len(rows),
+            'seconds': seconds,
+            'receipts_per_sec': len(rows) / seconds if seconds > 0 else 0.0,
+        }
+
+    def _write_batch(self, output_path, as_zip, rendered):
+        """Write rendered chunks, in order, to a zip of PDFs or one combined PDF"""
+        if as_zip:
+            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for chunk in rendered:
+                    for receipt_ref, data in chunk:
+                        archive.writestr(f"{receipt_ref}.pdf", data)
+        else:
+            pdf = canvas.Canvas(output_path, pagesize=letter)
+            for chunk in rendered:
+                for receipt_ref, text in chunk:
+                    draw_receipt_page(pdf, text)
+            pdf.save()
+
+# Dashboards, drawn into a caller-supplied Figure so the Analytics tab and
+# the report runner share them. sources maps names to data engines.
+def draw_product_distribution(fig, sources):
+    """Draw enhanced product distribution chart"""
+    snapshot = sources['snapshot']
+    snapshot.refresh()
+    
+    # Fold in rentals that have moved to archives
+    merged = {product: [count, revenue] for product, (count, revenue) in snapshot.group_by('product').items()}
+    for product_type, (count, revenue, _) in sources['archive'].rollup_totals().items():
+        if product_type:
+            entry = merged.setdefault(product_type, [0, 0])
+            entry[0] += count
+            entry[1] += revenue
+    data = sorted(((p, c, r) for p, (c, r) in merged.items()), key=lambda row: row[1], reverse=True)
+    
+    if not data:
+        ax = fig.add_subplot(111)
+        ax.text(0.5, 0.5, 'No rental data available', 
+               transform=ax.transAxes, ha='center', va='center',
+               fontsize=16, color='gray')
+        ax.set_title('Product Distribution')
+        return
+    
+    products = [row[0] for row in data]
+    counts = [row[1] for row in data]
+    revenues = [row[2] or 0 for row in data]
+    
+    # Create subplots
+    gs = fig.add_gridspec(2, 2, hspace=0.3, wspace=0.3)
+    
+    # Pie chart for count distribution
+    ax1 = fig.add_subplot(gs[0, 0])
+    colors = ['#3498db', '#e74c3c', '#27ae60', '#f39c12', '#9b59b6']
+    wedges, texts, autotexts = ax1.pie(counts, labels=products, autopct='%1.1f%%', 
+                                      colors=colors[:len(products)], startangle=90)
+    ax1.set_title('Rental Count Distribution', fontweight='bold')
+    
+    # Bar chart for revenue
+    ax2 = fig.add_subplot(gs[0, 1])
+    bars = ax2.bar(products, revenues, color=colors[:len(products)])
+    ax2.set_title('Revenue by Product Type', fontweight='bold')
+    ax2.set_ylabel('Revenue (£)')
+    ax2.tick_params(axis='x', rotation=45)
+    
+    # Add value labels on bars
+    for bar in bars:
+        height = bar.get_height()
+        ax2.text(bar.get_x() + bar.get_width()/2., height + max(revenues)*0.01,
+                f'£{height:.0f}', ha='center', va='bottom', fontsize=9)
+    
+    # Trend chart (last 30 days)
+    ax3 = fig.add_subplot(gs[1, :])
+    today = datetime.date.today().toordinal()
+    day_counts, day_revenue = snapshot.daily(today - 30, today)
+    active = np.nonzero(day_counts)[0]
+    
+    if len(active):
+        dates = [datetime.date.fromordinal(today - 30 + int(i)).strftime('%m-%d') for i in active]
+        daily_counts = day_counts[active]
+        daily_revenue = day_revenue[active]
+        
+        ax3_twin = ax3.twinx()
+        
+        line1 = ax3.plot(dates, daily_counts, marker='o', color='#3498db', linewidth=2, label='Rentals')
+        line2 = ax3_twin.plot(dates, daily_revenue, marker='s', color='#e74c3c', linewidth=2, label='Revenue')
+        
+        ax3.set_xlabel('Date (Last 30 Days)')
+        ax3.set_ylabel('Number of Rentals', color='#3498db')
+        ax3_twin.set_ylabel('Revenue (£)', color='#e74c3c')
+        
+        # Combine legends
+        lines = line1 + line2
+        labels = [l.get_label() for l in lines]
+        ax3.legend(lines, labels, loc='upper left')
+        
+        ax3.set_title('Daily Rental Trends (Last 30 Days)', fontweight='bold')
+        ax3.tick_params(axis='x', rotation=45)
+    
+    fig.suptitle('Rental Analytics Dashboard', fontsize=16, fontweight='bold')
+
+def draw_monthly_revenue(fig, sources, product=None):
+    """Draw monthly revenue trends"""
+    snapshot = sources['snapshot']
+    snapshot.refresh()
+    today = datetime.date.today()
+    start = today.replace(year=today.year - 1, day=min(today.day, 28))
+    month_ids, month_counts, month_revenue = snapshot.monthly(start.toordinal(), product)
+    
+    if not len(month_ids):
+        ax = fig.add_subplot(111)
+        ax.text(0.5, 0.5, 'No data available for the last 12 months', 
+               transform=ax.transAxes, ha='center', va='center',
+               fontsize=16, color='gray')
+        ax.set_title('Monthly Revenue Trends')
+        return
+    
+    months = [datetime.date(1970 + int(m) // 12, int(m) % 12 + 1, 1).strftime('%b %Y') for m in month_ids]
+    revenues = month_revenue
+    counts = month_counts
+    avg_rentals = month_revenue / month_counts
+    
+    # Create subplots
+    ax1 = fig.add_subplot(3, 1, 1)
+    ax2 = fig.add_subplot(3, 1, 2)
+    ax3 = fig.add_subplot(3, 1, 3)
+    
+    # Revenue chart
+    bars1 = ax1.bar(months, revenues, color='#27ae60', alpha=0.7)
+    ax1.set_title('Monthly Revenue', fontweight='bold')
+    ax1.set_ylabel('Revenue (£)')
+    ax1.tick_params(axis='x', rotation=45)
+    
+    # Add trend line
+    if len(revenues) > 1:
+        z = np.polyfit(range(len(revenues)), revenues, 1)
+        p = np.poly1d(z)
+        ax1.plot(range(len(revenues)), p(range(len(revenues))), 
+                color='red', linestyle='--', alpha=0.8, label='Trend')
+        ax1.legend()
+    
+    # Count chart
+    bars2 = ax2.bar(months, counts, color='#3498db', alpha=0.7)
+    ax2.set_title('Monthly Rental Count', fontweight='bold')
+    ax2.set_ylabel('Number of Rentals')
+    ax2.tick_params(axis='x', rotation=45)
+    
+    # Average rental value
+    line3 = ax3.plot(months, avg_rentals, marker='o', color='#f39c12', linewidth=2, markersize=6)
+    ax3.set_title('Average Rental Value', fontweight='bold')
+    ax3.set_ylabel('Average Value (£)')
+    ax3.tick_params(axis='x', rotation=45)
+    ax3.grid(True, alpha=0.3)
+    
+    title = f'Monthly Performance Analysis - {product}' if product else 'Monthly Performance Analysis'
+    fig.suptitle(title, fontsize=16, fontweight='bold')
+    fig.tight_layout(rect=(0, 0, 1, 0.95))
+
+def draw_customer_stats(fig, sources):
+    """Draw comprehensive customer statistics"""
+    snapshot = sources['snapshot']
+    snapshot.refresh()
+    
+    # Get various statistics
+    summary = snapshot.summary()
+    total_rentals = summary['rentals']
+    total_revenue = summary['revenue']
+    unique_customers = summary['customers']
+    
+    conn = sources['db'].connect()
+    cursor = conn.cursor()
+    
+    # Include archived rentals in the business totals
+    cursor.execute('SELECT COALESCE(SUM(rentals), 0), COALESCE(SUM(revenue), 0) FROM rental_rollups')
+    archived_rentals, archived_revenue = cursor.fetchone()
+    total_rentals += archived_rentals
+    total_revenue += archived_revenue
+    avg_rental = total_revenue / total_rentals if total_rentals else 0
+    
+    # Payment method distribution
+    payment_data = sorted(((method, count) for method, (count, _) in snapshot.group_by('payment').items()
+                           if method != 'Select'), key=lambda row: row[1], reverse=True)
+    
+    # Top customers
+    customer_ids, customer_counts, customer_spend = snapshot.customer_totals()
+    top = np.argsort(-customer_spend, kind='stable')[:5]
+    top_ids = [int(customer_ids[i]) for i in top]
+    cursor.execute(f"SELECT customer_id, customer_name FROM customers WHERE customer_id IN ({','.join('?' * len(top_ids))})",
+                   top_ids)
+    names = dict(cursor.fetchall())
+    top_customers = [(names[int(customer_ids[i])], int(customer_counts[i]), float(customer_spend[i]))
+                     for i in top if int(customer_ids[i]) in names]
+    
+    conn.close()
+    
+    # Create layout
+    gs = fig.add_gridspec(2, 3, hspace=0.4, wspace=0.4)
+    
+    # Summary statistics (text)
+    ax1 = fig.add_subplot(gs[0, 0])
+    ax1.axis('off')
+    
+    stats_text = f"""BUSINESS SUMMARY
+    
+Total Rentals: {total_rentals:,}
+Total Revenue: £{total_revenue:,.2f}
+Average Rental: £{avg_rental:.2f}
+Unique Customers: {unique_customers:,}
+
+Revenue per Customer: £{total_revenue/unique_customers if unique_customers > 0 else 0:.2f}
+Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 else 0:.1f}"""
+    
+    ax1.text(0.05, 0.95, stats_text, transform=ax1.transAxes, 
+            fontsize=10, verticalalignment='top', fontfamily='monospace',
+            bbox=dict(boxstyle="round,pad=0.5", facecolor='lightblue', alpha=0.8))
+    
+    # Payment method pie chart
+    if payment_data:
+        ax2 = fig.add_subplot(gs[0, 1])
+        methods = [row[0] for row in payment_data]
+        counts = [row[1] for row in payment_data]
+        
+        ax2.pie(counts, labels=methods, autopct='%1.1f%%', startangle=90)
+        ax2.set_title('Payment Methods', fontweight='bold')
+    
+    # Top customers bar chart
+    if top_customers:
+        ax3 = fig.add_subplot(gs[0, 2])
+        names = [row[0][:10] + '...' if len(row[0]) > 10 else row[0] for row in top_customers]
+        spending = [row[2] for row in top_customers]
+        
+        bars = ax3.barh(names, spending, color='#e74c3c')
+        ax3.set_title('Top 5 Customers by Revenue', fontweight='bold')
+        ax3.set_xlabel('Total Spent (£)')
+        
+        # Add value labels
+        for i, bar in enumerate(bars):
+            width = bar.get_width()
+            ax3.text(width + max(spending)*0.01, bar.get_y() + bar.get_height()/2,
+                    f'£{width:.0f}', ha='left', va='center', fontsize=9)
+    
+    # Rental frequency distribution
+    rental_counts, frequencies = np.unique(customer_counts, return_counts=True)
+    
+    if len(rental_counts):
+        ax4 = fig.add_subplot(gs[1, :])
+        
+        bars = ax4.bar(rental_counts, frequencies, color='#9b59b6', alpha=0.7)
+        ax4.set_title('Customer Rental Frequency Distribution', fontweight='bold')
+        ax4.set_xlabel('Number of Rentals per Customer')
+        ax4.set_ylabel('Number of Customers')
+        ax4.grid(True, alpha=0.3, axis='y')
+        
+        # Add value labels
+        for bar in bars:
+            height = bar.get_height()
+            ax4.text(bar.get_x() + bar.get_width()/2., height + 0.1,
+                    f'{int(height)}', ha='center', va='bottom', fontsize=9)
+    
+    fig.suptitle('Customer Analytics Dashboard', fontsize=16, fontweight='bold')
+
+def draw_fleet_utilization(fig, sources):
+    """Draw utilization, revenue per unit-day and concurrency per product type"""
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=89)
+    report = sources['utilization'].report(start_date, end_date)
+    
+    if not report:
+        ax = fig.add_subplot(111)
+        ax.text(0.5, 0.5, 'No fleet data available', 
+               transform=ax.transAxes, ha='center', va='center',
+               fontsize=16, color='gray')
+        ax.set_title('Fleet Utilization')
+        return
+    
+    products = list(report.keys())
+    utilization = [report[p]['utilization'] for p in products]
+    revenue_per_unit = [report[p]['revenue_per_unit_day'] for p in products]
+    colors = ['#3498db', '#e74c3c', '#27ae60', '#f39c12', '#9b59b6']
+    
+    gs = fig.add_gridspec(2, 2, hspace=0.4, wspace=0.3)
+    
+    # Utilization % with over/under-stock guide lines
+    ax1 = fig.add_subplot(gs[0, 0])
+    bars = ax1.bar(products, utilization, color=[colors[i % len(colors)] for i in range(len(products))])
+    ax1.axhline(85, color='#e74c3c', linestyle='--', alpha=0.6, label='Over-stretched')
+    ax1.axhline(40, color='#f39c12', linestyle='--', alpha=0.6, label='Under-used')
+    ax1.set_title('Utilization (Last 90 Days)', fontweight='bold')
+    ax1.set_ylabel('Utilization (%)')
+    ax1.tick_params(axis='x', rotation=45)
+    ax1.legend(fontsize=8)
+    for bar, product in zip(bars, products):
+        ax1.text(bar.get_x() + bar.get_width()/2., bar.get_height() + 1,
+                f"peak {report[product]['peak_concurrency']}/{report[product]['units']}",
+                ha='center', va='bottom', fontsize=8)
+    
+    # Revenue per available unit-day
+    ax2 = fig.add_subplot(gs[0, 1])
+    ax2.bar(products, revenue_per_unit, color='#27ae60', alpha=0.7)
+    ax2.set_title('Revenue per Available Unit-Day', fontweight='bold')
+    ax2.set_ylabel('Revenue (£)')
+    ax2.tick_params(axis='x', rotation=45)
+    
+    # Units out per day against fleet size
+    ax3 = fig.add_subplot(gs[1, :])
+    dates = [start_date + datetime.timedelta(days=i) for i in range(90)]
+    for i, product in enumerate(products):
+        color = colors[i % len(colors)]
+        ax3.plot(dates, report[product]['daily_occupancy'], color=color, linewidth=2, label=product)
+        ax3.axhline(report[product]['units'], color=color, linestyle=':', alpha=0.6)
+    ax3.set_title('Units on Rent per Day (dotted = fleet size)', fontweight='bold')
+    ax3.set_ylabel('Units')
+    ax3.legend(loc='upper left', fontsize=8)
+    ax3.tick_params(axis='x', rotation=45)
+    ax3.grid(True, alpha=0.3)
+    
+    fig.suptitle('Fleet Utilization Dashboard', fontsize=16, fontweight='bold')
+
+def draw_demand_forecast(fig, sources):
+    """Draw next 90 days demand forecast and stock recommendations"""
+    recommendations = sources['forecaster'].stock_recommendations(horizon=90)
+    
+    if not recommendations:
+        ax = fig.add_subplot(111)
+        ax.text(0.5, 0.5, 'No rental history to forecast from', 
+               transform=ax.transAxes, ha='center', va='center',
+               fontsize=16, color='gray')
+        ax.set_title('Demand Forecast')
+        return
+    
+    products = list(recommendations.keys())
+    colors = ['#3498db', '#e74c3c', '#27ae60', '#f39c12', '#9b59b6']
+    gs = fig.add_gridspec(2, 1, hspace=0.4)
+    
+    # Daily demand forecast per product type
+    ax1 = fig.add_subplot(gs[0, 0])
+    today = datetime.date.today()
+    dates = [today + datetime.timedelta(days=i) for i in range(90)]
+    for i, product in enumerate(products):
+        ax1.plot(dates, recommendations[product]['forecast'], color=colors[i % len(colors)],
+                linewidth=2, label=f"{product} ({recommendations[product]['expected_rentals']:.0f})")
+    ax1.set_title('Expected Rentals per Day (Next 90 Days)', fontweight='bold')
+    ax1.set_ylabel('Rentals')
+    ax1.legend(loc='upper left', fontsize=8)
+    ax1.tick_params(axis='x', rotation=45)
+    ax1.grid(True, alpha=0.3)
+    
+    # Recommended vs current fleet size
+    ax2 = fig.add_subplot(gs[1, 0])
+    positions = range(len(products))
+    current = [recommendations[p]['current_units'] for p in products]
+    recommended = [recommendations[p]['recommended_units'] for p in products]
+    ax2.bar([p - 0.2 for p in positions], current, width=0.4, color='#3498db', label='Current Units')
+    ax2.bar([p + 0.2 for p in positions], recommended, width=0.4, color='#e74c3c', label='Recommended Units')
+    ax2.set_xticks(list(positions))
+    ax2.set_xticklabels(products)
+    ax2.set_title('Stock Recommendations', fontweight='bold')
+    ax2.set_ylabel('Units')
+    ax2.legend()
+    
+    fig.suptitle('Demand Forecasting', fontsize=16, fontweight='bold')
+
+def draw_customer_cohorts(fig, sources):
+    """Draw cohort retention, RFM segments and lifetime value"""
+    cohorts = sources['customers'].cohorts()
+    segments = sources['customers'].segment_summary()
+    
+    if not cohorts['months'] or not segments:
+        ax = fig.add_subplot(111)
+        ax.text(0.5, 0.5, 'No customer data available', 
+               transform=ax.transAxes, ha='center', va='center',
+               fontsize=16, color='gray')
+        ax.set_title('Customer Cohorts')
+        return
+    
+    gs = fig.add_gridspec(2, 2, hspace=0.4, wspace=0.3)
+    
+    # Retention heatmap (last 12 cohorts, first 12 months)
+    ax1 = fig.add_subplot(gs[0, 0])
+    retention = cohorts['retention'][-12:, :12]
+    image = ax1.imshow(retention * 100, aspect='auto', cmap='Blues', vmin=0, vmax=100)
+    ax1.set_yticks(range(len(retention)))
+    ax1.set_yticklabels(cohorts['months'][-12:], fontsize=8)
+    ax1.set_xlabel('Months Since Joining')
+    ax1.set_title('Cohort Retention (%)', fontweight='bold')
+    fig.colorbar(image, ax=ax1)
+    
+    # Average retention curve across cohorts
+    ax2 = fig.add_subplot(gs[0, 1])
+    curve = np.nanmean(cohorts['retention'][:, :12], axis=0) * 100
+    ax2.plot(range(len(curve)), curve, marker='o', color='#3498db', linewidth=2)
+    ax2.set_title('Average Retention Curve', fontweight='bold')
+    ax2.set_xlabel('Months Since Joining')
+    ax2.set_ylabel('Active Customers (%)')
+    ax2.grid(True, alpha=0.3)
+    
+    # RFM segment sizes
+    names = [n for n in segments if segments[n]['customers'] > 0]
+    ax3 = fig.add_subplot(gs[1, 0])
+    ax3.barh(names, [segments[n]['customers'] for n in names], color='#9b59b6')
+    ax3.set_title('RFM Segments', fontweight='bold')
+    ax3.set_xlabel('Customers')
+    
+    # Average lifetime value by segment
+    ax4 = fig.add_subplot(gs[1, 1])
+    ax4.barh(names, [segments[n]['avg_ltv'] for n in names], color='#27ae60')
+    ax4.set_title('Average Lifetime Value by Segment', fontweight='bold')
+    ax4.set_xlabel('LTV (£)')
+    
+    fig.suptitle('Customer Lifetime Analytics', fontsize=16, fontweight='bold')
+
+# Report name -> (title, draw function, has per-product variants)
+REPORTS = {
+    'products': ('Product Distribution', draw_product_distribution, False),
+    'monthly': ('Monthly Revenue', draw_monthly_revenue, True),
+    'customers': ('Customer Statistics', draw_customer_stats, False),
+    'utilization': ('Fleet Utilization', draw_fleet_utilization, False),
+    'forecast': ('Demand Forecast', draw_demand_forecast, False),
+    'cohorts': ('Customer Cohorts', draw_customer_cohorts, False),
+}
+
+def report_sources(db_manager, cache_dir=None):
+    """Data engines the dashboard draw functions read from"""
+    return {
+        'db': db_manager,
+        'snapshot': AnalyticsSnapshot(db_manager, cache_dir),
+        'archive': db_manager.archive,
+        'utilization': UtilizationEngine(db_manager),
+        'forecaster': DemandForecaster(db_manager),
+        'customers': CustomerAnalytics(db_manager),
+    }
+
+def init_report_worker():
+    """Pool initializer: worker processes render off-screen"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+def render_report_job(db_path, key_file, cache_dir, name, product, out_dir, formats):
+    """Render one dashboard to files from a read-only connection; runs in pool workers"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    sources = report_sources(ReadOnlyDatabase(db_path, key_file=key_file), cache_dir)
+    fig = Figure(figsize=(12, 8), facecolor='#ffffff')
+    FigureCanvasAgg(fig)
+    draw = REPORTS[name][1]
+    if product is None:
+        draw(fig, sources)
+    else:
+        draw(fig, sources, product)
+
+    slug = ''.join(ch if ch.isalnum() else '_' for ch in product) if product else ''
+    base = os.path.join(out_dir, f"{name}_{slug}" if slug else name)
+    paths = []
+    for fmt in formats:
+        fig.savefig(f"{base}.{fmt}", dpi=100)
+        paths.append(f"{base}.{fmt}")
+    return paths
+
+class ReportRunner:
+    """Render every dashboard, plus per-product variants, in parallel worker processes"""
+
+    def __init__(self, db_manager, cache_dir=None):
+        self.db_manager = db_manager
+        self.cache_dir = cache_dir
+
+    def jobs(self, names=None, per_product=True):
+        """(report name, product type or None) pairs to render"""
+        names = names or list(REPORTS)
+        snapshot = AnalyticsSnapshot(self.db_manager, self.cache_dir)
+        snapshot.refresh()
+        products = sorted(p for p in snapshot.products if p is not None)
+        jobs = [(name, None) for name in names]
+        if per_product:
+            jobs += [(name, product) for name in names if REPORTS[name][2] for product in products]
+        return jobs
+
+    def run(self, out_dir, names=None, per_product=True, formats=('png', 'pdf'), workers=None):
+        """Render reports into out_dir and combine the pages into board_pack.pdf"""
+        started = time.perf_counter()
+        os.makedirs(out_dir, exist_ok=True)
+
+        # Bring the shared column cache and forecast states up to date here,
+        # so the read-only workers find nothing left to write
+        jobs = self.jobs(names, per_product)
+        DemandForecaster(self.db_manager).update()
+        formats = tuple(formats) if 'png' in formats else tuple(formats) + ('png',)
+
+        # Workers open customer details with the same key file as this process
+        args = [(self.db_manager.db_name, self.db_manager.pii.key_file, self.cache_dir, name, product, out_dir, formats)
+                for name, product in jobs]
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=init_report_worker) as pool:
+                outputs = list(pool.map(render_report_job, *zip(*args)))
+        else:
+            outputs = [render_report_job(*job_args) for job_args in args]
+
+        combined = os.path.join(out_dir, 'board_pack.pdf')
+        self._combine(combined, jobs, outputs)
+        return {
+            'reports': len(jobs),
+            'files': [path for paths in outputs for path in paths],
+            'combined': combined,
+            'seconds': time.perf_counter() - started,
+        }
+
+    def _combine(self, path, jobs, outputs):
+        """One landscape page per rendered PNG, after a contents page"""
+        from reportlab.lib.pagesizes import landscape
+        width, height = landscape(letter)
+        pdf = canvas.Canvas(path, pagesize=(width, height))
+        pdf.setFont("Helvetica-Bold", 24)
+        pdf.drawString(50, height - 80, "Board Pack")
+        pdf.setFont("Helvetica", 12)
+        pdf.drawString(50, height - 105, f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        for i, (name, product) in enumerate(jobs):
+            pdf.drawString(70, height - 140 - i * 16, f"{i + 2}. {REPORTS[name][0]}{' - ' + product if product else ''}")
+        pdf.showPage()
+
+        for paths in outputs:
+            png = next(p for p in paths if p.endswith('.png'))
+            pdf.drawImage(png, 20, 20, width=width - 40, height=height - 40, preserveAspectRatio=True)
+            pdf.showPage()
+        pdf.save()
 
 class ImprovedRentalInventory:
-    def __init__(self, root):
+    def __init__(self, root, journal_mode=None):
         self.root = root
         self.root.title("Advanced Rental Inventory Management System")
         self.root.state('zoomed')  # Start maximized on Windows
         self.root.minsize(1200, 800)  # Minimum window size
         
+        # Callbacks from background threads, run on the Tk thread by poll_ui_queue
+        self.ui_queue = queue.Queue()
+        self.poll_ui_queue()
+        
         # Initialize database
-        self.db_manager = DatabaseManager()
+        self.db_manager = DatabaseManager(journal_mode=journal_mode)
+        
+        # Changes are made as a signed-in user, not as whoever launched the program
+        self.db_manager.access.sign_out()
+        self.root.withdraw()
+        if not self.sign_in():
+            self.root.destroy()
+            sys.exit(0)
+        self.root.deiconify()
+        
+        self.pricing_engine = PricingEngine(self.db_manager)
+        self.utilization_engine = UtilizationEngine(self.db_manager)
+        self.demand_forecaster = DemandForecaster(self.db_manager)
+        self.customer_analytics = CustomerAnalytics(self.db_manager)
+        self.sync_engine = SyncEngine(self.db_manager)
+        self.backup_manager = BackupManager(self.db_manager)
+        self.archive_manager = self.db_manager.archive
+        self.receipt_renderer = ReceiptRenderer(self.db_manager)
+        self.ledger = Ledger(self.db_manager)
+        self.analytics_snapshot = AnalyticsSnapshot(
+            self.db_manager, cache_dir=os.path.splitext(self.db_manager.db_name)[0] + '_analytics')
+        self.report_sources = {
+            'db': self.db_manager,
+            'snapshot': self.analytics_snapshot,
+            'archive': self.archive_manager,
+            'utilization': self.utilization_engine,
+            'forecaster': self.demand_forecaster,
+            'customers': self.customer_analytics,
+        }
+        self.report_runner = ReportRunner(self.db_manager, self.analytics_snapshot.cache_dir)
+        self.backup_manager.start_schedule(
+            on_error=lambda e: self.call_on_ui(lambda: messagebox.showerror("Backup", f"Scheduled snapshot failed: {str(e)}")))
+        self.return_scheduler = ReturnScheduler(self.db_manager)
+        self.return_scheduler.start(
+            on_error=lambda e: self.call_on_ui(lambda: messagebox.showerror("Returns", f"Overdue scan failed: {str(e)}")))
+        self.db_manager.audit.start_schedule(
+            on_error=lambda e: self.call_on_ui(lambda: messagebox.showerror("Audit", f"Audit journal flush failed: {str(e)}")))
         
         # Configure responsive styles
         self.configure_responsive_styles()
@@ -246,6 +5831,9 @@ class ImprovedRentalInventory:
         # Create responsive main interface
         self.create_responsive_interface()
         
+        # Apply committed data changes to the views as targeted updates
+        self.subscribe_to_changes()
+        
         # Bind resize events
         self.root.bind('<Configure>', self.on_window_resize)
     
@@ -341,6 +5929,7 @@ class ImprovedRentalInventory:
         self.customer_phone = StringVar()
         self.customer_email = StringVar()
         self.customer_address = StringVar()
+        self.customer_search = StringVar()
 
         # Product variables (NEW)
         self.product_id_var = StringVar()
@@ -352,6 +5941,11 @@ class ImprovedRentalInventory:
         
         # Search variable
         self.search_var = StringVar()
+        self.history_filters = {}
+        self.history_sort = ('Date', True)
+        self.history_offset = 0
+        self.history_after = None
+        self.history_has_more = False
     
     def create_responsive_interface(self):
         """Create responsive main interface"""
@@ -359,12 +5953,76 @@ class ImprovedRentalInventory:
         self.main_container = Frame(self.root, bg=self.colors['primary'])
         self.main_container.pack(fill=BOTH, expand=True)
         
+        # Menu bar
+        self.create_menu()
+        
         # Header
         self.create_header()
         
         # Notebook for tabs
         self.create_responsive_notebook()
     
+    def create_menu(self):
+        """Create the application menu bar"""
+        menubar = Menu(self.root)
+        
+        sync_menu = Menu(menubar, tearoff=0)
+        sync_menu.add_command(label="Export Changes...", command=self.export_sync_changes)
+        sync_menu.add_command(label="Import Changes...", command=self.import_sync_changes)
+        sync_menu.add_separator()
+        sync_menu.add_command(label="Sync with Branch...", command=self.sync_with_branch)
+        sync_menu.add_command(label="Accept Branch Sync", command=self.serve_branch_sync)
+        menubar.add_cascade(label="Sync", menu=sync_menu)
+        
+        backup_menu = Menu(menubar, tearoff=0)
+        backup_menu.add_command(label="Backup Now", command=self.backup_now)
+        backup_menu.add_command(label="Verify Snapshot...", command=self.verify_snapshot)
+        backup_menu.add_separator()
+        backup_menu.add_command(label="Restore Snapshot...", command=self.restore_snapshot)
+        backup_menu.add_command(label="Restore to Point in Time...", command=lambda: self.restore_snapshot(point_in_time=True))
+        backup_menu.add_separator()
+        backup_menu.add_command(label="Archive Old Rentals...", command=self.archive_old_rentals)
+        backup_menu.add_command(label="Lock Statistics", command=self.show_lock_statistics)
+        backup_menu.add_command(label="Compact Audit Journal...", command=self.compact_audit_journal)
+        menubar.add_cascade(label="Backup", menu=backup_menu)
+        
+        billing_menu = Menu(menubar, tearoff=0)
+        billing_menu.add_command(label="Record Payment...", command=self.record_payment)
+        billing_menu.add_command(label="Customer Balance", command=self.show_customer_balance)
+        billing_menu.add_separator()
+        billing_menu.add_command(label="Run Invoicing", command=self.run_invoicing)
+        billing_menu.add_command(label="Export Statements...", command=self.export_statements)
+        menubar.add_cascade(label="Billing", menu=billing_menu)
+        
+        returns_menu = Menu(menubar, tearoff=0)
+        returns_menu.add_command(label="Return Selected Rental", command=self.return_selected_rental)
+        returns_menu.add_command(label="Return to Maintenance", command=lambda: self.return_selected_rental('maintenance'))
+        returns_menu.add_separator()
+        returns_menu.add_command(label="Overdue Rentals", command=self.show_overdue_rentals)
+        returns_menu.add_command(label="Scan for Overdue Now", command=self.scan_overdue)
+        menubar.add_cascade(label="Returns", menu=returns_menu)
+        
+        maintenance_menu = Menu(menubar, tearoff=0)
+        maintenance_menu.add_command(label="Maintenance Schedule", command=self.show_maintenance_schedule)
+        maintenance_menu.add_command(label="Complete Service...", command=self.complete_unit_service)
+        maintenance_menu.add_command(label="Service Intervals...", command=self.edit_service_interval)
+        maintenance_menu.add_separator()
+        maintenance_menu.add_command(label="Re-plan All Units", command=self.replan_maintenance)
+        menubar.add_cascade(label="Maintenance", menu=maintenance_menu)
+        
+        account_menu = Menu(menubar, tearoff=0)
+        account_menu.add_command(label="Switch User...", command=self.switch_user)
+        account_menu.add_command(label="Change Password...", command=self.change_password)
+        account_menu.add_separator()
+        account_menu.add_command(label="Users", command=self.show_users)
+        account_menu.add_command(label="Add User...", command=self.add_user_account)
+        account_menu.add_command(label="Change User Role...", command=self.change_user_role)
+        account_menu.add_command(label="Reset User Password...", command=self.reset_user_password)
+        account_menu.add_command(label="Enable or Disable User...", command=self.toggle_user_account)
+        menubar.add_cascade(label="Account", menu=account_menu)
+        
+        self.root.config(menu=menubar)
+    
     def create_header(self):
         """Create responsive header"""
         header_frame = Frame(self.main_container, bg=self.colors['primary'], height=80)
@@ -379,6 +6037,13 @@ class ImprovedRentalInventory:
                           fg=self.colors['white'])
         title_label.pack(side=LEFT, pady=20)
         
+        self.session_label = Label(header_frame, text="",
+                                   font=('Segoe UI', 11),
+                                   bg=self.colors['primary'],
+                                   fg=self.colors['light'])
+        self.session_label.pack(side=LEFT, padx=20, pady=20)
+        self.update_session_label()
+        
         # Quick stats frame
         stats_frame = Frame(header_frame, bg=self.colors['primary'])
         stats_frame.pack(side=RIGHT, pady=20)
@@ -387,28 +6052,40 @@ class ImprovedRentalInventory:
     
     def create_quick_stats(self, parent):
         """Create quick statistics display"""
+        self.quick_stats = None
         try:
-            conn = sqlite3.connect(self.db_manager.db_name)
+            conn = self.db_manager.connect()
             cursor = conn.cursor()
             
-            cursor.execute('SELECT COUNT(*) FROM rentals')
+            # Hot rentals plus the rollups of archived ones
+            cursor.execute('SELECT (SELECT COUNT(*) FROM rentals) + (SELECT COALESCE(SUM(rentals), 0) FROM rental_rollups)')
             total_rentals = cursor.fetchone()[0]
             
-            cursor.execute('SELECT SUM(total) FROM rentals')
+            cursor.execute('SELECT (SELECT COALESCE(SUM(total), 0) FROM rentals) + (SELECT COALESCE(SUM(revenue), 0) FROM rental_rollups)')
             total_revenue = cursor.fetchone()[0] or 0
             
             conn.close()
+            overdue = self.return_scheduler.overdue_count()
             
             # Stats labels
-            Label(parent, text=f"Total Rentals: {total_rentals}", 
-                  font=('Segoe UI', 12, 'bold'), 
-                  bg=self.colors['primary'], 
-                  fg=self.colors['white']).pack(anchor=E)
+            self.total_rentals_label = Label(parent, text=f"Total Rentals: {total_rentals}", 
+                                             font=('Segoe UI', 12, 'bold'), 
+                                             bg=self.colors['primary'], 
+                                             fg=self.colors['white'])
+            self.total_rentals_label.pack(anchor=E)
             
-            Label(parent, text=f"Total Revenue: £{total_revenue:.2f}", 
-                  font=('Segoe UI', 12, 'bold'), 
-                  bg=self.colors['primary'], 
-                  fg=self.colors['white']).pack(anchor=E)
+            self.total_revenue_label = Label(parent, text=f"Total Revenue: £{total_revenue:.2f}", 
+                                             font=('Segoe UI', 12, 'bold'), 
+                                             bg=self.colors['primary'], 
+                                             fg=self.colors['white'])
+            self.total_revenue_label.pack(anchor=E)
+            
+            self.overdue_label = Label(parent, text=f"Overdue: {overdue}", 
+                                       font=('Segoe UI', 12, 'bold'), 
+                                       bg=self.colors['primary'], 
+                                       fg=self.colors['warning'] if overdue else self.colors['white'])
+            self.overdue_label.pack(anchor=E)
+            self.quick_stats = {'rentals': total_rentals, 'revenue': total_revenue, 'overdue': overdue}
         
         except Exception as e:
             Label(parent, text="Stats unavailable", 
@@ -540,7 +6217,7 @@ class ImprovedRentalInventory:
                                      font=('Segoe UI', 10))
         self.cboNoDays.grid(row=0, column=3, sticky="ew", padx=5, pady=5)
         self.cboNoDays.bind("<<ComboboxSelected>>", self.days_selected)
-        self.cboNoDays['values'] = ('Select', '1-30 days', '31-90 days', '91-270 days', '271-365 days')
+        self.cboNoDays['values'] = ['Select'] + self.pricing_engine.tariff.period_labels()
         self.cboNoDays.current(0)
         
         # Product Code
@@ -563,7 +6240,7 @@ class ImprovedRentalInventory:
         self.cboDiscount = ttk.Combobox(product_frame, textvariable=self.Discount, state='readonly', 
                                        font=('Segoe UI', 10))
         self.cboDiscount.grid(row=2, column=3, sticky="ew", padx=5, pady=5)
-        self.cboDiscount['values'] = ('Select', '0%', '5%', '10%', '15%', '20%')
+        self.cboDiscount['values'] = ['Select'] + [f"{t:g}%" for t in self.pricing_engine.tariff.discount_tiers]
         self.cboDiscount.current(0)
         
         # Payment Method
@@ -612,7 +6289,8 @@ class ImprovedRentalInventory:
         Label(billing_frame, text="Subtotal:", font=('Segoe UI', 10, 'bold')).grid(row=0, column=0, sticky="w", pady=2)
         Entry(billing_frame, textvariable=self.SubTotal, font=('Segoe UI', 10), state='readonly').grid(row=0, column=1, sticky="ew", padx=(10, 0), pady=2)
         
-        Label(billing_frame, text="Tax (15%):", font=('Segoe UI', 10, 'bold')).grid(row=1, column=0, sticky="w", pady=2)
+        self.tax_label = Label(billing_frame, text=f"Tax ({self.pricing_engine.tariff.tax_rate * 100:g}%):", font=('Segoe UI', 10, 'bold'))
+        self.tax_label.grid(row=1, column=0, sticky="w", pady=2)
         Entry(billing_frame, textvariable=self.Tax, font=('Segoe UI', 10), state='readonly').grid(row=1, column=1, sticky="ew", padx=(10, 0), pady=2)
         
         Label(billing_frame, text="Total:", font=('Segoe UI', 12, 'bold')).grid(row=2, column=0, sticky="w", pady=5)
@@ -669,12 +6347,81 @@ class ImprovedRentalInventory:
         
         Button(search_frame, text="Show All", font=('Segoe UI', 10, 'bold'),
                bg=self.colors['success'], fg=self.colors['white'],
-               command=self.load_all_rentals).grid(row=0, column=3, padx=5)
+               command=self.clear_history_filters).grid(row=0, column=3, padx=5)
         
         Button(search_frame, text="Export PDF", font=('Segoe UI', 10, 'bold'),
                bg=self.colors['danger'], fg=self.colors['white'],
                command=self.export_to_pdf).grid(row=0, column=4, padx=5)
         
+        Button(search_frame, text="Export CSV", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['warning'], fg=self.colors['white'],
+               command=self.export_history_csv).grid(row=0, column=5, padx=5)
+        
+        Button(search_frame, text="Load More", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['secondary'], fg=self.colors['white'],
+               command=self.load_more_rentals).grid(row=0, column=6, padx=5)
+
+        Button(search_frame, text="Batch Receipts", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['primary'], fg=self.colors['white'],
+               command=self.batch_receipts).grid(row=0, column=7, padx=5)
+        
+        # Facet filters
+        filter_frame = Frame(search_frame)
+        filter_frame.grid(row=1, column=0, columnspan=7, sticky="ew", pady=(10, 0))
+        
+        self.filter_use_dates = IntVar()
+        Checkbutton(filter_frame, text="From", variable=self.filter_use_dates,
+                    font=('Segoe UI', 9)).grid(row=0, column=0, sticky="w")
+        self.filter_start = DateEntry(filter_frame, width=11, date_pattern='yyyy-mm-dd')
+        self.filter_start.set_date(datetime.date.today() - datetime.timedelta(days=30))
+        self.filter_start.grid(row=0, column=1, padx=(0, 10))
+        Label(filter_frame, text="To", font=('Segoe UI', 9)).grid(row=0, column=2, sticky="w")
+        self.filter_end = DateEntry(filter_frame, width=11, date_pattern='yyyy-mm-dd')
+        self.filter_end.grid(row=0, column=3, padx=(5, 10))
+        
+        Label(filter_frame, text="Product", font=('Segoe UI', 9)).grid(row=0, column=4, sticky="w")
+        self.filter_product = ttk.Combobox(filter_frame, state='readonly', width=14,
+                                           postcommand=self.refresh_filter_choices)
+        self.filter_product.grid(row=0, column=5, padx=(5, 10))
+        
+        Label(filter_frame, text="Payment", font=('Segoe UI', 9)).grid(row=0, column=6, sticky="w")
+        self.filter_payment = ttk.Combobox(filter_frame, state='readonly', width=12)
+        self.filter_payment['values'] = ('All',) + tuple(self.cboPaymentM['values'][1:])
+        self.filter_payment.grid(row=0, column=7, padx=(5, 10))
+        
+        Label(filter_frame, text="Customer", font=('Segoe UI', 9)).grid(row=1, column=0, sticky="w", pady=(5, 0))
+        self.filter_customer = ttk.Combobox(filter_frame, state='readonly', width=24,
+                                            postcommand=self.refresh_filter_choices)
+        self.filter_customer.grid(row=1, column=1, columnspan=3, sticky="w", pady=(5, 0))
+        
+        Label(filter_frame, text="Total £", font=('Segoe UI', 9)).grid(row=1, column=4, sticky="w", pady=(5, 0))
+        total_frame = Frame(filter_frame)
+        total_frame.grid(row=1, column=5, sticky="w", padx=(5, 10), pady=(5, 0))
+        self.filter_min_total = StringVar()
+        self.filter_max_total = StringVar()
+        Entry(total_frame, textvariable=self.filter_min_total, width=6).pack(side=LEFT)
+        Label(total_frame, text="-").pack(side=LEFT)
+        Entry(total_frame, textvariable=self.filter_max_total, width=6).pack(side=LEFT)
+        
+        Label(filter_frame, text="On Hold", font=('Segoe UI', 9)).grid(row=1, column=6, sticky="w", pady=(5, 0))
+        self.filter_on_hold = ttk.Combobox(filter_frame, state='readonly', width=12,
+                                           values=('Any', 'Yes', 'No'))
+        self.filter_on_hold.grid(row=1, column=7, padx=(5, 10), pady=(5, 0))
+        
+        Button(filter_frame, text="Apply", font=('Segoe UI', 9, 'bold'),
+               bg=self.colors['accent'], fg=self.colors['white'],
+               command=self.search_rentals).grid(row=0, column=8, padx=5)
+        Button(filter_frame, text="Clear", font=('Segoe UI', 9, 'bold'),
+               bg=self.colors['secondary'], fg=self.colors['white'],
+               command=self.clear_history_filters).grid(row=1, column=8, padx=5, pady=(5, 0))
+        self.clear_history_filters(reload=False)
+        
+        self.history_status = Label(search_frame, text="", font=('Segoe UI', 9))
+        self.history_status.grid(row=2, column=0, columnspan=7, sticky="w", pady=(5, 0))
+        self.facet_label = Label(search_frame, text="", font=('Segoe UI', 9), fg=self.colors['secondary'],
+                                 justify=LEFT, anchor="w")
+        self.facet_label.grid(row=3, column=0, columnspan=7, sticky="w")
+        
         # History treeview
         tree_frame = Frame(history_main)
         tree_frame.pack(fill=BOTH, expand=True)
@@ -689,6 +6436,7 @@ class ImprovedRentalInventory:
         for col in columns:
             self.history_tree.heading(col, text=col, command=lambda c=col: self.sort_treeview(c))
             self.history_tree.column(col, width=column_widths.get(col, 100), anchor='center')
+        self.history_tree.heading('Date', text='Date ▼')
         
         # Scrollbars
         v_scrollbar = ttk.Scrollbar(tree_frame, orient=VERTICAL, command=self.history_tree.yview)
@@ -728,10 +6476,30 @@ class ImprovedRentalInventory:
                bg=self.colors['warning'], fg=self.colors['white'],
                command=self.show_customer_stats).pack(side=LEFT, padx=(0, 10))
         
+        Button(control_frame, text="Fleet Utilization", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['primary'], fg=self.colors['white'],
+               command=self.show_fleet_utilization).pack(side=LEFT, padx=(0, 10))
+        
+        Button(control_frame, text="Demand Forecast", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['danger'], fg=self.colors['white'],
+               command=self.show_demand_forecast).pack(side=LEFT, padx=(0, 10))
+        
+        Button(control_frame, text="Customer Cohorts", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['accent'], fg=self.colors['white'],
+               command=self.show_customer_cohorts).pack(side=LEFT, padx=(0, 10))
+        
         Button(control_frame, text="Refresh Charts", font=('Segoe UI', 10, 'bold'),
                bg=self.colors['secondary'], fg=self.colors['white'],
                command=self.refresh_charts).pack(side=RIGHT)
         
+        Button(control_frame, text="Export Customer Tables", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['success'], fg=self.colors['white'],
+               command=self.export_customer_analytics).pack(side=RIGHT, padx=(0, 10))
+        
+        Button(control_frame, text="Board Pack...", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['primary'], fg=self.colors['white'],
+               command=self.generate_board_pack).pack(side=RIGHT, padx=(0, 10))
+        
         # Chart area
         chart_frame = Frame(analytics_main, bg=self.colors['white'], relief='raised', bd=2)
         chart_frame.pack(fill=BOTH, expand=True)
@@ -782,6 +6550,10 @@ class ImprovedRentalInventory:
                bg=self.colors['accent'], fg=self.colors['white'],
                command=self.update_customer).pack(side=LEFT, padx=(0, 10))
         
+        Button(button_frame, text="History", font=('Segoe UI', 11, 'bold'),
+               bg=self.colors['secondary'], fg=self.colors['white'],
+               command=self.show_customer_history).pack(side=LEFT, padx=(0, 10))
+        
         Button(button_frame, text="Clear Form", font=('Segoe UI', 11, 'bold'),
                bg=self.colors['warning'], fg=self.colors['white'],
                command=self.clear_customer_form).pack(side=LEFT)
@@ -790,6 +6562,21 @@ class ImprovedRentalInventory:
         list_frame = ttk.LabelFrame(customer_main, text="Customer Directory", padding=15)
         list_frame.pack(fill=BOTH, expand=True)
         
+        # Customer search: a name prefix, or an exact phone number or email
+        cust_search_frame = Frame(list_frame)
+        cust_search_frame.pack(fill=X, pady=(0, 10))
+        cust_search_frame.grid_columnconfigure(1, weight=1)
+        
+        Label(cust_search_frame, text="Search:", font=('Segoe UI', 10, 'bold')).grid(row=0, column=0, sticky="w", padx=(0, 10))
+        
+        cust_search_entry = Entry(cust_search_frame, textvariable=self.customer_search, font=('Segoe UI', 10))
+        cust_search_entry.grid(row=0, column=1, sticky="ew", padx=(0, 10))
+        cust_search_entry.bind('<KeyRelease>', lambda e: self.search_customers_tree())
+        
+        Button(cust_search_frame, text="Show All", font=('Segoe UI', 10, 'bold'),
+               bg=self.colors['success'], fg=self.colors['white'],
+               command=self.show_all_customers).grid(row=0, column=2, padx=5)
+        
         # Customer treeview
         cust_tree_frame = Frame(list_frame)
         cust_tree_frame.pack(fill=BOTH, expand=True)
@@ -871,7 +6658,23 @@ class ImprovedRentalInventory:
 
         Button(button_frame, text="Clear Form", font=('Segoe UI', 11, 'bold'),
                bg=self.colors['warning'], fg=self.colors['white'],
-               command=self.clear_product_form).pack(side=LEFT)
+               command=self.clear_product_form).pack(side=LEFT, padx=(0, 10))
+
+        Button(button_frame, text="Reprice Open Rentals", font=('Segoe UI', 11, 'bold'),
+               bg=self.colors['secondary'], fg=self.colors['white'],
+               command=self.reprice_open_rentals).pack(side=LEFT, padx=(0, 10))
+        
+        Button(button_frame, text="Units", font=('Segoe UI', 11, 'bold'),
+               bg=self.colors['accent'], fg=self.colors['white'],
+               command=self.show_product_units).pack(side=LEFT, padx=(0, 10))
+        
+        Button(button_frame, text="Change Unit State...", font=('Segoe UI', 11, 'bold'),
+               bg=self.colors['primary'], fg=self.colors['white'],
+               command=self.change_unit_state).pack(side=LEFT, padx=(0, 10))
+        
+        Button(button_frame, text="History", font=('Segoe UI', 11, 'bold'),
+               bg=self.colors['secondary'], fg=self.colors['white'],
+               command=self.show_product_history).pack(side=LEFT)
         
         # Product list
         list_frame = ttk.LabelFrame(product_main, text="Product Inventory", padding=15)
@@ -924,17 +6727,11 @@ class ImprovedRentalInventory:
             customers = self.db_manager.get_all_customers()
             customer_list = ["Select Customer"]
             self.customer_dict = {}
+            self.customer_display = {}
             
             for customer in customers:
-                display_name = f"{customer[1]} (ID: {customer[0]})"
+                display_name = self.add_customer_choice(customer)
                 customer_list.append(display_name)
-                self.customer_dict[display_name] = {
-                    'id': customer[0],
-                    'name': customer[1],
-                    'phone': customer[2] or '',
-                    'email': customer[3] or '',
-                    'address': customer[4] or ''
-                }
             
             self.customer_combo['values'] = customer_list
             self.customer_combo.current(0)
@@ -942,6 +6739,19 @@ class ImprovedRentalInventory:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load customers: {str(e)}")
     
+    def add_customer_choice(self, customer):
+        """Register a customer row under its combobox display name"""
+        display_name = f"{customer[1]} (ID: {customer[0]})"
+        self.customer_display[customer[0]] = display_name
+        self.customer_dict[display_name] = {
+            'id': customer[0],
+            'name': customer[1],
+            'phone': customer[2] or '',
+            'email': customer[3] or '',
+            'address': customer[4] or ''
+        }
+        return display_name
+    
     def customer_selected(self, event):
         """Handle customer selection"""
         selected = self.customer_combo.get()
@@ -961,10 +6771,8 @@ class ImprovedRentalInventory:
     def load_product_types_for_rental(self):
         """Load available product types into the rental tab combobox."""
         try:
-            products = self.db_manager.get_all_products()
-            product_types = sorted(list(set([p[1] for p in products if p[4] > 0 and p[5] == 'Available']))) # Only available products
-            
-            self.cboProdType['values'] = ['Select'] + product_types
+            # Only types with available products
+            self.cboProdType['values'] = ['Select'] + self.db_manager.product_catalog.available_types()
             self.cboProdType.current(0)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load product types: {str(e)}")
@@ -973,16 +6781,12 @@ class ImprovedRentalInventory:
         """Handle product type selection with improved logic"""
         product_type = self.cboProdType.get()
         
-        # Fetch product details from DB based on selected type
-        conn = sqlite3.connect(self.db_manager.db_name)
-        cursor = conn.cursor()
-        cursor.execute('SELECT product_code, cost_per_day FROM products WHERE product_type = ? AND available_quantity > 0 AND status = "Available" LIMIT 1', (product_type,))
-        product_info = cursor.fetchone()
-        conn.close()
+        # First available unit of the type, from the in-memory catalog
+        product_info = self.db_manager.product_catalog.first_available(product_type)
 
         if product_info:
-            self.ProdCode.set(product_info[0])
-            self.CostPDay.set(f"£{product_info[1]:.2f}")
+            self.ProdCode.set(product_info[2])
+            self.CostPDay.set(f"£{product_info[3]:.2f}")
             
             # Set reasonable defaults
             self.CreCheck.set("No")
@@ -999,29 +6803,23 @@ class ImprovedRentalInventory:
     def days_selected(self, event):
         """Handle rental period selection"""
         period = self.cboNoDays.get()
+        band = self.pricing_engine.tariff.period_for_label(period)
         
-        period_configs = {
-            "1-30 days": {"days": 30, "limit": "£150", "discount": "5%"},
-            "31-90 days": {"days": 90, "limit": "£200", "discount": "10%"},
-            "91-270 days": {"days": 270, "limit": "£250", "discount": "15%"},
-            "271-365 days": {"days": 365, "limit": "£300", "discount": "20%"}
-        }
-        
-        if period in period_configs:
-            config = period_configs[period]
+        if band:
+            label, days, limit, discount = band
             
             # Set dates
             today = datetime.date.today()
-            end_date = today + datetime.timedelta(days=config["days"])
+            end_date = today + datetime.timedelta(days=days)
             
             self.AppDate.set(str(today))
             self.NextCreditReview.set(str(end_date))
-            self.LastCreditReview.set(str(config["days"]))
+            self.LastCreditReview.set(str(days))
             self.DateRev.set(str(end_date))
             
             # Set credit and discount
-            self.CreLimit.set(config["limit"])
-            self.Discount.set(config["discount"])
+            self.CreLimit.set(limit)
+            self.Discount.set(f"{discount:g}%")
             self.AcctOpen.set("Yes")
             
             # Auto-calculate total if product is selected
@@ -1060,20 +6858,17 @@ class ImprovedRentalInventory:
             days = int(self.LastCreditReview.get())
             rate = float(self.CostPDay.get().replace('£', ''))
             
-            # Calculate base price
-            base_price = days * rate
-            
             # Apply discount
             discount_str = self.Discount.get().replace('%', '')
-            discount_rate = 0
-            if discount_str and discount_str != 'Select' and discount_str.isdigit():
-                discount_rate = float(discount_str) / 100
-            
-            discounted_price = base_price * (1 - discount_rate)
+            discount_pct = 0
+            if discount_str and discount_str != 'Select':
+                discount_pct = float(discount_str)
             
-            # Calculate tax and total
-            tax_amount = discounted_price * 0.15
-            total_amount = discounted_price + tax_amount
+            # Price through the tariff engine and pricing rules
+            customer_id = self.customer_dict[self.customer_combo.get()]['id']
+            discounted_price, tax_amount, total_amount = self.pricing_engine.quote(
+                days, rate, discount_pct, self.ProdType.get(), customer_id=customer_id,
+                on_date=self.AppDate.get() or None)
             
             # Set values
             self.SubTotal.set(f"£{discounted_price:.2f}")
@@ -1104,43 +6899,22 @@ class ImprovedRentalInventory:
             
             # Clear and generate receipt
             self.txtReceipt.delete("1.0", END)
-            
-            receipt_text = f"""
-═══════════════════════════════════════════════
-           RENTAL INVOICE
-═══════════════════════════════════════════════
-
-Receipt Ref:     {receipt_ref}
-Date:           {datetime.date.today()}
-Customer:       {customer_info}
-
-─────────────────────────────────────────────────
-RENTAL DETAILS:
-─────────────────────────────────────────────────
-Product:        {self.ProdType.get()}
-Product Code:   {self.ProdCode.get()}
-Rental Period:  {self.NoDays.get()}
-Daily Rate:     {self.CostPDay.get()}
-Total Days:     {self.LastCreditReview.get()}
-
-Payment Method: {self.PaymentM.get()}
-Discount:       {self.Discount.get()}
-
-─────────────────────────────────────────────────
-BILLING SUMMARY:
-─────────────────────────────────────────────────
-Subtotal:       £{subtotal:.2f}
-Tax (15%):      £{tax:.2f}
-─────────────────────────────────────────────────
-TOTAL:          £{total:.2f}
-═══════════════════════════════════════════════
-
-Thank you for choosing our rental service!
-Contact us: info@rentalservice.com
-Phone: (555) 123-4567
-
-═══════════════════════════════════════════════
-"""
+            receipt_text = self.receipt_renderer.render_text({
+                'receipt_ref': receipt_ref,
+                'date': datetime.date.today(),
+                'customer': customer_info,
+                'product_type': self.ProdType.get(),
+                'product_code': self.ProdCode.get(),
+                'no_days': self.NoDays.get(),
+                'cost_per_day': self.CostPDay.get(),
+                'days': self.LastCreditReview.get(),
+                'payment_method': self.PaymentM.get(),
+                'discount': self.Discount.get(),
+                'subtotal': subtotal,
+                'tax_label': ReceiptRenderer.tax_label(self.pricing_engine.tariff.tax_rate),
+                'tax': tax,
+                'total': total,
+            })
             
             self.txtReceipt.insert("1.0", receipt_text)
             
@@ -1197,13 +6971,10 @@ Phone: (555) 123-4567
                 float(self.Total.get().replace('£', '')) if self.Total.get() else 0
             )
             
-            self.db_manager.save_rental(rental_data)
+            rental_id = self.db_manager.save_rental(rental_data)
+            self.pricing_engine.rules.note_rental(customer_id, rental_id)
             messagebox.showinfo("Success", f"Rental {self.Receipt_Ref.get()} saved successfully!")
             
-            # Refresh displays
-            self.load_all_rentals()
-            self.refresh_quick_stats()
-            
             # Ask if user wants to reset form
             if messagebox.askyesno("Continue", "Would you like to create another rental?"):
                 self.reset_form()
@@ -1268,97 +7039,188 @@ Phone: (555) 123-4567
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save receipt: {str(e)}")
     
+    def batch_receipts(self):
+        """Render receipts for the filter panel's date range and customer to a PDF or zip"""
+        try:
+            filters = self.collect_history_filters()
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".pdf",
+                filetypes=[("PDF file", "*.pdf"), ("Zip of PDFs", "*.zip")],
+                title="Save Batch Receipts"
+            )
+
+            if not filename:
+                return
+
+            customer_ids = [filters['customer_id']] if 'customer_id' in filters else None
+            self.root.config(cursor="watch")
+            self.root.update_idletasks()
+            stats = self.receipt_renderer.batch(filename, filters.get('start_date'), filters.get('end_date'),
+                                                customer_ids, self.pricing_engine.tariff.tax_rate)
+            messagebox.showinfo("Success", f"{stats['receipts']} receipts written to {filename}\n"
+                                           f"{stats['seconds']:.1f} s ({stats['receipts_per_sec']:.0f} receipts/s)")
+
+        except Exception as e:
+            messagebox.showerror("Error", f"Batch receipts failed: {str(e)}")
+        finally:
+            self.root.config(cursor="")
+
     # Database and display methods
     def load_all_rentals(self):
-        """Load all rentals with customer names"""
+        """Load the first page of all rentals with customer names"""
+        self.history_filters = {}
+        self.load_history_page(reset=True)
+    
+    def clear_history_filters(self, reload=True):
+        """Reset the search box and facet filter widgets, then list every rental"""
+        self.search_var.set('')
+        self.filter_use_dates.set(0)
+        self.filter_product.set('All')
+        self.filter_payment.set('All')
+        self.filter_customer.set('All Customers')
+        self.filter_min_total.set('')
+        self.filter_max_total.set('')
+        self.filter_on_hold.set('Any')
+        if reload:
+            self.load_all_rentals()
+    
+    def refresh_filter_choices(self):
+        """Fill the product and customer filter lists when they are opened"""
         try:
-            for item in self.history_tree.get_children():
-                self.history_tree.delete(item)
-            
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            
-            # Join with customers table to get names
-            cursor.execute('''
-                SELECT r.rental_id, r.receipt_ref, c.customer_name, r.product_type,
-                       r.no_days, r.total, r.created_date
-                FROM rentals r
-                LEFT JOIN customers c ON r.customer_id = c.customer_id
-                ORDER BY r.created_date DESC
-            ''')
+            self.filter_product['values'] = ['All'] + self.db_manager.get_rental_product_types()
+            self.filter_customer['values'] = ['All Customers'] + list(self.customer_dict)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load filter choices: {str(e)}")
+    
+    def collect_history_filters(self):
+        """Read the search box and facet widgets into a filter dict"""
+        filters = {'search': self.search_var.get().strip()}
+        if self.filter_use_dates.get():
+            filters['start_date'] = self.filter_start.get_date()
+            filters['end_date'] = self.filter_end.get_date()
+        if self.filter_product.get() not in ('', 'All'):
+            filters['product_type'] = self.filter_product.get()
+        if self.filter_payment.get() not in ('', 'All'):
+            filters['payment_method'] = self.filter_payment.get()
+        if self.filter_customer.get() in self.customer_dict:
+            filters['customer_id'] = self.customer_dict[self.filter_customer.get()]['id']
+        if self.filter_min_total.get().strip():
+            filters['min_total'] = float(self.filter_min_total.get().replace('£', ''))
+        if self.filter_max_total.get().strip():
+            filters['max_total'] = float(self.filter_max_total.get().replace('£', ''))
+        if self.filter_on_hold.get() in ('Yes', 'No'):
+            filters['on_hold'] = self.filter_on_hold.get() == 'Yes'
+        return filters
+    
+    def load_more_rentals(self):
+        """Append the next page of the current history listing"""
+        if self.history_has_more:
+            self.load_history_page(reset=False)
+    
+    def load_history_page(self, reset=True):
+        """Fetch a page of rentals in the current sort order and show it"""
+        try:
+            if reset:
+                for item in self.history_tree.get_children():
+                    self.history_tree.delete(item)
+                self.history_offset = 0
+                self.history_after = None
             
-            rentals = cursor.fetchall()
-            conn.close()
+            column, descending = self.history_sort
+            rentals = self.db_manager.get_rental_page(self.history_filters, column, descending,
+                                                      HISTORY_PAGE_SIZE, self.history_after)
+            self.history_offset += len(rentals)
+            if rentals:
+                self.history_after = (rentals[-1][7], rentals[-1][0])
+            self.history_has_more = len(rentals) == HISTORY_PAGE_SIZE
             
             for rental in rentals:
-                self.history_tree.insert('', 'end', values=(
-                    rental[0],  # rental_id
-                    rental[1],  # receipt_ref
-                    rental[2] or 'Unknown',  # customer_name
-                    rental[3],  # product_type
-                    rental[4],  # no_days
-                    f"£{rental[5]:.2f}" if rental[5] else "£0.00",  # total
-                    rental[6][:16] if rental[6] else ""  # created_date
-                ))
+                self.insert_history_row(rental, 'end')
+            
+            if reset:
+                self.facets = self.db_manager.get_rental_facets(self.history_filters)
+                self.facet_label.config(text=self.format_facets(self.facets))
+            self.update_history_status()
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load rental history: {str(e)}")
     
+    def insert_history_row(self, rental, index):
+        """Show one get_rental_page row in the history tree"""
+        self.history_tree.insert('', index, values=(
+            rental[0],  # rental_id
+            rental[1],  # receipt_ref
+            rental[2] or 'Unknown',  # customer_name
+            rental[3],  # product_type
+            rental[4],  # no_days
+            f"£{rental[5]:.2f}" if rental[5] else "£0.00",  # total
+            rental[6][:16] if rental[6] else ""  # created_date
+        ))
+    
+    def update_history_status(self):
+        """Show how much of the filtered history is loaded"""
+        more = " (Load More for the next page)" if self.history_has_more else ""
+        self.history_status.config(
+            text=f"Showing {self.history_offset} of {self.facets['rentals']} rentals"
+                 f" (£{self.facets['revenue']:,.2f}){more}")
+    
+    def format_facets(self, facets):
+        """Render facet counts as one line per facet"""
+        lines = []
+        for title, key in (('Product', 'product_type'), ('Payment', 'payment_method')):
+            counts = sorted(facets[key].items(), key=lambda item: item[1], reverse=True)
+            lines.append(f"{title}: " + ", ".join(f"{value} ({count})" for value, count in counts))
+        lines.append(f"On hold: {facets['on_hold'].get(True, 0)}, not on hold: {facets['on_hold'].get(False, 0)}")
+        return "\n".join(lines)
+    
     def search_rentals(self):
-        """Enhanced search functionality"""
-        search_term = self.search_var.get().strip()
-        
+        """Apply the search text and facet filters"""
+        try:
+            self.history_filters = self.collect_history_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Total range must be numeric")
+            return
+        self.load_history_page(reset=True)
+    
+    def get_history_export_rows(self):
+        """All rows for the current filters and sort, using the same query as the listing"""
+        column, descending = self.history_sort
+        return self.db_manager.get_rental_page(self.history_filters, column, descending, limit=None)
+    
+    def export_history_csv(self):
+        """Export the filtered rental history to CSV"""
         try:
-            for item in self.history_tree.get_children():
-                self.history_tree.delete(item)
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".csv",
+                filetypes=[("CSV files", "*.csv")],
+                title="Export Rental History"
+            )
             
-            if not search_term:
-                self.load_all_rentals()
+            if not filename:
                 return
             
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT r.rental_id, r.receipt_ref, c.customer_name, r.product_type,
-                       r.no_days, r.total, r.created_date
-                FROM rentals r
-                LEFT JOIN customers c ON r.customer_id = c.customer_id
-                WHERE r.receipt_ref LIKE ? OR r.product_type LIKE ? OR c.customer_name LIKE ?
-                ORDER BY r.created_date DESC
-            ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
-            
-            rentals = cursor.fetchall()
-            conn.close()
+            rows = self.get_history_export_rows()
+            table = pd.DataFrame([row[:7] for row in rows], columns=['rental_id', 'receipt_ref', 'customer',
+                                                                     'product_type', 'no_days', 'total', 'created_date'])
+            table.to_csv(filename, index=False)
+            messagebox.showinfo("Success", f"{len(rows)} rentals exported to {filename}")
             
-            for rental in rentals:
-                self.history_tree.insert('', 'end', values=(
-                    rental[0],  # rental_id
-                    rental[1],  # receipt_ref
-                    rental[2] or 'Unknown',  # customer_name
-                    rental[3],  # product_type
-                    rental[4],  # no_days
-                    f"£{rental[5]:.2f}" if rental[5] else "£0.00",  # total
-                    rental[6][:16] if rental[6] else ""  # created_date
-                ))
-                
         except Exception as e:
-            messagebox.showerror("Error", f"Search failed: {str(e)}")
+            messagebox.showerror("Error", f"CSV export failed: {str(e)}")
     
     def sort_treeview(self, column):
-        """Sort treeview by column"""
-        try:
-            data = [(self.history_tree.set(child, column), child) for child in self.history_tree.get_children('')]
-            
-            # Sort data
-            data.sort(reverse=False)
-            
-            # Rearrange items
-            for index, (val, child) in enumerate(data):
-                self.history_tree.move(child, '', index)
-                
-        except Exception as e:
-            pass  # Silently handle sort errors
+        """Sort history by column in the database, toggling direction on repeat clicks"""
+        current, descending = self.history_sort
+        self.history_sort = (column, not descending if column == current else False)
+        
+        # Show the active sort direction on the headings
+        for col in HISTORY_SORT_COLUMNS:
+            arrow = ''
+            if col == column:
+                arrow = ' ▼' if self.history_sort[1] else ' ▲'
+            self.history_tree.heading(col, text=col + arrow)
+        
+        self.load_history_page(reset=True)
     
     def export_to_pdf(self):
         """Enhanced PDF export"""
@@ -1401,14 +7263,17 @@ Phone: (555) 123-4567
             c.setFont("Helvetica", 9)
             y_pos -= 20
             
-            # Get data from treeview
-            for child in self.history_tree.get_children():
+            # Same filtered query as the history listing, without paging
+            rentals = self.get_history_export_rows()
+            for rental in rentals:
                 if y_pos < 50:  # New page
                     c.showPage()
                     y_pos = height - 50
                 
-                values = self.history_tree.item(child)['values']
-                for i, value in enumerate(values[1:]):  # Skip ID
+                values = (rental[1], rental[2] or 'Unknown', rental[3], rental[4],
+                          f"£{rental[5]:.2f}" if rental[5] else "£0.00",
+                          rental[6][:16] if rental[6] else "")
+                for i, value in enumerate(values):
                     if i < len(x_positions):
                         c.drawString(x_positions[i], y_pos, str(value)[:20])  # Truncate long text
                 
@@ -1420,7 +7285,7 @@ Phone: (555) 123-4567
                 y_pos = height - 50
             
             c.setFont("Helvetica-Bold", 12)
-            c.drawString(50, y_pos - 30, f"Total Records: {len(self.history_tree.get_children())}")
+            c.drawString(50, y_pos - 30, f"Total Records: {len(rentals)}")
             
             c.save()
             messagebox.showinfo("Success", f"Report exported successfully to {filename}")
@@ -1428,308 +7293,627 @@ Phone: (555) 123-4567
         except ImportError:
             messagebox.showerror("Error", "ReportLab library not installed. Please install it to export PDF.")
         except Exception as e:
-            messagebox.showerror("Error", f"PDF export failed: {str(e)}")
+            messagebox.showerror("Error", f"PDF export failed: {str(e)}")
+    
+    # Analytics methods
+    def show_product_distribution(self):
+        """Show enhanced product distribution chart"""
+        try:
+            self.fig.clear()
+            draw_product_distribution(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate analytics: {str(e)}")
+    
+    def show_monthly_revenue(self):
+        """Show monthly revenue trends"""
+        try:
+            self.fig.clear()
+            draw_monthly_revenue(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate monthly report: {str(e)}")
+    
+    def show_customer_stats(self):
+        """Show comprehensive customer statistics"""
+        try:
+            self.fig.clear()
+            draw_customer_stats(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate customer statistics: {str(e)}")
+    
+    def show_fleet_utilization(self):
+        """Show utilization, revenue per unit-day and concurrency per product type"""
+        try:
+            self.fig.clear()
+            draw_fleet_utilization(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate utilization report: {str(e)}")
+    
+    def show_demand_forecast(self):
+        """Show next 90 days demand forecast and stock recommendations"""
+        try:
+            self.fig.clear()
+            draw_demand_forecast(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate demand forecast: {str(e)}")
+    
+    def generate_board_pack(self):
+        """Render every dashboard and per-product variant into a folder"""
+        out_dir = filedialog.askdirectory(title="Board Pack Folder")
+        if not out_dir:
+            return
+        
+        try:
+            self.root.config(cursor='watch')
+            self.root.update_idletasks()
+            stats = self.report_runner.run(out_dir)
+            messagebox.showinfo("Board Pack",
+                                f"Rendered {stats['reports']} reports in {stats['seconds']:.1f} s\n\n"
+                                f"Combined report: {stats['combined']}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate board pack: {str(e)}")
+        finally:
+            self.root.config(cursor='')
+    
+    def show_customer_cohorts(self):
+        """Show cohort retention, RFM segments and lifetime value"""
+        try:
+            self.fig.clear()
+            draw_customer_cohorts(self.fig, self.report_sources)
+            self.canvas.draw()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to generate customer cohorts: {str(e)}")
+    
+    def export_customer_analytics(self):
+        """Export RFM/LTV and cohort tables to CSV"""
+        try:
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".csv",
+                filetypes=[("CSV files", "*.csv")],
+                title="Export Customer Analytics"
+            )
+            
+            if not filename:
+                return
+            
+            rfm_file, cohort_file = self.customer_analytics.export_tables(filename)
+            messagebox.showinfo("Success", f"Customer analytics exported to:\n{rfm_file}\n{cohort_file}")
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Customer analytics export failed: {str(e)}")
+    
+    # Background thread hand-off
+    def call_on_ui(self, callback):
+        """Run callback on the Tk thread; safe to call from any thread"""
+        self.ui_queue.put(callback)
+    
+    def poll_ui_queue(self):
+        """Run callbacks queued by background threads; the next poll is booked first so a failing callback cannot stop it"""
+        self.root.after(UI_POLL_MS, self.poll_ui_queue)
+        while True:
+            try:
+                callback = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+    
+    # Change event handlers
+    def subscribe_to_changes(self):
+        """Deliver data-layer change events on the Tk thread, coalesced per row"""
+        events = self.db_manager.events
+        # Timer threads (overdue scans, maintenance windows) publish too, so
+        # delivery goes through the queue rather than calling Tk from them
+        events.set_scheduler(self.call_on_ui)
+        events.subscribe(RentalCreated, self.on_rental_created)
+        events.subscribe(RentalOverdue, self.on_overdue_changed)
+        events.subscribe(RentalReturned, self.on_overdue_changed)
+        for event_type in (ProductAdded, ProductUpdated, ProductDeleted):
+            events.subscribe(event_type, self.on_product_changed)
+        for event_type in (CustomerAdded, CustomerUpdated):
+            events.subscribe(event_type, self.on_customer_changed)
+        events.subscribe(TableReloaded, self.on_table_reloaded)
+    
+    @staticmethod
+    def sorted_tree_index(tree, key, key_of):
+        """Binary search for where key belongs among a sorted tree's rows"""
+        children = tree.get_children()
+        lo, hi = 0, len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key_of(tree.item(children[mid], 'values')) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def on_rental_created(self, event):
+        """Count a new rental in the header and history facets, and show it if it is in the loaded window"""
+        try:
+            fields = event.fields
+            if self.quick_stats:
+                self.quick_stats['rentals'] += 1
+                self.quick_stats['revenue'] += fields.get('total') or 0
+                self.total_rentals_label.config(text=f"Total Rentals: {self.quick_stats['rentals']}")
+                self.total_revenue_label.config(text=f"Total Revenue: £{self.quick_stats['revenue']:.2f}")
+            
+            # One indexed lookup tells whether the rental passes the current filters
+            rows = self.db_manager.get_rental_page({**self.history_filters, 'rental_id': event.entity_id}, limit=1)
+            if not rows:
+                return
+            
+            for facet, value in (('product_type', fields.get('product_type') or 'Unknown'),
+                                 ('payment_method', fields.get('payment_method') or 'Unknown'),
+                                 ('on_hold', bool(fields.get('account_on_hold')))):
+                self.facets[facet][value] = self.facets[facet].get(value, 0) + 1
+            self.facets['rentals'] += 1
+            self.facets['revenue'] += fields.get('total') or 0
+            self.facet_label.config(text=self.format_facets(self.facets))
+            
+            # The newest rental sorts first by date or id descending and last
+            # ascending; other orders only reload the first page
+            column, descending = self.history_sort
+            if column not in ('Date', 'ID'):
+                self.load_history_page(reset=True)
+                return
+            if descending:
+                self.insert_history_row(rows[0], 0)
+                self.history_offset += 1
+            elif not self.history_has_more:
+                self.insert_history_row(rows[0], 'end')
+                self.history_offset += 1
+                self.history_after = (rows[0][7], rows[0][0])
+            self.update_history_status()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to show new rental: {str(e)}")
+    
+    def on_overdue_changed(self, event):
+        """Keep the header's overdue count in step with scans and returns"""
+        if not self.quick_stats:
+            return
+        if isinstance(event, RentalOverdue):
+            self.quick_stats['overdue'] += 1
+        elif event.fields.get('was_overdue'):
+            self.quick_stats['overdue'] -= 1
+        overdue = self.quick_stats['overdue']
+        self.overdue_label.config(text=f"Overdue: {overdue}",
+                                  fg=self.colors['warning'] if overdue else self.colors['white'])
+    
+    def on_product_changed(self, event):
+        """Apply one product change to the product tree and the rental product types"""
+        try:
+            iid = str(event.entity_id)
+            product = None if isinstance(event, ProductDeleted) else self.db_manager.get_product(event.entity_id)
+            if self.product_tree.exists(iid):
+                self.product_tree.delete(iid)
+            if product:
+                index = self.sorted_tree_index(self.product_tree, (product[1], str(product[2])),
+                                               lambda values: (str(values[1]), str(values[2])))
+                self.insert_product_row(product, index)
+            
+            product_types = ('Select',) + tuple(self.db_manager.product_catalog.available_types())
+            if tuple(self.cboProdType['values']) != product_types:
+                selected = self.cboProdType.get()
+                self.cboProdType['values'] = product_types
+                if selected not in product_types:
+                    self.cboProdType.current(0)
+                    
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to update products: {str(e)}")
+    
+    def on_customer_changed(self, event):
+        """Apply one added or edited customer to the directory and the rental customer list"""
+        try:
+            customer = self.db_manager.get_customer(event.entity_id)
+            if customer is None:
+                return
+            
+            iid = str(customer[0])
+            if self.customer_tree.exists(iid):
+                self.customer_tree.delete(iid)
+            index = self.sorted_tree_index(self.customer_tree, customer[1], lambda values: str(values[1]))
+            self.insert_customer_row(customer, index)
+            
+            old_name = self.customer_display.pop(customer[0], None)
+            self.customer_dict.pop(old_name, None)
+            display_name = self.add_customer_choice(customer)
+            choices = [choice for choice in self.customer_combo['values'] if choice != old_name]
+            position = bisect.bisect_right(choices, customer[1], lo=1,
+                                           key=lambda choice: self.customer_dict[choice]['name'])
+            choices.insert(position, display_name)
+            selected = self.customer_combo.get()
+            self.customer_combo['values'] = choices
+            if old_name and selected == old_name:
+                self.customer_combo.set(display_name)
+                self.customer_selected(None)
+                
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to update customers: {str(e)}")
+    
+    def on_table_reloaded(self, event):
+        """Too many changes to one table at once: reload its views in one pass"""
+        if event.entity_id == 'rentals':
+            self.load_history_page(reset=True)
+            self.refresh_quick_stats()
+        elif event.entity_id == 'products':
+            self.load_products_tree()
+            self.load_product_types_for_rental()
+        elif event.entity_id == 'customers':
+            self.load_customers()
+            self.load_customers_tree()
+    
+    # Branch sync methods
+    def reload_all_views(self):
+        """Reload every view after bulk changes arrive from elsewhere"""
+        self.db_manager.product_catalog.invalidate()
+        self.load_customers()
+        self.load_customers_tree()
+        self.load_products_tree()
+        self.load_product_types_for_rental()
+        self.clear_history_filters()
+        self.refresh_quick_stats()
+    
+    def export_sync_changes(self):
+        """Export local changes to a delta file for another branch"""
+        try:
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".rsync.gz",
+                filetypes=[("Sync delta files", "*.rsync.gz"), ("All files", "*.*")],
+                title="Export Changes"
+            )
+            
+            if filename:
+                count = self.sync_engine.export_changes(filename)
+                messagebox.showinfo("Success", f"{count} changes exported to {filename}")
+                
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export changes: {str(e)}")
+    
+    def import_sync_changes(self):
+        """Apply a delta file exported by another branch"""
+        try:
+            filename = filedialog.askopenfilename(
+                filetypes=[("Sync delta files", "*.rsync.gz"), ("All files", "*.*")],
+                title="Import Changes"
+            )
+            
+            if filename:
+                applied, skipped = self.sync_engine.import_changes(filename)
+                self.reload_all_views()
+                messagebox.showinfo("Success", f"{applied} changes applied, {skipped} older changes skipped")
+                
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to import changes: {str(e)}")
+    
+    def sync_with_branch(self):
+        """Run a two-way sync with a branch accepting connections"""
+        address = simpledialog.askstring("Sync with Branch", "Branch address (host:port):",
+                                         initialvalue=f"127.0.0.1:{SYNC_PORT}")
+        if not address:
+            return
+        
+        try:
+            host, _, port = address.rpartition(':')
+            sent, applied, skipped = self.sync_engine.sync_with(host or '127.0.0.1', int(port))
+            self.reload_all_views()
+            messagebox.showinfo("Success", f"Sent {sent} changes, applied {applied}, skipped {skipped}")
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Branch sync failed: {str(e)}")
+    
+    def serve_branch_sync(self):
+        """Accept one sync session from another branch in the background"""
+        address = simpledialog.askstring("Accept Branch Sync", "Listen on (host:port):",
+                                         initialvalue=f"{SYNC_HOST}:{SYNC_PORT}")
+        if not address:
+            return
+        host, _, port = address.rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            messagebox.showerror("Error", "Please enter the address as host:port")
+            return
+        
+        def serve():
+            try:
+                self.sync_engine.serve(host or SYNC_HOST, port)
+                self.call_on_ui(self.reload_all_views)
+                self.call_on_ui(lambda: messagebox.showinfo("Sync", "Branch sync completed"))
+            except Exception as e:
+                message = f"Branch sync failed: {str(e)}"
+                self.call_on_ui(lambda: messagebox.showerror("Error", message))
+        
+        threading.Thread(target=serve, daemon=True).start()
+        messagebox.showinfo("Sync", f"Waiting for a branch to connect on {host or SYNC_HOST}:{port}")
+    
+    # Backup methods
+    def backup_now(self):
+        """Take a snapshot in the background so the window stays responsive"""
+        def run():
+            try:
+                archive = self.backup_manager.snapshot(label='manual')
+                self.call_on_ui(lambda: messagebox.showinfo("Backup", f"Snapshot saved to {archive}"))
+            except Exception as e:
+                message = f"Backup failed: {str(e)}"
+                self.call_on_ui(lambda: messagebox.showerror("Error", message))
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def choose_snapshot(self, title):
+        return filedialog.askopenfilename(
+            initialdir=self.backup_manager.backup_dir,
+            filetypes=[("Snapshots", "*.db.gz")],
+            title=title
+        )
+    
+    def verify_snapshot(self):
+        """Verify a snapshot's checksum and integrity"""
+        archive = self.choose_snapshot("Verify Snapshot")
+        if not archive:
+            return
+        
+        try:
+            ok, message = self.backup_manager.verify(archive)
+            if ok:
+                messagebox.showinfo("Verify", "Snapshot is intact.")
+            else:
+                messagebox.showerror("Verify", f"Snapshot is damaged: {message}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Verification failed: {str(e)}")
+    
+    def restore_snapshot(self, point_in_time=False):
+        """Restore a snapshot, optionally rolled forward to a point in time"""
+        archive = self.choose_snapshot("Restore Snapshot")
+        if not archive:
+            return
+        
+        target_time = None
+        if point_in_time:
+            value = simpledialog.askstring("Point in Time", "Restore to (YYYY-MM-DD HH:MM:SS):",
+                                           initialvalue=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            if not value:
+                return
+            try:
+                local_time = datetime.datetime.strptime(value.strip(), '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                messagebox.showerror("Error", "Please enter the time as YYYY-MM-DD HH:MM:SS")
+                return
+            target_time = local_time.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.999')
+        
+        if not messagebox.askyesno("Confirm Restore", "Replace the current data with this snapshot? "
+                                   "A pre-restore snapshot will be taken first."):
+            return
+        
+        try:
+            self.backup_manager.restore(archive, target_time)
+            self.reload_all_views()
+            messagebox.showinfo("Success", "Database restored successfully!")
+        except Exception as e:
+            messagebox.showerror("Error", f"Restore failed: {str(e)}")
+    
+    def archive_old_rentals(self):
+        """Move rentals older than the archive horizon into per-year archive files"""
+        cutoff = self.archive_manager.cutoff_date()
+        if not messagebox.askyesno("Archive Rentals", f"Move rentals created before {cutoff} into archive files?"):
+            return
+        
+        try:
+            moved = self.archive_manager.archive_old_rentals()
+            self.clear_history_filters()
+            self.refresh_quick_stats()
+            messagebox.showinfo("Success", f"{moved} rentals archived.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Archiving failed: {str(e)}")
     
-    # Analytics methods
-    def show_product_distribution(self):
-        """Show enhanced product distribution chart"""
+    def show_lock_statistics(self):
+        """Show how long this session's writes waited for the database lock"""
+        stats = self.db_manager.lock_metrics.summary()
+        messagebox.showinfo("Lock Statistics",
+                            f"Write transactions: {stats['transactions']}\n"
+                            f"Retries after lock timeouts: {stats['retries']}\n"
+                            f"Failed after retrying: {stats['failures']}\n"
+                            f"Average lock wait: {stats['avg_wait'] * 1000:.1f} ms\n"
+                            f"Longest lock wait: {stats['max_wait'] * 1000:.1f} ms")
+    
+    def return_selected_rental(self, unit_state='available'):
+        """Check in the rental selected in the history tab"""
+        selection = self.history_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a rental in the Rental History tab")
+            return
+        
+        values = self.history_tree.item(selection[0])['values']
+        # Optional: without a reading only rental days count towards the service interval
+        odometer = simpledialog.askinteger("Return", "Odometer reading (Cancel to skip):", minvalue=0, parent=self.root)
         try:
-            self.fig.clear()
-            
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT product_type, COUNT(*) as count, SUM(total) as revenue
-                FROM rentals 
-                WHERE product_type IS NOT NULL
-                GROUP BY product_type
-                ORDER BY count DESC
-            ''')
-            
-            data = cursor.fetchall()
-            conn.close()
-            
-            if not data:
-                ax = self.fig.add_subplot(111)
-                ax.text(0.5, 0.5, 'No rental data available', 
-                       transform=ax.transAxes, ha='center', va='center',
-                       fontsize=16, color='gray')
-                ax.set_title('Product Distribution')
-                self.canvas.draw()
+            result = self.return_scheduler.return_rental(values[0], unit_state, odometer)
+            fee = f"\nLate by {result['days_late']} days: £{result['late_fee']:.2f} late fee charged" if result['days_late'] else ""
+            service = "\nThe vehicle is due for service and has gone to maintenance" if result['maintenance'] and unit_state == 'available' else ""
+            messagebox.showinfo("Returned", f"Rental {values[1]} returned on {result['returned_date']}{fee}{service}")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except Exception as e:
+            messagebox.showerror("Error", f"Return failed: {str(e)}")
+    
+    def show_overdue_rentals(self):
+        """List overdue rentals with the late fees accrued so far"""
+        try:
+            rows = self.return_scheduler.overdue(limit=30)
+            if not rows:
+                messagebox.showinfo("Overdue Rentals", "No rentals are overdue.")
                 return
-            
-            products = [row[0] for row in data]
-            counts = [row[1] for row in data]
-            revenues = [row[2] or 0 for row in data]
-            
-            # Create subplots
-            gs = self.fig.add_gridspec(2, 2, hspace=0.3, wspace=0.3)
-            
-            # Pie chart for count distribution
-            ax1 = self.fig.add_subplot(gs[0, 0])
-            colors = ['#3498db', '#e74c3c', '#27ae60', '#f39c12', '#9b59b6']
-            wedges, texts, autotexts = ax1.pie(counts, labels=products, autopct='%1.1f%%', 
-                                              colors=colors[:len(products)], startangle=90)
-            ax1.set_title('Rental Count Distribution', fontweight='bold')
-            
-            # Bar chart for revenue
-            ax2 = self.fig.add_subplot(gs[0, 1])
-            bars = ax2.bar(products, revenues, color=colors[:len(products)])
-            ax2.set_title('Revenue by Product Type', fontweight='bold')
-            ax2.set_ylabel('Revenue (£)')
-            ax2.tick_params(axis='x', rotation=45)
-            
-            # Add value labels on bars
-            for bar in bars:
-                height = bar.get_height()
-                ax2.text(bar.get_x() + bar.get_width()/2., height + max(revenues)*0.01,
-                        f'£{height:.0f}', ha='center', va='bottom', fontsize=9)
-            
-            # Trend chart (last 30 days)
-            ax3 = self.fig.add_subplot(gs[1, :])
-            conn = sqlite3.connect(self.db_manager.db_name) # Corrected: removed 'cursor ='
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT DATE(created_date) as date, COUNT(*) as count, SUM(total) as revenue
-                FROM rentals 
-                WHERE created_date >= date('now', '-30 days')
-                GROUP BY DATE(created_date)
-                ORDER BY date
-            ''')
-            trend_data = cursor.fetchall()
-            conn.close()
-            
-            if trend_data:
-                dates = [datetime.datetime.strptime(row[0], '%Y-%m-%d').strftime('%m-%d') for row in trend_data]
-                daily_counts = [row[1] for row in trend_data]
-                daily_revenue = [row[2] or 0 for row in trend_data]
-                
-                ax3_twin = ax3.twinx()
-                
-                line1 = ax3.plot(dates, daily_counts, marker='o', color='#3498db', linewidth=2, label='Rentals')
-                line2 = ax3_twin.plot(dates, daily_revenue, marker='s', color='#e74c3c', linewidth=2, label='Revenue')
-                
-                ax3.set_xlabel('Date (Last 30 Days)')
-                ax3.set_ylabel('Number of Rentals', color='#3498db')
-                ax3_twin.set_ylabel('Revenue (£)', color='#e74c3c')
-                
-                # Combine legends
-                lines = line1 + line2
-                labels = [l.get_label() for l in lines]
-                ax3.legend(lines, labels, loc='upper left')
-                
-                ax3.set_title('Daily Rental Trends (Last 30 Days)', fontweight='bold')
-                ax3.tick_params(axis='x', rotation=45)
-            
-            self.fig.suptitle('Rental Analytics Dashboard', fontsize=16, fontweight='bold')
-            self.canvas.draw()
-            
+            lines = [f"{receipt_ref or rental_id:<14} {str(customer_name or ''):<20} {unit_code or '':<12} "
+                     f"due {due_date}  {days_late}d  £{fee:.2f}"
+                     for rental_id, receipt_ref, customer_name, unit_code, due_date, days_late, fee in rows]
+            messagebox.showinfo("Overdue Rentals", "\n".join(lines))
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate analytics: {str(e)}")
+            messagebox.showerror("Error", f"Failed to load overdue rentals: {str(e)}")
     
-    def show_monthly_revenue(self):
-        """Show monthly revenue trends"""
+    def scan_overdue(self):
+        """Run the overdue scan now instead of waiting for the scheduler"""
         try:
-            self.fig.clear()
-            
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT strftime('%Y-%m', created_date) as month, 
-                       SUM(total) as revenue, COUNT(*) as count,
-                       AVG(total) as avg_rental
-                FROM rentals 
-                WHERE created_date >= date('now', '-12 months')
-                GROUP BY strftime('%Y-%m', created_date)
-                ORDER BY month
-            ''')
-            
-            data = cursor.fetchall()
-            conn.close()
-            
-            if not data:
-                ax = self.fig.add_subplot(111)
-                ax.text(0.5, 0.5, 'No data available for the last 12 months', 
-                       transform=ax.transAxes, ha='center', va='center',
-                       fontsize=16, color='gray')
-                ax.set_title('Monthly Revenue Trends')
-                self.canvas.draw()
+            due = self.return_scheduler.tick()
+            messagebox.showinfo("Overdue Scan", f"{len(due)} rentals newly overdue.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Overdue scan failed: {str(e)}")
+    
+    def show_maintenance_schedule(self):
+        """List planned and running maintenance windows, soonest first"""
+        try:
+            rows = self.db_manager.maintenance.schedule()
+            if not rows:
+                messagebox.showinfo("Maintenance Schedule", "No maintenance is planned.")
                 return
-            
-            months = [datetime.datetime.strptime(row[0], '%Y-%m').strftime('%b %Y') for row in data]
-            revenues = [row[1] or 0 for row in data]
-            counts = [row[2] for row in data]
-            avg_rentals = [row[3] or 0 for row in data]
-            
-            # Create subplots
-            ax1 = self.fig.add_subplot(3, 1, 1)
-            ax2 = self.fig.add_subplot(3, 1, 2)
-            ax3 = self.fig.add_subplot(3, 1, 3)
-            
-            # Revenue chart
-            bars1 = ax1.bar(months, revenues, color='#27ae60', alpha=0.7)
-            ax1.set_title('Monthly Revenue', fontweight='bold')
-            ax1.set_ylabel('Revenue (£)')
-            ax1.tick_params(axis='x', rotation=45)
-            
-            # Add trend line
-            if len(revenues) > 1:
-                z = np.polyfit(range(len(revenues)), revenues, 1)
-                p = np.poly1d(z)
-                ax1.plot(range(len(revenues)), p(range(len(revenues))), 
-                        color='red', linestyle='--', alpha=0.8, label='Trend')
-                ax1.legend()
-            
-            # Count chart
-            bars2 = ax2.bar(months, counts, color='#3498db', alpha=0.7)
-            ax2.set_title('Monthly Rental Count', fontweight='bold')
-            ax2.set_ylabel('Number of Rentals')
-            ax2.tick_params(axis='x', rotation=45)
-            
-            # Average rental value
-            line3 = ax3.plot(months, avg_rentals, marker='o', color='#f39c12', linewidth=2, markersize=6)
-            ax3.set_title('Average Rental Value', fontweight='bold')
-            ax3.set_ylabel('Average Value (£)')
-            ax3.tick_params(axis='x', rotation=45)
-            ax3.grid(True, alpha=0.3)
-            
-            self.fig.suptitle('Monthly Performance Analysis', fontsize=16, fontweight='bold')
-            plt.tight_layout()
-            self.canvas.draw()
-            
+            lines = [f"{unit_code:<14} {start} to {end}  {status:<8} {reason}"
+                     for unit_code, start, end, status, reason, _, _ in rows[:30]]
+            more = f"\n... and {len(rows) - 30} more" if len(rows) > 30 else ""
+            messagebox.showinfo("Maintenance Schedule", "\n".join(lines) + more)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate monthly report: {str(e)}")
+            messagebox.showerror("Error", f"Failed to load the maintenance schedule: {str(e)}")
     
-    def show_customer_stats(self):
-        """Show comprehensive customer statistics"""
+    def complete_unit_service(self):
+        """Sign a vehicle, by unit code, out of the workshop"""
+        unit_code = simpledialog.askstring("Complete Service", "Unit code:", parent=self.root)
+        if not unit_code:
+            return
+        
         try:
-            self.fig.clear()
-            
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            
-            # Get various statistics
-            cursor.execute('SELECT COUNT(*) FROM rentals')
-            total_rentals = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT SUM(total) FROM rentals')
-            total_revenue = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT AVG(total) FROM rentals')
-            avg_rental = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT COUNT(DISTINCT customer_id) FROM rentals')
-            unique_customers = cursor.fetchone()[0]
-            
-            # Payment method distribution
-            cursor.execute('''
-                SELECT payment_method, COUNT(*) as count
-                FROM rentals 
-                WHERE payment_method IS NOT NULL AND payment_method != 'Select'
-                GROUP BY payment_method
-                ORDER BY count DESC
-            ''')
-            payment_data = cursor.fetchall()
-            
-            # Top customers
-            cursor.execute('''
-                SELECT c.customer_name, COUNT(r.rental_id) as rental_count, SUM(r.total) as total_spent
-                FROM rentals r
-                JOIN customers c ON r.customer_id = c.customer_id
-                GROUP BY c.customer_id
-                ORDER BY total_spent DESC
-                LIMIT 5
-            ''')
-            top_customers = cursor.fetchall()
-            
+            unit = self.db_manager.fleet.unit_by_code(unit_code.strip())
+            if unit is None:
+                messagebox.showerror("Error", f"No unit with code {unit_code}")
+                return
+            self.db_manager.maintenance.complete_service(unit[0])
+            messagebox.showinfo("Success", f"{unit_code} is serviced and available again.")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to complete the service: {str(e)}")
+    
+    def edit_service_interval(self):
+        """Change how often one product type is serviced"""
+        product_type = simpledialog.askstring("Service Intervals", "Product type:",
+                                              initialvalue=self.product_type_var.get(), parent=self.root)
+        if not product_type:
+            return
+        product_type = product_type.strip()
+        
+        try:
+            conn = self.db_manager.connect()
+            current = MaintenancePlanner.intervals(conn.cursor()).get(product_type, (None, None, 1))
             conn.close()
+            rental_days = simpledialog.askinteger("Service Intervals", f"{product_type}: rental days between services:",
+                                                  initialvalue=current[0], minvalue=1, parent=self.root)
+            if rental_days is None:
+                return
+            mileage = simpledialog.askinteger("Service Intervals", f"{product_type}: miles between services:",
+                                              initialvalue=current[1], minvalue=1, parent=self.root)
+            if mileage is None:
+                return
+            service_days = simpledialog.askinteger("Service Intervals", f"{product_type}: days in the workshop:",
+                                                   initialvalue=current[2], minvalue=1, parent=self.root)
+            if service_days is None:
+                return
+            started = self.db_manager.maintenance.set_interval(product_type, rental_days, mileage, service_days)
+            messagebox.showinfo("Success", f"{product_type} interval saved; {len(started)} units sent to maintenance.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save the service interval: {str(e)}")
+    
+    def replan_maintenance(self):
+        """Re-plan every unit and open or close the windows that fall due today"""
+        try:
+            started = self.db_manager.maintenance.replan_all()
+            opened, finished = self.db_manager.maintenance.tick()
+            messagebox.showinfo("Maintenance", f"{len(started) + len(opened)} units sent to maintenance, "
+                                               f"{len(finished)} back from service.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Maintenance planning failed: {str(e)}")
+    
+    def selected_customer_id(self):
+        """Customer id of the row selected in the customer directory, or None"""
+        selection = self.customer_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a customer in the Customers tab")
+            return None
+        return self.customer_tree.item(selection[0])['values'][0]
+    
+    def record_payment(self):
+        """Record a payment received from the selected customer"""
+        customer_id = self.selected_customer_id()
+        if customer_id is None:
+            return
+        
+        amount = simpledialog.askfloat("Record Payment", "Amount received (£):", minvalue=0.01)
+        if not amount:
+            return
+        method = simpledialog.askstring("Record Payment", "Payment method:", initialvalue="Cash")
+        if method is None:
+            return
+        reference = simpledialog.askstring("Record Payment", "Reference (optional):", initialvalue="") or ''
+        
+        try:
+            self.ledger.record_payment(customer_id, amount, method, reference)
+            balance = self.ledger.customer_balance(customer_id)
+            messagebox.showinfo("Success", f"Payment of £{amount:.2f} recorded.\nBalance now £{balance:.2f}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to record payment: {str(e)}")
+    
+    def show_customer_balance(self):
+        """Show the selected customer's balance and recent ledger entries"""
+        customer_id = self.selected_customer_id()
+        if customer_id is None:
+            return
+        
+        try:
+            balance = self.ledger.customer_balance(customer_id)
+            lines = [f"{entry_date}  {entry_type:<8} {str(reference or ''):<14} £{debit - credit:>9.2f}  £{running:>9.2f}"
+                     for entry_date, entry_type, reference, debit, credit, running
+                     in self.ledger.customer_ledger(customer_id, 15)]
+            messagebox.showinfo("Customer Balance", f"Balance: £{balance:.2f}\n\n" + "\n".join(lines))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load balance: {str(e)}")
+    
+    def run_invoicing(self):
+        """Run the invoicing pass for all customers"""
+        try:
+            summary = self.ledger.run_invoicing()
+            aging = "\n".join(f"{bucket}: £{amount:,.2f}" for bucket, amount in summary['aging'].items())
+            messagebox.showinfo("Invoicing Complete",
+                                f"{summary['customers']} customer statements as of {summary['as_of']}\n"
+                                f"Outstanding: £{summary['outstanding']:,.2f}\n\n{aging}\n\n"
+                                f"Completed in {summary['seconds']:.1f} s")
+        except Exception as e:
+            messagebox.showerror("Error", f"Invoicing run failed: {str(e)}")
+    
+    def export_statements(self):
+        """Export statements from the latest invoicing run"""
+        try:
+            run_id = self.ledger.latest_run()
+            if run_id is None:
+                messagebox.showwarning("Warning", "Run invoicing first")
+                return
             
-            # Create layout
-            gs = self.fig.add_gridspec(2, 3, hspace=0.4, wspace=0.4)
-            
-            # Summary statistics (text)
-            ax1 = self.fig.add_subplot(gs[0, 0])
-            ax1.axis('off')
-            
-            stats_text = f"""BUSINESS SUMMARY
-            
-Total Rentals: {total_rentals:,}
-Total Revenue: £{total_revenue:,.2f}
-Average Rental: £{avg_rental:.2f}
-Unique Customers: {unique_customers:,}
-
-Revenue per Customer: £{total_revenue/unique_customers if unique_customers > 0 else 0:.2f}
-Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 else 0:.1f}"""
-            
-            ax1.text(0.05, 0.95, stats_text, transform=ax1.transAxes, 
-                    fontsize=10, verticalalignment='top', fontfamily='monospace',
-                    bbox=dict(boxstyle="round,pad=0.5", facecolor='lightblue', alpha=0.8))
-            
-            # Payment method pie chart
-            if payment_data:
-                ax2 = self.fig.add_subplot(gs[0, 1])
-                methods = [row[0] for row in payment_data]
-                counts = [row[1] for row in payment_data]
-                
-                ax2.pie(counts, labels=methods, autopct='%1.1f%%', startangle=90)
-                ax2.set_title('Payment Methods', fontweight='bold')
-            
-            # Top customers bar chart
-            if top_customers:
-                ax3 = self.fig.add_subplot(gs[0, 2])
-                names = [row[0][:10] + '...' if len(row[0]) > 10 else row[0] for row in top_customers]
-                spending = [row[2] for row in top_customers]
-                
-                bars = ax3.barh(names, spending, color='#e74c3c')
-                ax3.set_title('Top 5 Customers by Revenue', fontweight='bold')
-                ax3.set_xlabel('Total Spent (£)')
-                
-                # Add value labels
-                for i, bar in enumerate(bars):
-                    width = bar.get_width()
-                    ax3.text(width + max(spending)*0.01, bar.get_y() + bar.get_height()/2,
-                            f'£{width:.0f}', ha='left', va='center', fontsize=9)
-            
-            # Rental frequency distribution
-            conn = sqlite3.connect(self.db_manager.db_name) # Corrected: removed 'cursor ='
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT customer_rental_count, COUNT(*) as frequency
-                FROM (
-                    SELECT customer_id, COUNT(*) as customer_rental_count
-                    FROM rentals
-                    GROUP BY customer_id
-                ) customer_counts
-                GROUP BY customer_rental_count
-                ORDER BY customer_rental_count
-            ''')
-            frequency_data = cursor.fetchall()
-            conn.close()
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".pdf",
+                filetypes=[("PDF files", "*.pdf"), ("CSV files", "*.csv")],
+                title="Export Statements"
+            )
             
-            if frequency_data:
-                ax4 = self.fig.add_subplot(gs[1, :])
-                rental_counts = [row[0] for row in frequency_data]
-                frequencies = [row[1] for row in frequency_data]
-                
-                bars = ax4.bar(rental_counts, frequencies, color='#9b59b6', alpha=0.7)
-                ax4.set_title('Customer Rental Frequency Distribution', fontweight='bold')
-                ax4.set_xlabel('Number of Rentals per Customer')
-                ax4.set_ylabel('Number of Customers')
-                ax4.grid(True, alpha=0.3, axis='y')
+            if filename:
+                count = self.ledger.export_statements(run_id, filename)
+                messagebox.showinfo("Success", f"{count} statements exported to {filename}")
                 
-                # Add value labels
-                for bar in bars:
-                    height = bar.get_height()
-                    ax4.text(bar.get_x() + bar.get_width()/2., height + 0.1,
-                            f'{int(height)}', ha='center', va='bottom', fontsize=9)
-            
-            self.fig.suptitle('Customer Analytics Dashboard', fontsize=16, fontweight='bold')
-            self.canvas.draw()
-            
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate customer statistics: {str(e)}")
+            messagebox.showerror("Error", f"Statement export failed: {str(e)}")
     
     def refresh_charts(self):
         """Refresh all charts and statistics"""
@@ -1768,7 +7952,7 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
                 return
             
             # Check for duplicate names
-            conn = sqlite3.connect(self.db_manager.db_name)
+            conn = self.db_manager.connect()
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM customers WHERE customer_name = ?', 
                           (self.customer_name.get().strip(),))
@@ -1778,25 +7962,25 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
                     conn.close()
                     return
             
+            conn.close()
+            
+            # Check for duplicate contact details through their blind indexes
+            duplicates = self.db_manager.find_duplicate_customers(self.customer_phone.get(), self.customer_email.get())
+            if duplicates:
+                names = ', '.join(f"{name} (ID: {customer_id})" for customer_id, name in duplicates[:5])
+                if not messagebox.askyesno("Duplicate Contact",
+                                         f"{names} already has this phone number or email. Continue anyway?"):
+                    return
+            
             # Insert customer
-            cursor.execute('''
-                INSERT INTO customers (customer_name, phone, email, address)
-                VALUES (?, ?, ?, ?)
-            ''', (
+            self.db_manager.add_customer(
                 self.customer_name.get().strip(),
                 self.customer_phone.get().strip() or None,
                 self.customer_email.get().strip() or None,
                 self.customer_address.get().strip() or None
-            ))
-            
-            conn.commit()
-            conn.close()
+            )
             
             messagebox.showinfo("Success", "Customer added successfully!")
-            
-            # Refresh displays
-            self.load_customers()
-            self.load_customers_tree()
             self.clear_customer_form()
             
         except Exception as e:
@@ -1818,28 +8002,15 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
                 messagebox.showerror("Error", "Customer name is required")
                 return
             
-            conn = sqlite3.connect(self.db_manager.db_name)
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE customers 
-                SET customer_name = ?, phone = ?, email = ?, address = ?
-                WHERE customer_id = ?
-            ''', (
+            self.db_manager.update_customer(
+                customer_id,
                 self.customer_name.get().strip(),
                 self.customer_phone.get().strip() or None,
                 self.customer_email.get().strip() or None,
-                self.customer_address.get().strip() or None,
-                customer_id
-            ))
-            
-            conn.commit()
-            conn.close()
+                self.customer_address.get().strip() or None
+            )
             
             messagebox.showinfo("Success", "Customer updated successfully!")
-            
-            # Refresh displays
-            self.load_customers()
-            self.load_customers_tree()
             self.clear_customer_form()
             
         except Exception as e:
@@ -1853,18 +8024,43 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
             
             customers = self.db_manager.get_all_customers()
             for customer in customers:
-                self.customer_tree.insert('', 'end', values=(
-                    customer[0],  # customer_id
-                    customer[1],  # customer_name
-                    customer[2] or '',  # phone
-                    customer[3] or '',  # email
-                    customer[4] or '',  # address
-                    customer[5] or ''   # created_date
-                ))
+                self.insert_customer_row(customer, 'end')
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load customers: {str(e)}")
     
+    def search_customers_tree(self):
+        """Show the customers matching the search box, or all of them when it is empty"""
+        term = self.customer_search.get().strip()
+        if not term:
+            self.load_customers_tree()
+            return
+        try:
+            for item in self.customer_tree.get_children():
+                self.customer_tree.delete(item)
+            
+            for customer in self.db_manager.find_customers(term):
+                self.insert_customer_row(customer, 'end')
+                
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to search customers: {str(e)}")
+    
+    def show_all_customers(self):
+        """Clear the customer search"""
+        self.customer_search.set("")
+        self.load_customers_tree()
+    
+    def insert_customer_row(self, customer, index):
+        """Show one customer row in the directory, keyed by customer_id"""
+        self.customer_tree.insert('', index, iid=str(customer[0]), values=(
+            customer[0],  # customer_id
+            customer[1],  # customer_name
+            customer[2] or '',  # phone
+            customer[3] or '',  # email
+            customer[4] or '',  # address
+            customer[5] or ''   # created_date
+        ))
+    
     def on_customer_select(self, event):
         """Handle customer selection in tree"""
         try:
@@ -1915,11 +8111,12 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
             messagebox.showerror("Error", "Cost per day and quantity must be valid numbers.")
             return
 
-        if self.db_manager.add_product(product_type, product_code, cost_per_day, available_quantity):
-            messagebox.showinfo("Success", "Product added successfully!")
-            self.load_products_tree()
-            self.load_product_types_for_rental() # Refresh rental product types
-            self.clear_product_form()
+        try:
+            if self.db_manager.add_product(product_type, product_code, cost_per_day, available_quantity):
+                messagebox.showinfo("Success", "Product added successfully!")
+                self.clear_product_form()
+        except PermissionError as e:
+            messagebox.showerror("Access Denied", str(e))
 
     def update_product_in_db(self):
         """Update an existing product using form data."""
@@ -1949,11 +8146,12 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
             messagebox.showerror("Error", "Cost per day and quantity must be valid numbers.")
             return
 
-        if self.db_manager.update_product(product_id, product_type, product_code, cost_per_day, available_quantity, status):
-            messagebox.showinfo("Success", "Product updated successfully!")
-            self.load_products_tree()
-            self.load_product_types_for_rental() # Refresh rental product types
-            self.clear_product_form()
+        try:
+            if self.db_manager.update_product(product_id, product_type, product_code, cost_per_day, available_quantity, status):
+                messagebox.showinfo("Success", "Product updated successfully!")
+                self.clear_product_form()
+        except PermissionError as e:
+            messagebox.showerror("Access Denied", str(e))
 
     def delete_product_from_db(self):
         """Delete a selected product."""
@@ -1966,11 +8164,12 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
         product_code = self.product_tree.item(selection[0])['values'][2]
 
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete product '{product_code}'?"):
-            if self.db_manager.delete_product(product_id):
-                messagebox.showinfo("Success", "Product deleted successfully!")
-                self.load_products_tree()
-                self.load_product_types_for_rental() # Refresh rental product types
-                self.clear_product_form()
+            try:
+                if self.db_manager.delete_product(product_id):
+                    messagebox.showinfo("Success", "Product deleted successfully!")
+                    self.clear_product_form()
+            except PermissionError as e:
+                messagebox.showerror("Access Denied", str(e))
 
     def load_products_tree(self):
         """Load products into the product tree view."""
@@ -1980,18 +8179,22 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
             
             products = self.db_manager.get_all_products()
             for product in products:
-                self.product_tree.insert('', 'end', values=(
-                    product[0],  # product_id
-                    product[1],  # product_type
-                    product[2],  # product_code
-                    f"£{product[3]:.2f}",  # cost_per_day
-                    product[4],  # available_quantity
-                    product[5]   # status
-                ))
+                self.insert_product_row(product, 'end')
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load products: {str(e)}")
 
+    def insert_product_row(self, product, index):
+        """Show one product row in the product tree, keyed by product_id"""
+        self.product_tree.insert('', index, iid=str(product[0]), values=(
+            product[0],  # product_id
+            product[1],  # product_type
+            product[2],  # product_code
+            f"£{product[3]:.2f}",  # cost_per_day
+            product[4],  # available_quantity
+            product[5]   # status
+        ))
+
     def on_product_select(self, event):
         """Handle product selection in the product tree view."""
         try:
@@ -2011,6 +8214,259 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
         except Exception as e:
             pass  # Silently handle selection errors
 
+    def show_product_units(self):
+        """List the vehicles of the selected product and their states"""
+        selection = self.product_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a product.")
+            return
+        
+        try:
+            values = self.product_tree.item(selection[0])['values']
+            units = self.db_manager.fleet.units(values[0])
+            counts = {}
+            for unit in units:
+                counts[unit[2]] = counts.get(unit[2], 0) + 1
+            summary = ", ".join(f"{state}: {counts[state]}" for state in UNIT_STATES if state in counts)
+            lines = [f"{code:<16} {state:<12} {f'rental {rental_id}' if rental_id else ''}"
+                     for _, code, state, rental_id, _ in units[:25]]
+            more = f"\n... and {len(units) - 25} more" if len(units) > 25 else ""
+            messagebox.showinfo("Units", f"{values[1]} {values[2]}: {summary or 'no units'}\n\n" + "\n".join(lines) + more)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load units: {str(e)}")
+
+    def change_unit_state(self):
+        """Move one vehicle, by unit code, to another state"""
+        unit_code = simpledialog.askstring("Change Unit State", "Unit code:", parent=self.root)
+        if not unit_code:
+            return
+        
+        try:
+            unit = self.db_manager.fleet.unit_by_code(unit_code.strip())
+            if unit is None:
+                messagebox.showerror("Error", f"No unit with code {unit_code}")
+                return
+            unit_id, product_id, current = unit
+            state = simpledialog.askstring("Change Unit State",
+                                           f"{unit_code} is {current}. New state "
+                                           f"({', '.join(UNIT_TRANSITIONS[current]) or 'none allowed'}):",
+                                           parent=self.root)
+            if not state:
+                return
+            self.db_manager.fleet.transition(unit_id, state.strip().lower())
+            self.db_manager.events.publish(ProductUpdated(product_id))
+            messagebox.showinfo("Success", f"{unit_code} is now {state.strip().lower()}.")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to change unit state: {str(e)}")
+
+    def show_audit_history(self, title, table, row_id):
+        """Who changed one row and how, newest first"""
+        try:
+            entries = self.db_manager.audit.history(table, row_id, limit=30)
+            if not entries:
+                messagebox.showinfo(title, "No recorded changes.")
+                return
+            lines = []
+            for changed_at, actor, op, diff in entries:
+                if op == 'update':
+                    detail = "; ".join(f"{column}: {old} -> {new}" for column, (old, new) in diff.items())
+                elif op == 'delete':
+                    detail = "deleted"
+                else:
+                    detail = "created" if op == 'insert' else "state before this history"
+                lines.append(f"{changed_at[:16].replace('T', ' ')}  {actor}  {detail}")
+            messagebox.showinfo(title, "\n".join(lines))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load the change history: {str(e)}")
+    
+    def show_customer_history(self):
+        customer_id = self.selected_customer_id()
+        if customer_id is not None:
+            self.show_audit_history("Customer History", 'customers', customer_id)
+    
+    def show_product_history(self):
+        selection = self.product_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a product.")
+            return
+        values = self.product_tree.item(selection[0])['values']
+        self.show_audit_history(f"History of {values[2]}", 'products', values[0])
+    
+    def compact_audit_journal(self):
+        """Fold audit entries past the retention period into one snapshot per row"""
+        days = simpledialog.askinteger("Compact Audit Journal", "Keep full detail for how many days?",
+                                       initialvalue=AUDIT_RETENTION_DAYS, minvalue=30, parent=self.root)
+        if days is None:
+            return
+        
+        try:
+            self.db_manager.audit.flush()
+            removed = self.db_manager.audit.compact(days)
+            messagebox.showinfo("Success", f"{removed} audit entries compacted.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Audit compaction failed: {str(e)}")
+
+    # Account methods
+    def sign_in(self):
+        """Ask for a user name and password until someone signs in; False if cancelled"""
+        access = self.db_manager.access
+        if not access.has_users():
+            messagebox.showinfo("Welcome", "No accounts exist yet. Create the administrator account for this database.")
+            username = simpledialog.askstring("Create Administrator", "User name:", parent=self.root)
+            password = username and self.ask_new_password("Create Administrator")
+            if not password:
+                return False
+            try:
+                access.add_user(username, password, 'admin')
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return False
+        
+        while True:
+            username = simpledialog.askstring("Sign In", "User name:", parent=self.root)
+            if username is None:
+                return False
+            password = simpledialog.askstring("Sign In", f"Password for {username}:", show='*', parent=self.root)
+            if password is None:
+                return False
+            try:
+                access.sign_in(username, password)
+                self.update_session_label()
+                return True
+            except PermissionError as e:
+                messagebox.showerror("Sign In", str(e))
+    
+    def ask_new_password(self, title):
+        """Ask for a new password twice; None if cancelled or they differ"""
+        password = simpledialog.askstring(title, f"New password (at least {MIN_PASSWORD_LENGTH} characters):",
+                                          show='*', parent=self.root)
+        if password is None:
+            return None
+        if simpledialog.askstring(title, "Repeat the new password:", show='*', parent=self.root) != password:
+            messagebox.showerror("Error", "The passwords do not match.")
+            return None
+        return password
+    
+    def update_session_label(self):
+        """Show who is signed in next to the title"""
+        if not hasattr(self, 'session_label'):
+            return
+        session = self.db_manager.access.session
+        self.session_label.config(text=f"Signed in: {session.username} ({session.role})" if session else "Not signed in")
+    
+    def switch_user(self):
+        """End this session and let someone else sign in"""
+        self.db_manager.access.sign_out()
+        self.sign_in()
+        self.update_session_label()
+    
+    def change_password(self):
+        """Change the signed-in user's own password"""
+        session = self.db_manager.access.session
+        if session is None:
+            messagebox.showerror("Error", "Sign in first.")
+            return
+        current = simpledialog.askstring("Change Password", "Current password:", show='*', parent=self.root)
+        password = current is not None and self.ask_new_password("Change Password")
+        if not password:
+            return
+        
+        try:
+            self.db_manager.access.set_password(session.username, password, current=current)
+            messagebox.showinfo("Success", "Password changed.")
+        except (PermissionError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+    
+    def show_users(self):
+        """List the accounts with their roles and last sign-in"""
+        try:
+            lines = [f"{username}: {role}{'' if active else ' (disabled)'}, last signed in {last_login or 'never'}"
+                     for username, role, active, last_login in self.db_manager.access.users()]
+            messagebox.showinfo("Users", "\n".join(lines) or "No accounts.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to list users: {str(e)}")
+    
+    def ask_role(self, title, initialvalue='clerk'):
+        """Ask for one of the defined roles; None if cancelled"""
+        roles = sorted(self.db_manager.access.roles())
+        role = simpledialog.askstring(title, f"Role ({', '.join(roles)}):", initialvalue=initialvalue, parent=self.root)
+        return role.strip().lower() if role else None
+    
+    def add_user_account(self):
+        """Create an account with a role"""
+        username = simpledialog.askstring("Add User", "User name:", parent=self.root)
+        role = username and self.ask_role("Add User")
+        password = role and self.ask_new_password("Add User")
+        if not password:
+            return
+        
+        try:
+            self.db_manager.access.add_user(username, password, role)
+            messagebox.showinfo("Success", f"User {username.strip()} added as {role}.")
+        except (PermissionError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+    
+    def change_user_role(self):
+        """Give an account another role, from its next sign-in"""
+        username = simpledialog.askstring("Change User Role", "User name:", parent=self.root)
+        role = username and self.ask_role("Change User Role")
+        if not role:
+            return
+        
+        try:
+            self.db_manager.access.set_role(username.strip(), role)
+            messagebox.showinfo("Success", f"{username.strip()} is now {role} from their next sign-in.")
+        except (PermissionError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+    
+    def reset_user_password(self):
+        """Set a new password for another account"""
+        username = simpledialog.askstring("Reset User Password", "User name:", parent=self.root)
+        password = username and self.ask_new_password("Reset User Password")
+        if not password:
+            return
+        
+        try:
+            self.db_manager.access.set_password(username.strip(), password)
+            messagebox.showinfo("Success", f"Password reset for {username.strip()}.")
+        except (PermissionError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+    
+    def toggle_user_account(self):
+        """Disable an account, or enable a disabled one"""
+        username = simpledialog.askstring("Enable or Disable User", "User name:", parent=self.root)
+        if not username:
+            return
+        
+        try:
+            accounts = {row[0].lower(): row for row in self.db_manager.access.users()}
+            account = accounts.get(username.strip().lower())
+            if account is None:
+                messagebox.showerror("Error", f"No user named {username.strip()}.")
+                return
+            action = "Enable" if not account[2] else "Disable"
+            if not messagebox.askyesno("Confirm", f"{action} {account[0]}?"):
+                return
+            self.db_manager.access.set_active(account[0], not account[2])
+            messagebox.showinfo("Success", f"{account[0]} {action.lower()}d.")
+        except (PermissionError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+
+    def reprice_open_rentals(self):
+        """Reprice all open rentals against the current tariff."""
+        if not messagebox.askyesno("Confirm Reprice", "Reprice all open rentals using the current tariff?"):
+            return
+
+        try:
+            repriced = self.pricing_engine.reprice_open_book()
+            messagebox.showinfo("Success", f"{repriced} open rentals repriced.")
+            self.clear_history_filters()
+            self.refresh_quick_stats()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to reprice rentals: {str(e)}")
+
     def clear_product_form(self):
         """Clear product form fields."""
         self.product_id_var.set("")
@@ -2025,9 +8481,14 @@ Rentals per Customer: {total_rentals/unique_customers if unique_customers > 0 el
             self.product_tree.selection_remove(item)
 
 if __name__ == '__main__':
+    # python main.py [--journal-mode DELETE|WAL|...]
+    journal_mode = None
+    if '--journal-mode' in sys.argv[1:-1]:
+        journal_mode = sys.argv[sys.argv.index('--journal-mode') + 1]
+    
     try:
         root = tk.Tk()
-        app = ImprovedRentalInventory(root)
+        app = ImprovedRentalInventory(root, journal_mode)
         
         # Center window on screen
         root.update_idletasks()
@@ -0,0 +1,34 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database, key file and home directory under tmp_path"""
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return main.DatabaseManager(str(tmp_path / 'rental_inventory.db'), key_file=str(tmp_path / 'pii.key'))
+
+
+@pytest.fixture
+def rent(db):
+    """rent(customer_id, product_code, days, start=today) saves a rental as the rental form does"""
+    counter = iter(range(1, 10 ** 6))
+
+    def rent(customer_id, product_code, days, start=None, discount=0):
+        product = db.product_catalog.by_product_code(product_code)
+        start = start or datetime.date.today()
+        due = start + datetime.timedelta(days=days)
+        rate = product[3]
+        subtotal = round(rate * days * (1 - discount / 100), 2)
+        return db.save_rental((customer_id, f"T{next(counter)}", product[1], product[2], f"{days} days", rate,
+                               'Yes', str(start), str(due), days, str(due), '', 'No', 0, 'No', discount, 0, '',
+                               'Cash', 0, 0, 0, 0, 0, subtotal, subtotal))
+
+    return rent
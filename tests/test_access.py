@@ -0,0 +1,52 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def accounts(db):
+    """An administrator and a clerk; the first account made is the administrator whatever role it asks for"""
+    db.access.add_user('owner', 'owner-password', 'clerk')
+    db.access.add_user('counter', 'counter-password', 'clerk')
+    return db.access
+
+
+def test_first_account_is_the_administrator(accounts):
+    assert dict((username, role) for username, role, _, _ in accounts.users()) == {'owner': 'admin', 'counter': 'clerk'}
+
+
+def test_clerk_may_rent_but_not_price(db, accounts):
+    accounts.sign_in('counter', 'counter-password')
+    db.add_customer("Walk-in Customer")
+    with pytest.raises(PermissionError):
+        db.add_pricing_rule('surcharge', 10.0)
+    with pytest.raises(PermissionError):
+        accounts.add_user('another', 'another-password', 'admin')
+
+
+def test_wrong_password_is_refused(accounts):
+    with pytest.raises(PermissionError):
+        accounts.sign_in('counter', 'not-the-password')
+    with pytest.raises(PermissionError):
+        accounts.sign_in('nobody', 'counter-password')
+
+
+def test_changes_need_a_session(db, accounts):
+    accounts.sign_in('owner', 'owner-password')
+    accounts.sign_out()
+    with pytest.raises(PermissionError):
+        db.add_customer("Nobody's Customer")
+
+
+def test_idle_session_expires(db, accounts):
+    session = accounts.sign_in('counter', 'counter-password')
+    session.last_active -= main.SESSION_IDLE_MINUTES * 60 + 1
+    with pytest.raises(PermissionError):
+        db.add_customer("Late Customer")
+    assert accounts.session is None
+
+
+def test_changes_are_journaled_under_the_signed_in_user(db, accounts):
+    accounts.sign_in('counter', 'counter-password')
+    customer_id = db.add_customer("Audited Customer")
+    assert db.audit.history('customers', customer_id)[0][1].startswith('counter@')
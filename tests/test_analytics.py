@@ -0,0 +1,84 @@
+import csv
+import datetime
+
+import pytest
+
+import main
+
+
+def joined(db, customer_id, day):
+    conn = db.connect()
+    conn.execute('UPDATE customers SET created_date = ? WHERE customer_id = ?', (str(day), customer_id))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def customers(db, rent):
+    """Two customers who joined in January 2030 and one in February, renting a car a day at a time"""
+    ids = {}
+    for name, day, rentals in [("A", datetime.date(2030, 1, 5), [datetime.date(2030, 1, 10), datetime.date(2030, 2, 10)]),
+                               ("B", datetime.date(2030, 1, 20), [datetime.date(2030, 1, 25)]),
+                               ("C", datetime.date(2030, 2, 3), [datetime.date(2030, 2, 5), datetime.date(2030, 3, 1)])]:
+        ids[name] = db.add_customer(f"Customer {name}")
+        joined(db, ids[name], day)
+        for start in rentals:
+            rent(ids[name], 'CAR452', 1, start=start)
+    return ids
+
+
+def test_cohorts_count_each_customer_once_per_active_month(db, customers):
+    cohorts = main.CustomerAnalytics(db).cohorts()
+    assert cohorts['months'] == ['2030-01', '2030-02']
+    assert list(cohorts['sizes']) == [2, 1]
+    assert cohorts['active'].tolist() == [[2, 1], [1, 1]]
+    assert cohorts['retention'].tolist() == [[1.0, 0.5], [1.0, 1.0]]
+    assert main.CustomerAnalytics(db).monthly_retention_rate() == 0.75
+
+
+def test_rfm_scores_segment_and_value_customers(db, customers):
+    today = datetime.date(2030, 3, 31)
+    rfm = main.CustomerAnalytics(db).rfm(today)
+    by_customer = {int(customer_id): i for i, customer_id in enumerate(rfm['customer_id'])}
+    a, b, c = (by_customer[customers[name]] for name in "ABC")
+
+    assert rfm['frequency'][[a, b, c]].tolist() == [2, 1, 2]
+    assert rfm['monetary'][[a, b, c]].tolist() == [24.0, 12.0, 24.0]
+    assert rfm['recency'][c] == (today - datetime.date(2030, 3, 1)).days
+    segments = [main.CustomerAnalytics.RFM_SEGMENTS[rfm['segment'][i]] for i in (a, b, c)]
+    assert segments == ['Hibernating', 'Hibernating', 'Champions']
+
+    # Spend so far plus the monthly run rate carried forward at 75% retention
+    first = {a: datetime.date(2030, 1, 10), b: datetime.date(2030, 1, 25), c: datetime.date(2030, 2, 5)}
+    for i, day in first.items():
+        tenure = max(1.0, (today - day).days / 30.44)
+        assert rfm['ltv'][i] == pytest.approx(rfm['monetary'][i] * (1 + 3 / tenure))
+
+
+def test_new_rentals_append_and_created_date_rewrites_reload(db, rent, customers):
+    analytics = main.CustomerAnalytics(db)
+    analytics.cohorts()
+    rewrites = analytics.rewrites
+
+    rent(customers["B"], 'VAN775', 1, start=datetime.date(2030, 3, 5))
+    db.update_customer(customers["B"], "Customer B Renamed")
+    assert analytics.cohorts()['active'].tolist() == [[2, 1, 1], [1, 1, 0]]
+    assert analytics.rewrites == rewrites
+    assert len(analytics.rental_customer) == 6
+
+    joined(db, customers["B"], datetime.date(2030, 2, 20))
+    cohorts = analytics.cohorts()
+    assert analytics.rewrites != rewrites
+    assert list(cohorts['sizes']) == [1, 2]
+    assert len(analytics.rental_customer) == 6
+
+
+def test_export_writes_the_rfm_and_cohort_tables(db, customers, tmp_path):
+    filename, cohort_file = main.CustomerAnalytics(db).export_tables(str(tmp_path / 'customers.csv'))
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(int(row['customer_id']) for row in rows) == sorted(customers.values())
+    assert {row['segment'] for row in rows} <= set(main.CustomerAnalytics.RFM_SEGMENTS)
+    with open(cohort_file, newline='') as f:
+        cohort_rows = list(csv.reader(f))
+    assert [row[:2] for row in cohort_rows[1:]] == [['2030-01', '2'], ['2030-02', '1']]
@@ -0,0 +1,73 @@
+import datetime
+import os
+
+import main
+
+
+def add_rental(db, customer_id, total, days_ago, receipt_ref):
+    created = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO rentals (customer_id, receipt_ref, product_type, no_days, total, created_date)
+        VALUES (?, ?, 'Car', 3, ?, ?)
+    ''', (customer_id, receipt_ref, total, created.strftime('%Y-%m-%d %H:%M:%S')))
+    rental_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return rental_id
+
+
+def test_old_rentals_move_to_their_year_archive(db):
+    customer_id = db.add_customer("Archived Customer")
+    old = add_rental(db, customer_id, 100.0, days_ago=main.ARCHIVE_HORIZON_DAYS + 30, receipt_ref='OLD-1')
+    add_rental(db, customer_id, 40.0, days_ago=5, receipt_ref='NEW-1')
+    year = (datetime.date.today() - datetime.timedelta(days=main.ARCHIVE_HORIZON_DAYS + 30)).year
+
+    assert db.archive.archive_old_rentals() == 1
+    assert db.archive.archived_years() == [year]
+    assert os.path.exists(db.archive.archive_path(year))
+    conn = db.connect()
+    assert [row[0] for row in conn.execute('SELECT receipt_ref FROM rentals')] == ['NEW-1']
+    conn.close()
+    assert old in [row[0] for row in db.get_rental_page({}, 'ID', False, 10)]
+
+
+def test_archiving_keeps_customer_balance(db):
+    ledger = main.Ledger(db)
+    customer_id = db.add_customer("Archived Customer")
+    add_rental(db, customer_id, 100.0, days_ago=main.ARCHIVE_HORIZON_DAYS + 30, receipt_ref='OLD-1')
+    add_rental(db, customer_id, 40.0, days_ago=5, receipt_ref='NEW-1')
+    ledger.record_payment(customer_id, 90.0)
+    assert ledger.customer_balance(customer_id) == 50.0
+
+    assert db.archive.archive_old_rentals() == 1
+    assert ledger.customer_balance(customer_id) == 50.0
+    entries = {entry[1]: entry for entry in ledger.customer_ledger(customer_id)}
+    assert entries['archived charges'][3] == 100.0
+
+    # Nothing left to move, and the rolled-up charges are not counted twice
+    assert db.archive.archive_old_rentals() == 0
+    assert ledger.customer_balance(customer_id) == 50.0
+
+
+def test_archived_paid_rental_leaves_no_credit(db):
+    ledger = main.Ledger(db)
+    customer_id = db.add_customer("Paid Up Customer")
+    rental_id = add_rental(db, customer_id, 75.0, days_ago=main.ARCHIVE_HORIZON_DAYS + 400, receipt_ref='OLD-2')
+    ledger.record_payment(customer_id, 75.0, rental_id=rental_id)
+
+    assert db.archive.archive_old_rentals() == 1
+    assert ledger.customer_balance(customer_id) == 0
+
+
+def test_archived_rentals_still_listed(db):
+    customer_id = db.add_customer("Paging Customer")
+    for i in range(3):
+        add_rental(db, customer_id, 10.0 * (i + 1), days_ago=main.ARCHIVE_HORIZON_DAYS + 30 + i, receipt_ref=f'R-{i}')
+    add_rental(db, customer_id, 99.0, days_ago=1, receipt_ref='R-hot')
+    db.archive.archive_old_rentals()
+
+    first = db.get_rental_page({}, 'Total', True, 2)
+    second = db.get_rental_page({}, 'Total', True, 2, after=(first[-1][7], first[-1][0]))
+    assert [row[-1] for row in first + second] == [99.0, 30.0, 20.0, 10.0]
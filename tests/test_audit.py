@@ -0,0 +1,73 @@
+import datetime
+
+import main
+
+
+def backdate_journal(db, changed_at):
+    """Move every journaled entry back to changed_at, as if made then"""
+    db.audit.flush()
+    conn = db.connect()
+    conn.execute('UPDATE audit_context SET compacting = 1 WHERE id = 1')
+    conn.execute('UPDATE audit_journal SET changed_at = ?', (changed_at,))
+    conn.execute('UPDATE audit_context SET compacting = 0 WHERE id = 1')
+    conn.commit()
+    conn.close()
+
+
+def forget_journal(db):
+    """Drop the journal, as for rows created before it began"""
+    conn = db.connect()
+    conn.execute('UPDATE audit_context SET compacting = 1 WHERE id = 1')
+    conn.execute('DELETE FROM audit_journal')
+    conn.execute('DELETE FROM audit_pending')
+    conn.execute('UPDATE audit_context SET compacting = 0 WHERE id = 1')
+    conn.commit()
+    conn.close()
+
+
+def test_compaction_folds_old_entries_into_a_snapshot(db):
+    customer_id = db.add_customer("Ada", "07700 900123", "ada@example.com", "1 High Street")
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900123", "ada@example.com", "1 High Street")
+    backdate_journal(db, '2000-01-01T00:00:00.000')
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900999", "ada@example.com", "1 High Street")
+    db.audit.flush()
+
+    assert db.audit.compact(retention_days=30) == 1
+    history = db.audit.history('customers', customer_id)
+    assert [entry[2] for entry in history] == ['update', 'snapshot']
+    assert history[-1][3]['customer_name'] == "Ada Lovelace"
+
+
+def test_snapshot_of_a_row_older_than_the_journal_is_complete(db):
+    customer_id = db.add_customer("Ada", "07700 900123", "ada@example.com", "1 High Street")
+    forget_journal(db)
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900123", "ada@example.com", "1 High Street")
+    backdate_journal(db, '2000-01-01T00:00:00.000')
+    # Newer changes, journaled and still staged, are undone to find the older values
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900999", "ada@example.com", "1 High Street")
+    db.audit.flush()
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900999", "ada@example.com", "2 Low Road")
+
+    db.audit.compact(retention_days=30)
+    snapshot = db.audit.history('customers', customer_id)[-1]
+    assert snapshot[2] == 'snapshot'
+    assert {column: snapshot[3][column] for column in ('customer_name', 'phone', 'email', 'address')} == {
+        'customer_name': "Ada Lovelace", 'phone': "07700 900123", 'email': "ada@example.com",
+        'address': "1 High Street"}
+
+
+def test_snapshot_of_a_deleted_row_older_than_the_journal_is_complete(db):
+    db.add_pricing_rule('loyalty', -5.0, min_rentals=3, description="Regulars")
+    conn = db.connect()
+    rule_id = conn.execute('SELECT MAX(rule_id) FROM pricing_rules').fetchone()[0]
+    conn.close()
+    forget_journal(db)
+    db.update_pricing_rule(rule_id, 'loyalty', -10.0, min_rentals=3, description="Regulars")
+    backdate_journal(db, str(datetime.date.today() - datetime.timedelta(days=400)))
+    db.delete_pricing_rule(rule_id)
+    db.audit.flush()
+
+    db.audit.compact(retention_days=30)
+    snapshot = db.audit.history('pricing_rules', rule_id)[-1]
+    assert snapshot[2] == 'snapshot'
+    assert (snapshot[3]['adjustment'], snapshot[3]['min_rentals'], snapshot[3]['description']) == (-10.0, 3, "Regulars")
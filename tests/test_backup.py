@@ -0,0 +1,92 @@
+import datetime
+import json
+import time
+
+import pytest
+
+import main
+
+RESTORED_TABLES = ('customers', 'rentals', 'payments', 'open_rentals', 'rental_returns', 'units', 'products',
+                   'changelog', 'audit_pending', 'audit_journal')
+
+
+def table_rows(db):
+    conn = db.connect()
+    rows = {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1').fetchall() for table in RESTORED_TABLES}
+    conn.close()
+    return rows
+
+
+def utc_now():
+    time.sleep(0.01)  # Past every write so far, and before any that follows
+    now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+    time.sleep(0.01)
+    return now
+
+
+@pytest.fixture
+def backup(db, tmp_path):
+    return main.BackupManager(db, backup_dir=str(tmp_path / 'backups'), step_pause=0)
+
+
+def test_point_in_time_restore_replays_every_table(db, rent, backup):
+    archive = backup.snapshot()
+    customer_id = db.add_customer("Restored Customer", "07700 900123")
+    today = datetime.date.today()
+    rental_id = rent(customer_id, 'VAN775', 3, start=today - datetime.timedelta(days=5))
+    ledger = main.Ledger(db)
+    ledger.record_payment(customer_id, 20.0, rental_id=rental_id)
+    returned = main.ReturnScheduler(db).return_rental(rental_id)
+    assert returned['days_late'] == 2
+    expected, balance = table_rows(db), ledger.customer_balance(customer_id)
+
+    target_time = utc_now()
+    db.add_customer("Too Late")
+    rent(customer_id, 'CAR452', 4)
+    backup.restore(archive, target_time)
+
+    assert table_rows(db) == expected
+    assert ledger.customer_balance(customer_id) == balance
+    assert [row[1] for row in db.find_customers('Restored')] == ["Restored Customer"]
+    assert db.find_customers('Too Late') == []
+
+
+def test_restore_as_taken_drops_later_changes(db, rent, backup):
+    customer_id = db.add_customer("Snapshot Customer")
+    expected = table_rows(db)
+    archive = backup.snapshot()
+    rent(customer_id, 'TRK7483', 2)
+
+    backup.restore(archive)
+    assert table_rows(db) == expected
+
+
+def test_snapshot_without_redo_position_is_only_restored_as_taken(db, backup):
+    archive = backup.snapshot()
+    manifest_path = archive[:-len('.db.gz')] + '.json'
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    del manifest['redo_seq']
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    with pytest.raises(RuntimeError):
+        backup.restore(archive, utc_now())
+    backup.restore(archive)
+
+
+def test_redo_log_is_pruned_to_the_oldest_snapshot(db, backup):
+    backup.keep = 1
+    db.add_customer("Before")
+    backup.snapshot()
+    db.add_customer("Between")
+    kept = backup.snapshot()
+    db.add_customer("After")
+
+    with open(kept[:-len('.db.gz')] + '.json') as f:
+        kept_seq = json.load(f)['redo_seq']
+    conn = db.connect()
+    seqs = [row[0] for row in conn.execute('SELECT seq FROM redo_log')]
+    conn.close()
+    assert [archive for archive, _ in backup.list_snapshots()] == [kept]
+    assert seqs and min(seqs) > kept_seq
@@ -0,0 +1,47 @@
+import main
+
+
+def test_lookups_by_id_code_and_type(db):
+    catalog = db.product_catalog
+    van = catalog.by_product_code('VAN775')
+    assert catalog.get(van[0]) == van
+    assert van[1:] == ('Van', 'VAN775', 19.0, 3, 'Available')
+    assert catalog.available_types() == ['Car', 'Minibus', 'Truck', 'Van']
+    assert catalog.products('Van', 'Available') == [van]
+    assert catalog.by_product_code('NOPE') is None
+
+
+def test_first_available_is_the_lowest_code_in_stock(db):
+    db.add_product('Van', 'VAN100', 21.0, 1)
+    db.add_product('Van', 'VAN050', 22.0, 0)
+    assert db.product_catalog.first_available('Van')[2] == 'VAN100'
+    assert [row[2] for row in db.product_catalog.products('Van', 'Available')] == ['VAN050', 'VAN100', 'VAN775']
+
+
+def test_edits_and_deletes_move_a_product_between_indexes(db):
+    catalog = db.product_catalog
+    truck = catalog.by_product_code('TRK7483')
+    db.update_product(truck[0], 'Truck', 'TRK7483', 15.0, 2, 'Maintenance')
+    assert catalog.products('Truck', 'Available') == []
+    assert [row[0] for row in catalog.products('Truck', 'Maintenance')] == [truck[0]]
+    assert 'Truck' not in catalog.available_types()
+
+    db.update_product(truck[0], 'Truck', 'TRK7484', 15.0, 2, 'Available')
+    assert catalog.by_product_code('TRK7483') is None
+    assert catalog.first_available('Truck')[2] == 'TRK7484'
+
+    car = catalog.by_product_code('CAR452')
+    db.update_product(car[0], 'Car', 'CAR452', 12.0, 0, 'Available')
+    assert 'Car' not in catalog.available_types()
+    db.delete_product(truck[0])
+    assert catalog.get(truck[0]) is None and catalog.available_types() == ['Minibus', 'Van']
+
+
+def test_changes_from_another_counter_show_once_the_catalog_ages(db):
+    catalog = db.product_catalog
+    assert catalog.by_product_code('SCT100') is None
+    main.DatabaseManager(db.db_name, key_file=db.pii.key_file).add_product('Scooter', 'SCT100', 8.0, 2)
+    assert catalog.by_product_code('SCT100') is None
+
+    catalog.loaded_at -= catalog.max_age + 1
+    assert catalog.by_product_code('SCT100')[1:] == ('Scooter', 'SCT100', 8.0, 2, 'Available')
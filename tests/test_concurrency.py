@@ -0,0 +1,53 @@
+import datetime
+import multiprocessing
+
+import pytest
+
+import main
+
+PROCESSES = 4
+RENTALS_PER_PROCESS = 15
+
+
+def counter(db_path, key_file, journal_mode, seed):
+    """One rental counter in its own process: rent a car, take it back, repeat; returns (receipts, lock summary)"""
+    db = main.DatabaseManager(db_path, journal_mode, key_file=key_file)
+    returns = main.ReturnScheduler(db)
+    today = datetime.date.today()
+    due = today + datetime.timedelta(days=3)
+    receipts = []
+    for i in range(RENTALS_PER_PROCESS):
+        receipt_ref = f"C{seed}-{i}"
+        rental_id = db.save_rental((seed + 1, receipt_ref, 'Car', 'CAR452', '3 days', 12.0, 'Yes', str(today),
+                                    str(due), 3, str(due), '', 'No', 0, 'No', 0, 0, '', 'Cash', 0, 0, 0, 0, 0, 36.0,
+                                    36.0))
+        returned = returns.return_rental(rental_id)
+        if returned['maintenance']:
+            db.maintenance.complete_service(returned['unit_id'])
+        receipts.append(receipt_ref)
+    return receipts, db.lock_metrics.summary()
+
+
+@pytest.mark.parametrize('journal_mode', ['DELETE', 'WAL'])
+def test_counters_in_separate_processes_lose_no_rentals(tmp_path, journal_mode):
+    db_path, key_file = str(tmp_path / 'stress.db'), str(tmp_path / 'pii.key')
+    db = main.DatabaseManager(db_path, journal_mode, key_file=key_file)
+    car = db.product_catalog.by_product_code('CAR452')
+    db.update_product(car[0], car[1], car[2], car[3], PROCESSES * 2, car[5])
+    for i in range(PROCESSES):
+        db.add_customer(f"Counter Customer {i}")
+
+    with multiprocessing.Pool(PROCESSES) as pool:
+        results = pool.starmap(counter, [(db_path, key_file, journal_mode, seed) for seed in range(PROCESSES)])
+
+    receipts = sorted(receipt for result, _ in results for receipt in result)
+    assert len(receipts) == PROCESSES * RENTALS_PER_PROCESS
+    assert all(summary['failures'] == 0 for _, summary in results)
+    conn = db.connect()
+    assert sorted(row[0] for row in conn.execute('SELECT receipt_ref FROM rentals')) == receipts
+    assert conn.execute('SELECT COUNT(*) FROM rental_returns').fetchone()[0] == len(receipts)
+    assert conn.execute('SELECT COUNT(*) FROM open_rentals').fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM units WHERE state = 'rented'").fetchone()[0] == 0
+    # Each rental took a unit of its own while it was out
+    assert conn.execute('SELECT COUNT(*) FROM rentals WHERE unit_id IS NULL').fetchone()[0] == 0
+    conn.close()
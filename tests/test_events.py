@@ -0,0 +1,73 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def bus():
+    """A bus that queues until flushed, recording how often it asked to be"""
+    bus = main.EventBus()
+    bus.requests = []
+    bus.set_scheduler(bus.requests.append)
+    return bus
+
+
+def delivered(bus, event_type=main.ChangeEvent):
+    received = []
+    bus.subscribe(event_type, received.append)
+    return received
+
+
+def test_events_for_one_entity_coalesce_until_the_flush(bus):
+    received = delivered(bus)
+    bus.publish(main.CustomerUpdated(1))
+    bus.publish(main.CustomerUpdated(2))
+    bus.publish(main.CustomerAdded(3))
+    latest = main.CustomerUpdated(1)
+    bus.publish(latest)
+    assert received == [] and len(bus.requests) == 1
+
+    assert bus.flush() == 3
+    assert [(type(event), event.entity_id) for event in received] == [
+        (main.CustomerUpdated, 2), (main.CustomerAdded, 3), (main.CustomerUpdated, 1)]
+    assert received[-1] is latest
+
+    # The next publish asks for a new flush
+    bus.publish(main.CustomerUpdated(4))
+    assert len(bus.requests) == 2
+
+
+def test_handlers_receive_only_their_event_types(bus):
+    products, rentals = delivered(bus, main.ProductUpdated), delivered(bus, main.RentalCreated)
+    bus.publish(main.ProductUpdated(7))
+    bus.publish(main.ProductAdded(8))
+    bus.publish(main.RentalCreated(9))
+    bus.flush()
+    assert [event.entity_id for event in products] == [7]
+    assert [event.entity_id for event in rentals] == [9]
+
+
+def test_a_burst_of_changes_to_one_table_becomes_a_reload(bus):
+    received = delivered(bus)
+    for rental_id in range(main.EVENT_RELOAD_THRESHOLD + 1):
+        bus.publish(main.RentalCreated(rental_id))
+    bus.publish(main.CustomerAdded(1))
+    bus.flush()
+    assert [(type(event), event.entity_id) for event in received] == [
+        (main.TableReloaded, 'rentals'), (main.CustomerAdded, 1)]
+
+
+def test_data_layer_publishes_its_changes(db, rent):
+    received = delivered(db.events)
+    customer_id = db.add_customer("Evented Customer")
+    db.update_customer(customer_id, "Evented Customer Renamed")
+    db.add_product('Scooter', 'SCT100', 8.0, 2)
+    rental_id = rent(customer_id, 'CAR452', 3)
+
+    product_id = db.product_catalog.by_product_code('SCT100')[0]
+    assert [(type(event), event.entity_id) for event in received[:3]] == [
+        (main.CustomerAdded, customer_id), (main.CustomerUpdated, customer_id), (main.ProductAdded, product_id)]
+    created = next(event for event in received if isinstance(event, main.RentalCreated))
+    assert created.entity_id == rental_id
+    assert created.fields == {'customer_id': customer_id, 'product_type': 'Car', 'payment_method': 'Cash',
+                              'account_on_hold': 0, 'total': 36.0}
@@ -0,0 +1,47 @@
+import pytest
+
+import main
+
+
+def test_units_follow_the_state_machine(db):
+    db.add_product('Van', 'VAN-1', 50.0, 1)
+    unit_id = db.fleet.units(db.product_catalog.by_product_code('VAN-1')[0])[0][0]
+
+    assert db.fleet.transition(unit_id, 'maintenance') == 'available'
+    with pytest.raises(ValueError):
+        db.fleet.transition(unit_id, 'rented')
+    db.fleet.transition(unit_id, 'retired')
+    with pytest.raises(ValueError):
+        db.fleet.transition(unit_id, 'available')
+
+
+def test_each_rental_takes_a_unit_until_none_are_free(db, rent):
+    customer_id = db.add_customer("Fleet Customer")
+    db.add_product('Van', 'VAN-2', 50.0, 2)
+    rentals = [rent(customer_id, 'VAN-2', 3) for _ in range(2)]
+    with pytest.raises(ValueError):
+        rent(customer_id, 'VAN-2', 3)
+
+    units = db.fleet.units(db.product_catalog.by_product_code('VAN-2')[0])
+    assert sorted(unit[2] for unit in units) == ['rented', 'rented']
+    # A returned van goes straight back into the pool
+    main.ReturnScheduler(db).return_rental(rentals[0])
+    assert rent(customer_id, 'VAN-2', 3)
+
+
+def test_fleet_capacity_counts_units_not_stock(db):
+    engine = main.UtilizationEngine(db)
+    before = engine.fleet_capacity()
+    db.add_product('Van', 'VAN-1', 50.0, 3)
+    db.add_product('Van', 'VAN-2', 55.0, 2)
+    db.add_product('Bus', 'BUS-1', 120.0, 1)
+    van = db.product_catalog.by_product_code('VAN-1')[0]
+    units = db.fleet.units(van)
+    db.fleet.transition(units[0][0], 'maintenance')
+    db.fleet.transition(units[1][0], 'retired')
+    db.delete_product(db.product_catalog.by_product_code('BUS-1')[0])
+
+    # One VAN-1 unit in the workshop still counts; the retired one and the deleted bus do not
+    after = engine.fleet_capacity()
+    assert after.pop('Van') == before.pop('Van', 0) + 4
+    assert after == before
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+
+import main
+
+HISTORY_DAYS = 56
+
+
+@pytest.fixture
+def steady_vans(db, rent):
+    """Two three-day van rentals a day for the last HISTORY_DAYS days"""
+    van = db.product_catalog.by_product_code('VAN775')
+    db.update_product(van[0], van[1], van[2], van[3], 2 * HISTORY_DAYS, van[5])
+    customer_id = db.add_customer("Steady Customer")
+    today = datetime.date.today()
+    for back in range(HISTORY_DAYS, 0, -1):
+        for _ in range(2):
+            rent(customer_id, 'VAN775', 3, start=today - datetime.timedelta(days=back))
+    return today
+
+
+def test_daily_counts_group_rentals_by_type_and_day(db, rent):
+    customer_id = db.add_customer("Counted Customer")
+    day = datetime.date(2030, 3, 4)
+    rent(customer_id, 'CAR452', 2, start=day)
+    rent(customer_id, 'CAR452', 5, start=day)
+    rent(customer_id, 'VAN775', 1, start=day + datetime.timedelta(days=1))
+
+    counts = main.DemandForecaster(db).daily_counts()
+    assert counts == {'Car': {day.toordinal(): 2}, 'Van': {day.toordinal() + 1: 1}}
+    assert main.DemandForecaster(db).daily_counts(after_ordinal=day.toordinal()) == {'Van': {day.toordinal() + 1: 1}}
+
+
+def test_no_history_forecasts_no_demand(db):
+    forecaster = main.DemandForecaster(db)
+    assert forecaster.update() == set()
+    assert forecaster.forecast('Van', 7) == [0.0] * 7
+
+
+def test_steady_demand_forecasts_its_daily_rate(db, steady_vans):
+    forecaster = main.DemandForecaster(db)
+    assert forecaster.update() == {'Van'}
+    assert forecaster.forecast('Van', 14) == pytest.approx([2.0] * 14)
+
+
+def test_states_persist_and_resume_from_the_last_day(db, steady_vans):
+    forecaster = main.DemandForecaster(db)
+    forecaster.update()
+
+    resumed = main.DemandForecaster(db)
+    # Every complete day is already folded in, so there is nothing more to learn until tomorrow
+    assert resumed.update() == set()
+    assert resumed.states['Van']['last_ordinal'] == steady_vans.toordinal() - 1
+    assert resumed.forecast('Van', 30) == pytest.approx(forecaster.forecast('Van', 30))
+
+
+def test_stock_recommendation_covers_units_out_at_once(db, steady_vans):
+    recommendations = main.DemandForecaster(db).stock_recommendations(horizon=30, headroom=1.1)
+    van = recommendations['Van']
+    # Two a day for three days each is six vans out at once, plus a tenth headroom
+    assert van['recommended_units'] == 7
+    assert van['current_units'] == 2 * HISTORY_DAYS
+    assert van['shortfall'] == 7 - 2 * HISTORY_DAYS
+    assert van['expected_rentals'] == pytest.approx(60.0)
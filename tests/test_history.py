@@ -0,0 +1,109 @@
+import datetime
+
+import pytest
+
+
+def set_rental(db, rental_id, **columns):
+    conn = db.connect()
+    conn.execute(f"UPDATE rentals SET {', '.join(f'{column} = ?' for column in columns)} WHERE rental_id = ?",
+                 list(columns.values()) + [rental_id])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def history(db, rent):
+    """Seven rentals with tied and missing totals; returns their ids in the order made"""
+    customer_id = db.add_customer("History Customer")
+    ids = [rent(customer_id, code, days) for code, days in [('CAR452', 10), ('CAR452', 1), ('VAN775', 2),
+                                                             ('CAR452', 2), ('MIN334', 2), ('TRK7483', 3),
+                                                             ('VAN775', 1)]]
+    set_rental(db, ids[6], total=None)
+    return ids
+
+
+def all_pages(db, sort_column, descending, limit=3):
+    """Every row, fetched a page at a time from the last row's (sort value, rental_id)"""
+    rows, after = [], None
+    while True:
+        page = db.get_rental_page(sort_column=sort_column, descending=descending, limit=limit, after=after)
+        rows += page
+        if len(page) < limit:
+            return rows
+        after = (page[-1][-1], page[-1][0])
+
+
+def test_totals_and_days_sort_as_numbers(db, history):
+    totals = [row[5] for row in db.get_rental_page(sort_column='Total', descending=False)]
+    assert totals == [None, 12.0, 24.0, 24.0, 38.0, 45.0, 120.0]
+    days = [row[4] for row in db.get_rental_page(sort_column='Days', descending=True)]
+    assert days == ['10 days', '3 days', '2 days', '2 days', '2 days', '1 days', '1 days']
+
+
+@pytest.mark.parametrize('sort_column', ['Total', 'Days', 'Date', 'Product'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_keyset_pages_cover_every_row_once_in_order(db, history, sort_column, descending):
+    everything = db.get_rental_page(sort_column=sort_column, descending=descending)
+    assert sorted(row[0] for row in everything) == history
+    assert all_pages(db, sort_column, descending) == everything
+
+
+def test_ties_break_on_rental_id_in_the_sort_direction(db, history):
+    ascending = [row[0] for row in db.get_rental_page(sort_column='Total', descending=False) if row[5] == 24.0]
+    descending = [row[0] for row in db.get_rental_page(sort_column='Total', descending=True) if row[5] == 24.0]
+    assert ascending == [history[3], history[4]] and descending == [history[4], history[3]]
+
+
+def test_unknown_sort_column_is_refused(db):
+    with pytest.raises(ValueError):
+        db.get_rental_page(sort_column='customer_name; DROP TABLE rentals')
+
+
+@pytest.fixture
+def filed(db, history):
+    """The history rentals spread over three days, two paid by card and one on hold"""
+    days = ['2030-05-01 09:00:00', '2030-05-01 17:30:00', '2030-05-02 10:00:00', '2030-05-02 23:59:59',
+            '2030-05-03 00:00:00', '2030-05-03 12:00:00', '2030-05-04 08:00:00']
+    for rental_id, created in zip(history, days):
+        set_rental(db, rental_id, created_date=created)
+    set_rental(db, history[0], payment_method='Card')
+    set_rental(db, history[5], payment_method='Card', account_on_hold=1)
+    return history
+
+
+def matching(db, **filters):
+    return sorted(row[0] for row in db.get_rental_page(filters, limit=None))
+
+
+def test_filters_combine_into_one_query(db, filed):
+    assert matching(db, start_date=datetime.date(2030, 5, 2), end_date=datetime.date(2030, 5, 2)) == filed[2:4]
+    assert matching(db, product_type='Car') == [filed[0], filed[1], filed[3]]
+    assert matching(db, payment_method='Card') == [filed[0], filed[5]]
+    assert matching(db, min_total=24.0, max_total=45.0) == filed[2:6]
+    assert matching(db, on_hold=True) == [filed[5]]
+    assert matching(db, on_hold=False) == filed[:5] + filed[6:]
+    assert matching(db, search='History Cust') == filed
+    assert matching(db, product_type='Car', payment_method='Card', start_date=datetime.date(2030, 5, 1)) == [filed[0]]
+    assert matching(db, customer_id=-1) == []
+
+
+def test_facets_count_the_filtered_rentals(db, filed):
+    facets = db.get_rental_facets({'end_date': datetime.date(2030, 5, 3)})
+    assert facets['rentals'] == 6
+    assert facets['revenue'] == pytest.approx(120.0 + 12.0 + 38.0 + 24.0 + 24.0 + 45.0)
+    assert facets['product_type'] == {'Car': 3, 'Van': 1, 'Minibus': 1, 'Truck': 1}
+    assert facets['payment_method'] == {'Card': 2, 'Cash': 4}
+    assert facets['on_hold'] == {True: 1, False: 5}
+
+
+def test_filtered_export_matches_the_filtered_pages(db, filed):
+    filters = {'payment_method': 'Cash', 'start_date': datetime.date(2030, 5, 2)}
+    rows, after = [], None
+    while True:
+        page = db.get_rental_page(filters, 'Total', False, limit=2, after=after)
+        rows += page
+        if len(page) < 2:
+            break
+        after = (page[-1][-1], page[-1][0])
+    assert rows == db.get_rental_page(filters, 'Total', False, limit=None)
+    assert sorted(row[0] for row in rows) == [filed[2], filed[3], filed[4], filed[6]]
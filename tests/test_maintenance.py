@@ -0,0 +1,71 @@
+import datetime
+
+import main
+
+
+def product_state(db, product_id):
+    conn = db.connect()
+    row = conn.execute('SELECT status, maintenance_hold FROM products WHERE product_id = ?', (product_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def unit_state(db, unit_id):
+    conn = db.connect()
+    state = conn.execute('SELECT state FROM units WHERE unit_id = ?', (unit_id,)).fetchone()[0]
+    conn.close()
+    return state
+
+
+def set_unit_states(db, product_id, state):
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE units SET state = ? WHERE product_id = ? AND state != 'retired'", (state, product_id))
+    main.MaintenancePlanner.sync_status(cursor, [product_id])
+    conn.commit()
+    conn.close()
+
+
+def test_planner_hold_is_placed_and_lifted(db):
+    db.add_product('Truck', 'TRK-1', 80.0, 2)
+    product_id = db.product_catalog.by_product_code('TRK-1')[0]
+
+    set_unit_states(db, product_id, 'maintenance')
+    assert product_state(db, product_id) == ('Maintenance', 1)
+
+    set_unit_states(db, product_id, 'available')
+    assert product_state(db, product_id) == ('Available', 0)
+
+
+def test_manual_maintenance_status_is_kept(db):
+    db.add_product('Truck', 'TRK-2', 80.0, 2)
+    product_id = db.product_catalog.by_product_code('TRK-2')[0]
+    db.update_product(product_id, 'Truck', 'TRK-2', 80.0, 2, 'Maintenance')
+
+    set_unit_states(db, product_id, 'maintenance')
+    set_unit_states(db, product_id, 'available')
+    assert product_state(db, product_id) == ('Maintenance', 0)
+
+
+def test_manual_status_change_clears_planner_hold(db):
+    db.add_product('Truck', 'TRK-3', 80.0, 1)
+    product_id = db.product_catalog.by_product_code('TRK-3')[0]
+    set_unit_states(db, product_id, 'maintenance')
+    db.update_product(product_id, 'Truck', 'TRK-3', 80.0, 0, 'Unavailable')
+
+    set_unit_states(db, product_id, 'available')
+    assert product_state(db, product_id) == ('Unavailable', 0)
+
+
+def test_unit_due_for_service_goes_to_the_workshop_on_return(db, rent):
+    customer_id = db.add_customer("Long Hire Customer")
+    interval = main.DEFAULT_SERVICE_INTERVALS['Car'][0]
+    start = datetime.date.today() - datetime.timedelta(days=interval + 1)
+    rental_id = rent(customer_id, 'CAR452', interval + 1, start=start)
+
+    returned = main.ReturnScheduler(db).return_rental(rental_id)
+    assert returned['maintenance']
+    assert unit_state(db, returned['unit_id']) == 'maintenance'
+
+    db.maintenance.complete_service(returned['unit_id'])
+    assert unit_state(db, returned['unit_id']) == 'available'
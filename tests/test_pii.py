@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+import pytest
+
+import main
+
+
+def stored_details(db, customer_id):
+    conn = sqlite3.connect(db.db_name)
+    row = conn.execute('SELECT phone, email, address, phone_bidx, email_bidx FROM customers WHERE customer_id = ?',
+                       (customer_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_details_are_stored_encrypted_and_read_back(db):
+    customer_id = db.add_customer("Ada", "07700 900123", "ada@example.com", "1 High Street")
+    phone, email, address, phone_bidx, email_bidx = stored_details(db, customer_id)
+    assert all(main.FieldCipher.is_sealed(value) for value in (phone, email, address))
+    assert phone_bidx and email_bidx
+
+    row = db.find_customers('Ada')[0]
+    assert row[2:5] == ("07700 900123", "ada@example.com", "1 High Street")
+
+
+def test_ciphertext_is_bound_to_customer_and_column(db):
+    customer_id = db.add_customer("Ada", "07700 900123")
+    phone = stored_details(db, customer_id)[0]
+
+    assert db.pii.decrypt('phone', phone, customer_id) == "07700 900123"
+    with pytest.raises(ValueError):
+        db.pii.decrypt('phone', phone, customer_id + 1)
+    with pytest.raises(ValueError):
+        db.pii.decrypt('email', phone, customer_id)
+
+
+def test_lookups_match_reformatted_details(db):
+    customer_id = db.add_customer("Ada", "07700 900123", "ada@example.com")
+    db.add_customer("Bob", "07700 900999", "bob@example.com")
+
+    assert [row[0] for row in db.find_customers('07700900123')] == [customer_id]
+    assert [row[0] for row in db.find_customers(' ADA@example.com ')] == [customer_id]
+    assert db.find_duplicate_customers('077 009 00123', None) == [(customer_id, "Ada")]
+    assert db.find_duplicate_customers(None, 'Ada@Example.com', exclude_id=customer_id) == []
+
+
+def test_unchanged_details_keep_their_ciphertext(db):
+    customer_id = db.add_customer("Ada", "07700 900123", "ada@example.com")
+    before = stored_details(db, customer_id)
+    db.update_customer(customer_id, "Ada Lovelace", "07700 900123", "ada@example.com")
+    assert stored_details(db, customer_id) == before
+
+
+def test_wrong_key_file_is_refused(db, tmp_path):
+    db.add_customer("Ada", "07700 900123")
+    other = tmp_path / 'other.key'
+    other.write_text('00' * 32)
+    with pytest.raises(RuntimeError):
+        main.DatabaseManager(db.db_name, key_file=str(other))
+
+
+def test_replicated_customer_is_sealed_to_local_id(db, tmp_path):
+    remote = main.DatabaseManager(str(tmp_path / 'branch.db'), key_file=db.pii.key_file)
+    for name in ("Local 1", "Local 2"):
+        db.add_customer(name)
+    remote_id = remote.add_customer("Ada", "07700 900123", "ada@example.com")
+
+    changes, _ = main.SyncEngine(remote).changes_since(0)
+    main.SyncEngine(db).apply_changes(changes)
+
+    local = db.find_customers('Ada')[0]
+    assert local[0] != remote_id
+    assert local[2:4] == ("07700 900123", "ada@example.com")
+    assert db.find_duplicate_customers('07700900123', None) == [(local[0], "Ada")]
+
+
+def test_plaintext_from_an_older_branch_is_sealed_on_arrival(db):
+    uid = 'a' * 32
+    change = ['customers', uid, 'upsert',
+              json.dumps({'customer_name': 'Old Branch', 'phone': '0123 456789', 'sync_uid': uid}),
+              '2030-01-01T00:00:00.000', 'old-branch']
+    main.SyncEngine(db).apply_changes([change])
+
+    customer_id = db.find_customers('Old Branch')[0][0]
+    phone, _, _, phone_bidx, _ = stored_details(db, customer_id)
+    assert main.FieldCipher.is_sealed(phone)
+    assert phone_bidx == db.pii.blind_index('phone', '0123456789')
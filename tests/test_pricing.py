@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+import main
+
+
+def rental_prices(db, rental_id):
+    conn = db.connect()
+    row = conn.execute('SELECT cost_per_day, subtotal, tax, total FROM rentals WHERE rental_id = ?',
+                       (rental_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def set_tax_rate(db, tax_rate):
+    tariff = db.get_tariff()
+    db.save_tariff(main.Tariff(tariff.periods, tax_rate, tariff.discount_tiers, tariff.type_rates))
+
+
+# Quotes and batch pricing (user-026)
+
+def test_batch_prices_match_single_quotes(db):
+    engine = main.PricingEngine(db)
+    days = [1, 7, 30, 31, 90, 200, 365]
+    rates = [12.0, 19.0, 15.0, 12.0, 19.0, 15.0, 12.0]
+    subtotal, tax, total = engine.price_batch(days, rates)
+    for i, (d, rate) in enumerate(zip(days, rates)):
+        assert engine.quote(d, rate) == (subtotal[i], tax[i], total[i])
+
+
+def test_type_rate_overrides_the_product_rate(db):
+    tariff = db.get_tariff()
+    db.save_tariff(main.Tariff(tariff.periods, tariff.tax_rate, tariff.discount_tiers, {'Van': 25.0}))
+    engine = main.PricingEngine(db)
+    assert engine.quote(1, 19.0, discount_pct=0, product_type='Van') == (25.0, 3.75, 28.75)
+    assert engine.quote(1, 12.0, discount_pct=0, product_type='Car') == (12.0, 1.8, 13.8)
+
+
+def test_reprice_open_book_only_touches_rentals_still_out(db, rent):
+    customer_id = db.add_customer("Repriced Customer")
+    today = datetime.date.today()
+    returned_early = rent(customer_id, 'CAR452', 10, start=today - datetime.timedelta(days=2))
+    overdue = rent(customer_id, 'VAN775', 3, start=today - datetime.timedelta(days=10))
+    current = rent(customer_id, 'TRK7483', 5)
+    scheduler = main.ReturnScheduler(db)
+    scheduler.return_rental(returned_early)
+    assert scheduler.tick() == [overdue]
+    settled = rental_prices(db, returned_early)
+    out_totals = sum(rental_prices(db, rental_id)[3] for rental_id in (overdue, current))
+    balance = main.Ledger(db).customer_balance(customer_id)
+
+    # The agreed rate holds even when the catalog price has moved since
+    van = db.product_catalog.by_product_code('VAN775')
+    db.update_product(van[0], van[1], van[2], 40.0, van[4], van[5])
+    set_tax_rate(db, 0.2)
+    assert main.PricingEngine(db).reprice_open_book() == 2
+
+    assert rental_prices(db, returned_early) == settled
+    for rental_id, rate in ((overdue, 19.0), (current, 15.0)):
+        cost_per_day, subtotal, tax, total = rental_prices(db, rental_id)
+        assert cost_per_day == rate
+        assert tax == pytest.approx(round(subtotal * 0.2, 2))
+        assert total == pytest.approx(subtotal + tax)
+    repriced = sum(rental_prices(db, rental_id)[3] for rental_id in (overdue, current))
+    assert main.Ledger(db).customer_balance(customer_id) == pytest.approx(balance - out_totals + repriced)
@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+
+def unit_states(db, product_id):
+    return sorted(unit[2] for unit in db.fleet.units(product_id))
+
+
+def test_deleted_product_leaves_the_catalog_but_keeps_its_rentals(db, rent):
+    customer_id = db.add_customer("Deleted Product Customer")
+    van = db.product_catalog.by_product_code('VAN775')
+    rental_id = rent(customer_id, 'VAN775', 2)
+
+    assert db.delete_product(van[0])
+    assert db.product_catalog.get(van[0]) is None
+    assert 'VAN775' not in [row[2] for row in db.get_all_products()]
+    # The vehicle still out stays rented until it comes back
+    assert unit_states(db, van[0]) == ['rented', 'retired', 'retired']
+
+    conn = db.connect()
+    joined = conn.execute('''
+        SELECT p.product_type, p.deleted_at IS NOT NULL FROM rentals r
+        JOIN products p ON p.product_code = r.product_code WHERE r.rental_id = ?
+    ''', (rental_id,)).fetchone()
+    conn.close()
+    assert joined == ('Van', 1)
+
+
+def test_adding_a_deleted_code_again_restores_its_row(db):
+    truck = db.product_catalog.by_product_code('TRK7483')
+    db.delete_product(truck[0])
+    assert db.add_product('Truck', 'TRK7483', 17.5, 2)
+    restored = db.product_catalog.by_product_code('TRK7483')
+    assert restored[0] == truck[0]
+    assert restored[3:] == (17.5, 2, 'Available')
+
+
+def test_foreign_keys_are_enforced(db):
+    car = db.product_catalog.by_product_code('CAR452')
+    conn = db.connect()
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO units (product_id, product_type, unit_code) VALUES (-1, 'Car', 'ORPHAN-1')")
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('DELETE FROM products WHERE product_id = ?', (car[0],))
+    conn.rollback()
+    conn.close()
+
+
+def test_live_catalog_queries_use_the_partial_index(db):
+    conn = db.connect()
+    plan = ' '.join(row[3] for row in conn.execute('''
+        EXPLAIN QUERY PLAN SELECT product_id FROM products
+        WHERE product_type = 'Van' AND status = 'Available' AND deleted_at IS NULL
+    '''))
+    conn.close()
+    assert 'idx_products_active_type_status_qty' in plan
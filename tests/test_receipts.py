@@ -0,0 +1,67 @@
+import datetime
+import re
+import zipfile
+
+import pytest
+
+import main
+
+
+def pdf_pages(data):
+    return len(re.findall(rb'/Type /Page\b(?!s)', data))
+
+
+@pytest.fixture
+def receipts(db, rent):
+    """Five rentals for two customers over two days; returns (customer ids, receipt refs in date order)"""
+    first, second = db.add_customer("First Customer"), db.add_customer("Second Customer")
+    ids = [rent(first, 'CAR452', 2), rent(second, 'VAN775', 1), rent(first, 'MIN334', 3),
+           rent(second, 'CAR452', 1), rent(second, 'TRK7483', 4)]
+    conn = db.connect()
+    for rental_id, created in zip(ids, ['2030-04-01 09:00:00', '2030-04-01 10:00:00', '2030-04-02 09:00:00',
+                                        '2030-04-02 10:00:00', '2030-04-03 09:00:00']):
+        conn.execute('UPDATE rentals SET created_date = ? WHERE rental_id = ?', (created, rental_id))
+    conn.commit()
+    refs = [conn.execute('SELECT receipt_ref FROM rentals WHERE rental_id = ?', (i,)).fetchone()[0] for i in ids]
+    conn.close()
+    return (first, second), refs
+
+
+def test_compiled_template_renders_as_str_format_does():
+    fields = main.ReceiptRenderer.fields_from_row(
+        ('R1', '2030-04-01 09:00:00', None, None, 'Car', 'CAR452', '2 days', 12.0, 2, 'Cash', 5, 22.8, 3.42, 26.22),
+        0.15)
+    text = main.render_receipt_text(fields)
+    assert text == main.RECEIPT_TEMPLATE.format(**fields)
+    assert "Customer:       Walk-in Customer" in text
+    assert "Tax (15%):      £3.42" in text
+    assert "TOTAL:          £26.22" in text
+
+
+def test_rows_load_by_date_range_and_customer(db, receipts):
+    (first, second), refs = receipts
+    renderer = main.ReceiptRenderer(db)
+    assert [row[0] for row in renderer.load_rows()] == refs
+    assert [row[0] for row in renderer.load_rows(datetime.date(2030, 4, 2), datetime.date(2030, 4, 2))] == refs[2:4]
+    assert [row[0] for row in renderer.load_rows(customer_ids=[first])] == [refs[0], refs[2]]
+    assert [row[0] for row in renderer.load_rows(datetime.date(2030, 4, 2), customer_ids=[second])] == refs[3:]
+
+
+def test_batch_writes_one_page_per_receipt(db, receipts, tmp_path):
+    output = tmp_path / 'statements.pdf'
+    result = main.ReceiptRenderer(db).batch(str(output), workers=1)
+    assert result['receipts'] == 5 and result['receipts_per_sec'] > 0
+    assert pdf_pages(output.read_bytes()) == 5
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_zip_holds_a_pdf_per_receipt_in_order(db, receipts, tmp_path, monkeypatch, workers):
+    # Chunks of two so the pool gets more than one task
+    monkeypatch.setattr(main, 'RECEIPT_BATCH_CHUNK', 2)
+    (_, second), refs = receipts
+    output = tmp_path / 'statements.zip'
+    result = main.ReceiptRenderer(db).batch(str(output), customer_ids=[second], workers=workers)
+    assert result['receipts'] == 3
+    with zipfile.ZipFile(output) as archive:
+        assert archive.namelist() == [f"{ref}.pdf" for ref in (refs[1], refs[3], refs[4])]
+        assert all(pdf_pages(archive.read(name)) == 1 for name in archive.namelist())
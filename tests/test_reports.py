@@ -0,0 +1,54 @@
+import datetime
+import os
+import re
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def rented(db, rent):
+    customer_id = db.add_customer("Report Customer")
+    start = datetime.date.today() - datetime.timedelta(days=3)
+    for code, days in [('CAR452', 2), ('VAN775', 3), ('CAR452', 1)]:
+        rent(customer_id, code, days, start=start)
+    return db
+
+
+def test_jobs_add_a_variant_per_rented_product_where_the_report_has_one(rented):
+    jobs = main.ReportRunner(rented).jobs()
+    assert jobs[:len(main.REPORTS)] == [(name, None) for name in main.REPORTS]
+    assert jobs[len(main.REPORTS):] == [('monthly', 'Car'), ('monthly', 'Van')]
+    assert main.ReportRunner(rented).jobs(['products', 'monthly'], per_product=False) == [('products', None),
+                                                                                         ('monthly', None)]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_writes_every_report_and_a_combined_pack(rented, tmp_path, workers):
+    out_dir = tmp_path / 'board_pack'
+    result = main.ReportRunner(rented, str(tmp_path / 'cache')).run(str(out_dir), names=['products', 'monthly'],
+                                                                    formats=('pdf',), workers=workers)
+    assert result['reports'] == 4
+    # PNGs are always rendered, for the combined pack
+    assert sorted(os.path.basename(path) for path in result['files']) == sorted(
+        f"{base}.{fmt}" for base in ('products', 'monthly', 'monthly_Car', 'monthly_Van') for fmt in ('pdf', 'png'))
+    assert all(os.path.getsize(path) > 0 for path in result['files'])
+    with open(result['combined'], 'rb') as f:
+        assert len(re.findall(rb'/Type /Page\b(?!s)', f.read())) == 5
+
+
+def test_workers_read_through_a_read_only_connection(rented):
+    reader = main.ReadOnlyDatabase(rented.db_name, key_file=rented.pii.key_file)
+    assert reader.read_only
+    assert [row[1] for row in reader.find_customers('Report')] == ["Report Customer"]
+    conn = reader.connect()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM rentals")
+    conn.close()
+    # Forecast states are learned but only the writer saves them
+    assert main.DemandForecaster(reader).update() == {'Car', 'Van'}
+    conn = rented.connect()
+    assert conn.execute('SELECT COUNT(*) FROM forecast_state').fetchone()[0] == 0
+    conn.close()
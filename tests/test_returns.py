@@ -0,0 +1,124 @@
+import datetime
+import random
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock():
+    return main.SimulatedClock(datetime.datetime.combine(datetime.date.today(), datetime.time(9)))
+
+
+@pytest.fixture
+def scheduler(db, clock):
+    return main.ReturnScheduler(db, clock)
+
+
+@pytest.fixture
+def events(db):
+    """Overdue and returned events, in the order they were delivered"""
+    received = []
+    db.events.subscribe(main.RentalOverdue, received.append)
+    db.events.subscribe(main.RentalReturned, received.append)
+    return received
+
+
+def late_fees(db):
+    conn = db.connect()
+    total = conn.execute("SELECT COALESCE(SUM(debit), 0) FROM ledger WHERE entry_type = 'late fee'").fetchone()[0]
+    conn.close()
+    return total
+
+
+def unit_states(db, product_code):
+    product_id = db.product_catalog.by_product_code(product_code)[0]
+    return sorted(unit[2] for unit in db.fleet.units(product_id))
+
+
+def test_rental_goes_overdue_the_day_after_it_is_due(db, rent, clock, scheduler, events):
+    customer_id = db.add_customer("Overdue Customer")
+    rental_id = rent(customer_id, 'CAR452', 3, start=clock.now().date())
+
+    clock.advance(days=3)
+    assert scheduler.tick() == []
+    clock.advance(days=1)
+    assert scheduler.tick() == [rental_id]
+    assert scheduler.tick() == []
+    assert scheduler.overdue_count() == 1
+    assert [(type(event), event.entity_id) for event in events] == [(main.RentalOverdue, rental_id)]
+
+
+def test_late_return_charges_the_late_fee_and_restocks(db, rent, clock, scheduler, events):
+    customer_id = db.add_customer("Late Customer")
+    rental_id = rent(customer_id, 'VAN775', 3, start=clock.now().date())
+    assert 'rented' in unit_states(db, 'VAN775')
+    clock.advance(days=5)
+    scheduler.tick()
+
+    result = scheduler.return_rental(rental_id)
+    assert (result['days_late'], result['late_fee']) == (2, round(2 * 19.0 * 1.5, 2))
+    assert late_fees(db) == pytest.approx(result['late_fee'])
+    assert 'rented' not in unit_states(db, 'VAN775')
+    assert scheduler.overdue_count() == 0
+
+    returned = events[-1]
+    assert isinstance(returned, main.RentalReturned) and returned.entity_id == rental_id
+    assert returned.fields == {'days_late': 2, 'late_fee': result['late_fee'], 'was_overdue': True}
+
+
+def test_early_return_is_free(db, rent, clock, scheduler, events):
+    customer_id = db.add_customer("Early Customer")
+    rental_id = rent(customer_id, 'TRK7483', 7, start=clock.now().date())
+    clock.advance(days=2)
+
+    result = scheduler.return_rental(rental_id)
+    assert (result['days_late'], result['late_fee']) == (0, 0)
+    assert late_fees(db) == 0
+    assert events[-1].fields == {'days_late': 0, 'late_fee': 0, 'was_overdue': False}
+    with pytest.raises(ValueError):
+        scheduler.return_rental(rental_id)
+
+
+def test_simulated_weeks_of_rentals_and_returns(db, rent, clock, scheduler, events):
+    """Random rentals, some returned late, checked day by day against the flags, fees and fleet"""
+    rng = random.Random(7)
+    customer_id = db.add_customer("Simulated Customer")
+    codes = ['CAR452', 'VAN775', 'MIN334', 'TRK7483']
+    for code in codes:
+        product = db.product_catalog.by_product_code(code)
+        db.update_product(product[0], product[1], product[2], product[3], 40, product[5])
+
+    out, planned, flagged, charged = {}, {}, set(), 0.0
+    for day in range(20):
+        today = clock.now().date()
+        for _ in range(6):
+            code = rng.choice(codes)
+            length = rng.randint(1, 10)
+            rental_id = rent(customer_id, code, length, start=today)
+            due = today + datetime.timedelta(days=length)
+            out[rental_id] = (due, db.product_catalog.by_product_code(code)[3])
+            lateness = rng.randint(1, 6) if rng.random() < 0.3 else -rng.randint(0, min(3, length - 1))
+            planned.setdefault(due + datetime.timedelta(days=lateness), []).append(rental_id)
+
+        for rental_id in planned.pop(today, []):
+            due, rate = out.pop(rental_id)
+            result = scheduler.return_rental(rental_id)
+            days_late = max(0, (today - due).days)
+            assert (result['days_late'], result['late_fee']) == (days_late, round(days_late * rate * 1.5, 2))
+            flagged.discard(rental_id)
+            charged += result['late_fee']
+
+        clock.advance(days=1)
+        expected = {rental_id for rental_id, (due, _) in out.items() if due < clock.now().date()} - flagged
+        assert set(scheduler.tick()) == expected
+        flagged |= expected
+
+    assert late_fees(db) == pytest.approx(charged)
+    assert sum(unit_states(db, code).count('rented') for code in codes) == len(out)
+    assert scheduler.overdue_count() == len(flagged)
+    overdue_events = {event.entity_id for event in events if isinstance(event, main.RentalOverdue)}
+    returned_events = {event.entity_id for event in events if isinstance(event, main.RentalReturned)}
+    assert flagged <= overdue_events
+    assert returned_events.isdisjoint(out)
@@ -0,0 +1,64 @@
+import datetime
+
+import main
+
+
+def quote(engine, product_type, rate, customer_id=None, on_date=None):
+    return engine.quote(1, rate, discount_pct=0, product_type=product_type, customer_id=customer_id,
+                        on_date=on_date)[0]
+
+
+def test_seasonal_rule_applies_to_its_dates_and_type(db):
+    db.add_pricing_rule('seasonal', 20.0, product_type='Van', start_date='2030-06-01', end_date='2030-06-30')
+    engine = main.PricingEngine(db)
+
+    assert quote(engine, 'Van', 19.0, on_date='2030-06-01') == 22.8
+    assert quote(engine, 'Van', 19.0, on_date='2030-06-30') == 22.8
+    assert quote(engine, 'Van', 19.0, on_date='2030-07-01') == 19.0
+    assert quote(engine, 'Car', 12.0, on_date='2030-06-15') == 12.0
+
+
+def test_loyalty_tier_counts_the_customers_earlier_rentals(db, rent):
+    db.add_pricing_rule('loyalty', -10.0, min_rentals=2)
+    db.add_pricing_rule('loyalty', -20.0, min_rentals=4)
+    regular, newcomer = db.add_customer("Regular"), db.add_customer("Newcomer")
+    for _ in range(2):
+        rent(regular, 'CAR452', 1)
+    engine = main.PricingEngine(db)
+
+    assert quote(engine, 'Car', 12.0, customer_id=newcomer) == 12.0
+    assert quote(engine, 'Car', 12.0, customer_id=regular) == 10.8
+
+
+def test_surcharges_stack_with_the_global_one(db):
+    db.add_pricing_rule('surcharge', 5.0)
+    db.add_pricing_rule('surcharge', 10.0, product_type='Truck')
+    engine = main.PricingEngine(db)
+
+    assert quote(engine, 'Truck', 100.0) == 115.0
+    assert quote(engine, 'Car', 100.0) == 105.0
+
+
+def test_batch_pricing_applies_the_same_rules(db):
+    db.add_pricing_rule('seasonal', 15.0, start_date='2030-01-01', end_date='2030-01-31')
+    db.add_pricing_rule('surcharge', 10.0, product_type='Van')
+    engine = main.PricingEngine(db)
+    dates = [datetime.date(2029, 12, 31), datetime.date(2030, 1, 15), datetime.date(2030, 2, 1)]
+    types = ['Van', 'Car', 'Van']
+
+    subtotal, _, _ = engine.price_batch([3, 3, 3], [19.0, 12.0, 19.0], discount_pct=[0, 0, 0], product_types=types,
+                                        ordinals=[d.toordinal() for d in dates])
+    assert list(subtotal) == [engine.quote(3, rate, 0, product_type, on_date=d)[0]
+                              for rate, product_type, d in zip([19.0, 12.0, 19.0], types, dates)]
+
+
+def test_rule_edits_from_another_instance_are_picked_up(db):
+    engine = main.PricingEngine(db)
+    assert quote(engine, 'Car', 12.0) == 12.0
+
+    other = main.DatabaseManager(db.db_name, key_file=db.pii.key_file)
+    other.add_pricing_rule('surcharge', 50.0)
+    # Within the check interval the compiled plan stands; after it the stored version is re-read
+    assert quote(engine, 'Car', 12.0) == 12.0
+    engine.rules.checked_at -= main.RULES_CHECK_SECONDS
+    assert quote(engine, 'Car', 12.0) == 18.0
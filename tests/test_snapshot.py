@@ -0,0 +1,138 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+
+def add_rentals(db, rows):
+    """Insert (customer_id, product_type, payment_method, total, created_date) rows as an import would"""
+    conn = db.connect()
+    conn.executemany('''
+        INSERT INTO rentals (customer_id, product_type, payment_method, total, created_date) VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def rentals(db):
+    first, second = db.add_customer("First Customer"), db.add_customer("Second Customer")
+    add_rentals(db, [(first, 'Car', 'Cash', 24.0, '2030-01-31 09:00:00'),
+                     (second, 'Van', 'Card', 19.99, '2030-02-01 10:00:00'),
+                     (first, 'Car', 'Card', 12.5, '2030-02-01 11:00:00'),
+                     (None, 'Truck', 'Cash', 60.0, '2030-02-03 12:00:00'),
+                     (second, None, None, 5.0, '2030-03-01 08:00:00')])
+    return first, second
+
+
+def test_group_bys_match_the_rentals(db, rentals):
+    snapshot = main.AnalyticsSnapshot(db)
+    assert snapshot.refresh() == 5
+    assert snapshot.group_by('product') == {'Car': (2, 36.5), 'Van': (1, 19.99), 'Truck': (1, 60.0)}
+    assert snapshot.group_by('payment') == {'Cash': (2, 84.0), 'Card': (2, 32.49)}
+    assert snapshot.group_by('product', datetime.date(2030, 2, 1).toordinal()) == {
+        'Car': (1, 12.5), 'Van': (1, 19.99), 'Truck': (1, 60.0)}
+
+    counts, revenue = snapshot.daily(datetime.date(2030, 2, 1).toordinal(), datetime.date(2030, 2, 3).toordinal())
+    assert counts.tolist() == [2, 0, 1] and revenue.tolist() == pytest.approx([32.49, 0, 60.0])
+    months, counts, revenue = snapshot.monthly(datetime.date(2030, 1, 1).toordinal(), product='Car')
+    assert [str(np.datetime64(int(m), 'M')) for m in months] == ['2030-01', '2030-02']
+    assert counts.tolist() == [1, 1] and revenue.tolist() == [24.0, 12.5]
+
+
+def test_customer_totals_and_summary_skip_walk_ins(db, rentals):
+    first, second = rentals
+    snapshot = main.AnalyticsSnapshot(db)
+    snapshot.refresh()
+    ids, counts, spend = snapshot.customer_totals()
+    assert dict(zip(ids.tolist(), zip(counts.tolist(), spend.tolist()))) == {first: (2, 36.5), second: (2, 24.99)}
+    assert snapshot.summary() == {'rentals': 5, 'revenue': 121.49, 'customers': 2}
+
+
+def test_refresh_appends_new_rentals_and_rebuilds_after_rewrites(db, rentals):
+    snapshot = main.AnalyticsSnapshot(db)
+    snapshot.refresh()
+    assert snapshot.refresh() == 0
+
+    add_rentals(db, [(None, 'Minibus', 'Cash', 30.0, '2030-03-02 09:00:00')])
+    assert snapshot.refresh() == 1
+    assert snapshot.group_by('product')['Minibus'] == (1, 30.0)
+
+    conn = db.connect()
+    conn.execute("UPDATE rentals SET total = 100.0 WHERE product_type = 'Minibus'")
+    conn.commit()
+    conn.close()
+    assert snapshot.refresh() == 6
+    assert snapshot.group_by('product')['Minibus'] == (1, 100.0)
+
+
+def test_columns_grow_past_their_capacity_a_batch_at_a_time(db, monkeypatch):
+    monkeypatch.setattr(main.AnalyticsSnapshot, 'FETCH_BATCH', 700)
+    add_rentals(db, [(None, 'Car' if i % 3 else 'Van', 'Cash', 1.25, '2030-01-01 09:00:00') for i in range(2500)])
+    snapshot = main.AnalyticsSnapshot(db)
+    assert snapshot.refresh() == 2500
+    assert snapshot.column('rental_id').tolist() == list(range(1, 2501))
+    assert snapshot.group_by('product') == {'Van': (834, 1042.5), 'Car': (1666, 2082.5)}
+    # 28 bytes a rental across the six columns
+    assert snapshot.memory_bytes() == 2500 * 28
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'analytics_cache')
+
+
+def test_cache_is_mapped_on_start_up_and_appended_to(db, rentals, cache_dir):
+    assert main.AnalyticsSnapshot(db, cache_dir).refresh() == 5
+
+    # A new process reads nothing from the database that the cache already holds
+    snapshot = main.AnalyticsSnapshot(db, cache_dir)
+    assert snapshot.refresh() == 0
+    assert isinstance(snapshot.columns['total_pence'], np.memmap)
+    assert snapshot.summary() == {'rentals': 5, 'revenue': 121.49, 'customers': 2}
+
+    add_rentals(db, [(None, 'Minibus', 'Cash', 30.0, '2030-03-02 09:00:00')])
+    assert snapshot.refresh() == 1
+    assert main.AnalyticsSnapshot(db, cache_dir).refresh() == 0
+    assert os.path.getsize(os.path.join(cache_dir, 'total_pence.bin')) == 6 * 8
+
+
+def test_writers_sharing_a_cache_see_each_others_appends(db, rentals, cache_dir):
+    first, second = main.AnalyticsSnapshot(db, cache_dir), main.AnalyticsSnapshot(db, cache_dir)
+    first.refresh()
+    second.refresh()
+    add_rentals(db, [(None, 'Minibus', 'Cash', 30.0, '2030-03-02 09:00:00')])
+    assert first.refresh() == 1
+    assert second.refresh() == 0
+    assert second.group_by('product')['Minibus'] == (1, 30.0)
+
+
+def test_cache_is_rebuilt_after_rewrites_or_for_another_database(db, rentals, cache_dir, tmp_path):
+    main.AnalyticsSnapshot(db, cache_dir).refresh()
+    conn = db.connect()
+    conn.execute("DELETE FROM rentals WHERE product_type = 'Truck'")
+    conn.commit()
+    conn.close()
+    snapshot = main.AnalyticsSnapshot(db, cache_dir)
+    assert snapshot.refresh() == 4
+    assert 'Truck' not in snapshot.group_by('product')
+
+    other = main.DatabaseManager(str(tmp_path / 'other.db'), key_file=db.pii.key_file)
+    add_rentals(other, [(None, 'Van', 'Cash', 10.0, '2030-01-01 09:00:00')])
+    snapshot = main.AnalyticsSnapshot(other, cache_dir)
+    assert snapshot.refresh() == 1
+    assert snapshot.summary()['rentals'] == 1
+
+
+def test_read_only_snapshot_maps_the_cache_but_never_writes_it(db, rentals, cache_dir):
+    main.AnalyticsSnapshot(db, cache_dir).refresh()
+    add_rentals(db, [(None, 'Minibus', 'Cash', 30.0, '2030-03-02 09:00:00')])
+    before = {name: os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)}
+
+    snapshot = main.AnalyticsSnapshot(main.ReadOnlyDatabase(db.db_name, key_file=db.pii.key_file), cache_dir)
+    assert snapshot.refresh() == 1
+    assert snapshot.summary()['rentals'] == 6
+    assert {name: os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)} == before
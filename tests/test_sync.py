@@ -0,0 +1,104 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_serving(engine):
+    """Serve one session in a thread; returns (port, thread, errors)"""
+    port, errors = free_port(), []
+
+    def serve():
+        try:
+            engine.serve('127.0.0.1', port)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return port, thread, errors
+
+
+def once_listening(call):
+    """Retry call until the server thread has started listening"""
+    for _ in range(100):
+        try:
+            return call()
+        except ConnectionRefusedError:
+            time.sleep(0.02)
+    return call()
+
+
+def peers(db):
+    conn = db.connect()
+    rows = conn.execute('SELECT peer_id FROM sync_peers').fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def branch(db, tmp_path):
+    """Another branch sharing the key file"""
+    return main.DatabaseManager(str(tmp_path / 'branch.db'), key_file=db.pii.key_file)
+
+
+def test_branches_sharing_the_key_file_sync_both_ways(db, branch):
+    db.add_customer("Head Office Customer", "07700 900123")
+    branch.add_customer("Branch Customer", "07700 900456")
+    port, thread, errors = start_serving(main.SyncEngine(db))
+
+    sent, applied, skipped = once_listening(lambda: main.SyncEngine(branch).sync_with('127.0.0.1', port))
+    thread.join(5)
+    assert errors == []
+    assert applied >= 1 and sent >= 1
+    for database in (db, branch):
+        assert [row[1] for row in database.find_customers('Head Office')] == ["Head Office Customer"]
+        assert [row[1:3] for row in database.find_customers('Branch')] == [("Branch Customer", "07700 900456")]
+
+
+def test_branch_with_another_key_file_is_refused(db, tmp_path):
+    stranger = main.DatabaseManager(str(tmp_path / 'stranger.db'), key_file=str(tmp_path / 'stranger.key'))
+    stranger.add_customer("Pushed Customer")
+    port, thread, errors = start_serving(main.SyncEngine(db))
+
+    with pytest.raises(ValueError):
+        once_listening(lambda: main.SyncEngine(stranger).sync_with('127.0.0.1', port))
+    thread.join(5)
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+    assert db.find_customers('Pushed') == []
+    assert peers(db) == []
+
+
+def test_peer_without_the_key_cannot_push_changes(db):
+    engine = main.SyncEngine(db)
+    port, thread, errors = start_serving(engine)
+
+    with once_listening(lambda: socket.create_connection(('127.0.0.1', port))) as conn:
+        engine._send(conn, {'from': 'intruder', 'nonce': os.urandom(16).hex()})
+        hello = engine._receive(conn)
+        # Nothing about the branch beyond its node id and challenge before the peer answers it
+        assert set(hello) == {'from', 'nonce', 'proof'}
+        engine._send(conn, {'proof': '00' * 32})
+        with pytest.raises(ValueError):
+            engine._receive(conn)
+    thread.join(5)
+    assert len(errors) == 1
+    assert peers(db) == []
+
+
+def test_export_needs_sync_permission(db, tmp_path):
+    db.access.add_user('owner', 'owner-password', 'admin')
+    db.access.add_user('counter', 'counter-password', 'clerk')
+    db.access.sign_in('counter', 'counter-password')
+    with pytest.raises(PermissionError):
+        main.SyncEngine(db).export_changes(str(tmp_path / 'delta.json.gz'))